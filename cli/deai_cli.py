@@ -3,6 +3,7 @@
 import typer
 import asyncio
 import time
+import requests
 from rich.console import Console
 from rich.table import Table
 from rich.live import Live
@@ -21,6 +22,9 @@ app = typer.Typer(
 )
 console = Console()
 
+# A task in one of these states will not change again (REVOKED: cancelled or expired).
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
 # --- Client Initialization ---
 client: DeAIClient = None
 
@@ -38,6 +42,42 @@ def main(ctx: typer.Context):
         console.print("Please ensure your .env file is configured correctly.")
         raise typer.Exit(code=1)
 
+# --- Helpers ---
+
+def _wait_for_result(task_id: str, live: Live) -> dict:
+    """
+    Waits for a task to finish using the pushed task events of the node the
+    client submitted it to, falling back to polling if they are unavailable.
+    """
+    try:
+        for event in client.stream_job_events(task_id):
+            live.update(Spinner("dots", text=f"Task status: {event.status}"))
+            if event.status in TERMINAL_STATES:
+                return dict(event)
+    except (requests.exceptions.RequestException, TimeoutError) as e:
+        console.print(f"[yellow]Task events unavailable ({e}). Polling instead.[/yellow]")
+
+    status = ""
+    while status not in TERMINAL_STATES:
+        time.sleep(2)
+        result = dict(client.get_job_status(task_id))
+        status = result['status']
+        live.update(Spinner("dots", text=f"Task status: {status}"))
+    return result
+
+def _cancel_task(task_id: str):
+    """Asks the node running a task to stop it, so it stops using (and billing) decode steps."""
+    try:
+        client.cancel_job(task_id)
+        console.print(f"[yellow]Cancelled task {task_id}.[/yellow]")
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 409:
+            console.print(f"[yellow]Task {task_id} had already finished.[/yellow]")
+        else:
+            console.print(f"[bold red]Could not cancel task {task_id}:[/bold red] {e}")
+    except requests.exceptions.RequestException as e:
+        console.print(f"[bold red]Could not cancel task {task_id}:[/bold red] {e}")
+
 # --- CLI Commands ---
 
 @app.command()
@@ -87,18 +127,20 @@ def generate(
         console.print(f"[green]&#10003; Job submitted![/green] Task ID: [yellow]{task_info['task_id']}[/yellow]")
 
         if wait:
-            status = ""
-            with Live(Spinner("dots", text="Waiting for result..."), console=console, transient=True) as live:
-                while status not in ["SUCCESS", "FAILURE"]:
-                    time.sleep(2)
-                    result = asyncio.run(client.get_result(task_info['task_id']))
-                    status = result['status']
-                    live.update(Spinner("dots", text=f"Task status: {status}"))
+            try:
+                with Live(Spinner("dots", text="Waiting for result..."), console=console, transient=True) as live:
+                    result = _wait_for_result(task_info['task_id'], live)
+            except KeyboardInterrupt:
+                # Nobody is waiting for the result any more; free the worker.
+                _cancel_task(task_info['task_id'])
+                raise typer.Exit(code=130)
 
             console.print("--- Generation Result ---")
             if result['status'] == "SUCCESS":
                 output = result['result']['output']
                 console.print(output)
+            elif result['status'] == "REVOKED":
+                console.print("[bold yellow]Generation was cancelled or expired before it finished.[/bold yellow]")
             else:
                 console.print(f"[bold red]Generation Failed.[/bold red]")
                 console.print(result.get('result', 'No details available.'))
@@ -6,6 +6,7 @@ import requests
 # --- Configuration ---
 BASE_URL = os.environ.get("API_URL", "http://127.0.0.1:8080")
 API_KEY = os.environ.get("API_KEY", "default-secret-key")
+WALLET_ADDRESS = os.environ.get("WALLET_ADDRESS", "")
 
 def generate_text_polling(prompt: str):
     """Makes a request to the /generate endpoint and polls for the result."""
@@ -54,13 +55,13 @@ def generate_text_polling(prompt: str):
             time.sleep(5)
 
 def stream_text(prompt: str):
-    """Connects to the /stream endpoint and prints tokens as they arrive."""
+    """Connects to the /api/gateway/stream endpoint and prints tokens as they arrive."""
     print(f"\nSending prompt (streaming): '{prompt}'")
     try:
         response = requests.post(
-            f"{BASE_URL}/stream",
+            f"{BASE_URL}/api/gateway/stream",
             headers={"X-API-Key": API_KEY},
-            json={"prompt": prompt},
+            json={"address": WALLET_ADDRESS, "prompt": prompt},
             stream=True
         )
     except requests.exceptions.ConnectionError as e:
@@ -71,14 +72,29 @@ def stream_text(prompt: str):
         print("Authentication Error: Invalid or missing API key.")
         return
 
+    if response.status_code != 200:
+        print(f"Error: Received status code {response.status_code}")
+        print(f"Response: {response.text}")
+        return
+
     print("\n--- Generated Text (Streaming) ---")
-    for line in response.iter_lines():
+    # SSE sends events as "event: <name>" / "data: <token>" lines ended by a
+    # blank line. Unnamed events carry tokens; "task", "end" and "error" are control events.
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
         if line:
-            # SSE sends lines like "data: {token}". We parse it here.
-            decoded_line = line.decode('utf-8')
-            if decoded_line.startswith('data:'):
-                token = decoded_line[5:].strip()
-                print(token, end="", flush=True)
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[6:] if line.startswith('data: ') else line[5:])
+            continue
+
+        payload = "\n".join(data)
+        if event == "message":
+            print(payload, end="", flush=True)
+        elif event == "error":
+            print(f"\nStream error: {json.loads(payload).get('error')}")
+        event, data = "message", []
     print("\n----------------------------------\n")
 
 if __name__ == "__main__":
@@ -6,9 +6,13 @@ source .venv/bin/activate
 # Start the Celery worker
 # -A points to the application module
 # -l info sets the log level to info
-# --pool=solo is used to ensure tasks run one at a time on a single process.
-# This is important because GPU models are loaded into memory, and running
-# multiple jobs in parallel on one GPU can lead to memory issues.
+# --pool=threads keeps a single process, so GPU models are loaded into memory
+# only once. The threads hand their prompts to the per-model batching engine,
+# which runs them through shared forward passes instead of one job at a time.
+# CELERY_WORKER_POOL=prefork runs one process per slot instead; the models are
+# loaded before the fork and shared copy-on-write (see WORKER_PRELOAD_MODELS).
+# The worker consumes the `model.<name>` queues of the models it serves; set
+# WORKER_MODELS (e.g. "gemma") to dedicate it to a subset of the plugins.
 
 echo "Starting Celery worker..."
-celery -A node-engine.tasks worker --loglevel=info --pool=solo
+celery -A node-engine.tasks worker --loglevel=info --pool=${CELERY_WORKER_POOL:-threads} --concurrency=${CELERY_WORKER_CONCURRENCY:-${BATCH_MAX_SIZE:-8}}
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import json
 import time
 import requests
 import threading
-from typing import List, Optional, Union
+from typing import Iterator, List, Optional, Union
 from web3 import Web3
 from eth_account import Account
 from dotenv import load_dotenv
@@ -14,6 +15,8 @@ from .abi import DEAI_TOKEN_ABI
 
 # --- Constants ---
 TOKEN_DECIMALS = 18
+# A job in one of these states will not change again (REVOKED: cancelled or expired).
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
 
 class DeAIClient:
     """Client for interacting with the DeAI Gateway and Blockchain with dynamic node discovery."""
@@ -34,6 +37,9 @@ class DeAIClient:
             self.api_base_urls = [url.strip() for url in urls_str.split(',')]
         
         self.active_api_url = None
+        # Capability records from the last /nodes refresh, by node URL.
+        self.node_capabilities = {}
+        self._nodes_etag = None
 
         # --- Blockchain Initialization ---
         self.rpc_url = rpc_url or os.getenv("RPC_URL")
@@ -74,17 +80,29 @@ class DeAIClient:
             raise ConnectionError(f"Failed to connect to any DeAI Gateway in the list: {self.api_base_urls}")
 
     def refresh_nodes(self):
-        """Refreshes the list of API URLs from the active gateway's /nodes endpoint."""
+        """
+        Refreshes the list of API URLs and their capability records from the
+        active gateway's /nodes endpoint. The request is conditional, so an
+        unchanged list costs an empty 304 response.
+        """
         if not self.active_api_url:
             print("Cannot refresh nodes without an active connection.")
             return
 
         try:
             print(f"Refreshing node list from gateway: {self.active_api_url}")
-            response = requests.get(f"{self.active_api_url}/nodes", timeout=5)
+            headers = {"If-None-Match": self._nodes_etag} if self._nodes_etag else {}
+            response = requests.get(f"{self.active_api_url}/nodes", headers=headers, timeout=5)
+            if response.status_code == 304:
+                print("Node list unchanged.")
+                return
             response.raise_for_status()
             data = response.json()
+            self._nodes_etag = response.headers.get("ETag")
             new_nodes = data.get("nodes", [])
+            self.node_capabilities = {
+                peer["url"]: peer.get("capabilities") for peer in data.get("peers", []) if "url" in peer
+            }
             
             if new_nodes:
                 with self._lock:
@@ -161,15 +179,58 @@ class DeAIClient:
 
     def get_job_status(self, task_id: str) -> TaskStatus:
         """Retrieves the status of a specific job."""
-        response = self._make_request("get", f"/api/gateway/result/{task_id}")
+        response = self._make_request("get", f"/api/gateway/tasks/status/{task_id}")
+        return TaskStatus(**response.json())
+
+    def cancel_job(self, task_id: str) -> TaskStatus:
+        """
+        Stops a queued or running job. It finishes with a "CANCELLED" result
+        holding the text generated so far, and only those tokens are billed.
+        """
+        response = self._make_request("delete", f"/api/gateway/tasks/{task_id}")
         return TaskStatus(**response.json())
 
+    def stream_job_events(self, task_id: str, timeout: int = 120) -> Iterator[TaskStatus]:
+        """
+        Yields status updates pushed by the gateway (Server-Sent Events) until
+        the job reaches a terminal state or `timeout` seconds pass.
+        """
+        if not self.active_api_url:
+            self._find_healthy_node()
+
+        url = f"{self.active_api_url}/api/gateway/tasks/{task_id}/events"
+        start_time = time.time()
+        # The read timeout only has to outlast the server's keep-alive interval.
+        with requests.get(url, headers={"Accept": "text/event-stream"}, stream=True, timeout=(5, 30)) as response:
+            response.raise_for_status()
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if time.time() - start_time > timeout:
+                    raise TimeoutError(f"Job {task_id} timed out after {timeout} seconds.")
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+                elif not line and data_lines:
+                    yield TaskStatus(**json.loads("\n".join(data_lines)))
+                    data_lines = []
+
     def get_job_result(self, task_id: str, timeout: int = 120, polling_interval: int = 5) -> TaskStatus:
-        """Waits for a job to complete and retrieves the final result."""
+        """
+        Waits for a job to complete and retrieves the final result.
+        Uses the gateway's pushed task events, falling back to polling when
+        the gateway does not offer them.
+        """
         start_time = time.time()
+        try:
+            for status in self.stream_job_events(task_id, timeout=timeout):
+                if status.status in TERMINAL_STATES:
+                    return status
+                print(f"Job is {status.status}...")
+        except requests.exceptions.RequestException as e:
+            print(f"Task events unavailable ({e}). Falling back to polling.")
+
         while time.time() - start_time < timeout:
             status = self.get_job_status(task_id)
-            if status.status in ["SUCCESS", "FAILURE"]:
+            if status.status in TERMINAL_STATES:
                 return status
             print(f"Job is still {status.status}... polling again in {polling_interval}s")
             time.sleep(polling_interval)
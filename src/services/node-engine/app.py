@@ -1,36 +1,79 @@
 import os
 import asyncio
+import hashlib
+import json
 import httpx
-import random
 import grpc
-from typing import Dict, List
+from typing import Dict, Optional
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import threading
 
-from fastapi import FastAPI, status, Request
+from fastapi import FastAPI, status, Request, Response
+from fastapi.responses import JSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
 
 # Load environment variables from .env file
 load_dotenv()
 
 # --- gRPC Imports ---
-from services.node_engine.grpc.server import serve as grpc_serve, peers, peers_lock, _add_peers
+from services.node_engine.grpc.server import (
+    serve as grpc_serve, shutdown as grpc_shutdown, join as grpc_join, peers, peers_lock, peer_channels, _add_peers,
+    peer_capabilities,
+)
 from services.node_engine.grpc import node_pb2, node_pb2_grpc
 
 # --- Local Imports ---
-from services.node_engine.main.routes import router as main_router
+from services.node_engine.main.routes import router as main_router, task_event_hub
+from services.node_engine.dependencies import close_onchain_service
 from services.node_engine.billing.routes import router as billing_router
-from services.node_engine.main.websocket import connect_websocket, ws_client
+from services.node_engine.main.websocket import connect_gateway, close_gateway
+from services.node_engine.balancer import PeerBalancer, post_to_peer
+from services.node_engine.capabilities import (
+    CAPABILITY_REFRESH_SECONDS, Capabilities, collect_capabilities, rank_peers,
+)
+from services.node_engine.tasks import get_available_models, meter
+from services.node_engine.metrics import PROXY_REQUESTS
 
 # --- Constants ---
 GRPC_PORT = os.getenv("GRPC_PORT", "50051")
+MY_GRPC_ADDRESS = f"localhost:{GRPC_PORT}" # Assuming local development
+PROXY_TIMEOUT_SECONDS = float(os.getenv("PROXY_TIMEOUT_SECONDS", "300"))
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "200"))
+PROXY_KEEPALIVE_SECONDS = float(os.getenv("PROXY_KEEPALIVE_SECONDS", "60"))
+PROXY_HTTP2 = os.getenv("PROXY_HTTP2", "true").lower() == "true"
+# Port of the peers' HTTP API; peers are known by their gRPC address.
+PEER_HTTP_PORT = int(os.getenv("PEER_HTTP_PORT", "8000"))
+
+# --- Proxy State ---
+proxy_balancer = PeerBalancer()
+_proxy_client: Optional[httpx.AsyncClient] = None
+
+def get_proxy_client() -> httpx.AsyncClient:
+    """One pooled client for all proxied requests, keeping connections to peers alive."""
+    global _proxy_client
+    if _proxy_client is None:
+        _proxy_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(PROXY_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=PROXY_MAX_CONNECTIONS,
+                max_keepalive_connections=PROXY_MAX_CONNECTIONS,
+                keepalive_expiry=PROXY_KEEPALIVE_SECONDS,
+            ),
+            http2=PROXY_HTTP2,
+        )
+    return _proxy_client
+
+def _http_peer(peer: str) -> str:
+    """HTTP base URL of a peer's API, from its gRPC address."""
+    return f"http://{peer.split(':')[0]}:{PEER_HTTP_PORT}"
 
 # --- Dynamic Peer Discovery (gRPC based) ---
-def bootstrap_to_mesh():
+async def bootstrap_to_mesh():
     """
     Connects to the gRPC-based peer-to-peer network.
-    It uses PEER_NODES from .env as initial bootstrap points.
+    It uses PEER_NODES from .env as initial bootstrap points. With gossip on,
+    every seed is contacted at once; otherwise the first one that answers an
+    announcement is used.
     """
     bootstrap_nodes_str = os.getenv("PEER_NODES", "")
     if not bootstrap_nodes_str:
@@ -38,23 +81,29 @@ def bootstrap_to_mesh():
         return
 
     bootstrap_peers = [peer.strip() for peer in bootstrap_nodes_str.split(',')]
-    my_address = f"localhost:{GRPC_PORT}" # Assuming local development
+    my_address = MY_GRPC_ADDRESS
+
+    joined = await grpc_join(bootstrap_peers)
+    if joined:
+        print(f"Joined the gossip mesh through {joined} of {len(bootstrap_peers)} seed(s).")
+        _add_peers([my_address])
+        return
 
     for peer_address in bootstrap_peers:
         print(f"Attempting to bootstrap with peer: {peer_address}")
         try:
-            with grpc.insecure_channel(peer_address) as channel:
-                stub = node_pb2_grpc.NodeStub(channel)
-                request = node_pb2.AnnouncePeerRequest(address=my_address)
-                
-                response = stub.AnnouncePeer(request, timeout=5)
-                
-                print(f"Successfully bootstrapped with {peer_address}. Discovering network...")
-                discovered_peers = list(response.peers)
-                
-                _add_peers(discovered_peers)
-                _add_peers([my_address, peer_address])
-                return
+            # The channel stays open for the prober and later RPCs to this peer.
+            stub = node_pb2_grpc.NodeStub(peer_channels.get(peer_address))
+            request = node_pb2.AnnouncePeerRequest(address=my_address)
+
+            response = await stub.AnnouncePeer(request, timeout=5)
+
+            print(f"Successfully bootstrapped with {peer_address}. Discovering network...")
+            discovered_peers = list(response.current_peers)
+
+            _add_peers(discovered_peers)
+            _add_peers([my_address, peer_address])
+            return
 
         except grpc.RpcError as e:
             print(f"Failed to connect to bootstrap peer {peer_address}: {e.details()}")
@@ -70,17 +119,25 @@ async def lifespan(app: FastAPI):
     """
     print("FastAPI server starting...")
 
-    grpc_thread = threading.Thread(target=grpc_serve, daemon=True)
-    grpc_thread.start()
-
-    bootstrap_thread = threading.Thread(target=bootstrap_to_mesh, daemon=True)
-    bootstrap_thread.start()
+    # The mesh runs on this event loop: no server thread pool, no probe threads.
+    await grpc_serve(GRPC_PORT, self_address=MY_GRPC_ADDRESS,
+                     capabilities=lambda: collect_capabilities(get_available_models()))
+    bootstrap_task = asyncio.create_task(bootstrap_to_mesh())
+    # Routed inferences from the gateway, when GATEWAY_WEBSOCKET_URL is set.
+    connect_gateway(task_event_hub)
 
     yield
     
     print("FastAPI server shutting down...")
-    if ws_client:
-        ws_client.close()
+    bootstrap_task.cancel()
+    await close_gateway()
+    await grpc_shutdown()
+    await task_event_hub.close()
+    await close_onchain_service()
+    # Debits what the cached results served since the last flush.
+    meter.close()
+    if _proxy_client is not None:
+        await _proxy_client.aclose()
 
 # --- FastAPI App Initialization ---
 app = FastAPI(lifespan=lifespan)
@@ -105,41 +162,66 @@ def read_root():
     return {"message": "Welcome to the Node Engine"}
 
 # --- Gateway Mesh Endpoints ---
+def _peer_records() -> Dict[str, Optional[Capabilities]]:
+    """Known peers by gRPC address, with their capability record if they published one."""
+    records = peer_capabilities()
+    with peers_lock:
+        addresses = set(peers)
+    return {address: records.get(address) for address in addresses}
+
 @app.get("/nodes", status_code=status.HTTP_200_OK)
-def get_nodes() -> Dict[str, List[str]]:
+def get_nodes(request: Request):
     """
-    Returns the current list of known peer nodes from the dynamic gRPC peer set.
+    Returns the known peer nodes and their capability records. The response
+    carries an ETag; a request whose If-None-Match matches gets a 304.
     """
-    with peers_lock:
-        http_peers = [f"http://{peer.split(':')[0]}:8000" for peer in peers]
-            
-    return {"nodes": http_peers}
+    records = _peer_records()
+    body = {
+        "nodes": sorted({_http_peer(address) for address in records}),
+        "peers": [
+            {"url": _http_peer(address), "address": address,
+             "capabilities": record.to_dict() if record else None}
+            for address, record in sorted(records.items())
+        ],
+    }
+    content = json.dumps(body, separators=(",", ":"), sort_keys=True).encode()
+    etag = f'"{hashlib.sha1(content).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"max-age={int(CAPABILITY_REFRESH_SECONDS)}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
 
 @app.post("/proxy-inference")
 async def proxy_inference(request: Request):
     """
-    Proxies an inference request to a randomly selected healthy node from the gRPC peer list.
+    Proxies an inference request to a mesh node picked by the latency-aware
+    balancer (see balancer.py). Nodes advertising the requested model are
+    preferred, weighted by their backlog (see capabilities.py). If the node
+    cannot be reached, the request is retried on another one.
     """
-    with peers_lock:
-        if not peers:
-            return {"error": "No healthy nodes available"}, status.HTTP_503_SERVICE_UNAVAILABLE
-        http_peers = [f"http://{peer.split(':')[0]}:8000" for peer in peers]
-        target_node_url = random.choice(http_peers)
+    records = {_http_peer(address): record for address, record in _peer_records().items()}
+    if not records:
+        return JSONResponse({"error": "No healthy nodes available"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    proxy_balancer.forget(list(records))
 
     body = await request.json()
-    print(f"Proxying inference request to random mesh node: {target_node_url}")
-
-    async with httpx.AsyncClient(timeout=300) as client:
-        try:
-            response = await client.post(f"{target_node_url}/generate", json=body)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            print(f"Error from target node {target_node_url}: {e.response.text}")
-            return e.response.json(), e.response.status_code
-        except httpx.RequestError as e:
-            print(f"Failed to proxy request to {target_node_url}: {e}")
-            return {"error": f"Failed to proxy to node {target_node_url}"}, status.HTTP_502_BAD_GATEWAY
+    candidates, weights = rank_peers(records, body.get("model") if isinstance(body, dict) else None)
+    try:
+        target_node_url, response = await post_to_peer(get_proxy_client(), proxy_balancer, sorted(candidates),
+                                                        "/generate", body, weights=weights)
+    except httpx.RequestError as e:
+        PROXY_REQUESTS.labels(result="unreachable").inc()
+        print(f"Failed to proxy inference request: {e}")
+        return JSONResponse({"error": "Failed to proxy to a mesh node"}, status_code=status.HTTP_502_BAD_GATEWAY)
+
+    if response.status_code >= 500:
+        PROXY_REQUESTS.labels(result="error").inc()
+        print(f"Error from target node {target_node_url}: {response.text}")
+    else:
+        PROXY_REQUESTS.labels(result="ok").inc()
+    return Response(content=response.content, status_code=response.status_code,
+                    media_type=response.headers.get("content-type"))
 
 
 # --- API Routers ---
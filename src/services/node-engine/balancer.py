@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Peer selection for `/proxy-inference`.
+
+`PeerBalancer` uses power-of-two-choices. It samples two candidate peers
+and picks the cheaper one, where the cost is the peer's EWMA latency times
+its in-flight requests plus one. Sampling two peers instead of scanning all
+of them keeps a burst of requests from piling onto the single best peer, and
+the cost still steers traffic away from slow or busy ones. Callers may scale
+the cost per peer with `weights`, e.g. by a peer's advertised backlog.
+
+A peer that fails `PROXY_EJECT_AFTER_FAILURES` times in a row (connection
+errors or 5xx responses) is ejected for `PROXY_EJECT_SECONDS`. The ejection
+time doubles for each repeated ejection. At most `PROXY_MAX_EJECTED_PERCENT`
+of the peers are ejected at once, so a bad network blip cannot empty the pool.
+"""
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+
+import httpx
+
+from .metrics import PROXY_PEER_EJECTIONS
+
+# --- Configuration ---
+# Time constant of the latency average: older samples weigh e^(-age / decay).
+PROXY_EWMA_DECAY_SECONDS = float(os.getenv("PROXY_EWMA_DECAY_SECONDS", "10"))
+PROXY_EJECT_AFTER_FAILURES = int(os.getenv("PROXY_EJECT_AFTER_FAILURES", "3"))
+PROXY_EJECT_SECONDS = float(os.getenv("PROXY_EJECT_SECONDS", "30"))
+PROXY_MAX_EJECT_SECONDS = float(os.getenv("PROXY_MAX_EJECT_SECONDS", "300"))
+PROXY_MAX_EJECTED_PERCENT = float(os.getenv("PROXY_MAX_EJECTED_PERCENT", "50"))
+# Peers tried per request when the chosen one cannot be reached.
+PROXY_ATTEMPTS = int(os.getenv("PROXY_ATTEMPTS", "2"))
+
+
+@dataclass
+class PeerStats:
+    in_flight: int = 0
+    ewma_seconds: Optional[float] = None  # None until the first response
+    updated_at: float = 0.0
+    consecutive_failures: int = 0
+    ejections: int = 0
+    ejected_until: float = 0.0
+
+
+class PeerBalancer:
+    """
+    Tracks latency, load and health per peer. Safe to share between threads.
+    """
+    def __init__(self, decay_seconds: float = PROXY_EWMA_DECAY_SECONDS,
+                 eject_after_failures: int = PROXY_EJECT_AFTER_FAILURES,
+                 eject_seconds: float = PROXY_EJECT_SECONDS,
+                 max_eject_seconds: float = PROXY_MAX_EJECT_SECONDS,
+                 max_ejected_percent: float = PROXY_MAX_EJECTED_PERCENT,
+                 rng: Optional[random.Random] = None, clock=time.monotonic):
+        self.decay_seconds = decay_seconds
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.max_ejected_percent = max_ejected_percent
+        self._rng = rng or random.Random()
+        self._clock = clock
+        self._peers: Dict[str, PeerStats] = {}
+        self._lock = threading.Lock()
+
+    # --- Selection ---
+
+    def _cost(self, stats: PeerStats, default_latency: float) -> float:
+        latency = stats.ewma_seconds if stats.ewma_seconds is not None else default_latency
+        return latency * (stats.in_flight + 1)
+
+    def choose(self, candidates: Sequence[str], exclude: Sequence[str] = (),
+               weights: Optional[Dict[str, float]] = None) -> Optional[str]:
+        """
+        Picks the cheaper of two random healthy candidates, or None if there
+        are none. `weights` multiplies the cost of the peers it lists.
+        """
+        candidates = [peer for peer in dict.fromkeys(candidates) if peer not in exclude]
+        if not candidates:
+            return None
+        now = self._clock()
+        with self._lock:
+            stats = {peer: self._peers.setdefault(peer, PeerStats()) for peer in candidates}
+            healthy = [peer for peer in candidates if stats[peer].ejected_until <= now]
+            # If every candidate is ejected, trying one beats failing outright.
+            pool = healthy or candidates
+            if len(pool) == 1:
+                return pool[0]
+            # Unmeasured peers are assumed average, so they get traffic without being flooded.
+            known = [s.ewma_seconds for s in stats.values() if s.ewma_seconds is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            weights = weights or {}
+            first, second = self._rng.sample(pool, 2)
+            first_cost = self._cost(stats[first], default_latency) * weights.get(first, 1.0)
+            second_cost = self._cost(stats[second], default_latency) * weights.get(second, 1.0)
+            return second if second_cost < first_cost else first
+
+    # --- Accounting ---
+
+    @contextmanager
+    def track(self, peer: str):
+        """
+        Counts a request to `peer` as in flight for the duration of the block.
+        Call `succeeded()` or `failed()` on the yielded handle; a block that
+        raises counts as a failure.
+        """
+        with self._lock:
+            self._peers.setdefault(peer, PeerStats()).in_flight += 1
+        handle = _RequestHandle(self, peer, self._clock())
+        try:
+            yield handle
+        except BaseException:
+            handle.failed()
+            raise
+        finally:
+            with self._lock:
+                self._peers[peer].in_flight -= 1
+
+    def _observe(self, peer: str, started: float, ok: bool):
+        now = self._clock()
+        latency = now - started
+        with self._lock:
+            stats = self._peers.setdefault(peer, PeerStats())
+            if not ok:
+                # A fast failure must not make the peer look fast.
+                latency = max(latency, (stats.ewma_seconds or latency) * 2)
+            if stats.ewma_seconds is None:
+                stats.ewma_seconds = latency
+            else:
+                weight = math.exp(-(now - stats.updated_at) / self.decay_seconds)
+                stats.ewma_seconds = stats.ewma_seconds * weight + latency * (1 - weight)
+            stats.updated_at = now
+            if ok:
+                stats.consecutive_failures = 0
+                return
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.eject_after_failures and stats.ejected_until <= now:
+                self._maybe_eject(peer, stats, now)
+
+    def _maybe_eject(self, peer: str, stats: PeerStats, now: float):
+        ejected = sum(1 for s in self._peers.values() if s.ejected_until > now)
+        if (ejected + 1) * 100 > len(self._peers) * self.max_ejected_percent:
+            return
+        stats.ejections += 1
+        duration = min(self.eject_seconds * 2 ** (stats.ejections - 1), self.max_eject_seconds)
+        stats.ejected_until = now + duration
+        stats.consecutive_failures = 0
+        PROXY_PEER_EJECTIONS.inc()
+        print(f"Ejected peer {peer} for {duration:.0f}s after repeated failures.")
+
+    def forget(self, keep: Sequence[str]):
+        """Drops the state of peers that have left the mesh."""
+        keep = set(keep)
+        with self._lock:
+            for peer in [p for p in self._peers if p not in keep and not self._peers[p].in_flight]:
+                del self._peers[peer]
+
+    def stats(self) -> Dict[str, dict]:
+        now = self._clock()
+        with self._lock:
+            return {
+                peer: {
+                    "in_flight": s.in_flight,
+                    "ewma_ms": round(s.ewma_seconds * 1000, 2) if s.ewma_seconds is not None else None,
+                    "ejected": s.ejected_until > now,
+                    "ejections": s.ejections,
+                }
+                for peer, s in self._peers.items()
+            }
+
+
+class _RequestHandle:
+    def __init__(self, balancer: PeerBalancer, peer: str, started: float):
+        self._balancer = balancer
+        self._peer = peer
+        self._started = started
+        self._done = False
+
+    def succeeded(self):
+        self._finish(ok=True)
+
+    def failed(self):
+        self._finish(ok=False)
+
+    def _finish(self, ok: bool):
+        if not self._done:
+            self._done = True
+            self._balancer._observe(self._peer, self._started, ok)
+
+
+async def post_to_peer(client: httpx.AsyncClient, balancer: PeerBalancer, peers: Sequence[str],
+                       path: str, payload, attempts: int = PROXY_ATTEMPTS,
+                       weights: Optional[Dict[str, float]] = None) -> Tuple[str, httpx.Response]:
+    """
+    POSTs `payload` as JSON to `path` on a peer picked by `balancer`. If the
+    connection fails, nothing was sent, so the next attempt goes to another peer.
+
+    Returns:
+        The peer's base URL and its response, whatever the status code.
+
+    Raises:
+        httpx.RequestError: If no attempt got a response.
+    """
+    tried = []
+    last_error: Optional[httpx.RequestError] = None
+    for _ in range(attempts):
+        peer = balancer.choose(peers, exclude=tried, weights=weights)
+        if peer is None:
+            break
+        tried.append(peer)
+        with balancer.track(peer) as attempt:
+            try:
+                response = await client.post(f"{peer}{path}", json=payload)
+            except httpx.ConnectError as e:
+                attempt.failed()
+                last_error = e
+                print(f"Failed to connect to peer {peer}: {e}")
+                continue
+            if response.status_code >= 500:
+                attempt.failed()
+            else:
+                attempt.succeeded()
+            return peer, response
+    raise last_error or httpx.ConnectError("No peer available to send the request to.")
@@ -1,84 +1,77 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import asyncio
-import json
-import threading
 from pathlib import Path
 from typing import Dict
 
+from .ledger import LedgerBackend, SQLiteLedger, RedisLedger, migrate_json_file
+
 # --- Constants ---
+# Legacy JSON store, imported into the ledger on first start.
 BALANCES_FILE = Path("balances.json")
+# "sqlite" (single host, any number of processes) or "redis" (multiple hosts).
+BALANCE_BACKEND = os.getenv("BALANCE_BACKEND", "sqlite").lower()
+BALANCE_DB_PATH = os.getenv("BALANCE_DB_PATH", "balances.db")
 
-# --- Thread-safe Balance Management ---
-_lock = threading.Lock()
-_balances: Dict[str, float] = {}
-
-def _load_balances():
-    """Loads the balances from the JSON file into memory."""
-    # This function should be called within a lock.
-    if BALANCES_FILE.exists():
-        with open(BALANCES_FILE, 'r') as f:
-            try:
-                _balances = json.load(f)
-            except json.JSONDecodeError:
-                # If file is empty or corrupt, start with empty balances
-                _balances = {}
-    else:
-        _balances = {}
 
-def _save_balances():
-    """Saves the current in-memory balances to the JSON file."""
-    # This function should be called within a lock.
-    with open(BALANCES_FILE, 'w') as f:
-        json.dump(_balances, f, indent=4)
+def _create_ledger() -> LedgerBackend:
+    """Instantiates the configured ledger backend."""
+    if BALANCE_BACKEND == "redis":
+        return RedisLedger()
+    if BALANCE_BACKEND == "sqlite":
+        return SQLiteLedger(BALANCE_DB_PATH)
+    raise ValueError(f"Unknown BALANCE_BACKEND '{BALANCE_BACKEND}'. Use 'sqlite' or 'redis'.")
 
 # --- Public API ---
 
 def get_balance(user_id: str) -> float:
     """
     Retrieves the credit balance for a specific user.
-    This operation is thread-safe and reads the latest data from the file.
+    This is a single indexed lookup and is safe across processes.
     """
-    with _lock:
-        _load_balances()
-        return _balances.get(user_id, 0.0)
+    return ledger.get_balance(user_id)
 
 def add_credits(user_id: str, amount_usd: float):
     """
-    Adds credits to a user's balance in a thread-safe manner.
+    Adds credits to a user's balance atomically.
     """
-    with _lock:
-        _load_balances() # Load the latest state to avoid overwriting recent changes
-        _balances[user_id] = _balances.get(user_id, 0.0) + amount_usd
-        _save_balances() # Persist the change immediately
-    print(f"Added ${amount_usd} to {user_id}. New balance: {_balances.get(user_id, 0.0)}")
+    new_balance = ledger.credit(user_id, amount_usd, reference="stripe")
+    print(f"Added ${amount_usd} to {user_id}. New balance: {new_balance}")
 
 
 async def check_and_debit_balance(user_id: str, amount_usd: float) -> bool:
     """
     Asynchronously checks for sufficient balance and deducts credits.
     This is the recommended method for use in async contexts like FastAPI.
-    It runs the synchronous, thread-safe file operations in a separate thread.
+    The check and the debit happen in one ledger transaction, run in a
+    separate thread so the event loop is not blocked.
     """
     def _sync_check_and_debit():
-        with _lock:
-            _load_balances()  # Load the latest state from disk
-            current_balance = _balances.get(user_id, 0.0)
-            if current_balance >= amount_usd:
-                _balances[user_id] = current_balance - amount_usd
-                _save_balances()  # Persist the change
-                print(f"Used ${amount_usd} from {user_id}. Remaining balance: {_balances[user_id]}")
-                return True
-            else:
-                print(f"Insufficient balance for {user_id}. Required: ${amount_usd}, has: ${current_balance}")
-                return False
+        remaining = ledger.debit(user_id, amount_usd)
+        if remaining is not None:
+            print(f"Used ${amount_usd} from {user_id}. Remaining balance: {remaining}")
+            return True
+        print(f"Insufficient balance for {user_id}. Required: ${amount_usd}, has: ${ledger.get_balance(user_id)}")
+        return False
 
-    # Run the synchronous, thread-safe function in a separate thread to avoid blocking the event loop
+    # Run the blocking ledger call in a separate thread to avoid blocking the event loop
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, _sync_check_and_debit)
 
 
+def charge_usage(charges: Dict[str, float]):
+    """
+    Debits metered usage for several users in one ledger transaction (see
+    metering.py). Balances may go negative, since the work was delivered.
+    """
+    balances = ledger.charge(charges, reference="usage")
+    overdrawn = sum(balance < 0 for balance in balances.values())
+    print(f"Debited metered usage of ${sum(charges.values()):.6f} from {len(charges)} user(s); "
+          f"{overdrawn} overdrawn.")
+
+
 # --- Initial Load ---
-# Perform an initial load when the module is imported.
-with _lock:
-    _load_balances()
+# Open the ledger when the module is imported and carry over any legacy balances.
+ledger: LedgerBackend = _create_ledger()
+migrate_json_file(ledger, BALANCES_FILE)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Transactional credit ledgers backing the balance service.
+
+Every credit and debit is appended to an immutable entry log, and a per-user
+balance index is updated in the same atomic step, so a debit costs one indexed
+row update instead of rewriting every user's balance. Amounts are stored as
+integer micro-dollars to avoid floating point drift.
+
+Two backends are provided, both safe to share between processes:
+- `SQLiteLedger`: a single database file in WAL mode, for one host.
+- `RedisLedger`: Lua scripts against Redis, for workers spread over hosts.
+"""
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+
+# --- Constants ---
+MICROS_PER_USD = 1_000_000
+
+
+def to_micros(amount_usd: float) -> int:
+    return int(round(amount_usd * MICROS_PER_USD))
+
+
+def from_micros(amount_micros: int) -> float:
+    return amount_micros / MICROS_PER_USD
+
+
+class LedgerBackend(ABC):
+    """
+    Interface every ledger backend implements.
+    """
+
+    @abstractmethod
+    def get_balance(self, user_id: str) -> float:
+        """Returns the user's balance in USD (0.0 for unknown users)."""
+        pass
+
+    @abstractmethod
+    def credit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> float:
+        """Adds credits and returns the new balance."""
+        pass
+
+    @abstractmethod
+    def debit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> Optional[float]:
+        """
+        Atomically deducts credits if the balance covers them.
+        Returns the remaining balance, or None if the balance was insufficient.
+        """
+        pass
+
+    @abstractmethod
+    def charge(self, charges: Dict[str, float], reference: Optional[str] = None) -> Dict[str, float]:
+        """
+        Deducts already-delivered usage from several users in one atomic step
+        and returns their new balances. The work has been done, so a balance
+        may go negative; the user owes the difference.
+        """
+        pass
+
+    @abstractmethod
+    def import_balances(self, balances: Dict[str, float], reference: str = "migration") -> int:
+        """
+        Seeds balances for users the ledger does not know yet and returns how
+        many were imported. Existing users are left untouched, so importing the
+        same data twice never double-credits anyone.
+        """
+        pass
+
+
+class SQLiteLedger(LedgerBackend):
+    """
+    Ledger stored in a SQLite database in WAL mode.
+
+    WAL lets readers proceed while one writer commits, and `BEGIN IMMEDIATE`
+    serialises writers across every process that opens the same file.
+    """
+    def __init__(self, path: str = "balances.db"):
+        self.path = str(path)
+        self._local = threading.local()
+        # `executescript` manages its own transaction; the DDL is idempotent.
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS ledger_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                amount_micros INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                reference TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ledger_entries_user ON ledger_entries (user_id);
+            CREATE TABLE IF NOT EXISTS balances (
+                user_id TEXT PRIMARY KEY,
+                balance_micros INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._connection())
+
+    def get_balance(self, user_id: str) -> float:
+        row = self._connection().execute(
+            "SELECT balance_micros FROM balances WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return from_micros(row[0]) if row else 0.0
+
+    def credit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> float:
+        amount = to_micros(amount_usd)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO balances (user_id, balance_micros) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET balance_micros = balance_micros + excluded.balance_micros",
+                (user_id, amount),
+            )
+            conn.execute(
+                "INSERT INTO ledger_entries (user_id, amount_micros, kind, reference, created_at) VALUES (?, ?, 'credit', ?, ?)",
+                (user_id, amount, reference, time.time()),
+            )
+            balance = conn.execute("SELECT balance_micros FROM balances WHERE user_id = ?", (user_id,)).fetchone()[0]
+        return from_micros(balance)
+
+    def debit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> Optional[float]:
+        amount = to_micros(amount_usd)
+        with self._transaction() as conn:
+            # The balance check and the deduction are one conditional UPDATE.
+            cursor = conn.execute(
+                "UPDATE balances SET balance_micros = balance_micros - ? WHERE user_id = ? AND balance_micros >= ?",
+                (amount, user_id, amount),
+            )
+            if cursor.rowcount != 1:
+                return None
+            conn.execute(
+                "INSERT INTO ledger_entries (user_id, amount_micros, kind, reference, created_at) VALUES (?, ?, 'debit', ?, ?)",
+                (user_id, -amount, reference, time.time()),
+            )
+            balance = conn.execute("SELECT balance_micros FROM balances WHERE user_id = ?", (user_id,)).fetchone()[0]
+        return from_micros(balance)
+
+    def charge(self, charges: Dict[str, float], reference: Optional[str] = None) -> Dict[str, float]:
+        now = time.time()
+        rows = [(user_id, to_micros(amount_usd)) for user_id, amount_usd in charges.items()]
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO balances (user_id, balance_micros) VALUES (?, -?) "
+                "ON CONFLICT (user_id) DO UPDATE SET balance_micros = balance_micros + excluded.balance_micros",
+                rows,
+            )
+            conn.executemany(
+                "INSERT INTO ledger_entries (user_id, amount_micros, kind, reference, created_at) VALUES (?, -?, 'usage', ?, ?)",
+                [(user_id, amount, reference, now) for user_id, amount in rows],
+            )
+            balances = {}
+            for user_id, _ in rows:
+                balance = conn.execute("SELECT balance_micros FROM balances WHERE user_id = ?", (user_id,)).fetchone()[0]
+                balances[user_id] = from_micros(balance)
+        return balances
+
+    def import_balances(self, balances: Dict[str, float], reference: str = "migration") -> int:
+        now = time.time()
+        imported = 0
+        with self._transaction() as conn:
+            for user_id, amount_usd in balances.items():
+                amount = to_micros(amount_usd)
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO balances (user_id, balance_micros) VALUES (?, ?)", (user_id, amount)
+                )
+                if cursor.rowcount == 1:
+                    conn.execute(
+                        "INSERT INTO ledger_entries (user_id, amount_micros, kind, reference, created_at) VALUES (?, ?, 'credit', ?, ?)",
+                        (user_id, amount, reference, now),
+                    )
+                    imported += 1
+        return imported
+
+
+class _ImmediateTransaction:
+    """Context manager running a block inside `BEGIN IMMEDIATE ... COMMIT`."""
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# --- Redis Backend ---
+
+# KEYS[1] = balance hash, KEYS[2] = entry stream
+# ARGV = user_id, amount_micros, reference
+_CREDIT_SCRIPT = """
+local balance = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+redis.call('XADD', KEYS[2], '*', 'user', ARGV[1], 'amount', ARGV[2], 'kind', 'credit', 'ref', ARGV[3])
+return balance
+"""
+
+_DEBIT_SCRIPT = """
+local balance = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local amount = tonumber(ARGV[2])
+if balance < amount then
+    return false
+end
+balance = redis.call('HINCRBY', KEYS[1], ARGV[1], -amount)
+redis.call('XADD', KEYS[2], '*', 'user', ARGV[1], 'amount', -amount, 'kind', 'debit', 'ref', ARGV[3])
+return balance
+"""
+
+# ARGV = reference, then user_id, amount_micros pairs
+_CHARGE_SCRIPT = """
+local balances = {}
+for i = 2, #ARGV - 1, 2 do
+    balances[#balances + 1] = redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    redis.call('XADD', KEYS[2], '*', 'user', ARGV[i], 'amount', -tonumber(ARGV[i + 1]), 'kind', 'usage', 'ref', ARGV[1])
+end
+return balances
+"""
+
+_IMPORT_SCRIPT = """
+local imported = 0
+for i = 1, #ARGV - 1, 2 do
+    if redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('XADD', KEYS[2], '*', 'user', ARGV[i], 'amount', ARGV[i + 1], 'kind', 'credit', 'ref', 'migration')
+        imported = imported + 1
+    end
+end
+return imported
+"""
+
+
+class RedisLedger(LedgerBackend):
+    """
+    Ledger stored in Redis. Each operation is a single Lua script, so the
+    balance check, update and entry append are atomic across all clients.
+    """
+    # The hash tag keeps both keys in one slot on Redis Cluster.
+    BALANCES_KEY = "{deai:ledger}:balances"
+    ENTRIES_KEY = "{deai:ledger}:entries"
+    _IMPORT_CHUNK = 1000
+
+    def __init__(self, client=None):
+        if client is None:
+            from ..redis_client import get_redis
+            client = get_redis()
+        self.redis = client
+        self._credit = client.register_script(_CREDIT_SCRIPT)
+        self._debit = client.register_script(_DEBIT_SCRIPT)
+        self._charge = client.register_script(_CHARGE_SCRIPT)
+        self._import = client.register_script(_IMPORT_SCRIPT)
+
+    def _keys(self):
+        return [self.BALANCES_KEY, self.ENTRIES_KEY]
+
+    def get_balance(self, user_id: str) -> float:
+        balance = self.redis.hget(self.BALANCES_KEY, user_id)
+        return from_micros(int(balance)) if balance is not None else 0.0
+
+    def credit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> float:
+        balance = self._credit(keys=self._keys(), args=[user_id, to_micros(amount_usd), reference or ""])
+        return from_micros(int(balance))
+
+    def debit(self, user_id: str, amount_usd: float, reference: Optional[str] = None) -> Optional[float]:
+        balance = self._debit(keys=self._keys(), args=[user_id, to_micros(amount_usd), reference or ""])
+        return from_micros(int(balance)) if balance is not None else None
+
+    def charge(self, charges: Dict[str, float], reference: Optional[str] = None) -> Dict[str, float]:
+        if not charges:
+            return {}
+        args = [reference or ""]
+        for user_id, amount_usd in charges.items():
+            args.extend([user_id, to_micros(amount_usd)])
+        balances = self._charge(keys=self._keys(), args=args)
+        return {user_id: from_micros(int(balance)) for user_id, balance in zip(charges, balances)}
+
+    def import_balances(self, balances: Dict[str, float], reference: str = "migration") -> int:
+        items = list(balances.items())
+        imported = 0
+        for start in range(0, len(items), self._IMPORT_CHUNK):
+            args = []
+            for user_id, amount_usd in items[start:start + self._IMPORT_CHUNK]:
+                args.extend([user_id, to_micros(amount_usd)])
+            imported += int(self._import(keys=self._keys(), args=args))
+        return imported
+
+
+# --- Migration ---
+
+def migrate_json_file(ledger: LedgerBackend, path: Path) -> int:
+    """
+    Imports balances from the legacy `balances.json` file into `ledger`.
+    Safe to run repeatedly; returns the number of newly imported users.
+    """
+    path = Path(path)
+    if not path.exists():
+        return 0
+    with open(path, 'r') as f:
+        try:
+            balances = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Legacy balance file {path} is empty or corrupt; nothing to migrate.")
+            return 0
+    imported = ledger.import_balances({user: float(amount) for user, amount in balances.items()})
+    print(f"Migrated {imported} of {len(balances)} balances from {path}.")
+    return imported
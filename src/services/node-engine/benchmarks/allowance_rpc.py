@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Allowance lookup latency and RPC round trips, with and without the allowance reader.
+
+Runs an in-process eth-tester chain behind a local JSON-RPC HTTP endpoint that
+adds `--rpc-latency-ms` to every HTTP request (a stand-in for the network hop
+to a real node), then performs `--requests` payment verifications for
+`--users` distinct users from `--concurrency` threads:
+
+- `direct`: one `allowance()` eth_call per verification, as before.
+- `reader`: `AllowanceReader` with its TTL cache and batched eth_calls.
+- `async-reader`: `AsyncAllowanceReader` on one event loop and a shared
+  aiohttp session, as used by `AsyncOnChainService`; no executor threads.
+
+Usage:
+    python -m services.node_engine.benchmarks.allowance_rpc
+    python -m services.node_engine.benchmarks.allowance_rpc --users 1000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from web3 import AsyncWeb3, AsyncHTTPProvider, Web3, EthereumTesterProvider
+
+from ..onchain.allowance import AllowanceCache, AllowanceReader, AsyncAllowanceReader
+
+# Runtime code `return sload(0)`, so every allowance() reads one storage slot.
+_STUB_TOKEN_INITCODE = "0x600b600c600039600b6000f360005460005260206000f3"
+_ALLOWANCE_ABI = [{
+    "name": "allowance", "type": "function", "stateMutability": "view",
+    "inputs": [{"name": "owner", "type": "address"}, {"name": "spender", "type": "address"}],
+    "outputs": [{"name": "", "type": "uint256"}],
+}]
+
+
+class _Server(ThreadingHTTPServer):
+    # Every benchmark thread may connect at once.
+    request_queue_size = 1024
+
+
+class _ChainServer:
+    """Serves an eth-tester chain over HTTP JSON-RPC, counting round trips."""
+    def __init__(self, latency_ms: float):
+        self.chain = Web3(EthereumTesterProvider())
+        self.latency = latency_ms / 1000.0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(server.latency)
+                with server._lock:
+                    server.round_trips += 1
+                    replies = [server._call(item) for item in body] if isinstance(body, list) else server._call(body)
+                payload = Web3.to_json(replies).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _call(self, item: dict) -> dict:
+        # Goes through the client middlewares, which fill in defaults such as `from`.
+        response = self.chain.manager._make_request(item["method"], item.get("params", []))
+        return {"jsonrpc": "2.0", "id": item["id"], **{k: v for k, v in response.items() if k in ("result", "error")}}
+
+    def deploy_token(self) -> str:
+        deployer = self.chain.eth.accounts[0]
+        tx_hash = self.chain.eth.send_transaction({"from": deployer, "data": _STUB_TOKEN_INITCODE})
+        return self.chain.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def _owners(users: int):
+    return [Web3.to_checksum_address(f"0x{i + 1:040x}") for i in range(users)]
+
+
+def _run_threaded(mode: str, server: _ChainServer, token_address: str, users: int,
+                  requests: int, concurrency: int):
+    w3 = Web3(Web3.HTTPProvider(server.url))
+    token = w3.eth.contract(address=token_address, abi=_ALLOWANCE_ABI)
+    operator = server.chain.eth.accounts[1]
+    owners = _owners(users)
+    reader = AllowanceReader(w3, token, rpc_url=server.url, cache=AllowanceCache())
+
+    def lookup(i: int) -> float:
+        owner = owners[i % users]
+        started = time.perf_counter()
+        if mode == "direct":
+            token.functions.allowance(owner, operator).call()
+        else:
+            reader.get_allowance(owner, operator)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lookup, range(requests)))
+
+
+async def _run_async(server: _ChainServer, token_address: str, users: int, requests: int, concurrency: int):
+    operator = server.chain.eth.accounts[1]
+    owners = _owners(users)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=32)) as session:
+        w3 = AsyncWeb3(AsyncHTTPProvider(server.url))
+        await w3.provider.cache_async_session(session)
+        token = w3.eth.contract(address=token_address, abi=_ALLOWANCE_ABI)
+        reader = AsyncAllowanceReader(w3, token, server.url, session, cache=AllowanceCache())
+        limit = asyncio.Semaphore(concurrency)
+
+        async def lookup(i: int) -> float:
+            async with limit:
+                started = time.perf_counter()
+                await reader.get_allowance(owners[i % users], operator)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(lookup(i) for i in range(requests)))
+
+
+def bench_mode(mode: str, server: _ChainServer, token_address: str, users: int,
+               requests: int, concurrency: int) -> dict:
+    server.round_trips = 0
+    started = time.perf_counter()
+    if mode == "async-reader":
+        latencies = asyncio.run(_run_async(server, token_address, users, requests, concurrency))
+    else:
+        latencies = _run_threaded(mode, server, token_address, users, requests, concurrency)
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latencies)
+
+    return {
+        "mode": mode,
+        "users": users,
+        "requests": requests,
+        "concurrency": concurrency,
+        "rpc_round_trips": server.round_trips,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "verifications_per_second": round(requests / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rpc-latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    server = _ChainServer(args.rpc_latency_ms)
+    try:
+        token_address = server.deploy_token()
+        results = [
+            bench_mode(mode, server, token_address, args.users, args.requests, args.concurrency)
+            for mode in ("direct", "reader", "async-reader")
+        ]
+    finally:
+        server.close()
+
+    print(json.dumps({"benchmark": "allowance_rpc", "rpc_latency_ms": args.rpc_latency_ms,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
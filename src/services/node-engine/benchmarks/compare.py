@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares two load-test reports (see load_test.py) and flags regressions.
+
+A scenario regresses when its RPS (or generate's tokens/sec) drops, or its
+p95 latency grows, by more than `--threshold`, or when it has more errors.
+The exit status is 1 if any scenario regressed, so the script can gate CI.
+
+Usage:
+    python -m services.node_engine.benchmarks.compare before.json after.json
+    python -m services.node_engine.benchmarks.compare before.json after.json --threshold 0.2
+"""
+import argparse
+import json
+import sys
+from typing import List
+
+# Metric -> whether higher is better.
+METRICS = {"rps": True, "tokens_per_second": True, "p95_ms": False}
+
+
+def compare(base: dict, new: dict, threshold: float) -> List[str]:
+    """Prints a line per scenario and metric and returns the regressions found."""
+    regressions = []
+    for scenario, before in base["scenarios"].items():
+        after = new["scenarios"].get(scenario)
+        if after is None:
+            print(f"{scenario}: missing from the new report")
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in before or metric not in after:
+                continue
+            old, current = before[metric], after[metric]
+            change = (current - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > threshold else ""
+            print(f"{scenario:>10} {metric:>18}: {old:>10} -> {current:>10} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append(f"{scenario} {metric} {change:+.1%}")
+        if after["errors"] > before["errors"]:
+            print(f"{scenario:>10} {'errors':>18}: {before['errors']:>10} -> {after['errors']:>10} REGRESSION")
+            regressions.append(f"{scenario} errors {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="Report of the baseline run.")
+    parser.add_argument("new", help="Report of the run to check.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated relative change (default 0.1).")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"Comparing {base['meta'].get('commit') or args.base} -> {new['meta'].get('commit') or args.new}")
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): " + "; ".join(regressions))
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
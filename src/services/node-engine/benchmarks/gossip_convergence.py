@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Convergence time and per-node bandwidth of SWIM gossip, in one process.
+
+For each mesh size in `--sizes`, `SwimNode`s are wired together through a
+simulated network with `--latency` one-way delay and `--loss` drop
+probability. Node 0 is the only seed. The run measures:
+
+- join: seconds until every node sees every other node as alive.
+- failure: seconds from killing one node until every survivor has it DEAD.
+- messages and bytes sent per node per protocol period, with bytes taken
+  from the serialized `GossipPeers` protos. These should stay flat as the
+  mesh grows.
+
+Results are printed as JSON.
+
+Usage:
+    python -m services.node_engine.benchmarks.gossip_convergence --sizes 16 32 64
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+from ..grpc.gossip import (
+    ALIVE, DEAD, GossipMessage, GossipReply, Membership, SwimNode, message_to_proto, reply_to_proto,
+)
+
+
+class SimulatedNetwork:
+    """A `GossipTransport` delivering messages to in-process nodes."""
+    def __init__(self, latency: float = 0.002, loss: float = 0.0, rng: random.Random = None):
+        self.latency = latency
+        self.loss = loss
+        self.rng = rng or random.Random(0)
+        self.nodes: Dict[str, SwimNode] = {}
+        self.down = set()
+        self.messages = 0
+        self.bytes = 0
+
+    def transport(self, address: str) -> "_Endpoint":
+        return _Endpoint(self, address)
+
+    async def _deliver(self, sender: str, address: str, message: GossipMessage, timeout: float) -> GossipReply:
+        self.messages += 1
+        self.bytes += message_to_proto(message).ByteSize()
+        node = self.nodes.get(address)
+
+        async def round_trip():
+            await asyncio.sleep(self.latency)
+            if node is None or address in self.down or sender in self.down or self.rng.random() < self.loss:
+                await asyncio.sleep(timeout)
+                raise ConnectionError(f"{address} unreachable")
+            reply = await node.handle(message)
+            self.bytes += reply_to_proto(reply).ByteSize()
+            await asyncio.sleep(self.latency)
+            return reply
+
+        try:
+            return await asyncio.wait_for(round_trip(), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"{address} timed out")
+
+
+class _Endpoint:
+    def __init__(self, network: SimulatedNetwork, address: str):
+        self.network = network
+        self.address = address
+
+    async def send(self, address: str, message: GossipMessage, timeout: float) -> GossipReply:
+        return await self.network._deliver(self.address, address, message, timeout)
+
+
+def build_cluster(size: int, network: SimulatedNetwork, period: float) -> List[SwimNode]:
+    nodes = []
+    for i in range(size):
+        address = f"node-{i}:50051"
+        membership = Membership(address, rng=random.Random(i))
+        node = SwimNode(membership, network.transport(address), period=period,
+                        probe_timeout=period * 0.4, suspicion_mult=2)
+        network.nodes[address] = node
+        nodes.append(node)
+    return nodes
+
+
+def sees(node: SwimNode, address: str, status: int) -> bool:
+    member = node.membership.members.get(address)
+    return member is not None and member.status == status
+
+
+async def wait_until(predicate, timeout: float, poll: float = 0.01) -> float:
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            return float("nan")
+        await asyncio.sleep(poll)
+    return time.perf_counter() - started
+
+
+async def bench_size(size: int, period: float, latency: float, loss: float, timeout: float) -> dict:
+    network = SimulatedNetwork(latency, loss)
+    nodes = build_cluster(size, network, period)
+    addresses = [node.address for node in nodes]
+    try:
+        for node in nodes:
+            node.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(node.join([addresses[0]]) for node in nodes[1:]))
+        await wait_until(lambda: all(sees(n, a, ALIVE) for n in nodes for a in addresses if a != n.address), timeout)
+        join_seconds = time.perf_counter() - started
+
+        # Steady-state traffic, once the join backlog has drained.
+        await asyncio.sleep(5 * period)
+        messages, sent, started = network.messages, network.bytes, time.perf_counter()
+        await asyncio.sleep(10 * period)
+        periods = (time.perf_counter() - started) / period
+        steady = {
+            "messages_per_node_period": round((network.messages - messages) / size / periods, 2),
+            "bytes_per_node_period": round((network.bytes - sent) / size / periods, 1),
+        }
+
+        victim = nodes[-1]
+        network.down.add(victim.address)
+        await victim.stop()
+        survivors = nodes[:-1]
+        failure_seconds = await wait_until(lambda: all(sees(n, victim.address, DEAD) for n in survivors), timeout)
+    finally:
+        await asyncio.gather(*(node.stop() for node in nodes))
+    return {
+        "nodes": size,
+        "join_seconds": round(join_seconds, 3),
+        "failure_detection_seconds": round(failure_seconds, 3),
+        **steady,
+    }
+
+
+async def bench_gossip(sizes, period: float, latency: float, loss: float, timeout: float) -> dict:
+    results = [await bench_size(size, period, latency, loss, timeout) for size in sizes]
+    return {"period_s": period, "latency_s": latency, "loss": loss, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--period", type=float, default=0.1, help="Protocol period in seconds.")
+    parser.add_argument("--latency", type=float, default=0.002, help="One-way delay in seconds.")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability that a message is dropped.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Give up on a phase after this many seconds.")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench_gossip(args.sizes, args.period, args.latency, args.loss, args.timeout))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Debit throughput of the balance ledger, compared with the legacy JSON store.
+
+Seeds a ledger with `--users` accounts, then runs `--debits` debits against
+random users from `--processes` worker processes sharing the same backend, and
+prints a JSON report. The legacy baseline re-reads and rewrites the whole
+`balances.json` per debit, as the old balance service did.
+
+Usage:
+    python -m services.node_engine.benchmarks.ledger_throughput --users 100000
+    python -m services.node_engine.benchmarks.ledger_throughput --backend redis
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from ..balances.ledger import SQLiteLedger, RedisLedger
+
+
+def _open_ledger(backend: str, db_path: str):
+    return RedisLedger() if backend == "redis" else SQLiteLedger(db_path)
+
+
+def _debit_worker(args):
+    backend, db_path, users, count, seed = args
+    ledger = _open_ledger(backend, db_path)
+    rng = random.Random(seed)
+    succeeded = 0
+    for _ in range(count):
+        if ledger.debit(f"user-{rng.randrange(users)}", 0.001, reference="bench") is not None:
+            succeeded += 1
+    return succeeded
+
+
+def bench_ledger(backend: str, users: int, debits: int, processes: int, db_path: str) -> dict:
+    ledger = _open_ledger(backend, db_path)
+    started = time.perf_counter()
+    ledger.import_balances({f"user-{i}": 100.0 for i in range(users)}, reference="bench-seed")
+    seed_seconds = time.perf_counter() - started
+
+    per_process = debits // processes
+    jobs = [(backend, db_path, users, per_process, seed) for seed in range(processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        succeeded = sum(pool.map(_debit_worker, jobs))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "backend": backend,
+        "users": users,
+        "processes": processes,
+        "debits": per_process * processes,
+        "succeeded": succeeded,
+        "seed_seconds": round(seed_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "debits_per_second": round(per_process * processes / elapsed, 1),
+    }
+
+
+def bench_legacy_json(users: int, debits: int, path: Path) -> dict:
+    """Replays the old read-modify-write cycle on the full JSON file."""
+    with open(path, 'w') as f:
+        json.dump({f"user-{i}": 100.0 for i in range(users)}, f, indent=4)
+
+    rng = random.Random(0)
+    started = time.perf_counter()
+    for _ in range(debits):
+        with open(path, 'r') as f:
+            balances = json.load(f)
+        user_id = f"user-{rng.randrange(users)}"
+        balances[user_id] = balances.get(user_id, 0.0) - 0.001
+        with open(path, 'w') as f:
+            json.dump(balances, f, indent=4)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "backend": "legacy-json",
+        "users": users,
+        "processes": 1,
+        "debits": debits,
+        "elapsed_seconds": round(elapsed, 3),
+        "debits_per_second": round(debits / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--debits", type=int, default=20_000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--legacy-debits", type=int, default=20,
+                        help="Debits to replay against the legacy JSON store (0 to skip).")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        results.append(bench_ledger(args.backend, args.users, args.debits, args.processes,
+                                    os.path.join(tmp, "ledger.db")))
+        if args.legacy_debits:
+            results.append(bench_legacy_json(args.users, args.legacy_debits, Path(tmp) / "balances.json"))
+
+    print(json.dumps({"benchmark": "ledger_throughput", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
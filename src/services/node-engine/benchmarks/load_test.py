@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end load test of the node engine API, in one process.
+
+Starts the pieces a node needs and then drives the API:
+
+- Redis: a fakeredis TCP server, or a real one with `--redis-url`. It serves
+  as the Celery broker and result backend and as the shared Redis.
+- A Celery worker: a thread pool with `--worker-concurrency` threads,
+  serving the tiny CPU model in benchmarks/tiny_model.py.
+- The FastAPI app: behind httpx's ASGI transport.
+
+On-chain payment verification is replaced through FastAPI's dependency
+overrides, so no chain is needed. `/proxy-inference` forwards to a local
+stub peer, so its scenario measures the proxy path itself. Each scenario
+sends `--requests` requests from `--concurrency` concurrent clients:
+
+- generate: POST /api/gateway/generate, then poll the status endpoint until
+  the task finishes. Latency is end to end.
+- status: GET /api/gateway/tasks/status/{id} of a finished task.
+- proxy: POST /proxy-inference.
+- balance: GET /billing/balance/{user}.
+
+A JSON report with RPS, p50/p95/p99 latency, errors and (for generate)
+tokens/sec is printed, and written to `--output` if given. Compare two
+reports with `python -m services.node_engine.benchmarks.compare`.
+
+Usage:
+    python -m services.node_engine.benchmarks.load_test --output before.json
+    python -m services.node_engine.benchmarks.load_test --scenarios generate --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List
+
+SCENARIOS = ("generate", "status", "proxy", "balance")
+MODEL = "tiny"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _start_redis(url: str) -> str:
+    """Returns the Redis URL to use, starting a fakeredis TCP server if none was given."""
+    if url:
+        return url
+    from fakeredis import TcpFakeServer
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    server.daemon_threads = True  # Open connections must not keep the process alive.
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+async def drive(requests: int, concurrency: int, send: Callable[[int], Awaitable[bool]]) -> dict:
+    """Sends `requests` requests from `concurrency` clients; `send` returns False on an error."""
+    latencies, errors, next_index = [], 0, 0
+
+    async def client():
+        nonlocal errors, next_index
+        while next_index < requests:
+            index, next_index = next_index, next_index + 1
+            started = time.perf_counter()
+            try:
+                ok = await send(index)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+class _PaidOnChainService:
+    """Stands in for the chain: every payment verifies."""
+    async def verify_payment(self, user_address: str, amount_usd: float):
+        return True, "Payment verified."
+
+
+async def _start_stub_peer(port: int):
+    """A mesh peer that accepts any `/generate` at once, so the proxy path is what gets measured."""
+    from aiohttp import web
+
+    async def generate(request):
+        await request.read()
+        return web.json_response({"task_id": "stub"})
+
+    app = web.Application()
+    app.router.add_post("/generate", generate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def run_scenarios(scenarios, requests: int, concurrency: int, max_new_tokens: int) -> Dict[str, dict]:
+    import httpx
+    from prometheus_client import REGISTRY
+
+    from .. import app as node_app
+    from ..dependencies import get_onchain_service
+    from ..grpc.server import _add_peers
+
+    node_app.app.dependency_overrides[get_onchain_service] = _PaidOnChainService
+    transport = httpx.ASGITransport(app=node_app.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://node", timeout=120) as client:
+        async def generate(index: int) -> bool:
+            body = {"address": f"0xbench{index % 64}", "prompt": f"request {index}: hello there",
+                    "model": MODEL, "max_new_tokens": max_new_tokens, "temperature": 0.7}
+            response = await client.post("/api/gateway/generate", json=body)
+            if response.status_code != 200:
+                return False
+            status_path = f"/api/gateway/tasks/status/{response.json()['task_id']}"
+            while True:
+                state = (await client.get(status_path)).json()["status"]
+                if state in ("SUCCESS", "FAILURE"):
+                    return state == "SUCCESS"
+                await asyncio.sleep(0.01)
+
+        # Load the model and warm the batcher before anything is timed.
+        if not await generate(-1):
+            raise RuntimeError("Warm-up generation failed; is the worker running?")
+
+        if "generate" in scenarios:
+            def generated_tokens():
+                return REGISTRY.get_sample_value("deai_batch_generated_tokens_total", {"model": MODEL}) or 0.0
+            before = generated_tokens()
+            results["generate"] = await drive(requests, concurrency, generate)
+            tokens = generated_tokens() - before
+            results["generate"]["tokens"] = int(tokens)
+            results["generate"]["tokens_per_second"] = round(tokens / results["generate"]["elapsed_seconds"], 1)
+
+        if "status" in scenarios:
+            body = {"address": "0xbench", "prompt": "status", "model": MODEL, "max_new_tokens": 1}
+            task_id = (await client.post("/api/gateway/generate", json=body)).json()["task_id"]
+            while (await client.get(f"/api/gateway/tasks/status/{task_id}")).json()["status"] != "SUCCESS":
+                await asyncio.sleep(0.01)
+
+            async def status(index: int) -> bool:
+                return (await client.get(f"/api/gateway/tasks/status/{task_id}")).status_code == 200
+            results["status"] = await drive(requests, concurrency, status)
+
+        if "proxy" in scenarios:
+            runner = await _start_stub_peer(node_app.PEER_HTTP_PORT)
+            _add_peers(["127.0.0.1:50051"])
+            try:
+                async def proxy(index: int) -> bool:
+                    body = {"address": "0xbench", "prompt": "proxied", "model": MODEL}
+                    return (await client.post("/proxy-inference", json=body)).status_code == 200
+                results["proxy"] = await drive(requests, concurrency, proxy)
+            finally:
+                await node_app.get_proxy_client().aclose()
+                await runner.cleanup()
+
+        if "balance" in scenarios:
+            async def balance(index: int) -> bool:
+                return (await client.get(f"/billing/balance/0xbench{index % 64}")).status_code == 200
+            results["balance"] = await drive(requests, concurrency, balance)
+    return results
+
+
+def bench_node_engine(scenarios, requests: int, concurrency: int, worker_concurrency: int,
+                      max_new_tokens: int, redis_url: str) -> dict:
+    redis_label = redis_url or "fakeredis"
+    redis_url = _start_redis(redis_url)
+    scratch = tempfile.mkdtemp(prefix="deai-bench-")
+    # Everything reads its configuration at import, so set it first.
+    os.environ.update({
+        "REDIS_URL": redis_url,
+        "CELERY_BROKER_URL": redis_url,
+        "CELERY_RESULT_BACKEND": redis_url,
+        "BALANCE_DB_PATH": os.path.join(scratch, "balances.db"),
+        "PEER_HTTP_PORT": str(_free_port()),
+        "RESULT_CACHE_ENABLED": "false",
+    })
+
+    from celery.contrib.testing.worker import start_worker
+    from kombu import Queue
+    from .. import tasks
+    from ..routing import ModelAdvertiser, model_queue
+    from . import tiny_model
+
+    tasks.model_registry.register(MODEL, tiny_model)
+    tasks.celery_app.conf.task_queues = list(tasks.celery_app.conf.task_queues) + [Queue(model_queue(MODEL))]
+    # The tasks are registered already; the deployment's `include` path is not importable from here.
+    tasks.celery_app.conf.include = []
+    advertiser = ModelAdvertiser("bench-worker", served=lambda: [MODEL], loaded=tasks.model_registry.loaded)
+    with start_worker(tasks.celery_app, pool="threads", concurrency=worker_concurrency,
+                      perform_ping_check=False, shutdown_timeout=30):
+        advertiser.start()
+        try:
+            results = asyncio.run(run_scenarios(scenarios, requests, concurrency, max_new_tokens))
+        finally:
+            advertiser.stop()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "redis": redis_label,
+            "model": tiny_model.MODEL_ID,
+            "requests": requests,
+            "concurrency": concurrency,
+            "worker_concurrency": worker_concurrency,
+            "max_new_tokens": max_new_tokens,
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients.")
+    parser.add_argument("--worker-concurrency", type=int, default=8, help="Celery worker threads.")
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL", ""),
+                        help="Use this Redis instead of an in-process fakeredis server.")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    report = bench_node_engine(args.scenarios, args.requests, args.concurrency, args.worker_concurrency,
+                               args.max_new_tokens, args.redis_url)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
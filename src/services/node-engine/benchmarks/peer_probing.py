@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CPU time and thread count of peer health probing, `grpc.aio` vs the old
+thread-per-probe loop.
+
+Starts one in-process `grpc.aio` health server listening on `--peers`
+ports; each port stands in for one mesh peer. Both probing strategies then
+run for `--rounds` probe intervals of `--interval` seconds:
+
+- legacy: every interval, one OS thread per peer, each opening a new
+  insecure channel, as the old `_start_peer_probing` did.
+- aio: `PeerProber` with persistent channels, jittered schedules and
+  bounded concurrency, on the event loop.
+
+The process CPU time and the peak thread count (read from /proc, so gRPC's
+own threads are included) are printed as JSON.
+
+Usage:
+    python -m services.node_engine.benchmarks.peer_probing --peers 300
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
+from grpc_health.v1.health import aio as health_aio
+
+from ..grpc import server as mesh
+
+
+class _CountingProber(mesh.PeerProber):
+    probes = 0
+
+    async def probe(self, peer: str) -> bool:
+        self.probes += 1
+        return await super().probe(peer)
+
+
+def _os_threads() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+async def _start_peers(count: int):
+    server = grpc.aio.server()
+    health_servicer = health_aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    await health_servicer.set("", health_pb2.HealthCheckResponse.SERVING)
+    addresses = [f"127.0.0.1:{server.add_insecure_port('127.0.0.1:0')}" for _ in range(count)]
+    await server.start()
+    return server, addresses
+
+
+def _legacy_probe(peer_address, results):
+    try:
+        with grpc.insecure_channel(peer_address) as channel:
+            health_stub = health_pb2_grpc.HealthStub(channel)
+            response = health_stub.Check(health_pb2.HealthCheckRequest(service=""), timeout=2)
+            results.append(response.status == health_pb2.HealthCheckResponse.SERVING)
+    except grpc.RpcError:
+        results.append(False)
+
+
+def _legacy_round(addresses, results):
+    threads = [threading.Thread(target=_legacy_probe, args=(peer, results), daemon=True) for peer in addresses]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+async def _measure(run) -> dict:
+    peak = _os_threads()
+    cpu, wall = time.process_time(), time.perf_counter()
+    task = asyncio.create_task(run())
+    while not task.done():
+        peak = max(peak, _os_threads())
+        await asyncio.sleep(0.02)
+    probes = await task
+    return {
+        "probes": probes,
+        "cpu_seconds": round(time.process_time() - cpu, 3),
+        "wall_seconds": round(time.perf_counter() - wall, 3),
+        "peak_threads": peak,
+    }
+
+
+async def bench_peer_probing(peers: int, rounds: int, interval: float, concurrency: int) -> dict:
+    server, addresses = await _start_peers(peers)
+    loop = asyncio.get_running_loop()
+    report = {"peers": peers, "rounds": rounds, "interval_s": interval, "idle_threads": _os_threads()}
+    try:
+        async def legacy():
+            results = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                await loop.run_in_executor(None, _legacy_round, addresses, results)
+                await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+            return len(results)
+
+        async def aio():
+            mesh._add_peers(addresses)
+            channels = mesh.PeerChannels()
+            prober = _CountingProber(channels, interval=interval, concurrency=concurrency)
+            prober.start()
+            await asyncio.sleep(rounds * interval)
+            await prober.stop()
+            await channels.close_all()
+            with mesh.peers_lock:
+                mesh.peers.difference_update(addresses)
+            return prober.probes
+
+        report["legacy_threads"] = await _measure(legacy)
+        report["aio"] = await _measure(aio)
+    finally:
+        await server.stop(0)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=2.0, help="Probe interval in seconds.")
+    parser.add_argument("--concurrency", type=int, default=mesh.PEER_PROBE_CONCURRENCY)
+    args = parser.parse_args()
+
+    report = asyncio.run(bench_peer_probing(args.peers, args.rounds, args.interval, args.concurrency))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
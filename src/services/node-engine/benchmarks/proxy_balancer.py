@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Proxy latency under the power-of-two-choices balancer, compared with the old
+random peer selection.
+
+Starts `--nodes` local HTTP nodes in-process. Each serves `/generate` with
+`--capacity` concurrent slots and a log-normal service time; extra requests
+queue. One node is `--slow-factor` times slower, and one fails a
+`--error-rate` share of its requests with a fast 503. Poisson arrivals at
+`--rps` are sent through `post_to_peer` with a shared pooled client, once
+per policy, and a JSON report with latency percentiles and error counts is
+printed.
+
+Usage:
+    python -m services.node_engine.benchmarks.proxy_balancer
+    python -m services.node_engine.benchmarks.proxy_balancer --rps 600 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+from aiohttp import web
+
+from ..balancer import PeerBalancer, post_to_peer
+
+
+class RandomBalancer(PeerBalancer):
+    """The previous behaviour: a uniformly random peer per request."""
+    def choose(self, candidates, exclude=(), weights=None):
+        candidates = [peer for peer in candidates if peer not in exclude]
+        return self._rng.choice(candidates) if candidates else None
+
+
+def _node_app(service_ms: float, capacity: int, error_rate: float, rng: random.Random) -> web.Application:
+    slots = asyncio.Semaphore(capacity)
+
+    async def generate(request):
+        await request.json()
+        if rng.random() < error_rate:
+            return web.json_response({"error": "overloaded"}, status=503)
+        async with slots:
+            await asyncio.sleep(service_ms / 1000 * rng.lognormvariate(0, 0.3))
+        return web.json_response({"task_id": "bench", "status_url": "/tasks/status/bench"})
+
+    app = web.Application()
+    app.router.add_post("/generate", generate)
+    return app
+
+
+async def _start_nodes(args, rng: random.Random):
+    runners, urls = [], []
+    for i in range(args.nodes):
+        service_ms = args.service_ms * (args.slow_factor if i == 0 else 1)
+        error_rate = args.error_rate if i == 1 else 0.0
+        runner = web.AppRunner(_node_app(service_ms, args.capacity, error_rate, rng), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        runners.append(runner)
+        urls.append(f"http://{host}:{port}")
+    return runners, urls
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _run_policy(balancer: PeerBalancer, urls, args, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    chosen = {url: 0 for url in urls}
+
+    async def one_request(client):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            peer, response = await post_to_peer(client, balancer, urls, "/generate", {"prompt": "bench"})
+            chosen[peer] += 1
+            if response.status_code >= 500:
+                errors += 1
+        except httpx.RequestError:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=args.nodes * args.capacity * 4, max_keepalive_connections=args.nodes * args.capacity * 4)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        tasks = []
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.create_task(one_request(client)))
+            await asyncio.sleep(rng.expovariate(args.rps))
+        await asyncio.gather(*tasks)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "share_slow_node": round(chosen[urls[0]] / max(len(latencies), 1), 3),
+        "share_flaky_node": round(chosen[urls[1]] / max(len(latencies), 1), 3),
+    }
+
+
+async def bench_proxy_balancer(args) -> dict:
+    runners, urls = await _start_nodes(args, random.Random(args.seed))
+    try:
+        report = {"nodes": args.nodes, "rps": args.rps, "duration_s": args.duration}
+        report["random"] = await _run_policy(RandomBalancer(rng=random.Random(args.seed)), urls, args, args.seed)
+        report["p2c_ewma"] = await _run_policy(PeerBalancer(rng=random.Random(args.seed)), urls, args, args.seed)
+        report["p99_improvement_pct"] = round(
+            100 * (1 - report["p2c_ewma"]["p99_ms"] / report["random"]["p99_ms"]), 1
+        )
+        return report
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=6)
+    parser.add_argument("--capacity", type=int, default=4, help="Concurrent requests each node serves.")
+    parser.add_argument("--service-ms", type=float, default=20.0)
+    parser.add_argument("--slow-factor", type=float, default=6.0)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--rps", type=float, default=300.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(bench_proxy_balancer(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Acceptance rate and decode speedup of speculative decoding.
+
+Builds a randomly initialised `--layers`-layer GPT-2 target on CPU and a
+draft made of its first `--draft-layers` layers. The deeper layers' output
+projections are scaled by `--deep-scale`: a random GPT-2 is dominated by its
+embeddings, and the scaling gives the layers the draft lacks enough weight
+that it disagrees with the target about as often as a real draft does.
+Each of `--requests` random prompts is decoded greedily, once with plain
+`model.generate` and once with a `SpeculativeDecoder` per `--draft-tokens`
+value. The outputs are checked to be identical, and a JSON report with the
+acceptance rate, tokens/sec and speedup is printed.
+
+Usage:
+    python -m services.node_engine.benchmarks.speculative_decoding
+    python -m services.node_engine.benchmarks.speculative_decoding --draft-tokens 2 4 8 --deep-scale 6
+"""
+import argparse
+import json
+import random
+import time
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+from ..models.speculative import SpeculativeDecoder
+
+
+def _tiny_pair(vocab_size: int, layers: int, draft_layers: int, hidden: int, deep_scale: float, seed: int):
+    """A target GPT-2, a draft sharing its first layers, and a word-level tokenizer for both."""
+    torch.manual_seed(seed)
+    vocab = ["<pad>", "<eos>"] + [f"w{i}" for i in range(vocab_size - 2)]
+    backend = Tokenizer(models.WordLevel({tok: i for i, tok in enumerate(vocab)}, unk_token="<pad>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<eos>")
+
+    def gpt2(n_layer):
+        config = GPT2Config(vocab_size=vocab_size, n_positions=1024, n_embd=hidden, n_layer=n_layer,
+                            n_head=max(hidden // 64, 1), bos_token_id=1, eos_token_id=1, pad_token_id=0)
+        return GPT2LMHeadModel(config).eval()
+
+    target = gpt2(layers)
+    with torch.no_grad():
+        for block in target.transformer.h[draft_layers:]:
+            block.attn.c_proj.weight.mul_(deep_scale)
+            block.mlp.c_proj.weight.mul_(deep_scale)
+    draft = gpt2(draft_layers)
+    draft.load_state_dict(target.state_dict(), strict=False)
+    return target, draft, tokenizer
+
+
+def bench_speculative(requests: int, prompt_tokens: int, new_tokens: int, draft_tokens_list, layers: int,
+                      draft_layers: int, hidden: int, deep_scale: float, seed: int) -> dict:
+    target, draft, tokenizer = _tiny_pair(1024, layers, draft_layers, hidden, deep_scale, seed)
+    rng = random.Random(seed)
+    prompts = [" ".join(f"w{rng.randrange(1022)}" for _ in range(prompt_tokens)) for _ in range(requests)]
+
+    def baseline(prompt):
+        input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+        with torch.no_grad():
+            output = target.generate(input_ids, max_new_tokens=new_tokens, do_sample=False, pad_token_id=0)
+        generated = output[0, input_ids.shape[1]:].tolist()
+        return tokenizer.decode(generated, skip_special_tokens=True), len(generated)
+
+    def timed(generate):
+        results, started = [], time.perf_counter()
+        for prompt in prompts:
+            results.append(generate(prompt))
+        return results, time.perf_counter() - started
+
+    # Warm up kernels and allocator before timing.
+    baseline(prompts[0])
+    SpeculativeDecoder(target, draft, tokenizer, name="bench").generate(prompts[0], max_new_tokens=new_tokens)
+
+    plain, plain_seconds = timed(baseline)
+    plain_tokens = sum(count for _, count in plain)
+    report = {
+        "requests": requests,
+        "prompt_tokens": prompt_tokens,
+        "new_tokens": new_tokens,
+        "target_layers": layers,
+        "draft_layers": draft_layers,
+        "deep_scale": deep_scale,
+        "plain_tokens_per_second": round(plain_tokens / plain_seconds, 1),
+        "speculative": [],
+    }
+    for draft_tokens in draft_tokens_list:
+        decoder = SpeculativeDecoder(target, draft, tokenizer, name="bench", draft_tokens=draft_tokens)
+        results, seconds = timed(lambda prompt: decoder.generate(prompt, max_new_tokens=new_tokens))
+        proposed = sum(r.proposed_tokens for r in results)
+        accepted = sum(r.accepted_tokens for r in results)
+        tokens = sum(r.completion_tokens for r in results)
+        report["speculative"].append({
+            "draft_tokens": draft_tokens,
+            "outputs_identical": [r.completion for r in results] == [text for text, _ in plain],
+            "acceptance_rate": round(accepted / proposed, 3) if proposed else None,
+            "tokens_per_target_pass": round(tokens / (tokens - accepted), 2) if tokens > accepted else None,
+            "tokens_per_second": round(tokens / seconds, 1),
+            "speedup": round((tokens / seconds) / (plain_tokens / plain_seconds), 2),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--prompt-tokens", type=int, default=32)
+    parser.add_argument("--new-tokens", type=int, default=128)
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--draft-layers", type=int, default=1)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--deep-scale", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = bench_speculative(args.requests, args.prompt_tokens, args.new_tokens, args.draft_tokens, args.layers,
+                               args.draft_layers, args.hidden, args.deep_scale, args.seed)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shares of admitted requests between tenants under the admission rate limiter.
+
+One heavy tenant offers `--heavy-rps` requests per second and `--tenants`
+light tenants offer `--light-rps` each, all for `--seconds`, against one
+`RateLimiter` (main/admission.py). The report gives each tenant's admitted
+rate next to its fair share, min(offered, limit). It also gives Jain's
+fairness index over admitted / fair share, where 1.0 means every tenant got
+its share. The p50/p99 latency of a check (one Redis round trip) is included.
+
+Usage:
+    python -m services.node_engine.benchmarks.tenant_fairness
+    python -m services.node_engine.benchmarks.tenant_fairness --heavy-rps 500 --tenants 20
+    python -m services.node_engine.benchmarks.tenant_fairness --redis-url redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import List
+
+from ..main.admission import RateLimiter
+
+
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def _jain(values: List[float]) -> float:
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values)) if any(values) else 0.0
+
+
+async def _tenant(limiter: RateLimiter, address: str, rps: float, seconds: float, latencies: List[float]) -> int:
+    """Offers `rps` requests per second on a fixed schedule; returns how many were admitted."""
+    admitted, started = 0, time.perf_counter()
+    for i in range(int(rps * seconds)):
+        delay = started + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        check_started = time.perf_counter()
+        decision = await limiter.check("bench", address)
+        latencies.append(time.perf_counter() - check_started)
+        admitted += decision.allowed
+    return admitted
+
+
+async def bench_fairness(client, tenants: int, heavy_rps: float, light_rps: float, rate: float, burst: float,
+                         seconds: float) -> dict:
+    limiter = RateLimiter(client, address_rate=rate, address_burst=burst, max_queue_depth=0)
+    run = uuid.uuid4().hex[:8]  # fresh buckets on a shared Redis
+    offered = {f"heavy-{run}": heavy_rps, **{f"light-{i}-{run}": light_rps for i in range(tenants)}}
+    latencies: List[float] = []
+    started = time.perf_counter()
+    admitted = await asyncio.gather(*(_tenant(limiter, address, rps, seconds, latencies)
+                                      for address, rps in offered.items()))
+    elapsed = time.perf_counter() - started
+
+    report, shares = {}, []
+    for (address, rps), count in zip(offered.items(), admitted):
+        fair = min(rps, rate + burst / seconds)
+        shares.append(count / elapsed / fair)
+        report[address.rsplit("-", 1)[0]] = {"offered_rps": rps, "admitted_rps": round(count / elapsed, 2),
+                                            "fair_share_rps": round(fair, 2)}
+    return {
+        "limit": {"rate": rate, "burst": burst},
+        "seconds": round(elapsed, 2),
+        "checks": len(latencies),
+        "check_p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "check_p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "jain_fairness": round(_jain(shares), 4),
+        "tenants": report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=9, help="Light tenants next to the heavy one.")
+    parser.add_argument("--heavy-rps", type=float, default=200)
+    parser.add_argument("--light-rps", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=10, help="Per-address limit, requests per second.")
+    parser.add_argument("--burst", type=float, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL", ""),
+                        help="Use this Redis instead of an in-process fakeredis.")
+    args = parser.parse_args()
+
+    if args.redis_url:
+        import redis.asyncio as aioredis
+        client = aioredis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    report = asyncio.run(bench_fairness(client, args.tenants, args.heavy_rps, args.light_rps, args.rate,
+                                        args.burst, args.seconds))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A tiny, randomly initialised GPT-2 with a character-level tokenizer, as a
+model plugin (same interface as `models/*/loader.py`). It runs on CPU and
+needs no download, so load tests exercise the real serving path quickly.
+"""
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast, pipeline
+
+# --- Model Metadata ---
+MODEL_ID = "bench/tiny-gpt2-random"
+PRICE_PER_1K_PROMPT_TOKENS = 0.00001  # USD
+PRICE_PER_1K_COMPLETION_TOKENS = 0.00002  # USD
+VOCAB = ["<pad>", "<eos>"] + list("abcdefghijklmnopqrstuvwxyz .,?!")
+
+
+def get_price() -> dict:
+    """Returns the price in USD per 1,000 prompt and per 1,000 completion tokens."""
+    return {"prompt": PRICE_PER_1K_PROMPT_TOKENS, "completion": PRICE_PER_1K_COMPLETION_TOKENS}
+
+
+def load_model(layers: int = 2, hidden: int = 64):
+    """Builds the model and tokenizer and returns a text-generation pipeline."""
+    torch.manual_seed(0)
+    backend = Tokenizer(models.WordLevel({tok: i for i, tok in enumerate(VOCAB)}, unk_token="<pad>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", behavior="isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<eos>")
+    config = GPT2Config(vocab_size=len(VOCAB), n_positions=512, n_embd=hidden, n_layer=layers, n_head=2,
+                        bos_token_id=1, eos_token_id=1, pad_token_id=0)
+    model = GPT2LMHeadModel(config).eval()
+    return pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory and throughput of the Celery worker modes.
+
+Starts a real worker process for each of `--modes`, against a fakeredis TCP
+server (or `--redis-url`), serving a tiny CPU GPT-2 scaled up with
+`--layers`/`--hidden` so its weights dominate the worker's memory:
+
+- threads: one process whose `--concurrency` threads share the model and
+  its batching engine (the default, see celery_app.py).
+- prefork: `--concurrency` child processes, with the model loaded in the
+  parent before the fork and shared copy-on-write (WORKER_PRELOAD_MODELS).
+- prefork-lazy: the same children, each loading its own copy of the model
+  on its first task (WORKER_PRELOAD_MODELS=false).
+
+Each worker gets a warm-up round, so every child has served a task, and then
+`--requests` greedy generations sent at once. Memory is read from
+/proc/<pid>/smaps_rollup (Linux only) for the worker and its children: RSS
+counts shared pages in every process, while PSS divides them among the
+processes sharing them, so the PSS total is the memory the mode really uses.
+A JSON report with RSS per process, the RSS and PSS totals, and tokens/sec
+is printed.
+
+Usage:
+    python -m services.node_engine.benchmarks.worker_modes
+    python -m services.node_engine.benchmarks.worker_modes --modes threads prefork --concurrency 8 --hidden 768
+"""
+import argparse
+import functools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+MODES = {
+    "threads": ("threads", "true"),
+    "prefork": ("prefork", "true"),
+    "prefork-lazy": ("prefork", "false"),
+}
+MODEL = "tiny"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_redis(url: str) -> str:
+    """Returns the Redis URL to use, starting a fakeredis TCP server if none was given."""
+    if url:
+        return url
+    from fakeredis import TcpFakeServer
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    server.daemon_threads = True  # Open connections must not keep the process alive.
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+# --- Worker Process ---
+
+def serve(pool: str, concurrency: int, layers: int, hidden: int):
+    """Runs a worker serving the tiny model; the broker comes from the environment."""
+    from kombu import Queue
+
+    from .. import tasks
+    from ..routing import model_queue
+    from . import tiny_model
+
+    plugin = SimpleNamespace(MODEL_ID=tiny_model.MODEL_ID, get_price=tiny_model.get_price,
+                             load_model=functools.partial(tiny_model.load_model, layers=layers, hidden=hidden))
+    tasks.model_registry.register(MODEL, plugin)
+    tasks.celery_app.conf.task_queues = list(tasks.celery_app.conf.task_queues) + [Queue(model_queue(MODEL))]
+    # The tasks are already registered; the hyphenated include cannot be imported.
+    tasks.celery_app.conf.include = []
+    tasks.celery_app.worker_main([
+        "worker", "--pool", pool, "--concurrency", str(concurrency), "--loglevel", "warning",
+        "--without-gossip", "--without-mingle", "--without-heartbeat",
+    ])
+
+
+# --- Measurement ---
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                pids.extend(_process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def _memory_mb(pid: int) -> Dict[str, float]:
+    """RSS and PSS of one process, in MiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss_mb": round(fields.get("Rss", 0.0), 1), "pss_mb": round(fields.get("Pss", 0.0), 1)}
+
+
+def _run_round(app, prompts: List[str], new_tokens: int, timeout: float) -> dict:
+    from ..routing import model_queue
+
+    started = time.perf_counter()
+    results = [
+        app.send_task("generate_text_task", queue=model_queue(MODEL),
+                      kwargs={"prompt": prompt, "model_name": MODEL, "temperature": 0.0,
+                              "max_new_tokens": new_tokens})
+        for prompt in prompts
+    ]
+    deadline = time.monotonic() + timeout
+    while not all(result.ready() for result in results):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{sum(not r.ready() for r in results)} tasks did not finish in {timeout}s")
+        time.sleep(0.05)
+    seconds = time.perf_counter() - started
+    outputs = [result.get() for result in results]
+    tokens = sum(output["usage"]["completion_tokens"] for output in outputs)
+    return {"seconds": seconds, "tokens": tokens}
+
+
+def bench_mode(mode: str, redis_url: str, requests: int, concurrency: int, new_tokens: int,
+               layers: int, hidden: int, timeout: float) -> dict:
+    from celery import Celery
+
+    pool, preload = MODES[mode]
+    env = dict(os.environ, CELERY_BROKER_URL=redis_url, CELERY_RESULT_BACKEND=redis_url, REDIS_URL=redis_url,
+               CELERY_WORKER_POOL=pool, WORKER_PRELOAD_MODELS=preload, WORKER_MODELS=MODEL)
+    command = [sys.executable, "-m", __spec__.name, "--serve", "--pool", pool, "--concurrency", str(concurrency),
+               "--layers", str(layers), "--hidden", str(hidden)]
+    # The worker's banner and logs go to stderr, keeping stdout for the report.
+    worker = subprocess.Popen(command, env=env, stdout=sys.stderr, start_new_session=True)
+    app = Celery("worker-modes-bench", broker=redis_url, backend=redis_url)
+    try:
+        # Enough warm-up tasks that every prefork child serves (and loads) at least once.
+        _run_round(app, [f"warm up {i}" for i in range(concurrency * 2)], new_tokens, timeout)
+        measured = _run_round(app, [f"request number {i}" for i in range(requests)], new_tokens, timeout)
+        processes = [_memory_mb(pid) for pid in _process_tree(worker.pid)]
+    finally:
+        os.killpg(worker.pid, signal.SIGTERM)
+        try:
+            worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(worker.pid, signal.SIGKILL)
+            worker.wait()
+        app.close()
+
+    return {
+        "mode": mode,
+        "pool": pool,
+        "processes": len(processes),
+        "rss_mb_per_process": [p["rss_mb"] for p in processes],
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+        "tokens_per_second": round(measured["tokens"] / measured["seconds"], 1),
+        "requests_per_second": round(requests / measured["seconds"], 2),
+    }
+
+
+def bench_worker_modes(modes, redis_url: str, requests: int, concurrency: int, new_tokens: int,
+                       layers: int, hidden: int, timeout: float) -> dict:
+    redis_url = _start_redis(redis_url)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "new_tokens": new_tokens,
+        "layers": layers,
+        "hidden": hidden,
+        "modes": [bench_mode(mode, redis_url, requests, concurrency, new_tokens, layers, hidden, timeout)
+                  for mode in modes],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--redis-url", default="", help="Real Redis to use instead of a fakeredis TCP server.")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--hidden", type=int, default=512)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--pool", default="threads", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.pool, args.concurrency, args.layers, args.hidden)
+        return
+    report = bench_worker_modes(args.modes, args.redis_url, args.requests, args.concurrency, args.new_tokens,
+                                args.layers, args.hidden, args.timeout)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cooperative cancellation of generation tasks.
+
+The API cancels a task by setting a flag in Redis (`request_cancel`), from
+`DELETE /tasks/{task_id}` or when the last reader of a task's token stream
+disconnects and nobody re-attaches within `STREAM_CANCEL_GRACE_SECONDS`.
+Celery cannot stop a running thread, so the worker cooperates instead. Each
+worker process has a `CancellationWatcher`, which checks the flags of all its
+running tasks in one Redis round trip every `CANCEL_POLL_SECONDS`. It turns
+a raised flag into a `threading.Event`. The decode loops check that event
+between steps: the batching engine on every pass, and the plain pipeline
+through a `StoppingCriteria` (see tasks.py). A cancelled generation
+frees its batch slot at once and returns what it produced so far, and only
+those tokens are billed.
+
+Celery reports a task ID it has no record of as PENDING, the same as a task
+still waiting in its queue. So the API remembers the IDs it hands out
+(`remember_task`) and refuses to cancel a PENDING task it never issued.
+"""
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+CANCEL_POLL_SECONDS = float(os.getenv("CANCEL_POLL_SECONDS", "0.25"))
+# A flag outlives any task that can still be queued or running.
+CANCEL_TTL_SECONDS = int(os.getenv("CANCEL_TTL_SECONDS", "3600"))
+# How long a stream may go without readers before its task is cancelled,
+# so a client can re-attach with `Last-Event-ID` after a dropped connection.
+STREAM_CANCEL_GRACE_SECONDS = float(os.getenv("STREAM_CANCEL_GRACE_SECONDS", "10"))
+
+CANCEL_KEY = "deai:tasks:{task_id}:cancel"
+READERS_KEY = "deai:tasks:{task_id}:readers"
+ISSUED_KEY = "deai:tasks:{task_id}:issued"
+
+
+# --- API Side ---
+
+async def remember_task(task_id: str, client=None):
+    """Records that the API issued `task_id`, before the task is queued."""
+    if client is None:
+        from .redis_client import get_async_redis
+        client = get_async_redis()
+    await client.set(ISSUED_KEY.format(task_id=task_id), 1, ex=CANCEL_TTL_SECONDS)
+
+
+async def was_issued(task_id: str, client=None) -> bool:
+    if client is None:
+        from .redis_client import get_async_redis
+        client = get_async_redis()
+    return bool(await client.exists(ISSUED_KEY.format(task_id=task_id)))
+
+
+async def request_cancel(task_id: str, client=None):
+    """Asks the worker running (or about to run) `task_id` to stop."""
+    if client is None:
+        from .redis_client import get_async_redis
+        client = get_async_redis()
+    await client.set(CANCEL_KEY.format(task_id=task_id), 1, ex=CANCEL_TTL_SECONDS)
+
+
+class StreamReaders:
+    """
+    Counts the clients reading each task's token stream, across API
+    processes, and cancels a task its last reader abandoned.
+    """
+    def __init__(self, client=None, grace_seconds: float = STREAM_CANCEL_GRACE_SECONDS):
+        self._client = client
+        self.grace_seconds = grace_seconds
+        self._pending: Set[asyncio.Task] = set()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .redis_client import get_async_redis
+            self._client = get_async_redis()
+        return self._client
+
+    async def attach(self, task_id: str):
+        key = READERS_KEY.format(task_id=task_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, CANCEL_TTL_SECONDS)
+        await pipe.execute()
+
+    def detach(self, task_id: str, finished: bool) -> asyncio.Task:
+        """
+        Drops a reader. If it left before the stream ended, the task is
+        cancelled after the grace period unless another reader is attached
+        by then. Runs in the background, so it is safe from a `finally`
+        block of a cancelled coroutine.
+        """
+        task = asyncio.get_running_loop().create_task(self._release(task_id, finished))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def _release(self, task_id: str, finished: bool):
+        key = READERS_KEY.format(task_id=task_id)
+        try:
+            await self.client.decr(key)
+            if finished:
+                return
+            await asyncio.sleep(self.grace_seconds)
+            if int(await self.client.get(key) or 0) <= 0:
+                print(f"Cancelling task {task_id}: its stream has no readers.")
+                await request_cancel(task_id, self.client)
+        except Exception as e:
+            print(f"Failed to release a reader of task {task_id}: {e}")
+
+
+# --- Worker Side ---
+
+class CancellationWatcher:
+    """
+    Polls the cancel flags of this process's running tasks and sets the
+    event returned by `watch` once a task's flag appears.
+    """
+    def __init__(self, client=None, interval: float = CANCEL_POLL_SECONDS):
+        self._client = client
+        self.interval = interval
+        self._events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .redis_client import get_redis
+            self._client = get_redis()
+        return self._client
+
+    def is_cancelled(self, task_id: str) -> bool:
+        """Checks the flag once, e.g. before a task starts; a Redis failure counts as not cancelled."""
+        try:
+            return bool(self.client.exists(CANCEL_KEY.format(task_id=task_id)))
+        except Exception as e:
+            print(f"Failed to check the cancel flag of task {task_id}: {e}")
+            return False
+
+    @contextmanager
+    def watch(self, task_id: str) -> Iterator[threading.Event]:
+        """Yields an event that is set once `task_id` is cancelled while the block runs."""
+        event = threading.Event()
+        with self._lock:
+            self._events[task_id] = event
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cancellation-watcher", daemon=True)
+                self._thread.start()
+        try:
+            yield event
+        finally:
+            with self._lock:
+                self._events.pop(task_id, None)
+
+    def poll_once(self):
+        with self._lock:
+            watched = [(task_id, event) for task_id, event in self._events.items() if not event.is_set()]
+        if not watched:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for task_id, _ in watched:
+            pipe.exists(CANCEL_KEY.format(task_id=task_id))
+        for (task_id, event), flagged in zip(watched, pipe.execute()):
+            if flagged:
+                print(f"Task {task_id} was cancelled.")
+                event.set()
+
+    def close(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Failed to poll cancel flags; retrying in {self.interval}s: {e}")
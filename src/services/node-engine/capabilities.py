@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Capability records that nodes publish through the peer mesh.
+
+A record lists the models the node's workers serve and the ones they hold in
+memory. It also carries the backlog of the node's model queues, its free
+model memory, its recent token throughput and its version. It is built from
+the workers' Redis adverts (see routing.py) and rides on the node's own
+gossip updates (see grpc/gossip.py).
+
+A record only spreads through the mesh when the node bumps its incarnation,
+so `CapabilityPublisher` republishes only when the record changes
+materially. That means a different model set or version, or a figure that
+moved by more than `CAPABILITY_CHANGE_THRESHOLD`.
+"""
+import asyncio
+import os
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+NODE_VERSION = os.getenv("NODE_VERSION", "1.0.0")
+CAPABILITY_REFRESH_SECONDS = float(os.getenv("CAPABILITY_REFRESH_SECONDS", "5"))
+# Relative change in queue depth, free memory or throughput that triggers a republish.
+CAPABILITY_CHANGE_THRESHOLD = float(os.getenv("CAPABILITY_CHANGE_THRESHOLD", "0.25"))
+# Proxy cost multiplier for a node that would have to load the model first.
+PROXY_COLD_MODEL_PENALTY = float(os.getenv("PROXY_COLD_MODEL_PENALTY", "4"))
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    models: Tuple[str, ...] = ()
+    loaded_models: Tuple[str, ...] = ()
+    queue_depth: int = 0
+    free_memory_bytes: int = 0
+    tokens_per_second: float = 0.0
+    version: str = NODE_VERSION
+
+    @classmethod
+    def from_fleet(cls, fleet: dict, version: str = NODE_VERSION) -> "Capabilities":
+        """Builds this node's record from a `routing.fleet_snapshot`."""
+        return cls(
+            models=tuple(sorted(fleet["models"])),
+            loaded_models=tuple(sorted(fleet["loaded_models"])),
+            queue_depth=int(fleet["queue_depth"]),
+            free_memory_bytes=int(fleet["free_memory_bytes"]),
+            tokens_per_second=round(float(fleet["tokens_per_second"]), 1),
+            version=version,
+        )
+
+    def differs(self, other: Optional["Capabilities"], threshold: float = CAPABILITY_CHANGE_THRESHOLD) -> bool:
+        """Whether `other` is different enough from this record to be worth gossiping."""
+        if other is None:
+            return True
+        if (self.models, self.loaded_models, self.version) != (other.models, other.loaded_models, other.version):
+            return True
+        for name in ("queue_depth", "free_memory_bytes", "tokens_per_second"):
+            old, new = getattr(other, name), getattr(self, name)
+            if abs(new - old) > threshold * max(abs(old), 1):
+                return True
+        return False
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record["models"] = list(self.models)
+        record["loaded_models"] = list(self.loaded_models)
+        return record
+
+
+class CapabilityPublisher:
+    """
+    Periodically collects this node's record and hands it to `publish` when
+    it changed materially.
+    """
+    def __init__(self, collect: Callable[[], Awaitable[Capabilities]], publish: Callable[[Capabilities], None],
+                 interval: float = CAPABILITY_REFRESH_SECONDS, threshold: float = CAPABILITY_CHANGE_THRESHOLD):
+        self.collect = collect
+        self.publish = publish
+        self.interval = interval
+        self.threshold = threshold
+        self.current: Optional[Capabilities] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self) -> bool:
+        """Collects the record once. Returns True if it was published."""
+        record = await self.collect()
+        if not record.differs(self.current, self.threshold):
+            return False
+        self.current = record
+        self.publish(record)
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh node capabilities: {e}")
+            await asyncio.sleep(self.interval)
+
+
+async def collect_capabilities(models: Iterable[str], client=None) -> Capabilities:
+    """This node's record, read from the workers' adverts in Redis."""
+    from .routing import fleet_snapshot
+    return Capabilities.from_fleet(await fleet_snapshot(models, client))
+
+
+# --- Proxy Routing ---
+
+def rank_peers(records: Dict[str, Optional[Capabilities]], model: Optional[str],
+               cold_penalty: float = PROXY_COLD_MODEL_PENALTY) -> Tuple[Sequence[str], Dict[str, float]]:
+    """
+    Filters proxy candidates by model and weighs them by backlog.
+
+    Args:
+        records: Candidate peer -> its capability record (None if it has not published one).
+        model: The requested model, if known.
+
+    Returns:
+        The candidates and a cost multiplier for each. Peers advertising the
+        model are preferred; peers without a record are only used when none
+        advertises it.
+    """
+    model = (model or "").lower()
+    if model:
+        serving = [peer for peer, record in records.items() if record is not None and model in record.models]
+        candidates = serving or [peer for peer, record in records.items() if record is None] or list(records)
+    else:
+        candidates = list(records)
+    weights = {}
+    for peer in candidates:
+        record = records[peer]
+        if record is None:
+            continue
+        weight = 1.0 + record.queue_depth
+        if model and model not in record.loaded_models:
+            weight *= cold_penalty
+        weights[peer] = weight
+    return candidates, weights
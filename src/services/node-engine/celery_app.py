@@ -2,12 +2,22 @@ import os
 from celery import Celery
 from dotenv import load_dotenv
 
+from .routing import PRIORITY_STEPS, TASK_PRIORITIES
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Get broker and backend URLs from environment variables, with defaults
 broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+# Tasks a worker thread reserves ahead; more would hold bulk work past newly queued interactive tasks.
+prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
+# "threads" runs one process that owns the model weights; its threads share
+# the batching engine. "prefork" runs a process per slot, and the served
+# models are loaded before the fork so the weights are shared copy-on-write
+# (see WORKER_PRELOAD_MODELS in tasks.py). `--pool`/`--concurrency` override both.
+worker_pool = os.getenv("CELERY_WORKER_POOL", "threads")
+worker_concurrency = int(os.getenv("CELERY_WORKER_CONCURRENCY", os.getenv("BATCH_MAX_SIZE", "8")))
 
 # Initialize the Celery application
 celery_app = Celery(
@@ -21,6 +31,12 @@ celery_app = Celery(
 celery_app.conf.update(
     task_track_started=True,
     result_expires=3600,  # Expire results after 1 hour
+    # Priority queues on Redis (see routing.py); tasks sent without a priority count as "normal".
+    broker_transport_options={"priority_steps": PRIORITY_STEPS},
+    task_default_priority=TASK_PRIORITIES["normal"],
+    worker_prefetch_multiplier=prefetch_multiplier,
+    worker_pool=worker_pool,
+    worker_concurrency=worker_concurrency,
 )
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the node engine tests.
+"""
+
+import fakeredis
+import pytest
+
+
+# --- Redis ---
+
+@pytest.fixture
+def server():
+    """An in-process fakeredis server, fresh for each test."""
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_client(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def async_redis_client(server):
+    return fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+
+# --- Decoding ---
+
+def _greedy(model, tokenizer, prompt, max_new_tokens):
+    """Unbatched greedy decoding through `model.generate`, up to and including EOS (ID 1)."""
+    input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    output = model.generate(input_ids, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=0)
+    generated = output[0, input_ids.shape[1]:].tolist()
+    if 1 in generated:
+        generated = generated[:generated.index(1) + 1]
+    return generated
+
+
+@pytest.fixture
+def reference_greedy():
+    """The token IDs plain greedy decoding produces, to compare the engines against."""
+    return _greedy
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load figures of the worker fleet behind a node, shared through Redis.
+
+Workers add each finished generation to a latency histogram with fixed
+buckets. There is one Redis hash per `FLEET_LATENCY_SLOT_SECONDS` time
+slot, and histograms merge by adding their bucket counts. The rolling p50
+and p95 over the last `FLEET_LATENCY_WINDOW_SECONDS` therefore come from a
+handful of small hashes, however many workers there are. Per-worker figures
+(active tasks, free memory, token rate) travel with the worker adverts in
+routing.py. A prefork worker is advertised by its parent process, which runs
+no tasks, so its children count their tasks and tokens in a shared Redis
+hash (`SharedWorkerLoad`) instead of in process memory. `routing.fleet_snapshot` reads everything in two round trips, so
+nothing here needs Celery's inspect broadcast.
+"""
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+FLEET_LATENCY_SLOT_SECONDS = int(os.getenv("FLEET_LATENCY_SLOT_SECONDS", "10"))
+FLEET_LATENCY_WINDOW_SECONDS = int(os.getenv("FLEET_LATENCY_WINDOW_SECONDS", "60"))
+# The heartbeat score halves when the fleet's p95 latency reaches this.
+HEARTBEAT_TARGET_P95_SECONDS = float(os.getenv("HEARTBEAT_TARGET_P95_SECONDS", "10"))
+
+# Upper bounds of the latency buckets, in seconds; the last bucket is open-ended.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300)
+LATENCY_KEY = "deai:fleet:latency:{slot}"
+WORKER_LOAD_KEY = "deai:workers:{worker}:load"  # hash: active_tasks, generated_tokens
+
+
+def _bucket(seconds: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def record_latency(seconds: float, client=None):
+    """Adds one finished generation to the current slot's histogram."""
+    if client is None:
+        from .redis_client import get_redis
+        client = get_redis()
+    key = LATENCY_KEY.format(slot=int(time.time() // FLEET_LATENCY_SLOT_SECONDS))
+    pipe = client.pipeline(transaction=False)
+    pipe.hincrby(key, str(_bucket(seconds)), 1)
+    pipe.expire(key, FLEET_LATENCY_WINDOW_SECONDS + FLEET_LATENCY_SLOT_SECONDS)
+    pipe.execute()
+
+
+def latency_keys(now: float) -> List[str]:
+    """The histogram keys covering the rolling window ending at `now`."""
+    current = int(now // FLEET_LATENCY_SLOT_SECONDS)
+    slots = max(1, math.ceil(FLEET_LATENCY_WINDOW_SECONDS / FLEET_LATENCY_SLOT_SECONDS))
+    return [LATENCY_KEY.format(slot=current - i) for i in range(slots)]
+
+
+def merge_histograms(histograms: Iterable[Dict[str, str]]) -> List[int]:
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for histogram in histograms:
+        for bucket, count in histogram.items():
+            counts[int(bucket)] += int(count)
+    return counts
+
+
+def quantile(counts: Sequence[int], q: float) -> float:
+    """
+    Estimates the `q` quantile of a bucketed histogram by linear
+    interpolation inside the bucket it falls in (0.0 if there are no samples).
+    """
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            # The open-ended bucket reports its lower bound.
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else lower
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BUCKETS[-1])
+
+
+class ActiveTasks:
+    """Counts the generations running in this worker; use as a context manager."""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.count += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.count -= 1
+        return False
+
+
+class SharedWorkerLoad:
+    """
+    Active tasks and generated tokens of a prefork worker, summed over its
+    child processes in Redis. Used like `ActiveTasks`; updates are best
+    effort, as a Redis hiccup must not fail a generation.
+    """
+    def __init__(self, worker_name: str, client=None):
+        self.key = WORKER_LOAD_KEY.format(worker=worker_name)
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .redis_client import get_redis
+            self._client = get_redis()
+        return self._client
+
+    def reset(self):
+        """Clears the counts, e.g. left behind by children that died mid-task."""
+        try:
+            self.client.delete(self.key)
+        except Exception as e:
+            print(f"Failed to reset the shared worker load: {e}")
+
+    def add_tokens(self, tokens: int):
+        self._incr("generated_tokens", tokens)
+
+    def read(self) -> Tuple[int, float]:
+        """Returns `(active_tasks, generated_tokens)`."""
+        values = self.client.hmget(self.key, "active_tasks", "generated_tokens")
+        return max(0, int(values[0] or 0)), float(values[1] or 0)
+
+    def __enter__(self):
+        self._incr("active_tasks", 1)
+        return self
+
+    def __exit__(self, *exc):
+        self._incr("active_tasks", -1)
+        return False
+
+    def _incr(self, field: str, amount: int):
+        try:
+            self.client.hincrby(self.key, field, amount)
+        except Exception as e:
+            print(f"Failed to update the shared worker load: {e}")
+
+
+# --- Gateway Heartbeat ---
+
+def heartbeat(snapshot: dict, target_p95: float = HEARTBEAT_TARGET_P95_SECONDS) -> dict:
+    """
+    The metrics message sent to the gateway, from a `routing.fleet_snapshot`.
+
+    `load` is the share of worker slots that running and queued tasks would
+    fill, capped at 1. `score` falls from 1 as the rolling p95 latency grows,
+    and is 0 when no worker is alive.
+    """
+    waiting = snapshot["active_tasks"] + snapshot["queue_depth"]
+    capacity = snapshot["capacity"]
+    if capacity:
+        load = min(1.0, waiting / capacity)
+        score = 1.0 / (1.0 + snapshot["latency_p95_seconds"] / target_p95)
+    else:
+        load, score = 1.0, 0.0
+    return {
+        "type": "metrics",
+        "score": round(score, 3),
+        "load": round(load, 3),
+        "queues": snapshot["queues"],
+        "active_tasks": snapshot["active_tasks"],
+        "workers": snapshot["workers"],
+        "latency_p50_ms": round(snapshot["latency_p50_seconds"] * 1000),
+        "latency_p95_ms": round(snapshot["latency_p95_seconds"] * 1000),
+        "tokens_per_second": round(snapshot["tokens_per_second"], 1),
+        "memory_headroom_bytes": snapshot["free_memory_bytes"],
+    }
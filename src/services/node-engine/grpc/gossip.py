@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SWIM-style membership for the peer mesh, over the `GossipPeers` RPC.
+
+Each protocol period a node probes one member, walking the members in a
+shuffled round-robin order. If there is no reply within
+`GOSSIP_PROBE_TIMEOUT_SECONDS`, it asks `GOSSIP_INDIRECT_PROBES` other
+members to probe the target on its behalf. If none of them reaches it
+either, the target becomes SUSPECT. A suspect that does not refute the
+suspicion before the suspicion timeout, which grows with log(N), becomes
+DEAD. A member refutes suspicion by gossiping ALIVE with a higher
+incarnation.
+
+Membership changes are versioned by incarnation and piggybacked on the
+probes. At most `GOSSIP_MAX_UPDATES` go in each message, each is resent
+about log(N) times, and each node sends a fixed number of messages per
+period. Per-node bandwidth therefore stays flat as the mesh grows. Only a
+joining node receives the full membership, once, from the seed it contacts.
+
+A member's updates about itself also carry its capability record (see
+capabilities.py). Publishing a new record bumps the member's incarnation, so
+the record spreads like any other change.
+"""
+import asyncio
+import math
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Protocol
+
+import grpc
+
+from . import node_pb2
+from . import node_pb2_grpc
+from ..capabilities import Capabilities
+from ..metrics import GOSSIP_MESSAGES, GOSSIP_MEMBERS
+
+# --- Configuration ---
+GOSSIP_PERIOD_SECONDS = float(os.getenv("GOSSIP_PERIOD_SECONDS", "1.0"))
+GOSSIP_PROBE_TIMEOUT_SECONDS = float(os.getenv("GOSSIP_PROBE_TIMEOUT_SECONDS", "0.4"))
+GOSSIP_INDIRECT_PROBES = int(os.getenv("GOSSIP_INDIRECT_PROBES", "3"))
+GOSSIP_MAX_UPDATES = int(os.getenv("GOSSIP_MAX_UPDATES", "8"))
+# Each update is resent ceil(mult * log2(N + 1)) times.
+GOSSIP_RETRANSMIT_MULT = float(os.getenv("GOSSIP_RETRANSMIT_MULT", "3"))
+# Suspects are declared dead after mult * log2(N + 1) periods.
+GOSSIP_SUSPICION_MULT = float(os.getenv("GOSSIP_SUSPICION_MULT", "4"))
+# Dead members are remembered this long, so stale ALIVE gossip cannot revive them.
+GOSSIP_DEAD_RETENTION_SECONDS = float(os.getenv("GOSSIP_DEAD_RETENTION_SECONDS", "60"))
+
+ALIVE = node_pb2.MemberUpdate.ALIVE
+SUSPECT = node_pb2.MemberUpdate.SUSPECT
+DEAD = node_pb2.MemberUpdate.DEAD
+
+
+@dataclass(frozen=True)
+class Update:
+    address: str
+    incarnation: int
+    status: int
+    capabilities: Optional[Capabilities] = None
+
+
+@dataclass
+class Member:
+    address: str
+    incarnation: int = 0
+    status: int = ALIVE
+    changed_at: float = 0.0
+    capabilities: Optional[Capabilities] = None
+
+
+@dataclass
+class GossipMessage:
+    from_address: str
+    updates: List[Update] = field(default_factory=list)
+    probe_target: str = ""
+
+
+@dataclass
+class GossipReply:
+    updates: List[Update] = field(default_factory=list)
+    target_alive: bool = False
+
+
+class GossipTransport(Protocol):
+    async def send(self, address: str, message: GossipMessage, timeout: float) -> GossipReply:
+        """Delivers `message` to `address` and returns its reply; raises on failure or timeout."""
+
+
+def _overrides(update: Update, member: Member) -> bool:
+    """SWIM precedence: whether `update` supersedes what we know about the member."""
+    if update.status == ALIVE:
+        return update.incarnation > member.incarnation
+    if member.status == DEAD:
+        return False
+    if update.status == SUSPECT:
+        return update.incarnation > member.incarnation or (
+            update.incarnation == member.incarnation and member.status == ALIVE
+        )
+    return True
+
+
+class Membership:
+    """
+    This node's view of the mesh plus the queue of changes still to gossip.
+    """
+    def __init__(self, self_address: str, retransmit_mult: float = GOSSIP_RETRANSMIT_MULT,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_change: Optional[Callable[[str, int], None]] = None,
+                 rng: Optional[random.Random] = None):
+        self.self_address = self_address
+        self.incarnation = 0
+        self.capabilities: Optional[Capabilities] = None
+        self.retransmit_mult = retransmit_mult
+        self.members: Dict[str, Member] = {}
+        self._clock = clock
+        self._on_change = on_change
+        self._rng = rng or random.Random()
+        self._pending: Dict[str, List] = {}  # address -> [update, times sent]
+        self._probe_order: List[str] = []
+
+    # --- Views ---
+
+    def live_addresses(self) -> List[str]:
+        """Members not known to be dead (suspects may still be alive)."""
+        return [m.address for m in self.members.values() if m.status != DEAD]
+
+    def full_state(self) -> List[Update]:
+        return [self.self_update()] + [
+            Update(m.address, m.incarnation, m.status, m.capabilities) for m in self.members.values()
+        ]
+
+    def self_update(self) -> Update:
+        return Update(self.self_address, self.incarnation, ALIVE, self.capabilities)
+
+    def capabilities_of(self) -> Dict[str, Capabilities]:
+        """Capability records of the members not known to be dead, and our own."""
+        records = {m.address: m.capabilities for m in self.members.values()
+                   if m.status != DEAD and m.capabilities is not None}
+        if self.capabilities is not None:
+            records[self.self_address] = self.capabilities
+        return records
+
+    def retransmit_limit(self) -> int:
+        return max(1, math.ceil(self.retransmit_mult * math.log2(len(self.members) + 2)))
+
+    # --- Applying Changes ---
+
+    def set_capabilities(self, capabilities: Capabilities):
+        """Publishes a new record for this node under a new incarnation."""
+        self.capabilities = capabilities
+        self.incarnation += 1
+        self._enqueue(self.self_update())
+
+    def apply(self, update: Update) -> bool:
+        """Merges a gossiped update. Returns True if it changed our view."""
+        if update.address == self.self_address:
+            if update.status != ALIVE and update.incarnation >= self.incarnation:
+                # Someone suspects us: refute with a newer incarnation.
+                self.incarnation = update.incarnation + 1
+                self._enqueue(self.self_update())
+            return False
+        member = self.members.get(update.address)
+        is_new = member is None
+        if is_new:
+            if update.status == DEAD:
+                return False
+            member = self.members[update.address] = Member(update.address, -1)
+        if not _overrides(update, member):
+            return False
+        previous = member.status
+        member.incarnation = update.incarnation
+        member.status = update.status
+        member.changed_at = self._clock()
+        if update.capabilities is not None:
+            member.capabilities = update.capabilities
+        self._enqueue(update)
+        if is_new or previous != update.status:
+            self._notify(member)
+        return True
+
+    def suspect(self, address: str):
+        member = self.members.get(address)
+        if member is not None and member.status == ALIVE:
+            self.apply(Update(address, member.incarnation, SUSPECT))
+
+    def expire(self, suspicion_timeout: float, dead_retention: float = GOSSIP_DEAD_RETENTION_SECONDS):
+        """Declares overdue suspects dead and forgets long-dead members."""
+        now = self._clock()
+        for member in list(self.members.values()):
+            if member.status == SUSPECT and now - member.changed_at >= suspicion_timeout:
+                self.apply(Update(member.address, member.incarnation, DEAD))
+            elif member.status == DEAD and now - member.changed_at >= dead_retention:
+                del self.members[member.address]
+                self._pending.pop(member.address, None)
+
+    def _enqueue(self, update: Update):
+        self._pending[update.address] = [update, 0]
+
+    def _notify(self, member: Member):
+        GOSSIP_MEMBERS.labels(status="alive").set(sum(m.status == ALIVE for m in self.members.values()))
+        GOSSIP_MEMBERS.labels(status="suspect").set(sum(m.status == SUSPECT for m in self.members.values()))
+        if self._on_change:
+            self._on_change(member.address, member.status)
+
+    # --- Dissemination ---
+
+    def updates_to_send(self, limit: int = GOSSIP_MAX_UPDATES) -> List[Update]:
+        """The least-sent pending updates, counting this as one more transmission."""
+        chosen = sorted(self._pending.values(), key=lambda entry: entry[1])[:limit]
+        retransmit_limit = self.retransmit_limit()
+        for entry in chosen:
+            entry[1] += 1
+            if entry[1] >= retransmit_limit:
+                self._pending.pop(entry[0].address, None)
+        return [entry[0] for entry in chosen]
+
+    # --- Probe Selection ---
+
+    def next_probe_target(self) -> Optional[str]:
+        """Round-robin over the live members in a freshly shuffled order each lap."""
+        while self._probe_order:
+            address = self._probe_order.pop()
+            member = self.members.get(address)
+            if member is not None and member.status != DEAD:
+                return address
+        self._probe_order = self.live_addresses()
+        self._rng.shuffle(self._probe_order)
+        return self._probe_order.pop() if self._probe_order else None
+
+    def random_members(self, count: int, exclude: Iterable[str] = ()) -> List[str]:
+        exclude = set(exclude)
+        candidates = [a for a, m in self.members.items() if m.status == ALIVE and a not in exclude]
+        return self._rng.sample(candidates, min(count, len(candidates)))
+
+
+class SwimNode:
+    """
+    Runs the SWIM failure detector for one `Membership` over a transport.
+    """
+    def __init__(self, membership: Membership, transport: GossipTransport,
+                 period: float = GOSSIP_PERIOD_SECONDS, probe_timeout: float = GOSSIP_PROBE_TIMEOUT_SECONDS,
+                 indirect_probes: int = GOSSIP_INDIRECT_PROBES, max_updates: int = GOSSIP_MAX_UPDATES,
+                 suspicion_mult: float = GOSSIP_SUSPICION_MULT):
+        self.membership = membership
+        self.transport = transport
+        self.period = period
+        self.probe_timeout = probe_timeout
+        self.indirect_probes = indirect_probes
+        self.max_updates = max_updates
+        self.suspicion_mult = suspicion_mult
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def address(self) -> str:
+        return self.membership.self_address
+
+    def suspicion_timeout(self) -> float:
+        return self.suspicion_mult * math.log2(len(self.membership.members) + 2) * self.period
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def join(self, seeds: Iterable[str]) -> int:
+        """Contacts every seed and merges the membership they return. Returns how many answered."""
+        seeds = [seed for seed in dict.fromkeys(seeds) if seed and seed != self.address]
+        replies = await asyncio.gather(
+            *(self.transport.send(seed, self._message(), self.probe_timeout * 5) for seed in seeds),
+            return_exceptions=True,
+        )
+        joined = 0
+        for seed, reply in zip(seeds, replies):
+            if isinstance(reply, BaseException):
+                print(f"Failed to join the mesh through {seed}: {reply}")
+                continue
+            joined += 1
+            self._absorb(reply.updates)
+        return joined
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Gossip round failed: {e}")
+            await asyncio.sleep(max(self.period - (loop.time() - started), 0))
+
+    # --- Protocol ---
+
+    async def tick(self):
+        """One protocol period: probe a member, indirectly if needed, and expire suspects."""
+        self.membership.expire(self.suspicion_timeout())
+        target = self.membership.next_probe_target()
+        if target is None:
+            return
+        if await self._ping(target):
+            return
+        helpers = self.membership.random_members(self.indirect_probes, exclude=[target])
+        timeout = max(self.period - self.probe_timeout, self.probe_timeout)
+        results = await asyncio.gather(*(self._ping_req(helper, target, timeout) for helper in helpers))
+        if not any(results):
+            self.membership.suspect(target)
+
+    def _message(self, probe_target: str = "") -> GossipMessage:
+        # Our own ALIVE record rides along so receivers learn our incarnation.
+        updates = [self.membership.self_update()] + self.membership.updates_to_send(self.max_updates)
+        return GossipMessage(self.address, updates, probe_target)
+
+    def _absorb(self, updates: Iterable[Update]):
+        for update in updates:
+            self.membership.apply(update)
+
+    async def _ping(self, target: str) -> bool:
+        GOSSIP_MESSAGES.labels(kind="ping").inc()
+        try:
+            reply = await self.transport.send(target, self._message(), self.probe_timeout)
+        except Exception:
+            return False
+        self._absorb(reply.updates)
+        return True
+
+    async def _ping_req(self, helper: str, target: str, timeout: float) -> bool:
+        GOSSIP_MESSAGES.labels(kind="ping_req").inc()
+        try:
+            reply = await self.transport.send(helper, self._message(probe_target=target), timeout)
+        except Exception:
+            return False
+        self._absorb(reply.updates)
+        return reply.target_alive
+
+    async def handle(self, message: GossipMessage) -> GossipReply:
+        """Answers a probe, an indirect probe request or a join."""
+        joining = message.from_address not in self.membership.members
+        self._absorb(message.updates)
+        target_alive = await self._ping(message.probe_target) if message.probe_target else False
+        if joining:
+            # A new member needs everything once; afterwards it only gets deltas.
+            return GossipReply(self.membership.full_state(), target_alive)
+        return GossipReply([self.membership.self_update()] + self.membership.updates_to_send(self.max_updates),
+                           target_alive)
+
+
+# --- gRPC Transport ---
+
+def capabilities_to_proto(record: Capabilities) -> node_pb2.NodeCapabilities:
+    return node_pb2.NodeCapabilities(models=record.models, loaded_models=record.loaded_models,
+                                     queue_depth=record.queue_depth, free_memory_bytes=record.free_memory_bytes,
+                                     tokens_per_second=record.tokens_per_second, version=record.version)
+
+
+def capabilities_from_proto(record: node_pb2.NodeCapabilities) -> Capabilities:
+    return Capabilities(tuple(record.models), tuple(record.loaded_models), record.queue_depth,
+                        record.free_memory_bytes, round(record.tokens_per_second, 1), record.version)
+
+
+def updates_to_proto(updates: Iterable[Update]) -> List[node_pb2.MemberUpdate]:
+    protos = []
+    for u in updates:
+        proto = node_pb2.MemberUpdate(address=u.address, incarnation=u.incarnation, status=u.status)
+        if u.capabilities is not None:
+            proto.capabilities.CopyFrom(capabilities_to_proto(u.capabilities))
+        protos.append(proto)
+    return protos
+
+
+def updates_from_proto(updates) -> List[Update]:
+    return [
+        Update(u.address, u.incarnation, u.status,
+               capabilities_from_proto(u.capabilities) if u.HasField("capabilities") else None)
+        for u in updates
+    ]
+
+
+def message_to_proto(message: GossipMessage) -> node_pb2.GossipPeersRequest:
+    return node_pb2.GossipPeersRequest(from_address=message.from_address,
+                                       updates=updates_to_proto(message.updates),
+                                       probe_target=message.probe_target)
+
+
+def reply_to_proto(reply: GossipReply) -> node_pb2.GossipPeersResponse:
+    return node_pb2.GossipPeersResponse(updates=updates_to_proto(reply.updates), target_alive=reply.target_alive)
+
+
+class GrpcGossipTransport:
+    """Sends gossip over the persistent per-peer channels."""
+    def __init__(self, channels):
+        self.channels = channels
+
+    async def send(self, address: str, message: GossipMessage, timeout: float) -> GossipReply:
+        stub = node_pb2_grpc.NodeStub(self.channels.get(address))
+        try:
+            response = await stub.GossipPeers(message_to_proto(message), timeout=timeout)
+        except grpc.RpcError as e:
+            raise ConnectionError(f"Gossip to {address} failed: {e.code()}") from e
+        return GossipReply(updates_from_proto(response.updates), response.target_alive)
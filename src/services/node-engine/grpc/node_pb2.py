@@ -1,13 +1,22 @@
-
 # -*- coding: utf-8 -*-
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
 # source: node.proto
+# Protobuf Python Version: 7.35.1
 """Generated protocol buffer code."""
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import descriptor_pool as _descriptor_pool
-from google.protobuf import message as _message
-from google.protobuf import reflection as _reflection
+from google.protobuf import runtime_version as _runtime_version
 from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'node.proto'
+)
 # @@protoc_insertion_point(imports)
 
 _sym_db = _symbol_database.Default()
@@ -15,34 +24,67 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nnode.proto\x12\x04node\"#\n\x13AnnouncePeerRequest\x12\x0c\n\x04peer\x18\x01 \x01(\t"8\n\x14AnnouncePeerResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0f\n\x07peers\x18\x02 \x03(\t2U\n\x04Node\x12M\n\x0cAnnouncePeer\x12\x19.node.AnnouncePeerRequest\x1a\x1a.node.AnnouncePeerResponse"\x00\x62\x06proto3')
-
-
-
-_ANNOUNCEPEERREQUEST = DESCRIPTOR.message_types_by_name['AnnouncePeerRequest']
-_ANNOUNCEPEERRESPONSE = DESCRIPTOR.message_types_by_name['AnnouncePeerResponse']
-AnnouncePeerRequest = _reflection.GeneratedProtocolMessageType('AnnouncePeerRequest', (_message.Message,), {
-  'DESCRIPTOR' : _ANNOUNCEPEERREQUEST,
-  '__module__' : 'node_pb2'
-  # @@protoc_insertion_point(class_scope:node.AnnouncePeerRequest)
-  })
-_sym_db.RegisterMessage(AnnouncePeerRequest)
-
-AnnouncePeerResponse = _reflection.GeneratedProtocolMessageType('AnnouncePeerResponse', (_message.Message,), {
-  'DESCRIPTOR' : _ANNOUNCEPEERRESPONSE,
-  '__module__' : 'node_pb2'
-  # @@protoc_insertion_point(class_scope:node.AnnouncePeerResponse)
-  })
-_sym_db.RegisterMessage(AnnouncePeerResponse)
-
-_NODE = DESCRIPTOR.services_by_name['Node']
-if _descriptor._USE_C_DESCRIPTORS == False:
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nnode.proto\x12\x04node\"4\n\x10ValidatorMessage\x12\x11\n\tpublicKey\x18\x01 \x01(\t\x12\r\n\x05stake\x18\x02 \x01(\x03\"i\n\x12TransactionMessage\x12\x11\n\tpublicKey\x18\x01 \x01(\t\x12\n\n\x02to\x18\x02 \x01(\t\x12\x0e\n\x06\x61mount\x18\x03 \x01(\x03\x12\x11\n\ttimestamp\x18\x04 \x01(\x03\x12\x11\n\tsignature\x18\x05 \x01(\t\"\x96\x01\n\x0c\x42lockMessage\x12\x0e\n\x06height\x18\x01 \x01(\x03\x12\x11\n\ttimestamp\x18\x02 \x01(\x03\x12\x11\n\tvalidator\x18\x03 \x01(\t\x12\x12\n\nparentHash\x18\x04 \x01(\t\x12\x0c\n\x04hash\x18\x05 \x01(\t\x12.\n\x0ctransactions\x18\x06 \x03(\x0b\x32\x18.node.TransactionMessage\"\x0f\n\rStatusRequest\"0\n\x0bStatusReply\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\x03\"\x17\n\x15ListValidatorsRequest\"D\n\x16ListValidatorsResponse\x12*\n\nvalidators\x18\x01 \x03(\x0b\x32\x16.node.ValidatorMessage\"7\n\x13\x41\x64\x64ValidatorRequest\x12\x11\n\tpublicKey\x18\x01 \x01(\t\x12\r\n\x05stake\x18\x02 \x01(\x03\"\'\n\x14\x41\x64\x64ValidatorResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"+\n\x16RemoveValidatorRequest\x12\x11\n\tpublicKey\x18\x01 \x01(\t\"*\n\x17RemoveValidatorResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"&\n\x13\x41nnouncePeerRequest\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\">\n\x14\x41nnouncePeerResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x15\n\rcurrent_peers\x18\x02 \x03(\t\"\xa3\x01\n\x1aSyncValidatorUpdateRequest\x12@\n\x0bupdate_type\x18\x02 \x01(\x0e\x32+.node.SyncValidatorUpdateRequest.UpdateType\x12\x11\n\tpublicKey\x18\x03 \x01(\t\x12\r\n\x05stake\x18\x04 \x01(\x03\"!\n\nUpdateType\x12\x07\n\x03\x41\x44\x44\x10\x00\x12\n\n\x06REMOVE\x10\x01\".\n\x1bSyncValidatorUpdateResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"\xb9\x01\n\x0cMemberUpdate\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x13\n\x0bincarnation\x18\x02 \x01(\x04\x12)\n\x06status\x18\x03 \x01(\x0e\x32\x19.node.MemberUpdate.Status\x12,\n\x0c\x63\x61pabilities\x18\x04 \x01(\x0b\x32\x16.node.NodeCapabilities\"*\n\x06Status\x12\t\n\x05\x41LIVE\x10\x00\x12\x0b\n\x07SUSPECT\x10\x01\x12\x08\n\x04\x44\x45\x41\x44\x10\x02\"\x95\x01\n\x10NodeCapabilities\x12\x0e\n\x06models\x18\x01 \x03(\t\x12\x15\n\rloaded_models\x18\x02 \x03(\t\x12\x13\n\x0bqueue_depth\x18\x03 \x01(\r\x12\x19\n\x11\x66ree_memory_bytes\x18\x04 \x01(\x04\x12\x19\n\x11tokens_per_second\x18\x05 \x01(\x02\x12\x0f\n\x07version\x18\x06 \x01(\t\"t\n\x12GossipPeersRequest\x12\x14\n\x0c\x66rom_address\x18\x01 \x01(\t\x12\r\n\x05peers\x18\x02 \x03(\t\x12#\n\x07updates\x18\x03 \x03(\x0b\x32\x12.node.MemberUpdate\x12\x14\n\x0cprobe_target\x18\x04 \x01(\t\"v\n\x13GossipPeersResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x13\n\x0bknown_peers\x18\x02 \x03(\t\x12#\n\x07updates\x18\x03 \x03(\x0b\x32\x12.node.MemberUpdate\x12\x14\n\x0ctarget_alive\x18\x04 \x01(\x08\"L\n\x14\x41nnounceBlockRequest\x12!\n\x05\x62lock\x18\x01 \x01(\x0b\x32\x12.node.BlockMessage\x12\x11\n\tfrom_peer\x18\x02 \x01(\t\"(\n\x15\x41nnounceBlockResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"\x11\n\x0fGetChainRequest\"6\n\x10GetChainResponse\x12\"\n\x06\x62locks\x18\x01 \x03(\x0b\x32\x12.node.BlockMessage\"D\n\x19SubmitTransactionResponse\x12\x16\n\x0etransaction_id\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\t\".\n\x1b\x41nnounceTransactionResponse\x12\x0f\n\x07message\x18\x01 \x01(\t2\xc5\x06\n\x04Node\x12\x35\n\tGetStatus\x12\x13.node.StatusRequest\x1a\x11.node.StatusReply\"\x00\x12M\n\x0eListValidators\x12\x1b.node.ListValidatorsRequest\x1a\x1c.node.ListValidatorsResponse\"\x00\x12G\n\x0c\x41\x64\x64Validator\x12\x19.node.AddValidatorRequest\x1a\x1a.node.AddValidatorResponse\"\x00\x12P\n\x0fRemoveValidator\x12\x1c.node.RemoveValidatorRequest\x1a\x1d.node.RemoveValidatorResponse\"\x00\x12G\n\x0c\x41nnouncePeer\x12\x19.node.AnnouncePeerRequest\x1a\x1a.node.AnnouncePeerResponse\"\x00\x12\\\n\x13SyncValidatorUpdate\x12 .node.SyncValidatorUpdateRequest\x1a!.node.SyncValidatorUpdateResponse\"\x00\x12\x44\n\x0bGossipPeers\x12\x18.node.GossipPeersRequest\x1a\x19.node.GossipPeersResponse\"\x00\x12J\n\rAnnounceBlock\x12\x1a.node.AnnounceBlockRequest\x1a\x1b.node.AnnounceBlockResponse\"\x00\x12;\n\x08GetChain\x12\x15.node.GetChainRequest\x1a\x16.node.GetChainResponse\"\x00\x12P\n\x11SubmitTransaction\x12\x18.node.TransactionMessage\x1a\x1f.node.SubmitTransactionResponse\"\x00\x12T\n\x13\x41nnounceTransaction\x12\x18.node.TransactionMessage\x1a!.node.AnnounceTransactionResponse\"\x00\x62\x06proto3')
 
-  DESCRIPTOR._options = None
-  _ANNOUNCEPEERREQUEST._serialized_start=20
-  _ANNOUNCEPEERREQUEST._serialized_end=55
-  _ANNOUNCEPEERRESPONSE._serialized_start=57
-  _ANNOUNCEPEERRESPONSE._serialized_end=113
-  _NODE._serialized_start=115
-  _NODE._serialized_end=200
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'node_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_VALIDATORMESSAGE']._serialized_start=20
+  _globals['_VALIDATORMESSAGE']._serialized_end=72
+  _globals['_TRANSACTIONMESSAGE']._serialized_start=74
+  _globals['_TRANSACTIONMESSAGE']._serialized_end=179
+  _globals['_BLOCKMESSAGE']._serialized_start=182
+  _globals['_BLOCKMESSAGE']._serialized_end=332
+  _globals['_STATUSREQUEST']._serialized_start=334
+  _globals['_STATUSREQUEST']._serialized_end=349
+  _globals['_STATUSREPLY']._serialized_start=351
+  _globals['_STATUSREPLY']._serialized_end=399
+  _globals['_LISTVALIDATORSREQUEST']._serialized_start=401
+  _globals['_LISTVALIDATORSREQUEST']._serialized_end=424
+  _globals['_LISTVALIDATORSRESPONSE']._serialized_start=426
+  _globals['_LISTVALIDATORSRESPONSE']._serialized_end=494
+  _globals['_ADDVALIDATORREQUEST']._serialized_start=496
+  _globals['_ADDVALIDATORREQUEST']._serialized_end=551
+  _globals['_ADDVALIDATORRESPONSE']._serialized_start=553
+  _globals['_ADDVALIDATORRESPONSE']._serialized_end=592
+  _globals['_REMOVEVALIDATORREQUEST']._serialized_start=594
+  _globals['_REMOVEVALIDATORREQUEST']._serialized_end=637
+  _globals['_REMOVEVALIDATORRESPONSE']._serialized_start=639
+  _globals['_REMOVEVALIDATORRESPONSE']._serialized_end=681
+  _globals['_ANNOUNCEPEERREQUEST']._serialized_start=683
+  _globals['_ANNOUNCEPEERREQUEST']._serialized_end=721
+  _globals['_ANNOUNCEPEERRESPONSE']._serialized_start=723
+  _globals['_ANNOUNCEPEERRESPONSE']._serialized_end=785
+  _globals['_SYNCVALIDATORUPDATEREQUEST']._serialized_start=788
+  _globals['_SYNCVALIDATORUPDATEREQUEST']._serialized_end=951
+  _globals['_SYNCVALIDATORUPDATEREQUEST_UPDATETYPE']._serialized_start=918
+  _globals['_SYNCVALIDATORUPDATEREQUEST_UPDATETYPE']._serialized_end=951
+  _globals['_SYNCVALIDATORUPDATERESPONSE']._serialized_start=953
+  _globals['_SYNCVALIDATORUPDATERESPONSE']._serialized_end=999
+  _globals['_MEMBERUPDATE']._serialized_start=1002
+  _globals['_MEMBERUPDATE']._serialized_end=1187
+  _globals['_MEMBERUPDATE_STATUS']._serialized_start=1145
+  _globals['_MEMBERUPDATE_STATUS']._serialized_end=1187
+  _globals['_NODECAPABILITIES']._serialized_start=1190
+  _globals['_NODECAPABILITIES']._serialized_end=1339
+  _globals['_GOSSIPPEERSREQUEST']._serialized_start=1341
+  _globals['_GOSSIPPEERSREQUEST']._serialized_end=1457
+  _globals['_GOSSIPPEERSRESPONSE']._serialized_start=1459
+  _globals['_GOSSIPPEERSRESPONSE']._serialized_end=1577
+  _globals['_ANNOUNCEBLOCKREQUEST']._serialized_start=1579
+  _globals['_ANNOUNCEBLOCKREQUEST']._serialized_end=1655
+  _globals['_ANNOUNCEBLOCKRESPONSE']._serialized_start=1657
+  _globals['_ANNOUNCEBLOCKRESPONSE']._serialized_end=1697
+  _globals['_GETCHAINREQUEST']._serialized_start=1699
+  _globals['_GETCHAINREQUEST']._serialized_end=1716
+  _globals['_GETCHAINRESPONSE']._serialized_start=1718
+  _globals['_GETCHAINRESPONSE']._serialized_end=1772
+  _globals['_SUBMITTRANSACTIONRESPONSE']._serialized_start=1774
+  _globals['_SUBMITTRANSACTIONRESPONSE']._serialized_end=1842
+  _globals['_ANNOUNCETRANSACTIONRESPONSE']._serialized_start=1844
+  _globals['_ANNOUNCETRANSACTIONRESPONSE']._serialized_end=1890
+  _globals['_NODE']._serialized_start=1893
+  _globals['_NODE']._serialized_end=2730
 # @@protoc_insertion_point(module_scope)
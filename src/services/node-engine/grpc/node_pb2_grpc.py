@@ -1,11 +1,31 @@
 # Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
 """Client and server classes corresponding to protobuf-defined services."""
 import grpc
+import warnings
 
 from . import node_pb2 as node__pb2
 
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
 
-class NodeStub(object):
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in node_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class NodeStub:
     """The Node service definition.
     """
 
@@ -15,44 +35,289 @@ class NodeStub(object):
         Args:
             channel: A grpc.Channel.
         """
+        self.GetStatus = channel.unary_unary(
+                '/node.Node/GetStatus',
+                request_serializer=node__pb2.StatusRequest.SerializeToString,
+                response_deserializer=node__pb2.StatusReply.FromString,
+                _registered_method=True)
+        self.ListValidators = channel.unary_unary(
+                '/node.Node/ListValidators',
+                request_serializer=node__pb2.ListValidatorsRequest.SerializeToString,
+                response_deserializer=node__pb2.ListValidatorsResponse.FromString,
+                _registered_method=True)
+        self.AddValidator = channel.unary_unary(
+                '/node.Node/AddValidator',
+                request_serializer=node__pb2.AddValidatorRequest.SerializeToString,
+                response_deserializer=node__pb2.AddValidatorResponse.FromString,
+                _registered_method=True)
+        self.RemoveValidator = channel.unary_unary(
+                '/node.Node/RemoveValidator',
+                request_serializer=node__pb2.RemoveValidatorRequest.SerializeToString,
+                response_deserializer=node__pb2.RemoveValidatorResponse.FromString,
+                _registered_method=True)
         self.AnnouncePeer = channel.unary_unary(
                 '/node.Node/AnnouncePeer',
                 request_serializer=node__pb2.AnnouncePeerRequest.SerializeToString,
                 response_deserializer=node__pb2.AnnouncePeerResponse.FromString,
-                )
+                _registered_method=True)
+        self.SyncValidatorUpdate = channel.unary_unary(
+                '/node.Node/SyncValidatorUpdate',
+                request_serializer=node__pb2.SyncValidatorUpdateRequest.SerializeToString,
+                response_deserializer=node__pb2.SyncValidatorUpdateResponse.FromString,
+                _registered_method=True)
+        self.GossipPeers = channel.unary_unary(
+                '/node.Node/GossipPeers',
+                request_serializer=node__pb2.GossipPeersRequest.SerializeToString,
+                response_deserializer=node__pb2.GossipPeersResponse.FromString,
+                _registered_method=True)
+        self.AnnounceBlock = channel.unary_unary(
+                '/node.Node/AnnounceBlock',
+                request_serializer=node__pb2.AnnounceBlockRequest.SerializeToString,
+                response_deserializer=node__pb2.AnnounceBlockResponse.FromString,
+                _registered_method=True)
+        self.GetChain = channel.unary_unary(
+                '/node.Node/GetChain',
+                request_serializer=node__pb2.GetChainRequest.SerializeToString,
+                response_deserializer=node__pb2.GetChainResponse.FromString,
+                _registered_method=True)
+        self.SubmitTransaction = channel.unary_unary(
+                '/node.Node/SubmitTransaction',
+                request_serializer=node__pb2.TransactionMessage.SerializeToString,
+                response_deserializer=node__pb2.SubmitTransactionResponse.FromString,
+                _registered_method=True)
+        self.AnnounceTransaction = channel.unary_unary(
+                '/node.Node/AnnounceTransaction',
+                request_serializer=node__pb2.TransactionMessage.SerializeToString,
+                response_deserializer=node__pb2.AnnounceTransactionResponse.FromString,
+                _registered_method=True)
 
 
-class NodeServicer(object):
+class NodeServicer:
     """The Node service definition.
     """
 
+    def GetStatus(self, request, context):
+        """... (other RPCs are unchanged)
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListValidators(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AddValidator(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RemoveValidator(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def AnnouncePeer(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SyncValidatorUpdate(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GossipPeers(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AnnounceBlock(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetChain(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SubmitTransaction(self, request, context):
+        """Submit a new, signed transaction to the network.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AnnounceTransaction(self, request, context):
+        """Announce a new transaction to a peer.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_NodeServicer_to_server(servicer, server):
     rpc_method_handlers = {
+            'GetStatus': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetStatus,
+                    request_deserializer=node__pb2.StatusRequest.FromString,
+                    response_serializer=node__pb2.StatusReply.SerializeToString,
+            ),
+            'ListValidators': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListValidators,
+                    request_deserializer=node__pb2.ListValidatorsRequest.FromString,
+                    response_serializer=node__pb2.ListValidatorsResponse.SerializeToString,
+            ),
+            'AddValidator': grpc.unary_unary_rpc_method_handler(
+                    servicer.AddValidator,
+                    request_deserializer=node__pb2.AddValidatorRequest.FromString,
+                    response_serializer=node__pb2.AddValidatorResponse.SerializeToString,
+            ),
+            'RemoveValidator': grpc.unary_unary_rpc_method_handler(
+                    servicer.RemoveValidator,
+                    request_deserializer=node__pb2.RemoveValidatorRequest.FromString,
+                    response_serializer=node__pb2.RemoveValidatorResponse.SerializeToString,
+            ),
             'AnnouncePeer': grpc.unary_unary_rpc_method_handler(
                     servicer.AnnouncePeer,
                     request_deserializer=node__pb2.AnnouncePeerRequest.FromString,
                     response_serializer=node__pb2.AnnouncePeerResponse.SerializeToString,
             ),
+            'SyncValidatorUpdate': grpc.unary_unary_rpc_method_handler(
+                    servicer.SyncValidatorUpdate,
+                    request_deserializer=node__pb2.SyncValidatorUpdateRequest.FromString,
+                    response_serializer=node__pb2.SyncValidatorUpdateResponse.SerializeToString,
+            ),
+            'GossipPeers': grpc.unary_unary_rpc_method_handler(
+                    servicer.GossipPeers,
+                    request_deserializer=node__pb2.GossipPeersRequest.FromString,
+                    response_serializer=node__pb2.GossipPeersResponse.SerializeToString,
+            ),
+            'AnnounceBlock': grpc.unary_unary_rpc_method_handler(
+                    servicer.AnnounceBlock,
+                    request_deserializer=node__pb2.AnnounceBlockRequest.FromString,
+                    response_serializer=node__pb2.AnnounceBlockResponse.SerializeToString,
+            ),
+            'GetChain': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetChain,
+                    request_deserializer=node__pb2.GetChainRequest.FromString,
+                    response_serializer=node__pb2.GetChainResponse.SerializeToString,
+            ),
+            'SubmitTransaction': grpc.unary_unary_rpc_method_handler(
+                    servicer.SubmitTransaction,
+                    request_deserializer=node__pb2.TransactionMessage.FromString,
+                    response_serializer=node__pb2.SubmitTransactionResponse.SerializeToString,
+            ),
+            'AnnounceTransaction': grpc.unary_unary_rpc_method_handler(
+                    servicer.AnnounceTransaction,
+                    request_deserializer=node__pb2.TransactionMessage.FromString,
+                    response_serializer=node__pb2.AnnounceTransactionResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'node.Node', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('node.Node', rpc_method_handlers)
 
 
  # This class is part of an EXPERIMENTAL API.
-class Node(object):
+class Node:
     """The Node service definition.
     """
 
     @staticmethod
-    def AnnouncePeer(request, 
+    def GetStatus(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/GetStatus',
+            node__pb2.StatusRequest.SerializeToString,
+            node__pb2.StatusReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ListValidators(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/ListValidators',
+            node__pb2.ListValidatorsRequest.SerializeToString,
+            node__pb2.ListValidatorsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AddValidator(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/AddValidator',
+            node__pb2.AddValidatorRequest.SerializeToString,
+            node__pb2.AddValidatorResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RemoveValidator(request,
             target,
             options=(),
             channel_credentials=None,
@@ -62,8 +327,207 @@ class Node(object):
             wait_for_ready=None,
             timeout=None,
             metadata=None):
-        return grpc.experimental.unary_unary(request, target, '/node.Node/AnnouncePeer',
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/RemoveValidator',
+            node__pb2.RemoveValidatorRequest.SerializeToString,
+            node__pb2.RemoveValidatorResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AnnouncePeer(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/AnnouncePeer',
             node__pb2.AnnouncePeerRequest.SerializeToString,
             node__pb2.AnnouncePeerResponse.FromString,
-            options, channel_credentials,
-            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SyncValidatorUpdate(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/SyncValidatorUpdate',
+            node__pb2.SyncValidatorUpdateRequest.SerializeToString,
+            node__pb2.SyncValidatorUpdateResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GossipPeers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/GossipPeers',
+            node__pb2.GossipPeersRequest.SerializeToString,
+            node__pb2.GossipPeersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AnnounceBlock(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/AnnounceBlock',
+            node__pb2.AnnounceBlockRequest.SerializeToString,
+            node__pb2.AnnounceBlockResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetChain(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/GetChain',
+            node__pb2.GetChainRequest.SerializeToString,
+            node__pb2.GetChainResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SubmitTransaction(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/SubmitTransaction',
+            node__pb2.TransactionMessage.SerializeToString,
+            node__pb2.SubmitTransactionResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AnnounceTransaction(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node.Node/AnnounceTransaction',
+            node__pb2.TransactionMessage.SerializeToString,
+            node__pb2.AnnounceTransactionResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -1,17 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+gRPC peer mesh, served with `grpc.aio` on the FastAPI event loop.
 
-import grpc
-from concurrent import futures
-import time
+Each known peer gets one persistent channel, reused by every probe and RPC
+to it. Membership and failure detection use SWIM gossip over `GossipPeers`
+(see gossip.py), which also spreads each node's capability record.
+
+With `GOSSIP_ENABLED=false`, the node falls back to probing every peer
+instead. A `PeerProber` gives each peer its own probe schedule. The first
+probe happens at a random point within the interval, and later intervals
+are jittered by `PEER_PROBE_JITTER`, so probes do not go out in bursts. At
+most `PEER_PROBE_CONCURRENCY` probes run at once. A peer that fails
+`PEER_PROBE_MAX_FAILURES` probes in a row is removed and its channel closed.
+"""
+import asyncio
+import os
+import random
 import threading
+from typing import Awaitable, Callable, Dict, Optional
+
+import grpc
 
 # Import the generated gRPC files
 from . import node_pb2
 from . import node_pb2_grpc
 
 # Import the gRPC health checking library
-from grpc_health.v1 import health
 from grpc_health.v1 import health_pb2
 from grpc_health.v1 import health_pb2_grpc
+from grpc_health.v1.health import aio as health_aio
+
+from .gossip import (
+    DEAD, ALIVE, GossipMessage, GrpcGossipTransport, Membership, SwimNode, Update,
+    reply_to_proto, updates_from_proto,
+)
+from ..capabilities import Capabilities, CapabilityPublisher
+from ..metrics import PEER_PROBES
+
+# --- Configuration ---
+GRPC_PORT = os.getenv("GRPC_PORT", "50051")
+GOSSIP_ENABLED = os.getenv("GOSSIP_ENABLED", "true").lower() == "true"
+PEER_PROBE_INTERVAL_SECONDS = float(os.getenv("PEER_PROBE_INTERVAL_SECONDS", "30"))
+PEER_PROBE_JITTER = float(os.getenv("PEER_PROBE_JITTER", "0.2"))  # +/- fraction of the interval
+PEER_PROBE_TIMEOUT_SECONDS = float(os.getenv("PEER_PROBE_TIMEOUT_SECONDS", "2"))
+PEER_PROBE_CONCURRENCY = int(os.getenv("PEER_PROBE_CONCURRENCY", "32"))
+PEER_PROBE_MAX_FAILURES = int(os.getenv("PEER_PROBE_MAX_FAILURES", "2"))
+
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 60_000),
+    ("grpc.keepalive_timeout_ms", 10_000),
+    ("grpc.keepalive_permit_without_calls", 1),
+]
 
 # --- Global Peer State ---
 # This lock and set are imported by the FastAPI app to share peer state.
@@ -23,7 +63,7 @@ def _add_peers(new_peers):
     """Safely adds multiple new peers to the set."""
     with peers_lock:
         for peer in new_peers:
-            if peer not in peers:
+            if peer and peer not in peers:
                 peers.add(peer)
                 print(f"Discovered new peer: {peer}")
 
@@ -34,39 +74,114 @@ def _remove_peer(peer_address):
             peers.remove(peer_address)
             print(f"Removed unresponsive peer: {peer_address}")
 
-def _probe_peer(peer_address):
-    """Probes a single peer for its health status."""
-    try:
-        with grpc.insecure_channel(peer_address) as channel:
-            health_stub = health_pb2_grpc.HealthStub(channel)
-            response = health_stub.Check(health_pb2.HealthCheckRequest(service=""), timeout=2)
-
-            if response.status != health_pb2.HealthCheckResponse.SERVING:
-                _remove_peer(peer_address)
-    except grpc.RpcError:
-        _remove_peer(peer_address)
-
-def _start_peer_probing():
-    """Starts a background thread to periodically probe all known peers."""
-    def probe_loop():
+
+class PeerChannels:
+    """
+    One long-lived `grpc.aio` channel per peer address.
+    """
+    def __init__(self, options=CHANNEL_OPTIONS):
+        self.options = options
+        self._channels: Dict[str, grpc.aio.Channel] = {}
+
+    def get(self, address: str) -> grpc.aio.Channel:
+        channel = self._channels.get(address)
+        if channel is None:
+            channel = grpc.aio.insecure_channel(address, options=self.options)
+            self._channels[address] = channel
+        return channel
+
+    async def close(self, address: str):
+        channel = self._channels.pop(address, None)
+        if channel is not None:
+            await channel.close()
+
+    async def close_all(self):
+        for address in list(self._channels):
+            await self.close(address)
+
+    def __len__(self):
+        return len(self._channels)
+
+
+class PeerProber:
+    """
+    Health-checks every peer in `peers` on its own jittered schedule.
+    """
+    def __init__(self, channels: PeerChannels, interval: float = PEER_PROBE_INTERVAL_SECONDS,
+                 jitter: float = PEER_PROBE_JITTER, timeout: float = PEER_PROBE_TIMEOUT_SECONDS,
+                 concurrency: int = PEER_PROBE_CONCURRENCY, max_failures: int = PEER_PROBE_MAX_FAILURES,
+                 self_address: Optional[str] = None):
+        self.channels = channels
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.self_address = self_address
+        self._slots = asyncio.Semaphore(concurrency)
+        self._probes: Dict[str, asyncio.Task] = {}
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._supervisor = asyncio.create_task(self._supervise())
+        print("gRPC server started peer health probing.")
+
+    async def stop(self):
+        tasks = [t for t in [self._supervisor, *self._probes.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._probes.clear()
+
+    async def _supervise(self):
+        """Starts a probe loop for each new peer and stops those of removed peers."""
         while True:
             with peers_lock:
-                current_peers = peers.copy()
-            
-            for peer in current_peers:
-                threading.Thread(target=_probe_peer, args=(peer,), daemon=True).start()
-            
-            time.sleep(30) # Probe every 30 seconds
+                current = set(peers)
+            current.discard(self.self_address)
+            for peer in current:
+                task = self._probes.get(peer)
+                # A finished loop means the peer was dropped, then announced again.
+                if task is None or task.done():
+                    self._probes[peer] = asyncio.create_task(self._probe_loop(peer))
+            for peer in self._probes.keys() - current:
+                self._probes.pop(peer).cancel()
+                await self.channels.close(peer)
+            await asyncio.sleep(min(1.0, self.interval))
+
+    async def _probe_loop(self, peer: str):
+        failures = 0
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            if await self.probe(peer):
+                failures = 0
+            else:
+                failures += 1
+                if failures >= self.max_failures:
+                    _remove_peer(peer)
+                    return
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def probe(self, peer: str) -> bool:
+        """Returns True if `peer` reports SERVING."""
+        async with self._slots:
+            try:
+                stub = health_pb2_grpc.HealthStub(self.channels.get(peer))
+                response = await stub.Check(health_pb2.HealthCheckRequest(service=""), timeout=self.timeout)
+                healthy = response.status == health_pb2.HealthCheckResponse.SERVING
+            except grpc.RpcError:
+                healthy = False
+        PEER_PROBES.labels(result="healthy" if healthy else "unhealthy").inc()
+        return healthy
 
-    probing_thread = threading.Thread(target=probe_loop, daemon=True)
-    probing_thread.start()
-    print("gRPC server started peer health probing.")
 
 class NodeServicer(node_pb2_grpc.NodeServicer):
     """
     Implementation of the NodeServicer.
     """
-    def AnnouncePeer(self, request, context):
+    def __init__(self, swim: Optional[SwimNode] = None):
+        self.swim = swim
+
+    async def AnnouncePeer(self, request, context):
         """
         Handles a peer announcement.
         1. Adds the announcer to its peer list.
@@ -74,40 +189,144 @@ class NodeServicer(node_pb2_grpc.NodeServicer):
         """
         peer_address = request.address
         print(f"Received peer announcement from: {peer_address}")
-        
+
         with peers_lock:
             current_peers = list(peers)
             if peer_address not in peers:
                 peers.add(peer_address)
-        
-        return node_pb2.AnnouncePeerResponse(peers=current_peers)
+        if self.swim is not None:
+            self.swim.membership.apply(Update(peer_address, 0, ALIVE))
+
+        return node_pb2.AnnouncePeerResponse(current_peers=current_peers)
 
-def serve():
+    async def GossipPeers(self, request, context):
+        """
+        Handles a SWIM probe, indirect probe or join. A request with only the
+        legacy `peers` list is merged and answered with our full peer list.
+        """
+        if self.swim is None or (request.peers and not request.updates):
+            _add_peers([request.from_address, *request.peers])
+            if self.swim is not None:
+                for address in [request.from_address, *request.peers]:
+                    self.swim.membership.apply(Update(address, 0, ALIVE))
+            with peers_lock:
+                return node_pb2.GossipPeersResponse(known_peers=list(peers))
+
+        message = GossipMessage(request.from_address, updates_from_proto(request.updates), request.probe_target)
+        return reply_to_proto(await self.swim.handle(message))
+
+
+# --- Server Lifecycle ---
+peer_channels = PeerChannels()
+_server: Optional[grpc.aio.Server] = None
+_prober: Optional[PeerProber] = None
+_swim: Optional[SwimNode] = None
+_publisher: Optional[CapabilityPublisher] = None
+_self_address: Optional[str] = None
+
+
+def _on_member_change(address: str, status: int):
+    """Mirrors gossip membership into the shared `peers` set."""
+    if status == DEAD:
+        _remove_peer(address)
+        asyncio.get_running_loop().create_task(peer_channels.close(address))
+    else:
+        _add_peers([address])
+
+
+def _publish_capabilities(record: Capabilities):
+    if _swim is not None:
+        _swim.membership.set_capabilities(record)
+
+
+def peer_capabilities() -> Dict[str, Capabilities]:
+    """Known capability records, this node's included, keyed by gRPC address."""
+    if _swim is not None:
+        return _swim.membership.capabilities_of()
+    if _publisher is not None and _publisher.current is not None:
+        return {_self_address: _publisher.current}
+    return {}
+
+
+async def serve(port: str = GRPC_PORT, self_address: Optional[str] = None,
+                capabilities: Optional[Callable[[], Awaitable[Capabilities]]] = None) -> grpc.aio.Server:
     """
-    Starts the gRPC server, enables health checking, and starts peer probing.
+    Starts the gRPC server on the running event loop, enables health
+    checking, and starts peer probing. With `capabilities`, this node's
+    record is collected periodically and published to the mesh.
     """
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    node_pb2_grpc.add_NodeServicer_to_server(NodeServicer(), server)
+    global _server, _prober, _swim, _publisher, _self_address
+    _self_address = self_address or f"localhost:{port}"
+    if GOSSIP_ENABLED:
+        membership = Membership(_self_address, on_change=_on_member_change)
+        _swim = SwimNode(membership, GrpcGossipTransport(peer_channels))
+    server = grpc.aio.server()
+    node_pb2_grpc.add_NodeServicer_to_server(NodeServicer(_swim), server)
 
     # Setup and enable the gRPC Health Checking Protocol.
-    health_servicer = health.HealthServicer()
+    health_servicer = health_aio.HealthServicer()
     health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
-    health_servicer.set("", health_pb2.HealthCheckResponse.SERVING)
-    health_servicer.set(node_pb2.DESCRIPTOR.services_by_name['Node'].full_name, health_pb2.HealthCheckResponse.SERVING)
-    
+    await health_servicer.set("", health_pb2.HealthCheckResponse.SERVING)
+    await health_servicer.set(node_pb2.DESCRIPTOR.services_by_name['Node'].full_name,
+                              health_pb2.HealthCheckResponse.SERVING)
+
     # Start the server.
-    server.add_insecure_port('[::]:50051')
-    server.start()
-    print("gRPC server started on port 50051.")
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f"gRPC server started on port {port}.")
 
     # Start background tasks.
-    _start_peer_probing()
+    if _swim is not None:
+        _swim.start()
+        print("gRPC server started SWIM gossip.")
+    else:
+        _prober = PeerProber(peer_channels, self_address=self_address)
+        _prober.start()
+    if capabilities is not None:
+        _publisher = CapabilityPublisher(capabilities, _publish_capabilities)
+        _publisher.start()
+    _server = server
+    return server
+
+
+async def join(seeds) -> int:
+    """
+    Joins the gossip mesh through every seed at once. Returns how many seeds
+    answered (0 when gossip is disabled).
+    """
+    if _swim is None:
+        return 0
+    return await _swim.join(seeds)
+
+
+async def shutdown(grace: float = 1.0):
+    """Stops probing, closes the peer channels and stops the server."""
+    global _server, _prober, _swim, _publisher
+    if _publisher is not None:
+        await _publisher.stop()
+        _publisher = None
+    if _swim is not None:
+        await _swim.stop()
+        _swim = None
+    if _prober is not None:
+        await _prober.stop()
+        _prober = None
+    await peer_channels.close_all()
+    if _server is not None:
+        await _server.stop(grace)
+        _server = None
 
+
+async def _serve_forever():
+    server = await serve()
     try:
-        server.wait_for_termination()
-    except KeyboardInterrupt:
-        print("Shutting down gRPC server.")
-        server.stop(0)
+        await server.wait_for_termination()
+    finally:
+        await shutdown()
+
 
 if __name__ == '__main__':
-    serve()
+    try:
+        asyncio.run(_serve_forever())
+    except KeyboardInterrupt:
+        print("Shutting down gRPC server.")
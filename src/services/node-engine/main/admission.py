@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Admission control and per-tenant rate limiting for the generation endpoints.
+
+Each request passes one Lua script, so the check is a single Redis round
+trip, shared by every uvicorn worker and every node on the same Redis:
+
+1. If the requested model's queue already holds `ADMISSION_MAX_QUEUE_DEPTH`
+   tasks, at any priority, the request is rejected. It would only add to
+   everyone's wait.
+2. Otherwise a token is taken from the bucket of the request's `address`
+   and, if the client sent an `X-API-Key`, from the bucket of that key. Both
+   are taken or neither is. A bucket refills at its rate and holds at most
+   its burst. Time comes from the Redis server, so the clocks of the API
+   processes do not matter.
+
+A rejection carries a Retry-After. For a bucket it is the time until a token
+is available again; for a full queue it is `ADMISSION_RETRY_AFTER_SECONDS`.
+If Redis is unreachable, requests are let through: the limiter protects the
+queue, and does not decide who may use the node.
+"""
+import hashlib
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from ..metrics import ADMISSION_CHECK_SECONDS, ADMISSION_REJECTIONS
+from ..routing import queue_keys
+
+# --- Configuration ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Sustained requests per second and burst size per address and per API key; a rate of 0 disables that limit.
+RATE_LIMIT_ADDRESS_PER_SECOND = float(os.getenv("RATE_LIMIT_ADDRESS_PER_SECOND", "2"))
+RATE_LIMIT_ADDRESS_BURST = float(os.getenv("RATE_LIMIT_ADDRESS_BURST", "20"))
+RATE_LIMIT_API_KEY_PER_SECOND = float(os.getenv("RATE_LIMIT_API_KEY_PER_SECOND", "20"))
+RATE_LIMIT_API_KEY_BURST = float(os.getenv("RATE_LIMIT_API_KEY_BURST", "100"))
+# Tasks waiting in one model's queue beyond which new requests are turned away; 0 disables.
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "1000"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+
+BUCKET_KEY = "deai:ratelimit:{kind}:{subject}"
+
+# KEYS[1..ARGV[2]] = the model queue's priority lists, then the buckets
+# ARGV[1] = max queue depth (0 = unbounded), ARGV[2] = number of queue lists,
+# then per bucket: rate per second, burst
+# Returns {1, 0, 0} when admitted, {0, 0, 0} when the queue is full,
+# or {0, index of the limiting bucket, retry after in ms}.
+_ADMIT_SCRIPT = """
+local max_depth = tonumber(ARGV[1])
+local queues = tonumber(ARGV[2])
+if max_depth > 0 then
+    local depth = 0
+    for i = 1, queues do
+        depth = depth + redis.call('LLEN', KEYS[i])
+    end
+    if depth >= max_depth then
+        return {0, 0, 0}
+    end
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+local levels = {}
+for b = 1, #KEYS - queues do
+    local rate = tonumber(ARGV[1 + 2 * b]) / 1000
+    local burst = tonumber(ARGV[2 + 2 * b])
+    local state = redis.call('HMGET', KEYS[queues + b], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    tokens = math.min(burst, tokens + elapsed * rate)
+    if tokens < 1 then
+        return {0, b, math.ceil((1 - tokens) / rate)}
+    end
+    levels[b] = tokens
+end
+for b = 1, #KEYS - queues do
+    local rate = tonumber(ARGV[1 + 2 * b]) / 1000
+    local burst = tonumber(ARGV[2 + 2 * b])
+    redis.call('HSET', KEYS[queues + b], 'tokens', levels[b] - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[queues + b], math.ceil(burst / rate) + 1000)
+end
+return {1, 0, 0}
+"""
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    reason: str = ""  # "queue", "address" or "api_key" when rejected
+    retry_after: int = 0  # seconds
+
+    @property
+    def detail(self) -> str:
+        if self.reason == "queue":
+            return "The model's queue is full. Please retry later."
+        return f"Rate limit exceeded for this {self.reason.replace('_', ' ')}."
+
+
+def _subject(value: str) -> str:
+    # API keys are secrets; only a digest ends up in Redis.
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+
+class RateLimiter:
+    """Token buckets per address and per API key, plus the queue depth check."""
+    def __init__(self, client=None,
+                 address_rate: float = RATE_LIMIT_ADDRESS_PER_SECOND,
+                 address_burst: float = RATE_LIMIT_ADDRESS_BURST,
+                 api_key_rate: float = RATE_LIMIT_API_KEY_PER_SECOND,
+                 api_key_burst: float = RATE_LIMIT_API_KEY_BURST,
+                 max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+                 queue_retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self._client = client
+        self._script = None
+        self.limits = {"address": (address_rate, address_burst), "api_key": (api_key_rate, api_key_burst)}
+        self.max_queue_depth = max_queue_depth
+        self.queue_retry_after = queue_retry_after
+
+    def _admit_script(self):
+        if self._script is None:
+            if self._client is None:
+                from ..redis_client import get_async_redis
+                self._client = get_async_redis()
+            self._script = self._client.register_script(_ADMIT_SCRIPT)
+        return self._script
+
+    async def check(self, model: str, address: str, api_key: Optional[str] = None) -> Decision:
+        """Admits the request, consuming one token from each of its buckets, or says why not."""
+        queues = queue_keys(model)
+        kinds, keys, args = [], list(queues), [self.max_queue_depth, len(queues)]
+        for kind, subject in (("address", address.lower()), ("api_key", api_key)):
+            rate, burst = self.limits[kind]
+            if subject and rate > 0:
+                kinds.append(kind)
+                keys.append(BUCKET_KEY.format(kind=kind, subject=_subject(subject)))
+                args.extend([rate, max(burst, 1)])
+
+        with ADMISSION_CHECK_SECONDS.time():
+            allowed, index, retry_ms = await self._admit_script()(keys=keys, args=args)
+        if allowed:
+            return Decision(True)
+        if index == 0:
+            decision = Decision(False, "queue", self.queue_retry_after)
+        else:
+            decision = Decision(False, kinds[index - 1], max(1, math.ceil(int(retry_ms) / 1000)))
+        ADMISSION_REJECTIONS.labels(reason=decision.reason).inc()
+        return decision
+
+
+rate_limiter = RateLimiter()
+
+
+async def admit(model: str, address: str, api_key: Optional[str] = None) -> Decision:
+    """Checks a request against the process-wide limiter; lets it through if Redis fails."""
+    if not RATE_LIMIT_ENABLED:
+        return Decision(True)
+    try:
+        return await rate_limiter.check(model, address, api_key)
+    except Exception as e:
+        print(f"Admission check failed; admitting the request: {e}")
+        return Decision(True)
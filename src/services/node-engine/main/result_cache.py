@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of deterministic generation results.
+
+A request is deterministic when it decodes greedily (`temperature == 0`) or
+samples with a fixed seed. Its result is stored under a hash of
+(model, model revision, prompt, generation parameters). The API looks the
+hash up before dispatching, so a hit needs neither a queue hop nor a worker.
+Workers fill the cache after a successful generation.
+
+Entries expire after `RESULT_CACHE_TTL_SECONDS`. Their total size is capped
+at `RESULT_CACHE_MAX_BYTES`, and the oldest entries are dropped first once
+the cap is reached.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from ..metrics import RESULT_CACHE_REQUESTS, RESULT_CACHE_BYTES_SAVED
+
+# --- Configuration ---
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+ENTRY_KEY_PREFIX = "deai:result:"
+INDEX_KEY = "deai:result-index"     # sorted set: entry key -> insertion time
+SIZES_KEY = "deai:result-sizes"     # hash: entry key -> stored bytes
+TOTAL_KEY = "deai:result-bytes"     # total bytes of indexed entries
+
+# KEYS[1] = entry, KEYS[2] = index, KEYS[3] = sizes, KEYS[4] = total
+# ARGV = value, ttl seconds, now, max total bytes
+_STORE_SCRIPT = """
+local size = string.len(ARGV[1])
+local previous = tonumber(redis.call('HGET', KEYS[3], KEYS[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('HSET', KEYS[3], KEYS[1], size)
+local total = redis.call('INCRBY', KEYS[4], size - previous)
+local max_total = tonumber(ARGV[4])
+while total > max_total do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then break end
+    local evicted = tonumber(redis.call('HGET', KEYS[3], oldest[1]) or '0')
+    redis.call('HDEL', KEYS[3], oldest[1])
+    -- Entries that already expired still count until they are popped here.
+    redis.call('DEL', oldest[1])
+    total = redis.call('INCRBY', KEYS[4], -evicted)
+end
+return total
+"""
+
+
+def is_deterministic(temperature: Optional[float], seed: Optional[int]) -> bool:
+    return not temperature or seed is not None
+
+
+def cache_key(model: str, revision: str, prompt: str, temperature: Optional[float],
+              max_new_tokens: int, seed: Optional[int]) -> Optional[str]:
+    """Returns the entry key for a request, or None if its output is not reproducible."""
+    if not RESULT_CACHE_ENABLED or not is_deterministic(temperature, seed):
+        return None
+    params = {
+        "model": model.lower(),
+        "revision": revision,
+        "prompt": prompt,
+        "temperature": float(temperature or 0.0),
+        "max_new_tokens": int(max_new_tokens),
+        # Greedy output does not depend on the seed.
+        "seed": seed if temperature else None,
+    }
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{ENTRY_KEY_PREFIX}{digest}"
+
+
+async def lookup(key: str, client=None) -> Optional[dict]:
+    """Returns the cached task result for `key`, recording a hit or a miss."""
+    if client is None:
+        from ..redis_client import get_async_redis
+        client = get_async_redis()
+    raw = await client.get(key)
+    if raw is None:
+        RESULT_CACHE_REQUESTS.labels(result="miss").inc()
+        return None
+    RESULT_CACHE_REQUESTS.labels(result="hit").inc()
+    RESULT_CACHE_BYTES_SAVED.inc(len(raw.encode("utf-8")))
+    return json.loads(raw)
+
+
+def store(key: str, result: dict, client=None) -> bool:
+    """Caches a successful task result. Returns False if it is too large to keep."""
+    if client is None:
+        from ..redis_client import get_redis
+        client = get_redis()
+    value = json.dumps(result)
+    if len(value.encode("utf-8")) > RESULT_CACHE_MAX_ENTRY_BYTES:
+        return False
+    client.register_script(_STORE_SCRIPT)(
+        keys=[key, INDEX_KEY, SIZES_KEY, TOTAL_KEY],
+        args=[value, RESULT_CACHE_TTL_SECONDS, time.time(), RESULT_CACHE_MAX_BYTES],
+    )
+    return True
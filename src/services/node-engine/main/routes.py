@@ -1,23 +1,39 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import json
 import asyncio
-from fastapi import APIRouter, Response, status, HTTPException, Request, Depends
-from pydantic import BaseModel
-from typing import Optional, Dict
+import uuid
+from fastapi import APIRouter, Response, status, HTTPException, Request, Depends, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Literal, Optional, Dict, Union
+from celery import states
 from celery.result import AsyncResult
 
 # --- Refactored Imports ---
 # Import the dependency injector and the service class for type hinting
 from ..dependencies import get_onchain_service
 from ..onchain.service import OnChainService
+from ..onchain.async_service import AsyncOnChainService
 
 # Import tasks and celery app
 from ..tasks import (
     celery_app,
     generate_text_task,
-    get_all_model_costs,
+    get_all_model_prices,
+    get_model_price,
+    get_model_revision,
+    meter,
 )
+from ..metering import Usage
+from ..cancellation import StreamReaders, remember_task, request_cancel, was_issued
+from ..routing import model_queue, model_workers, TASK_PRIORITIES, WORKER_ADVERT_TTL_SECONDS
+from ..tracing import tracer, inject, parse_traceparent
+from .token_stream import read_token_stream, format_sse, TOKEN, END, STREAM_IDLE_TIMEOUT_SECONDS
+from .task_events import TaskEventHub, TERMINAL_STATES, task_status_payload
+from . import result_cache
+from .admission import admit
 
 # --- Pydantic Models ---
 class GenerateRequest(BaseModel):
@@ -26,6 +42,12 @@ class GenerateRequest(BaseModel):
     model: Optional[str] = "gemma"
     temperature: Optional[float] = 0.7
     max_new_tokens: Optional[int] = 150
+    # Samples reproducibly; with temperature 0 (greedy) the output is deterministic anyway.
+    seed: Optional[int] = None
+    # Interactive tasks are taken from the model's queue before normal ones, and those before bulk.
+    priority: Literal["interactive", "normal", "bulk"] = "normal"
+    # Seconds the result stays useful; a task no worker has started by then is dropped.
+    deadline_seconds: Optional[float] = None
 
 class GenerateResponse(BaseModel):
     task_id: str
@@ -39,18 +61,27 @@ class TaskStatusResponse(BaseModel):
 # --- Router Setup ---
 router = APIRouter(prefix="/api/gateway")
 
+# One Redis subscription per process, shared by every waiting client.
+task_event_hub = TaskEventHub(celery_app)
+# Cancels a streamed task once its last reader has gone (see cancellation.py).
+stream_readers = StreamReaders()
+
+# --- Constants ---
+EVENTS_MAX_WAIT_SECONDS = 60
+SSE_KEEPALIVE_SECONDS = 15
+
 # --- Health & Info Endpoints ---
 
 @router.get("/models")
 def get_models():
     """
-    Returns the list of available models and their costs.
+    Returns the list of available models and their prices per 1,000 prompt
+    and completion tokens.
     """
-    model_costs = get_all_model_costs()
-    if not model_costs:
+    model_prices = get_all_model_prices()
+    if not model_prices:
         raise HTTPException(status_code=503, detail="Models are not loaded yet. Please try again.")
-    # Align with test expectations and best practices (string costs)
-    return [{"name": name, "cost": str(cost)} for name, cost in model_costs.items()]
+    return [{"name": name, **price.to_dict()} for name, price in model_prices.items()]
 
 @router.get("/operator-address")
 def get_operator_address():
@@ -62,44 +93,220 @@ def get_operator_address():
         raise HTTPException(status_code=500, detail="OPERATOR_ADDRESS environment variable not set.")
     return {"address": operator_address}
 
+# --- Shared Helpers ---
+
+async def _verify_payment(request: GenerateRequest, onchain_svc: Union[AsyncOnChainService, OnChainService]):
+    """
+    Verifies the user has enough token allowance on-chain for the most the
+    request can cost: its estimated prompt plus `max_new_tokens` of completion.
+    What it actually consumed is billed after it finishes (see metering.py).
+
+    Raises:
+        HTTPException: 400 Bad Request if the model is unknown.
+        HTTPException: 402 Payment Required if verification fails.
+    """
+    price = get_model_price(request.model)
+    if price is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown model '{request.model}'.")
+    amount_usd = price.quote(request.prompt, request.max_new_tokens)
+    if asyncio.iscoroutinefunction(onchain_svc.verify_payment):
+        is_verified, message = await onchain_svc.verify_payment(request.address, amount_usd)
+    else:
+        # Run in an executor to avoid blocking the asyncio event loop during the RPC call.
+        loop = asyncio.get_running_loop()
+        is_verified, message = await loop.run_in_executor(
+            None,
+            onchain_svc.verify_payment,
+            request.address,
+            amount_usd
+        )
+
+    if not is_verified:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Payment verification failed: {message}"
+        )
+
+async def _admit(request: GenerateRequest, api_key: Optional[str] = None):
+    """
+    Applies the per-address and per-API-key rate limits and the model's queue
+    depth limit (see admission.py).
+
+    Raises:
+        HTTPException: 429 Too Many Requests, with a Retry-After, if the request is turned away.
+    """
+    decision = await admit(request.model, request.address, api_key)
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=decision.detail,
+            headers={"Retry-After": str(decision.retry_after)}
+        )
+
+async def _ensure_model_served(request: GenerateRequest):
+    """
+    Checks the workers' advertisements in Redis before anything is queued.
+
+    Raises:
+        HTTPException: 503 Service Unavailable if no live worker serves the model.
+    """
+    serving, _ = await model_workers(request.model)
+    if not serving:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"No worker is currently serving model '{request.model}'.",
+            headers={"Retry-After": str(int(WORKER_ADVERT_TTL_SECONDS))}
+        )
+
+async def _cached_result(request: GenerateRequest):
+    """
+    Looks a deterministic request up in the result cache.
+
+    Returns:
+        `(cache_key, result)`. The key is None if the request is not cacheable,
+        and the result is None on a miss.
+    """
+    revision = get_model_revision(request.model) or request.model
+    key = result_cache.cache_key(request.model, revision, request.prompt, request.temperature,
+                                 request.max_new_tokens, request.seed)
+    if key is None:
+        return None, None
+    try:
+        cached = await result_cache.lookup(key)
+    except Exception as e:
+        # The cache is an optimization; fall back to generating.
+        print(f"Result cache lookup failed: {e}")
+        return key, None
+    if cached is not None and "usage" not in cached:
+        # Cached before token counts were kept, so it cannot be billed; generate it again.
+        return key, None
+    return key, cached
+
+async def _complete_from_cache(request: GenerateRequest, cached: dict) -> str:
+    """
+    Bills a cached result to the requester, for the tokens its generation
+    consumed, and records it under a new task ID, so the status, events and
+    stream endpoints serve it like any finished task.
+    """
+    tokens = cached["usage"]
+    price = get_model_price(request.model)
+    cost = price.cost(tokens["prompt_tokens"], tokens["completion_tokens"]) if price else 0.0
+    usage = Usage(request.address, request.model.lower(), tokens["prompt_tokens"], tokens["completion_tokens"], cost)
+    meter.record(usage)
+    result = {**cached, "usage": usage.to_dict()}
+
+    task_id = str(uuid.uuid4())
+    # The result backend client is synchronous; keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, celery_app.backend.store_result, task_id, result, states.SUCCESS)
+    return task_id
+
+async def _dispatch_generation(request: GenerateRequest, stream: bool = False, cache_key: Optional[str] = None):
+    """
+    Sends the generation task to the queue of the requested model, carrying
+    the current trace context in its headers. The task expires at the
+    request's deadline; a stream without one expires when its reader would
+    give up waiting for the first token. Its ID is remembered first, so it
+    can be cancelled while still queued.
+    """
+    deadline = request.deadline_seconds
+    if deadline is None and stream:
+        deadline = STREAM_IDLE_TIMEOUT_SECONDS
+    task_id = str(uuid.uuid4())
+    await remember_task(task_id)
+    # Taken here: the trace context does not follow the call into the executor.
+    headers = inject({})
+    # Publishing to the broker blocks; keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: generate_text_task.apply_async(
+        task_id=task_id,
+        kwargs={
+            "prompt": request.prompt,
+            "model_name": request.model,
+            "temperature": request.temperature,
+            "max_new_tokens": request.max_new_tokens,
+            "stream": stream,
+            "seed": request.seed,
+            "cache_key": cache_key,
+            "user": request.address,
+        },
+        queue=model_queue(request.model),
+        priority=TASK_PRIORITIES[request.priority],
+        expires=deadline,
+        headers=headers
+    ))
+
+async def _sse_token_events(task_id: str, last_event_id: str = "0-0"):
+    """
+    Turns a task's token stream into Server-Sent Events. A client that
+    disconnects before the end leaves the task to be cancelled, unless it
+    re-attaches in time.
+    """
+    yield format_sse(json.dumps({"task_id": task_id}), event="task")
+    await stream_readers.attach(task_id)
+    finished = False
+    try:
+        async for entry_id, entry_type, data in read_token_stream(task_id, last_event_id):
+            if entry_type == TOKEN:
+                yield format_sse(data, event_id=entry_id)
+            elif entry_type == END:
+                yield format_sse(json.dumps({"status": data}), event="end", event_id=entry_id)
+            else:
+                yield format_sse(json.dumps({"error": data}), event="error", event_id=entry_id)
+        finished = True
+    except TimeoutError as e:
+        yield format_sse(json.dumps({"error": str(e)}), event="error")
+    finally:
+        stream_readers.detach(task_id, finished)
+
+async def _sse_cached_events(task_id: str, result: dict):
+    """Replays a cached result as a token stream with a single piece."""
+    yield format_sse(json.dumps({"task_id": task_id}), event="task")
+    yield format_sse(result.get("output", ""))
+    yield format_sse(json.dumps({"status": states.SUCCESS}), event="end")
+
 # --- Core Inference Endpoint (Refactored) ---
 
 @router.post("/generate", response_model=GenerateResponse)
 async def generate_text(
     request: GenerateRequest,
     http_request: Request,
-    onchain_svc: OnChainService = Depends(get_onchain_service)
+    onchain_svc: Union[AsyncOnChainService, OnChainService] = Depends(get_onchain_service),
+    x_api_key: Optional[str] = Header(None)
 ):
     """
     Accepts a prompt and dispatches a text generation task after verifying
-    the user has sufficient token allowance on-chain.
+    the user has sufficient token allowance on-chain. Requests over the
+    caller's rate limit, or for a model whose queue is full, get a 429.
     """
-    # 1. Verify On-Chain Payment Allowance (asynchronously)
-    # Run in an executor to avoid blocking the asyncio event loop during the RPC call.
-    loop = asyncio.get_running_loop()
-    is_verified, message = await loop.run_in_executor(
-        None,
-        onchain_svc.verify_payment,
-        request.address,
-        request.model
-    )
+    # Continues the caller's trace if it sent a `traceparent` header.
+    parent = parse_traceparent(http_request.headers.get("traceparent"))
+    with tracer.span("api.generate", parent=parent, attributes={"model": request.model}) as span:
+        with tracer.span("api.admission"):
+            await _admit(request, x_api_key)
 
-    if not is_verified:
-        raise HTTPException(
-            status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Payment verification failed: {message}"
-        )
+        # 1. Deterministic requests may already have a cached result
+        with tracer.span("api.cache_lookup"):
+            cache_key, cached = await _cached_result(request)
 
-    # 2. If verification is successful, dispatch the generation task
-    task = generate_text_task.delay(
-        prompt=request.prompt,
-        model_name=request.model,
-        temperature=request.temperature,
-        max_new_tokens=request.max_new_tokens
-    )
+        # 2. Make sure a worker serves the model (unless cached), then verify the on-chain allowance
+        if cached is None:
+            with tracer.span("api.ensure_model_served"):
+                await _ensure_model_served(request)
+        with tracer.span("api.verify_payment"):
+            await _verify_payment(request, onchain_svc)
 
-    status_url = http_request.url_for('get_task_status', task_id=task.id)
-    return GenerateResponse(task_id=task.id, status_url=str(status_url))
+        # 3. If verification is successful, serve the cached result or dispatch the generation task
+        if cached is not None:
+            task_id = await _complete_from_cache(request, cached)
+        else:
+            with tracer.span("api.enqueue"):
+                task_id = (await _dispatch_generation(request, cache_key=cache_key)).id
+        span.set_attribute("task_id", task_id)
+        span.set_attribute("cached", cached is not None)
+
+    status_url = http_request.url_for('get_task_status', task_id=task_id)
+    return GenerateResponse(task_id=task_id, status_url=str(status_url))
 
 @router.get("/tasks/status/{task_id}", response_model=TaskStatusResponse, name="get_task_status")
 def get_task_status(task_id: str):
@@ -108,19 +315,168 @@ def get_task_status(task_id: str):
     (Path changed to be more RESTful)
     """
     task_result = AsyncResult(task_id, app=celery_app)
-    
-    response_data = {
-        "task_id": task_id,
-        "status": task_result.status,
-        "result": None,
-    }
-    
-    if task_result.successful():
-        response_data["result"] = task_result.get()
-    elif task_result.failed():
-        response_data["result"] = {
-            "error": "Task failed.",
-            "details": str(task_result.info) # Celery stores exception info here
-        }
-        
-    return response_data
+    return task_status_payload(task_id, task_result.status, task_result.result)
+
+@router.delete("/tasks/{task_id}", response_model=TaskStatusResponse, status_code=status.HTTP_202_ACCEPTED)
+async def cancel_task(task_id: str):
+    """
+    Cancels a queued or running generation. The worker stops it between
+    decode steps, and the task finishes with a "CANCELLED" result holding
+    the text generated so far, which is all that is billed.
+
+    Raises:
+        HTTPException: 404 Not Found if this API never issued the task.
+        HTTPException: 409 Conflict if the task has already finished.
+    """
+    loop = asyncio.get_running_loop()
+    state = await loop.run_in_executor(None, lambda: AsyncResult(task_id, app=celery_app).state)
+    if state in TERMINAL_STATES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Task {task_id} has already finished.")
+    # Celery reports unknown IDs as PENDING too; only a task the API queued can be waiting.
+    if state == states.PENDING and not await was_issued(task_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task {task_id} not found.")
+    await request_cancel(task_id)
+    return TaskStatusResponse(task_id=task_id, status="CANCELLING")
+
+async def _sse_task_events(task_id: str):
+    """Pushes task state transitions as Server-Sent Events, with keep-alive comments."""
+    events = task_event_hub.subscribe(task_id, heartbeat=SSE_KEEPALIVE_SECONDS)
+    try:
+        async for event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(json.dumps(event), event="status")
+    finally:
+        await events.aclose()
+
+@router.get("/tasks/{task_id}/events", response_model=TaskStatusResponse)
+async def get_task_events(
+    task_id: str,
+    request: Request,
+    since: Optional[str] = None,
+    timeout: float = 30
+):
+    """
+    Pushes task state transitions (PENDING -> PROGRESS -> SUCCESS/FAILURE)
+    instead of making clients poll `/tasks/status/{task_id}`.
+
+    - With `Accept: text/event-stream`, streams one `status` event per
+      transition and closes after the terminal state.
+    - Otherwise long-polls: returns as soon as the state differs from `since`
+      (or is terminal), or the latest state after `timeout` seconds.
+    """
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _sse_task_events(task_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    latest = None
+    events = task_event_hub.subscribe(task_id, timeout=min(max(timeout, 0), EVENTS_MAX_WAIT_SECONDS))
+    try:
+        async for event in events:
+            latest = event
+            if event["status"] != since or event["status"] in TERMINAL_STATES:
+                break
+    finally:
+        await events.aclose()
+    return latest
+
+# --- Streaming Endpoints ---
+
+@router.post("/stream")
+async def stream_text(
+    request: GenerateRequest,
+    onchain_svc: Union[AsyncOnChainService, OnChainService] = Depends(get_onchain_service),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Dispatches a generation task and streams its tokens back as Server-Sent Events.
+
+    The first event (`task`) carries the task ID. Every following unnamed event
+    carries one decoded text piece, and the stream ends with an `end` or
+    `error` event.
+    """
+    await _admit(request, x_api_key)
+    cache_key, cached = await _cached_result(request)
+    if cached is None:
+        await _ensure_model_served(request)
+    await _verify_payment(request, onchain_svc)
+    if cached is not None:
+        events = _sse_cached_events(await _complete_from_cache(request, cached), cached)
+    else:
+        events = _sse_token_events((await _dispatch_generation(request, stream=True, cache_key=cache_key)).id)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stream/{task_id}")
+async def resume_stream(task_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Re-attaches to the token stream of a task started with `POST /stream`.
+    Clients resuming after a dropped connection pass the `Last-Event-ID` header.
+    """
+    return StreamingResponse(
+        _sse_token_events(task_id, last_event_id or "0-0"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/stream/ws")
+async def stream_text_ws(
+    websocket: WebSocket,
+    onchain_svc: Union[AsyncOnChainService, OnChainService] = Depends(get_onchain_service)
+):
+    """
+    WebSocket variant of `POST /stream`. The client sends one JSON
+    `GenerateRequest` and receives `task`, `token` and `end`/`error` messages.
+    """
+    await websocket.accept()
+    try:
+        request = GenerateRequest(**json.loads(await websocket.receive_text()))
+        await _admit(request, websocket.headers.get("x-api-key"))
+        cache_key, cached = await _cached_result(request)
+        if cached is None:
+            await _ensure_model_served(request)
+        await _verify_payment(request, onchain_svc)
+    except (ValueError, ValidationError) as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+        return
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "error": e.detail})
+        await websocket.close()
+        return
+
+    if cached is not None:
+        await websocket.send_json({"type": "task", "task_id": await _complete_from_cache(request, cached)})
+        await websocket.send_json({"type": "token", "token": cached.get("output", "")})
+        await websocket.send_json({"type": "end", "status": states.SUCCESS})
+        await websocket.close()
+        return
+
+    task = await _dispatch_generation(request, stream=True, cache_key=cache_key)
+    await websocket.send_json({"type": "task", "task_id": task.id})
+    await stream_readers.attach(task.id)
+    finished = False
+    try:
+        async for _, entry_type, data in read_token_stream(task.id):
+            if entry_type == TOKEN:
+                await websocket.send_json({"type": "token", "token": data})
+            elif entry_type == END:
+                await websocket.send_json({"type": "end", "status": data})
+            else:
+                await websocket.send_json({"type": "error", "error": data})
+        finished = True
+        await websocket.close()
+    except TimeoutError as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        print(f"Streaming client disconnected from task {task.id}.")
+    finally:
+        stream_readers.detach(task.id, finished)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Push-based task state notifications for the API process.
+
+Celery's Redis result backend publishes every stored state (PENDING, PROGRESS,
+SUCCESS, FAILURE, ...) on the `celery-task-meta-<task_id>` channel. The
+`TaskEventHub` keeps a single pub/sub connection per process, subscribes to a
+task's channel while at least one HTTP client is waiting on it, and fans each
+message out to all of those waiters. The result backend is read only once per
+waiter, to pick up the state from before the subscription existed.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from celery import states
+from celery.result import AsyncResult
+
+from ..redis_client import get_async_redis
+
+# --- Constants ---
+TERMINAL_STATES = states.READY_STATES  # SUCCESS, FAILURE, REVOKED
+_WAITER_QUEUE_SIZE = 64
+
+
+def task_status_payload(task_id: str, status: str, result: Any) -> Dict[str, Any]:
+    """Formats a task state the same way as the `/tasks/status` endpoint."""
+    payload = {"task_id": task_id, "status": status, "result": None}
+    if status == states.SUCCESS:
+        payload["result"] = result
+    elif status == states.FAILURE:
+        payload["result"] = {
+            "error": "Task failed.",
+            "details": str(result)  # Celery stores exception info here
+        }
+    elif status == states.REVOKED:
+        payload["result"] = {
+            "error": "Task was revoked.",
+            "details": str(result)  # "expired" if its deadline passed before a worker started it
+        }
+    return payload
+
+
+class TaskEventHub:
+    """
+    Fans task state transitions from one Redis subscription out to many waiters.
+    """
+    def __init__(self, celery_app):
+        self.celery_app = celery_app
+        self._waiters: Dict[str, Set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def channel(task_id: str) -> str:
+        return f"celery-task-meta-{task_id}"
+
+    async def _ensure_reader(self):
+        if self._pubsub is None:
+            self._pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.05)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is None or message.get("type") != "message":
+                    continue
+                task_id = message["channel"][len("celery-task-meta-"):]
+                meta = self.celery_app.backend.decode_result(message["data"])
+                event = task_status_payload(task_id, meta["status"], meta.get("result"))
+                for waiter in list(self._waiters.get(task_id, ())):
+                    if waiter.full():
+                        # A slow consumer only needs the latest state.
+                        waiter.get_nowait()
+                    waiter.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Task event reader error: {e}")
+                await asyncio.sleep(1)
+
+    async def _register(self, task_id: str) -> asyncio.Queue:
+        waiter: asyncio.Queue = asyncio.Queue(maxsize=_WAITER_QUEUE_SIZE)
+        async with self._lock:
+            await self._ensure_reader()
+            if task_id not in self._waiters:
+                self._waiters[task_id] = set()
+                await self._pubsub.subscribe(self.channel(task_id))
+            self._waiters[task_id].add(waiter)
+        return waiter
+
+    async def _unregister(self, task_id: str, waiter: asyncio.Queue):
+        async with self._lock:
+            waiters = self._waiters.get(task_id)
+            if waiters is None:
+                return
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[task_id]
+                await self._pubsub.unsubscribe(self.channel(task_id))
+
+    def _current_state(self, task_id: str) -> Dict[str, Any]:
+        task_result = AsyncResult(task_id, app=self.celery_app)
+        return task_status_payload(task_id, task_result.status, task_result.result)
+
+    async def subscribe(
+        self,
+        task_id: str,
+        timeout: Optional[float] = None,
+        heartbeat: Optional[float] = None
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yields the task's current state, then every subsequent transition,
+        until a terminal state is reached or `timeout` seconds pass.
+
+        With `heartbeat`, also yields `None` whenever that many seconds pass
+        without a transition, so streaming callers can send keep-alives.
+        """
+        waiter = await self._register(task_id)
+        try:
+            # Subscribe first, then read, so no transition can slip in between.
+            loop = asyncio.get_running_loop()
+            current = await loop.run_in_executor(None, self._current_state, task_id)
+            yield current
+            if current["status"] in TERMINAL_STATES:
+                return
+
+            deadline = None if timeout is None else loop.time() + timeout
+            while True:
+                wait = heartbeat
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    event = await asyncio.wait_for(waiter.get(), timeout=wait)
+                except asyncio.TimeoutError:
+                    if heartbeat is not None:
+                        yield None
+                    continue
+                yield event
+                if event["status"] in TERMINAL_STATES:
+                    return
+        finally:
+            await self._unregister(task_id, waiter)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
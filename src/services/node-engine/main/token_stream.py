@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Carries generated tokens from a Celery worker to the API process.
+
+The worker appends every decoded text piece to a per-task Redis Stream; the API
+reads the stream with blocking `XREAD` calls and forwards entries to the client
+as Server-Sent Events. Streams (rather than pub/sub) keep the entries around for
+a while, so a client that connects late or reconnects with `Last-Event-ID`
+resumes without losing tokens.
+"""
+import os
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from ..redis_client import get_redis, get_async_redis
+
+# --- Constants ---
+STREAM_KEY_PREFIX = "deai:stream:"
+STREAM_TTL_SECONDS = int(os.getenv("STREAM_TTL_SECONDS", "600"))
+STREAM_MAX_LEN = 10000
+# How long a reader waits for the next entry before giving up on the task.
+STREAM_IDLE_TIMEOUT_SECONDS = int(os.getenv("STREAM_IDLE_TIMEOUT_SECONDS", "300"))
+_XREAD_BLOCK_MS = 5000
+
+# Entry types written to the stream.
+TOKEN = "token"
+END = "end"
+ERROR = "error"
+
+
+def stream_key(task_id: str) -> str:
+    return f"{STREAM_KEY_PREFIX}{task_id}"
+
+
+class TokenPublisher:
+    """
+    Worker-side writer for one task's token stream.
+    """
+    def __init__(self, task_id: str, client=None):
+        self.key = stream_key(task_id)
+        self.redis = client or get_redis()
+        self._expiry_set = False
+
+    def _append(self, fields: Dict[str, str]):
+        self.redis.xadd(self.key, fields, maxlen=STREAM_MAX_LEN, approximate=True)
+        if not self._expiry_set:
+            self.redis.expire(self.key, STREAM_TTL_SECONDS)
+            self._expiry_set = True
+
+    def publish(self, text: str):
+        """Appends a decoded text piece."""
+        if text:
+            self._append({"type": TOKEN, "data": text})
+
+    def close(self, error: Optional[str] = None, status: str = "SUCCESS"):
+        """Marks the stream as finished, with a status (e.g. "CANCELLED") or an error message."""
+        if error is None:
+            self._append({"type": END, "data": status})
+        else:
+            self._append({"type": ERROR, "data": error})
+
+
+async def read_token_stream(task_id: str, last_id: str = "0-0") -> AsyncIterator[Tuple[str, str, str]]:
+    """
+    Yields `(entry_id, type, data)` tuples for a task, starting after `last_id`,
+    until the worker writes an end or error entry.
+
+    Raises:
+        TimeoutError: If no entry arrives for `STREAM_IDLE_TIMEOUT_SECONDS`.
+    """
+    client = get_async_redis()
+    key = stream_key(task_id)
+    idle_ms = 0
+    while True:
+        response = await client.xread({key: last_id}, count=100, block=_XREAD_BLOCK_MS)
+        if not response:
+            idle_ms += _XREAD_BLOCK_MS
+            if idle_ms >= STREAM_IDLE_TIMEOUT_SECONDS * 1000:
+                raise TimeoutError(f"No tokens received for task {task_id}.")
+            continue
+
+        idle_ms = 0
+        for _, entries in response:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                entry_type = fields.get("type", TOKEN)
+                yield entry_id, entry_type, fields.get("data", "")
+                if entry_type in (END, ERROR):
+                    return
+
+
+def format_sse(data: str, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """Encodes one Server-Sent Event. Multi-line data is split across `data:` lines."""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
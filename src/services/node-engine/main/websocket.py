@@ -1,79 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asyncio client for the gateway's WebSocket.
+
+The gateway routes inference requests to the node as `route_inference`
+messages. Each one is queued as a Celery task on its model's queue. Its
+result is awaited through the result backend's pub/sub (`TaskEventHub`),
+not a blocking `task.get`, so many routed requests are in flight at once.
+
+At most `GATEWAY_MAX_IN_FLIGHT` run at a time. When that many are running,
+the client stops reading from the socket, which pushes back on the gateway.
+A payload with `"stream": true` also gets its decoded text pieces, sent as
+`inference_token` messages before the final `inference_result`.
+
+The heartbeat (see fleet_metrics.py) shares the connection. A dropped
+connection is re-established with capped, jittered exponential backoff.
+Results of requests that finish while it is down wait for the new connection.
+"""
+import asyncio
+import contextvars
 import json
 import os
-import threading
-import time
-import websocket
-from ..tasks import generate_text_task
-
-ws_client = None
-
-def on_message(ws, message):
-    try:
-        msg = json.loads(message)
-        if msg.get("type") == "route_inference":
-            request_id = msg.get("requestId")
-            payload = msg.get("payload", {})
-            prompt = payload.get("prompt")
-            model_name = payload.get("model_id", "gemma")
-
-            if not prompt or not request_id:
-                print("Missing prompt or request ID in inference request.")
-                return
+import random
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import websockets
+from celery import states
+
+from ..tasks import generate_text_task, get_available_models
+from ..routing import TASK_PRIORITIES, fleet_snapshot, model_queue
+from ..fleet_metrics import heartbeat
+from ..tracing import inject
+from .task_events import TaskEventHub
+from .token_stream import TOKEN, read_token_stream
+
+# --- Configuration ---
+GATEWAY_WEBSOCKET_URL = os.getenv("GATEWAY_WEBSOCKET_URL", "")
+GATEWAY_MAX_IN_FLIGHT = int(os.getenv("GATEWAY_MAX_IN_FLIGHT", "32"))
+GATEWAY_RESULT_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_RESULT_TIMEOUT_SECONDS", "120"))
+GATEWAY_RECONNECT_MIN_SECONDS = float(os.getenv("GATEWAY_RECONNECT_MIN_SECONDS", "1"))
+GATEWAY_RECONNECT_MAX_SECONDS = float(os.getenv("GATEWAY_RECONNECT_MAX_SECONDS", "60"))
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "10"))
+
+
+def dispatch_routed_inference(payload: Dict[str, Any]) -> str:
+    """
+    Queues a routed request on its model's queue and returns the task ID.
+    The payload may set a `priority` and `deadline_seconds` as for `POST
+    /generate`; without a deadline the task expires when the gateway would
+    stop waiting for its result.
+    """
+    model_name = payload.get("model_id", "gemma")
+    kwargs = {"prompt": payload["prompt"], "model_name": model_name, "stream": bool(payload.get("stream"))}
+    for option in ("temperature", "max_new_tokens", "seed"):
+        if payload.get(option) is not None:
+            kwargs[option] = payload[option]
+    if payload.get("address"):
+        kwargs["user"] = payload["address"]  # billed for the tokens used
+    priority = TASK_PRIORITIES.get(payload.get("priority") or "normal", TASK_PRIORITIES["normal"])
+    deadline = payload.get("deadline_seconds") or GATEWAY_RESULT_TIMEOUT_SECONDS
+    return generate_text_task.apply_async(kwargs=kwargs, queue=model_queue(model_name), priority=priority,
+                                          expires=deadline, headers=inject({})).id
+
+
+async def _fleet_heartbeat() -> Dict[str, Any]:
+    return heartbeat(await fleet_snapshot(get_available_models()))
+
+
+class GatewayClient:
+    """
+    One reconnecting WebSocket to the gateway, serving routed inferences
+    concurrently. `dispatch`, `events`, `tokens` and `metrics` default to
+    Celery, the result backend, the token streams and the fleet heartbeat.
+    """
+    def __init__(self, url: str, hub: Optional[TaskEventHub] = None,
+                 max_in_flight: int = GATEWAY_MAX_IN_FLIGHT,
+                 result_timeout: float = GATEWAY_RESULT_TIMEOUT_SECONDS,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL_SECONDS,
+                 reconnect_min: float = GATEWAY_RECONNECT_MIN_SECONDS,
+                 reconnect_max: float = GATEWAY_RECONNECT_MAX_SECONDS,
+                 dispatch: Callable[[Dict[str, Any]], str] = dispatch_routed_inference,
+                 events: Optional[Callable[..., AsyncIterator[Optional[Dict[str, Any]]]]] = None,
+                 tokens: Callable[[str], AsyncIterator] = read_token_stream,
+                 metrics: Callable[[], Awaitable[Dict[str, Any]]] = _fleet_heartbeat):
+        self.url = url
+        self.result_timeout = result_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.dispatch = dispatch
+        self.events = events or hub.subscribe
+        self.tokens = tokens
+        self.metrics = metrics
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._ws = None
+        self._connected = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._requests = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
 
-            print(f"Received inference request {request_id} for model {model_name}.")
+    async def stop(self):
+        tasks = [t for t in [self._task, *self._requests] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
 
-            task = generate_text_task.delay(prompt, model_name, {})
-            result_payload = task.get(timeout=120)
+    async def _run(self):
+        failures = 0
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    print(f"WebSocket connection to gateway {self.url} opened.")
+                    failures = 0
+                    await self._session(ws)
+                print("WebSocket connection to gateway closed.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket connection to gateway failed: {e}")
+            finally:
+                self._disconnected()
+            delay = min(self.reconnect_max, self.reconnect_min * 2 ** failures) * random.uniform(0.5, 1.0)
+            failures += 1
+            print(f"Reconnecting to the gateway in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+    def _disconnected(self):
+        self._ws = None
+        self._connected.clear()
 
-            response = {
-                "type": "inference_result",
-                "requestId": request_id,
-                "payload": result_payload,
-            }
-            ws.send(json.dumps(response))
-            print(f"Sent inference result for request {request_id}.")
+    async def _session(self, ws):
+        self._ws = ws
+        self._connected.set()
+        heartbeats = asyncio.create_task(self._heartbeat())
+        try:
+            async for raw in ws:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    print("Ignoring a malformed message from the gateway.")
+                    continue
+                if message.get("type") != "route_inference":
+                    continue
+                # Waiting here stops reading from the socket: backpressure on the gateway.
+                await self._slots.acquire()
+                task = asyncio.create_task(self._serve(message))
+                self._requests.add(task)
+                task.add_done_callback(self._requests.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            heartbeats.cancel()
 
-    except Exception as e:
-        print(f"Error processing message: {e}")
+    # --- Messages ---
 
-def on_error(ws, error):
-    print(f"WebSocket Error: {error}")
+    async def send(self, message: Dict[str, Any]) -> bool:
+        """Sends on the current connection. Returns False if there is none."""
+        ws = self._ws
+        if ws is None:
+            return False
+        try:
+            async with self._send_lock:
+                await ws.send(json.dumps(message))
+            return True
+        except websockets.ConnectionClosed:
+            if self._ws is ws:
+                self._disconnected()
+            return False
 
-def on_close(ws, close_status_code, close_msg):
-    print("WebSocket connection closed. Reconnecting...")
-    time.sleep(5)
-    connect_websocket()
+    async def deliver(self, message: Dict[str, Any]) -> bool:
+        """Sends, waiting up to `reconnect_max` seconds for a connection if there is none."""
+        deadline = asyncio.get_running_loop().time() + self.reconnect_max
+        while not await self.send(message):
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._connected.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
 
-def on_open(ws):
-    print("WebSocket connection to gateway opened.")
-    def send_metrics():
+    async def _heartbeat(self):
         while True:
             try:
-                metrics = {
-                    "type": "metrics",
-                    "score": 0.95, 
-                    "load": 0.1
-                }
-                if ws.sock and ws.sock.connected:
-                    ws.send(json.dumps(metrics))
-                else:
-                    break
-                time.sleep(10)
+                await self.send(await self.metrics())
             except Exception as e:
                 print(f"Error sending metrics: {e}")
-                break
-    threading.Thread(target=send_metrics, daemon=True).start()
-
-def connect_websocket():
-    global ws_client
-    gateway_url = os.getenv("GATEWAY_WEBSOCKET_URL", "ws://localhost:3000")
-    ws_client = websocket.WebSocketApp(
-        gateway_url,
-        on_open=on_open,
-        on_message=on_message,
-        on_error=on_error,
-        on_close=on_close
-    )
-    wst = threading.Thread(target=ws_client.run_forever)
-    wst.daemon = True
-    wst.start()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _serve(self, message: Dict[str, Any]):
+        self.in_flight += 1
+        request_id = message.get("requestId")
+        try:
+            payload = message.get("payload", {})
+            if not payload.get("prompt") or not request_id:
+                print("Missing prompt or request ID in inference request.")
+                return
+            print(f"Received inference request {request_id} for model {payload.get('model_id', 'gemma')}.")
+            result = await self._infer(request_id, payload)
+        except Exception as e:
+            print(f"Error processing inference request {request_id}: {e}")
+            return
+        finally:
+            # The slot is free once the task is done, even if delivery has to
+            # wait: the session must keep reading to notice a dropped connection.
+            self.in_flight -= 1
+            self._slots.release()
+        if not await self.deliver({"type": "inference_result", "requestId": request_id, "payload": result}):
+            print(f"Gateway unavailable; dropped the result of request {request_id}.")
+
+    async def _infer(self, request_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Publishing to the broker blocks; a slow Redis must not stall the loop. The
+        # copied context carries the trace context the task headers are built from.
+        task_id = await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, self.dispatch, payload)
+        if payload.get("stream"):
+            try:
+                async for _, entry_type, data in self.tokens(task_id):
+                    if entry_type == TOKEN:
+                        await self.send({"type": "inference_token", "requestId": request_id, "token": data})
+            except TimeoutError as e:
+                return {"status": states.FAILURE, "error": str(e)}
+        async for event in self.events(task_id, timeout=self.result_timeout):
+            if event["status"] == states.SUCCESS:
+                return event["result"]
+            if event["status"] in states.READY_STATES:
+                return {"status": event["status"], "error": event["result"]}
+        return {"status": states.FAILURE, "error": f"Task {task_id} timed out after {self.result_timeout}s."}
+
+
+# --- Process-wide Client ---
+gateway_client: Optional[GatewayClient] = None
+
+
+def connect_gateway(hub: TaskEventHub, url: str = GATEWAY_WEBSOCKET_URL) -> Optional[GatewayClient]:
+    """Starts the gateway client on the running loop, if a gateway URL is configured."""
+    global gateway_client
+    if not url:
+        return None
+    gateway_client = GatewayClient(url, hub)
+    gateway_client.start()
+    return gateway_client
+
+
+async def close_gateway():
+    global gateway_client
+    if gateway_client is not None:
+        await gateway_client.stop()
+        gateway_client = None
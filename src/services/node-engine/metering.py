@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Token-based pricing and metering of generations.
+
+Each model plugin declares its price per 1,000 prompt tokens and per 1,000
+completion tokens (`get_price()` in its `loader.py`). The model registry is
+the single place prices are read from. The API uses them to quote the most
+a request can cost before verifying payment. The workers use them to price
+what a finished task actually consumed.
+
+The token counts come once per task from the generation result, so nothing
+runs per token in the decode loop. The worker then hands a `Usage` to the
+process-wide `Meter`. The meter adds the charges up per user and debits them
+through the balance service in one ledger transaction, every
+`METERING_FLUSH_SECONDS` or once `METERING_BATCH_SIZE` tasks are waiting. A
+failed flush keeps the charges for the next one.
+
+A result served from the result cache is billed the same way, by the API
+process, for the token counts cached with it.
+"""
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .metrics import METERED_TOKENS, METERED_USD, METERING_PENDING_TASKS
+
+load_dotenv()
+
+# --- Configuration ---
+METERING_FLUSH_SECONDS = float(os.getenv("METERING_FLUSH_SECONDS", "5"))
+METERING_BATCH_SIZE = int(os.getenv("METERING_BATCH_SIZE", "256"))
+# Rough characters per token, for quoting a prompt before it is tokenized.
+CHARS_PER_TOKEN_ESTIMATE = float(os.getenv("CHARS_PER_TOKEN_ESTIMATE", "4"))
+
+
+@dataclass(frozen=True)
+class TokenPrice:
+    """USD per 1,000 tokens of prompt and of completion."""
+    prompt_per_1k: float
+    completion_per_1k: float
+
+    @classmethod
+    def from_loader(cls, loader) -> "TokenPrice":
+        price = loader.get_price()
+        return cls(float(price["prompt"]), float(price["completion"]))
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.prompt_per_1k + completion_tokens * self.completion_per_1k) / 1000
+
+    def quote(self, prompt: str, max_new_tokens: int) -> float:
+        """The most a request can cost: its estimated prompt plus a full-length completion."""
+        return self.cost(estimate_tokens(prompt), max(0, int(max_new_tokens or 0)))
+
+    def to_dict(self) -> Dict[str, str]:
+        # Strings, so JSON clients do not round the prices.
+        return {"prompt_per_1k_tokens": str(self.prompt_per_1k),
+                "completion_per_1k_tokens": str(self.completion_per_1k)}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN_ESTIMATE)
+
+
+@dataclass(frozen=True)
+class Usage:
+    """What one finished task consumed."""
+    user: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+
+    def to_dict(self) -> dict:
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "cost_usd": self.cost_usd}
+
+
+class Meter:
+    """
+    Buffers usage and debits it in batches.
+
+    `debit` receives `{user: amount_usd}` and must apply all of it or raise.
+    """
+    def __init__(self, debit: Callable[[Dict[str, float]], None], interval: float = METERING_FLUSH_SECONDS,
+                 batch_size: int = METERING_BATCH_SIZE):
+        self.debit = debit
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self._pending: List[Usage] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, usage: Usage):
+        METERED_TOKENS.labels(model=usage.model, kind="prompt").inc(usage.prompt_tokens)
+        METERED_TOKENS.labels(model=usage.model, kind="completion").inc(usage.completion_tokens)
+        METERED_USD.labels(model=usage.model).inc(usage.cost_usd)
+        with self._lock:
+            self._pending.append(usage)
+            pending = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="meter", daemon=True)
+                self._thread.start()
+        METERING_PENDING_TASKS.set(pending)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Debits everything recorded so far. Returns the number of tasks debited."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            charges: Dict[str, float] = {}
+            for usage in batch:
+                charges[usage.user] = charges.get(usage.user, 0.0) + usage.cost_usd
+            try:
+                self.debit(charges)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch
+                    METERING_PENDING_TASKS.set(len(self._pending))
+                raise
+            with self._lock:
+                METERING_PENDING_TASKS.set(len(self._pending))
+            return len(batch)
+
+    def close(self):
+        """Stops the flusher after a last flush."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Failed to debit metered usage on shutdown: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to debit metered usage; retrying in {self.interval}s: {e}")
+
+
+def debit_usage(charges: Dict[str, float]):
+    """Debits a batch of charges through the balance service."""
+    from .balances import balance_service
+    balance_service.charge_usage(charges)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Prometheus metrics shared by the API process and the Celery workers.
+
+Everything is registered on the default `prometheus_client` registry, which is
+the registry the FastAPI `Instrumentator` serves on `/metrics`.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# --- Batching Engine ---
+BATCH_SIZE = Histogram(
+    "deai_batch_size",
+    "Number of sequences in each batched forward pass.",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+BATCH_GENERATED_TOKENS = Counter(
+    "deai_batch_generated_tokens_total",
+    "Tokens produced by the batching engine.",
+    ["model"],
+)
+BATCH_TOKENS_PER_SECOND = Gauge(
+    "deai_batch_tokens_per_second",
+    "Throughput of the most recent batched forward pass.",
+    ["model"],
+)
+BATCH_QUEUE_WAIT_SECONDS = Histogram(
+    "deai_batch_queue_wait_seconds",
+    "Time a request waited before being admitted into a running batch.",
+    ["model"],
+)
+
+# --- Speculative Decoding ---
+SPECULATIVE_PROPOSED_TOKENS = Counter(
+    "deai_speculative_proposed_tokens_total",
+    "Tokens proposed by the draft model.",
+    ["model"],
+)
+SPECULATIVE_ACCEPTED_TOKENS = Counter(
+    "deai_speculative_accepted_tokens_total",
+    "Draft tokens the target model accepted; divide by proposed for the acceptance rate.",
+    ["model"],
+)
+SPECULATIVE_TARGET_PASSES = Counter(
+    "deai_speculative_target_passes_total",
+    "Target model forward passes made while decoding speculatively.",
+    ["model"],
+)
+
+# --- Prefix Cache ---
+PREFIX_CACHE_LOOKUPS = Counter(
+    "deai_prefix_cache_lookups_total",
+    "Prompt prefix KV cache lookups, by outcome (hit or miss).",
+    ["model", "result"],
+)
+PREFIX_CACHE_TOKENS_SAVED = Counter(
+    "deai_prefix_cache_tokens_saved_total",
+    "Prompt tokens resumed from a cached KV prefix instead of being prefilled.",
+    ["model"],
+)
+PREFIX_CACHE_CACHED_TOKENS = Gauge(
+    "deai_prefix_cache_cached_tokens",
+    "Prompt tokens whose KV cache is currently held by the prefix cache.",
+    ["model"],
+)
+
+# --- On-Chain Payment Verification ---
+ALLOWANCE_CACHE_HITS = Counter(
+    "deai_allowance_cache_hits_total",
+    "Allowance lookups answered from the local cache.",
+)
+ALLOWANCE_CACHE_MISSES = Counter(
+    "deai_allowance_cache_misses_total",
+    "Allowance lookups that had to be read from the chain.",
+)
+ALLOWANCE_CACHE_INVALIDATIONS = Counter(
+    "deai_allowance_cache_invalidations_total",
+    "Cached owners dropped because of an Approval or Transfer event.",
+)
+ALLOWANCE_LOOKUP_SECONDS = Histogram(
+    "deai_allowance_lookup_seconds",
+    "Latency of an allowance lookup during payment verification.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+ONCHAIN_RPC_ROUND_TRIPS = Counter(
+    "deai_onchain_rpc_round_trips_total",
+    "JSON-RPC round trips made to the blockchain node.",
+    ["method"],
+)
+ONCHAIN_RPC_BATCH_SIZE = Histogram(
+    "deai_onchain_rpc_batch_size",
+    "Number of allowance reads resolved by one flush.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+# --- Settlement ---
+SETTLEMENT_PENDING_CHARGES = Gauge(
+    "deai_settlement_pending_charges",
+    "Accrued charges not yet assigned to an on-chain transfer.",
+)
+SETTLEMENT_TRANSFERS = Counter(
+    "deai_settlement_transfers_total",
+    "Aggregated settlement transfers by outcome.",
+    ["status"],
+)
+SETTLEMENT_BROADCAST_FAILURES = Counter(
+    "deai_settlement_broadcast_failures_total",
+    "Signed settlement transfers the node refused to accept.",
+)
+SETTLEMENT_RELEASED_CHARGES = Counter(
+    "deai_settlement_released_charges_total",
+    "Charges returned to the pool because their transfer was dropped or reverted.",
+    ["status"],
+)
+
+# --- Model Registry ---
+MODEL_LOADS = Counter(
+    "deai_model_loads_total",
+    "Models loaded into this worker.",
+    ["model"],
+)
+MODEL_EVICTIONS = Counter(
+    "deai_model_evictions_total",
+    "Models unloaded to stay within the memory budget.",
+    ["model"],
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "deai_model_load_seconds",
+    "Time taken to load a model pipeline.",
+    ["model"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    "deai_model_resident_bytes",
+    "Estimated memory held by each loaded model (0 when unloaded).",
+    ["model"],
+)
+
+# --- Result Cache ---
+RESULT_CACHE_REQUESTS = Counter(
+    "deai_result_cache_requests_total",
+    "Result cache lookups for deterministic generations, by outcome (hit or miss).",
+    ["result"],
+)
+RESULT_CACHE_BYTES_SAVED = Counter(
+    "deai_result_cache_bytes_saved_total",
+    "Bytes of generated output served from the result cache instead of a worker.",
+)
+
+# --- Proxy Balancing ---
+PROXY_REQUESTS = Counter(
+    "deai_proxy_requests_total",
+    "Requests proxied to mesh nodes, by outcome (ok, error or unreachable).",
+    ["result"],
+)
+PROXY_PEER_EJECTIONS = Counter(
+    "deai_proxy_peer_ejections_total",
+    "Times a mesh node was temporarily ejected from proxy balancing after repeated failures.",
+)
+
+# --- Peer Mesh ---
+PEER_PROBES = Counter(
+    "deai_peer_probes_total",
+    "gRPC health probes sent to mesh peers, by outcome (healthy or unhealthy).",
+    ["result"],
+)
+GOSSIP_MESSAGES = Counter(
+    "deai_gossip_messages_total",
+    "SWIM gossip messages sent, by kind (ping or ping_req).",
+    ["kind"],
+)
+GOSSIP_MEMBERS = Gauge(
+    "deai_gossip_members",
+    "Mesh members in this node's gossip view, by status.",
+    ["status"],
+)
+
+# --- Request Tracing ---
+STAGE_SECONDS = Histogram(
+    "deai_stage_seconds",
+    "Duration of each traced stage of a generation (see tracing.py), by span name.",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+GENERATION_TOKENS = Histogram(
+    "deai_generation_tokens",
+    "Tokens per finished generation, by kind (prompt or completion).",
+    ["model", "kind"],
+    buckets=(1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+)
+
+# --- Scheduling ---
+EXPIRED_TASKS = Counter(
+    "deai_expired_tasks_total",
+    "Generation tasks dropped because their deadline passed before a worker started them.",
+    ["model"],
+)
+EXPIRED_GPU_SECONDS_SAVED = Counter(
+    "deai_expired_gpu_seconds_saved_total",
+    "Estimated generation seconds not spent on expired tasks, from the model's recent average.",
+    ["model"],
+)
+CANCELLED_TASKS = Counter(
+    "deai_cancelled_tasks_total",
+    "Generation tasks stopped on request, by stage (queued or running).",
+    ["model", "stage"],
+)
+
+# --- Metering ---
+METERED_TOKENS = Counter(
+    "deai_metered_tokens_total",
+    "Tokens billed for finished generations, by kind (prompt or completion).",
+    ["model", "kind"],
+)
+METERED_USD = Counter(
+    "deai_metered_usd_total",
+    "USD billed for finished generations.",
+    ["model"],
+)
+METERING_PENDING_TASKS = Gauge(
+    "deai_metering_pending_tasks",
+    "Metered tasks waiting for the next batched debit.",
+)
+
+# --- Admission Control ---
+ADMISSION_REJECTIONS = Counter(
+    "deai_admission_rejections_total",
+    "Generation requests turned away with a 429, by reason (address, api_key or queue).",
+    ["reason"],
+)
+ADMISSION_CHECK_SECONDS = Histogram(
+    "deai_admission_check_seconds",
+    "Latency of the rate limit and queue depth check.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+)
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Continuous (in-flight) batching for causal language models.
+
+A `ContinuousBatcher` owns one model and a background thread. Callers submit
+prompts from any thread and get a `Future` back. The thread runs every active
+sequence through a single padded forward pass per decode step, retires
+sequences as soon as they hit EOS or their token limit, and admits queued
+requests into the freed slots instead of waiting for the whole batch to drain.
+A sequence whose `cancelled` event is set leaves the batch after the current
+step, or is never admitted if it is still queued.
+
+Admitting new sequences re-prefills the running ones together with their
+generated tokens, so the KV cache always stays one left-padded rectangle. This
+keeps the engine independent of any model-specific cache layout, at the cost
+of one extra prefill per admission round.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+from ..metrics import (
+    BATCH_SIZE,
+    BATCH_GENERATED_TOKENS,
+    BATCH_TOKENS_PER_SECOND,
+    BATCH_QUEUE_WAIT_SECONDS,
+)
+
+# --- Configuration ---
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# Minimum decode steps between two admission rounds of a running batch.
+# Each round costs a prefill, so admitting on every step would dominate.
+BATCH_MIN_DECODE_STEPS = int(os.getenv("BATCH_MIN_DECODE_STEPS", "4"))
+
+
+@dataclass
+class GenerationResult:
+    """The outcome of one batched generation."""
+    text: str  # Prompt + completion, matching the pipeline's `return_full_text`
+    completion: str
+    prompt_tokens: int
+    completion_tokens: int
+    finish_reason: str  # "stop", "length" or "cancelled"
+    # Stage timings, in seconds: waiting for a batch slot, the pass that
+    # produced the first token, and the remaining decode steps.
+    queue_seconds: float = 0.0
+    prefill_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    # Speculative decoding only: draft tokens proposed and accepted by the target.
+    proposed_tokens: int = 0
+    accepted_tokens: int = 0
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a growing list of generated token IDs into text pieces for
+    streaming. Each step decodes only the tokens since the previous piece,
+    with the tokens of that piece as context, as Hugging Face's streamers
+    do (`prefix_offset`/`read_offset`). Decoding the whole sequence every
+    step would cost O(n) per token, and slicing it by character count breaks
+    when a longer decode rewrites earlier text (e.g. the spaces removed by
+    `clean_up_tokenization_spaces`).
+    """
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def step(self, ids: List[int], final: bool = False) -> str:
+        """Returns the text added by `ids[read_offset:]`, or "" if there is none yet."""
+        prefix = self.tokenizer.decode(ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(ids[self.prefix_offset:], skip_special_tokens=True)
+        # Hold back a trailing partial multi-byte character until it is complete.
+        if len(text) <= len(prefix) or (not final and text.endswith("\ufffd")):
+            return ""
+        self.prefix_offset, self.read_offset = self.read_offset, len(ids)
+        return text[len(prefix):]
+
+
+@dataclass
+class _Sequence:
+    prompt_ids: List[int]
+    temperature: float
+    max_new_tokens: int
+    future: Future
+    enqueued_at: float
+    on_token: Optional[Callable[[str], None]] = None
+    cancelled: Optional[threading.Event] = None
+    generator: Optional[torch.Generator] = None
+    generated: List[int] = field(default_factory=list)
+    detokenizer: Optional[IncrementalDetokenizer] = None
+    admitted_at: float = 0.0
+    first_token_at: float = 0.0
+
+
+class ContinuousBatcher:
+    """
+    Per-model scheduler that batches concurrent generation requests.
+    """
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        name: str = "model",
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        min_decode_steps: int = BATCH_MIN_DECODE_STEPS,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.min_decode_steps = min_decode_steps
+
+        eos = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self._eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+
+        if tokenizer.pad_token_id is not None:
+            self.pad_token_id = tokenizer.pad_token_id
+        else:
+            self.pad_token_id = next(iter(self._eos_ids), 0)
+
+        # Batch state, only touched by the engine thread.
+        self._pending: "queue.Queue[Optional[_Sequence]]" = queue.Queue()
+        self._active: List[_Sequence] = []
+        self._cache = None
+        self._attention_mask = None
+        self._positions = None
+        self._steps_since_prefill = 0
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "forward_passes": 0,
+            "prefills": 0,
+            "tokens_generated": 0,
+            "sequences_completed": 0,
+            "sequences_cancelled": 0,
+            "batch_size_sum": 0,
+            "busy_seconds": 0.0,
+        }
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_pipeline(cls, pipe, name: str, **kwargs) -> "ContinuousBatcher":
+        """Builds a batcher around the model and tokenizer of a `text-generation` pipeline."""
+        return cls(pipe.model, pipe.tokenizer, name=name, **kwargs)
+
+    # --- Public API ---
+
+    def submit(
+        self,
+        prompt: str,
+        temperature: float = 0.7,
+        max_new_tokens: int = 150,
+        on_token: Optional[Callable[[str], None]] = None,
+        seed: Optional[int] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Future:
+        """
+        Queues a prompt for generation and returns a Future resolving to a
+        `GenerationResult`. Tokenization happens on the caller's thread.
+
+        If `on_token` is given, it is called from the engine thread with each
+        newly decoded piece of text, so it must return quickly. A `seed` gives
+        the sequence its own random generator, so sampled output does not
+        depend on which other requests share the batch. Setting `cancelled`
+        stops the sequence between decode steps; its result then holds the
+        tokens generated so far.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError(f"Batcher for '{self.name}' has been shut down.")
+
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        if not prompt_ids:
+            bos = self.tokenizer.bos_token_id
+            prompt_ids = [bos if bos is not None else self.pad_token_id]
+
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.model.device).manual_seed(int(seed))
+
+        future: Future = Future()
+        self._pending.put(_Sequence(
+            prompt_ids=list(prompt_ids),
+            temperature=temperature or 0.0,
+            max_new_tokens=max(1, int(max_new_tokens)),
+            future=future,
+            enqueued_at=time.monotonic(),
+            on_token=on_token,
+            cancelled=cancelled,
+            generator=generator,
+            detokenizer=IncrementalDetokenizer(self.tokenizer) if on_token is not None else None,
+        ))
+        return future
+
+    def generate(self, prompt: str, **kwargs) -> GenerationResult:
+        """Blocking convenience wrapper around `submit`."""
+        return self.submit(prompt, **kwargs).result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns cumulative throughput figures for this batcher."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        passes = snapshot["forward_passes"]
+        busy = snapshot["busy_seconds"]
+        snapshot["avg_batch_size"] = snapshot["batch_size_sum"] / passes if passes else 0.0
+        snapshot["tokens_per_second"] = snapshot["tokens_generated"] / busy if busy else 0.0
+        snapshot["pending"] = self._pending.qsize()
+        snapshot["active"] = len(self._active)
+        return snapshot
+
+    def close(self):
+        """Stops the engine thread. Requests still queued are failed."""
+        self._stopped.set()
+        self._pending.put(None)
+        self._thread.join(timeout=5)
+        while True:
+            try:
+                seq = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if seq is not None and seq.future.set_running_or_notify_cancel():
+                seq.future.set_exception(RuntimeError(f"Batcher for '{self.name}' was shut down."))
+
+    # --- Engine Loop ---
+
+    def _run(self):
+        while not self._stopped.is_set():
+            admitted = self._admit()
+            if not self._active:
+                continue
+
+            started = time.perf_counter()
+            batch_size = len(self._active)
+            try:
+                with torch.no_grad():
+                    if admitted:
+                        self._prefill()
+                    else:
+                        self._decode_step()
+            except Exception as e:
+                print(f"Batcher '{self.name}' failed a forward pass: {e}")
+                self._fail_active(e)
+                continue
+            self._record_pass(batch_size, time.perf_counter() - started, prefill=admitted)
+            self._retire()
+
+        self._fail_active(RuntimeError(f"Batcher for '{self.name}' was shut down."))
+
+    def _admit(self) -> bool:
+        """Moves queued requests into free batch slots. Returns True if any were admitted."""
+        free = self.max_batch_size - len(self._active)
+        if free <= 0:
+            return False
+        if self._active and self._steps_since_prefill < self.min_decode_steps:
+            return False
+
+        incoming: List[_Sequence] = []
+        if not self._active:
+            # Idle: block for the first request, then hold the batch open
+            # for up to `max_wait` so concurrent arrivals share the prefill.
+            first = self._pending.get()
+            if first is None:
+                return False
+            incoming.append(first)
+            deadline = time.monotonic() + self.max_wait
+            while len(incoming) < free:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    seq = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if seq is None:
+                    break
+                incoming.append(seq)
+        else:
+            while len(incoming) < free:
+                try:
+                    seq = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if seq is None:
+                    break
+                incoming.append(seq)
+
+        now = time.monotonic()
+        admitted = []
+        for seq in incoming:
+            # Skips requests whose caller already cancelled the Future.
+            if not seq.future.set_running_or_notify_cancel():
+                continue
+            if self._is_cancelled(seq):
+                self._finish(seq, "cancelled")
+                continue
+            BATCH_QUEUE_WAIT_SECONDS.labels(model=self.name).observe(now - seq.enqueued_at)
+            seq.admitted_at = now
+            admitted.append(seq)
+        self._active.extend(admitted)
+        return bool(admitted)
+
+    def _prefill(self):
+        """Runs every active sequence (prompt + generated so far) through one padded pass."""
+        rows = [seq.prompt_ids + seq.generated for seq in self._active]
+        width = max(len(row) for row in rows)
+        input_ids = torch.full((len(rows), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, row in enumerate(rows):
+            input_ids[i, width - len(row):] = torch.tensor(row, dtype=torch.long)
+            attention_mask[i, width - len(row):] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        device = self.model.device
+        self._attention_mask = attention_mask.to(device)
+        outputs = self.model(
+            input_ids=input_ids.to(device),
+            attention_mask=self._attention_mask,
+            position_ids=position_ids.to(device),
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values
+        self._positions = position_ids[:, -1:].to(device)
+        self._steps_since_prefill = 0
+        self._append_tokens(outputs.logits[:, -1, :])
+
+    def _decode_step(self):
+        """Feeds the last sampled token of every active sequence through the model."""
+        device = self.model.device
+        last_tokens = torch.tensor([[seq.generated[-1]] for seq in self._active], dtype=torch.long, device=device)
+        self._attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))], dim=-1
+        )
+        self._positions = self._positions + 1
+        outputs = self.model(
+            input_ids=last_tokens,
+            attention_mask=self._attention_mask,
+            position_ids=self._positions,
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values
+        self._steps_since_prefill += 1
+        self._append_tokens(outputs.logits[:, -1, :])
+
+    def _append_tokens(self, logits: torch.Tensor):
+        """Samples one token per row: greedy for temperature 0, otherwise multinomial."""
+        logits = logits.float()
+        next_tokens = logits.argmax(dim=-1)
+        temperatures = torch.tensor([seq.temperature for seq in self._active], device=logits.device)
+        sampled_rows = temperatures > 0
+        if bool(sampled_rows.any()):
+            probs = torch.softmax(logits / temperatures.clamp(min=1e-5).unsqueeze(-1), dim=-1)
+            sampled = torch.multinomial(probs, num_samples=1).squeeze(-1)
+            for row, seq in enumerate(self._active):
+                if seq.generator is not None and seq.temperature > 0:
+                    sampled[row] = torch.multinomial(probs[row], num_samples=1, generator=seq.generator)[0]
+            next_tokens = torch.where(sampled_rows, sampled, next_tokens)
+        now = time.monotonic()
+        for seq, token in zip(self._active, next_tokens.tolist()):
+            seq.generated.append(token)
+            if len(seq.generated) == 1:
+                seq.first_token_at = now
+            if seq.on_token is not None:
+                self._emit(seq)
+
+    def _emit(self, seq: _Sequence, final: bool = False):
+        """Passes newly decoded text to the sequence's `on_token` callback."""
+        piece = seq.detokenizer.step(seq.generated, final=final)
+        if piece:
+            try:
+                seq.on_token(piece)
+            except Exception as e:
+                print(f"Token callback failed for a '{self.name}' sequence: {e}")
+
+    def _retire(self):
+        """Resolves finished sequences and shrinks the batch to the remaining ones."""
+        keep = []
+        for i, seq in enumerate(self._active):
+            last = seq.generated[-1]
+            if last in self._eos_ids:
+                self._finish(seq, "stop")
+            elif len(seq.generated) >= seq.max_new_tokens:
+                self._finish(seq, "length")
+            elif self._is_cancelled(seq):
+                self._finish(seq, "cancelled")
+            else:
+                keep.append(i)
+
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset_batch()
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        self._active = [self._active[i] for i in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+        if hasattr(self._cache, "batch_select_indices"):
+            self._cache.batch_select_indices(index)
+        else:
+            # Legacy tuple-of-tuples cache layout.
+            self._cache = tuple(tuple(t.index_select(0, index) for t in layer) for layer in self._cache)
+
+    @staticmethod
+    def _is_cancelled(seq: _Sequence) -> bool:
+        return seq.cancelled is not None and seq.cancelled.is_set()
+
+    def _finish(self, seq: _Sequence, finish_reason: str):
+        if seq.on_token is not None:
+            self._emit(seq, final=True)
+        # A sequence cancelled while queued was never admitted.
+        now = time.monotonic()
+        admitted_at = seq.admitted_at or now
+        first_token_at = seq.first_token_at or now
+        completion = self.tokenizer.decode(seq.generated, skip_special_tokens=True)
+        text = self.tokenizer.decode(seq.prompt_ids + seq.generated, skip_special_tokens=True)
+        seq.future.set_result(GenerationResult(
+            text=text,
+            completion=completion,
+            prompt_tokens=len(seq.prompt_ids),
+            completion_tokens=len(seq.generated),
+            finish_reason=finish_reason,
+            queue_seconds=admitted_at - seq.enqueued_at,
+            prefill_seconds=first_token_at - admitted_at,
+            decode_seconds=now - first_token_at,
+        ))
+        with self._stats_lock:
+            self._stats["sequences_cancelled" if finish_reason == "cancelled" else "sequences_completed"] += 1
+
+    def _fail_active(self, error: Exception):
+        for seq in self._active:
+            if not seq.future.done():
+                seq.future.set_exception(error)
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._active = []
+        self._cache = None
+        self._attention_mask = None
+        self._positions = None
+        self._steps_since_prefill = 0
+
+    def _record_pass(self, batch_size: int, elapsed: float, prefill: bool):
+        with self._stats_lock:
+            self._stats["forward_passes"] += 1
+            self._stats["prefills"] += int(prefill)
+            self._stats["tokens_generated"] += batch_size
+            self._stats["batch_size_sum"] += batch_size
+            self._stats["busy_seconds"] += elapsed
+        BATCH_SIZE.labels(model=self.name).observe(batch_size)
+        BATCH_GENERATED_TOKENS.labels(model=self.name).inc(batch_size)
+        if elapsed > 0:
+            BATCH_TOKENS_PER_SECOND.labels(model=self.name).set(batch_size / elapsed)
+
+
+# --- Per-Model Registry ---
+_batchers: Dict[str, ContinuousBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model_name: str, pipe) -> ContinuousBatcher:
+    """
+    Returns the batcher for `model_name`, creating it around `pipe` on first use.
+    A new batcher is built if the pipeline behind the name has been replaced.
+    """
+    with _batchers_lock:
+        batcher = _batchers.get(model_name)
+        if batcher is None or batcher.model is not pipe.model:
+            if batcher is not None:
+                batcher.close()
+            batcher = ContinuousBatcher.from_pipeline(pipe, name=model_name)
+            _batchers[model_name] = batcher
+        return batcher
+
+
+def close_batcher(model_name: str):
+    """Stops and forgets the batcher for `model_name`, e.g. when its model is unloaded."""
+    with _batchers_lock:
+        batcher = _batchers.pop(model_name, None)
+    if batcher is not None:
+        batcher.close()
+
+
+def get_batcher_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the throughput figures of every running batcher, keyed by model name."""
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {name: batcher.stats() for name, batcher in batchers.items()}
@@ -5,11 +5,12 @@ from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
 
 # --- Model Metadata ---
 MODEL_ID = "google/gemma-2b-it"
-COST_PER_JOB = 0.001 # USD
+PRICE_PER_1K_PROMPT_TOKENS = 0.0005 # USD
+PRICE_PER_1K_COMPLETION_TOKENS = 0.0015 # USD
 
-def get_cost() -> float:
-    """Returns the cost in USD for a single job with this model."""
-    return COST_PER_JOB
+def get_price() -> dict:
+    """Returns the price in USD per 1,000 prompt and per 1,000 completion tokens."""
+    return {"prompt": PRICE_PER_1K_PROMPT_TOKENS, "completion": PRICE_PER_1K_COMPLETION_TOKENS}
 
 def load_model():
     """
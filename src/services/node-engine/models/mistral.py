@@ -2,12 +2,15 @@ import torch
 from threading import Thread
 from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
 from .base import BaseModel
+from .prefix_cache import PrefixCache, PREFIX_CACHE_ENABLED
 
 class MistralModel(BaseModel):
     def __init__(self, model_id="mistralai/Mistral-7B-v0.1"):
         self.model_id = model_id
         self.model = None
         self.tokenizer = None
+        # Shared system/few-shot prefixes are prefilled once, then resumed from their KV cache.
+        self.prefix_cache = PrefixCache(name=model_id) if PREFIX_CACHE_ENABLED else None
 
     def load(self):
         """Loads the Mistral model and tokenizer with 4-bit quantization."""
@@ -33,7 +36,10 @@ class MistralModel(BaseModel):
 
         gen_kwargs = {"max_new_tokens": 150, "temperature": 0.7, **kwargs}
         
-        outputs = self.model.generate(**input_ids, **gen_kwargs)
+        if self.prefix_cache is not None:
+            outputs = self.prefix_cache.generate(self.model, **input_ids, **gen_kwargs)
+        else:
+            outputs = self.model.generate(**input_ids, **gen_kwargs)
         generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         
         if generated_text.startswith(prompt):
@@ -57,7 +63,10 @@ class MistralModel(BaseModel):
         }
 
         # Run generation in a separate thread
-        thread = Thread(target=self.model.generate, kwargs={**inputs, **gen_kwargs})
+        if self.prefix_cache is not None:
+            thread = Thread(target=self.prefix_cache.generate, args=(self.model,), kwargs={**inputs, **gen_kwargs})
+        else:
+            thread = Thread(target=self.model.generate, kwargs={**inputs, **gen_kwargs})
         thread.start()
 
         # Yield the tokens as they become available
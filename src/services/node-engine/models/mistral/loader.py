@@ -1,15 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+
 import torch
 from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
 
 # --- Model Metadata ---
 MODEL_ID = "mistralai/Mistral-7B-Instruct-v0.2"
-COST_PER_JOB = 0.002 # USD
+PRICE_PER_1K_PROMPT_TOKENS = 0.001 # USD
+PRICE_PER_1K_COMPLETION_TOKENS = 0.003 # USD
+# Speculative decoding (see models/speculative.py): a registered model with
+# Mistral's tokenizer that drafts tokens for this one. Gemma's vocabulary
+# differs, so no draft is configured unless one is deployed alongside.
+DRAFT_MODEL = os.getenv("MISTRAL_DRAFT_MODEL") or None
+DRAFT_TOKENS = int(os.getenv("MISTRAL_DRAFT_TOKENS", "4"))
 
-def get_cost() -> float:
-    """Returns the cost in USD for a single job with this model."""
-    return COST_PER_JOB
+def get_price() -> dict:
+    """Returns the price in USD per 1,000 prompt and per 1,000 completion tokens."""
+    return {"prompt": PRICE_PER_1K_PROMPT_TOKENS, "completion": PRICE_PER_1K_COMPLETION_TOKENS}
 
 def load_model():
     """
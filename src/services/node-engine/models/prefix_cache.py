@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reuse of prompt KV caches across requests that share a token prefix.
+
+Prompts often begin with the same system or few-shot text, and each request
+otherwise prefills that text again. `PrefixCache` keeps the past-key-values
+of recent prompts in a radix tree keyed by token ID. For a new prompt, it
+walks the tree as far as the prompt matches. The KV cache of any entry below
+that point covers the shared tokens, because a causal model's keys and values
+for a token depend only on the tokens before it. That cache is cropped to the
+matched length, and decoding resumes from there, so only the rest of the
+prompt is prefilled.
+
+Entries are evicted least recently used first once the cached tokens exceed
+`PREFIX_CACHE_MAX_TOKENS`. Only models using the standard dynamic KV cache
+are supported; others are generated without the cache.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from ..metrics import PREFIX_CACHE_LOOKUPS, PREFIX_CACHE_TOKENS_SAVED, PREFIX_CACHE_CACHED_TOKENS
+
+# --- Configuration ---
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+PREFIX_CACHE_MAX_TOKENS = int(os.getenv("PREFIX_CACHE_MAX_TOKENS", "32768"))
+# Shorter shared prefixes are not worth a cache lookup and copy.
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "16"))
+
+# One (key, value) pair per layer, each shaped (batch, heads, tokens, head_dim).
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+def _crop(kv: LegacyCache, length: int) -> LegacyCache:
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in kv)
+
+
+def _kv_bytes(kv: LegacyCache) -> int:
+    return sum(t.numel() * t.element_size() for layer in kv for t in layer)
+
+
+def _to_legacy(cache) -> Optional[LegacyCache]:
+    """The per-layer tensors of a KV cache, or None for cache types we cannot crop."""
+    if isinstance(cache, DynamicCache):
+        return cache.to_legacy_cache()
+    if isinstance(cache, tuple) and cache and all(isinstance(layer, tuple) for layer in cache):
+        return cache
+    return None
+
+
+class _Node:
+    __slots__ = ("tokens", "children", "parent", "kv", "last_used")
+
+    def __init__(self, tokens: Tuple[int, ...] = (), parent: Optional["_Node"] = None):
+        self.tokens = tokens  # Edge label from the parent
+        self.children: Dict[int, "_Node"] = {}
+        self.parent = parent
+        self.kv: Optional[LegacyCache] = None  # Covers every token from the root to this node
+        self.last_used = 0.0
+
+
+class PrefixCache:
+    """
+    Radix tree of prompt KV caches with LRU eviction. Safe to share between threads.
+    """
+    def __init__(self, name: str = "model", max_tokens: int = PREFIX_CACHE_MAX_TOKENS,
+                 min_prefix_tokens: int = PREFIX_CACHE_MIN_TOKENS):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.min_prefix_tokens = max(min_prefix_tokens, 1)
+        self._root = _Node()
+        self._entries: Dict[_Node, int] = {}  # node -> cached tokens
+        self._cached_tokens = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "prefill_tokens": 0, "tokens_saved": 0}
+
+    # --- Radix Tree ---
+
+    def _walk(self, ids: Sequence[int]) -> Tuple[_Node, int, Optional[_Node]]:
+        """
+        Follows `ids` down the tree. Returns the last node fully matched, the
+        number of tokens matched, and the child whose edge matched only partly.
+        """
+        node, depth = self._root, 0
+        while depth < len(ids):
+            child = node.children.get(ids[depth])
+            if child is None:
+                return node, depth, None
+            shared = 0
+            for a, b in zip(child.tokens, ids[depth:]):
+                if a != b:
+                    break
+                shared += 1
+            if shared < len(child.tokens):
+                return node, depth + shared, child
+            node, depth = child, depth + shared
+        return node, depth, None
+
+    @staticmethod
+    def _newest_entry(node: _Node) -> Optional[_Node]:
+        """The most recently used node with a KV cache in `node`'s subtree."""
+        best, stack = None, [node]
+        while stack:
+            current = stack.pop()
+            if current.kv is not None and (best is None or current.last_used > best.last_used):
+                best = current
+            stack.extend(current.children.values())
+        return best
+
+    def match(self, ids: Sequence[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        Returns `(length, kv)` for the longest cached prefix of `ids`, where
+        `kv` covers the first `length` tokens. At least one token is always
+        left for the model to process. Returns `(0, None)` on a miss.
+        """
+        ids = list(ids)[:-1]
+        with self._lock:
+            node, depth, partial = self._walk(ids)
+            source = self._newest_entry(partial or node) if depth >= self.min_prefix_tokens else None
+            if source is None:
+                PREFIX_CACHE_LOOKUPS.labels(model=self.name, result="miss").inc()
+                return 0, None
+            source.last_used = time.monotonic()
+            # Slice while locked: a concurrent insert or eviction may drop `source.kv`.
+            kv = _crop(source.kv, depth)
+        PREFIX_CACHE_LOOKUPS.labels(model=self.name, result="hit").inc()
+        return depth, kv
+
+    def insert(self, ids: Sequence[int], kv: LegacyCache):
+        """Caches `kv`, which covers the first `len(ids)` tokens of a prompt."""
+        ids = tuple(ids)
+        if len(ids) < self.min_prefix_tokens or len(ids) > self.max_tokens:
+            return
+        with self._lock:
+            node, depth, partial = self._walk(ids)
+            if partial is not None:
+                # Split the partly matched edge at the divergence point.
+                split = depth - sum(len(n.tokens) for n in self._path(node))
+                middle = _Node(partial.tokens[:split], parent=node)
+                node.children[middle.tokens[0]] = middle
+                partial.tokens = partial.tokens[split:]
+                partial.parent = middle
+                middle.children[partial.tokens[0]] = partial
+                node = middle
+            if depth < len(ids):
+                leaf = _Node(ids[depth:], parent=node)
+                node.children[leaf.tokens[0]] = leaf
+                node = leaf
+            now = time.monotonic()
+            descendant = self._newest_entry(node)
+            if descendant is not None:
+                # This prompt, or a longer one starting with it, is already cached.
+                descendant.last_used = now
+                return
+            # Copy out of the generation's buffers so they can be freed.
+            node.kv = tuple((k.clone(), v.clone()) for k, v in _crop(kv, len(ids)))
+            node.last_used = now
+            self._cached_tokens += len(ids)
+            self._entries[node] = len(ids)
+            # Shorter entries on the path are now redundant, so entries are always leaves.
+            ancestor = node.parent
+            while ancestor is not None:
+                if ancestor.kv is not None:
+                    self._drop(ancestor)
+                ancestor = ancestor.parent
+            self._evict(keep=node)
+            PREFIX_CACHE_CACHED_TOKENS.labels(model=self.name).set(self._cached_tokens)
+
+    def _path(self, node: _Node) -> List[_Node]:
+        path = []
+        while node is not None and node is not self._root:
+            path.append(node)
+            node = node.parent
+        return path
+
+    def _drop(self, node: _Node):
+        node.kv = None
+        self._cached_tokens -= self._entries.pop(node)
+
+    def _prune(self, node: _Node):
+        """Removes `node` and its ancestors while they hold neither a cache nor children."""
+        while node is not self._root and node.kv is None and not node.children:
+            parent = node.parent
+            del parent.children[node.tokens[0]]
+            node = parent
+
+    def _evict(self, keep: _Node):
+        while self._cached_tokens > self.max_tokens:
+            candidates = [n for n in self._entries if n is not keep]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda n: n.last_used)
+            self._drop(oldest)
+            self._prune(oldest)
+
+    # --- Generation ---
+
+    def generate(self, model, input_ids: torch.Tensor, **gen_kwargs):
+        """
+        `model.generate` for a single prompt, resuming from the longest
+        cached prefix and caching the prompt's KV afterwards.
+        """
+        if input_ids.shape[0] != 1 or "past_key_values" in gen_kwargs:
+            return model.generate(input_ids=input_ids, **gen_kwargs)
+
+        ids = input_ids[0].tolist()
+        gen_kwargs.setdefault("attention_mask", torch.ones_like(input_ids))
+        return_dict = gen_kwargs.pop("return_dict_in_generate", False)
+
+        length, kv = self.match(ids)
+        if kv is not None:
+            gen_kwargs["past_key_values"] = DynamicCache.from_legacy_cache(kv)
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["hits"] += kv is not None
+            self._stats["prefill_tokens"] += len(ids) - length
+            self._stats["tokens_saved"] += length
+        PREFIX_CACHE_TOKENS_SAVED.labels(model=self.name).inc(length)
+
+        outputs = model.generate(input_ids=input_ids, return_dict_in_generate=True, **gen_kwargs)
+        full_kv = _to_legacy(outputs.past_key_values)
+        if full_kv is not None:
+            self.insert(ids, full_kv)
+        return outputs if return_dict else outputs.sequences
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["cached_tokens"] = self._cached_tokens
+            snapshot["cached_bytes"] = sum(_kv_bytes(n.kv) for n in self._entries)
+        return snapshot
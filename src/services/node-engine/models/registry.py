@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Registry of the model plugins found under `models/*/loader.py`.
+
+Plugins are discovered up front, which only imports each loader to read its
+metadata. Weights are loaded the first time a model is used. Each loaded
+pipeline's memory is tracked. When the total exceeds `MODEL_MEMORY_BUDGET_MB`,
+the least recently used models are unloaded, except pinned models and models
+serving a request.
+"""
+import gc
+import importlib.util
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .batching import close_batcher
+from .speculative import SPECULATIVE_DRAFT_TOKENS, close_speculative_decoders
+from ..metering import TokenPrice
+from ..metrics import MODEL_LOADS, MODEL_EVICTIONS, MODEL_LOAD_SECONDS, MODEL_RESIDENT_BYTES
+
+# --- Configuration ---
+# Total memory the loaded models may use; 0 disables eviction.
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# Comma-separated models that are never evicted and are loaded at worker start.
+MODEL_PINNED = [name.strip().lower() for name in os.getenv("MODEL_PINNED", "").split(",") if name.strip()]
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    loader: Any
+    price: TokenPrice
+    revision: str = ""
+    pinned: bool = False
+    # A smaller model sharing the tokenizer, for speculative decoding.
+    draft: Optional[str] = None
+    draft_tokens: int = SPECULATIVE_DRAFT_TOKENS
+    pipeline: Any = None
+    memory_bytes: int = 0
+    last_used: float = 0.0
+    in_use: int = 0
+    load_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process, or 0 where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _available_bytes() -> int:
+    """Memory the OS can still hand out (MemAvailable), or 0 where /proc is unavailable."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def pipeline_memory_bytes(pipe) -> int:
+    """Bytes held by a pipeline's parameters and buffers (0 if it has no torch model)."""
+    model = getattr(pipe, "model", pipe)
+    if not hasattr(model, "parameters"):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, memory-bounded set of model pipelines.
+    """
+    def __init__(self, models_dir: Path, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB,
+                 pinned: Iterable[str] = MODEL_PINNED):
+        self.models_dir = Path(models_dir)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.pinned = {name.lower() for name in pinned}
+        self._entries: Dict[str, ModelEntry] = {}
+        self._lock = threading.Lock()
+
+    # --- Discovery ---
+
+    def discover(self):
+        """Imports every `loader.py` to register its model, without loading weights."""
+        if not self.models_dir.is_dir():
+            print(f"Models directory not found at: {self.models_dir}")
+            return
+
+        for model_dir in sorted(self.models_dir.iterdir()):
+            loader_path = model_dir / "loader.py"
+            if not loader_path.is_file():
+                continue
+            model_name = model_dir.name.lower()
+            try:
+                spec = importlib.util.spec_from_file_location(f"models.{model_dir.name}.loader", loader_path)
+                loader = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(loader)
+                self.register(model_name, loader)
+            except Exception as e:
+                print(f"Failed to register model plugin '{model_name}'. Error: {e}")
+
+    def register(self, name: str, loader):
+        """
+        Registers a plugin module (or any object) providing `get_price()` and
+        `load_model()`. The first registration of a name wins.
+        """
+        name = name.lower()
+        # Identifies the weights, so cached results never outlive a model upgrade.
+        revision = str(getattr(loader, "MODEL_REVISION", getattr(loader, "MODEL_ID", name)))
+        draft = getattr(loader, "DRAFT_MODEL", None)
+        entry = ModelEntry(name, loader, TokenPrice.from_loader(loader), revision=revision,
+                           pinned=name in self.pinned, draft=draft.lower() if draft else None,
+                           draft_tokens=int(getattr(loader, "DRAFT_TOKENS", SPECULATIVE_DRAFT_TOKENS)))
+        with self._lock:
+            self._entries.setdefault(name, entry)
+        print(f"Registered model plugin: '{name}'")
+
+    def preload_pinned(self):
+        """Loads the pinned models so the first requests for them do not wait."""
+        for name in sorted(self.pinned):
+            if name in self._entries:
+                try:
+                    with self.use(name):
+                        pass
+                except Exception as e:
+                    print(f"Failed to preload pinned model '{name}'. Error: {e}")
+
+    # --- Lookup ---
+
+    def names(self) -> List[str]:
+        """Every model this worker can serve, loaded or not."""
+        return list(self._entries)
+
+    def loaded(self) -> List[str]:
+        """Models whose weights are currently in memory."""
+        with self._lock:
+            return [name for name, entry in self._entries.items() if entry.pipeline is not None]
+
+    def prices(self) -> Dict[str, TokenPrice]:
+        return {name: entry.price for name, entry in self._entries.items()}
+
+    def price(self, name: str) -> Optional[TokenPrice]:
+        entry = self._entries.get(name.lower())
+        return entry.price if entry else None
+
+    def revision(self, name: str) -> Optional[str]:
+        entry = self._entries.get(name.lower())
+        return entry.revision if entry else None
+
+    def draft(self, name: str) -> Optional[Tuple[str, int]]:
+        """The registered draft model of `name` and its tokens per pass, if the plugin declares one."""
+        entry = self._entries.get(name.lower())
+        if entry is None or entry.draft is None or entry.draft == entry.name:
+            return None
+        if entry.draft not in self._entries:
+            print(f"Draft model '{entry.draft}' of '{entry.name}' is not registered; decoding without it.")
+            return None
+        return entry.draft, entry.draft_tokens
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Yields the pipeline for `name`, loading it first if needed. The model
+        cannot be evicted while the block runs.
+
+        Raises:
+            KeyError: If no plugin provides `name`.
+        """
+        entry = self._entries.get(name.lower())
+        if entry is None:
+            raise KeyError(name)
+
+        with self._lock:
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+        try:
+            if entry.pipeline is None:
+                self._load(entry)
+            yield entry.pipeline
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+            # Models that were busy during an earlier load may be evictable now.
+            self._evict_until(self.memory_budget)
+
+    # --- Loading & Eviction ---
+
+    def _load(self, entry: ModelEntry):
+        with entry.load_lock:
+            if entry.pipeline is not None:
+                return
+            # Make room up front when the model's size is known from an earlier load.
+            if entry.memory_bytes:
+                self._evict_until(self.memory_budget - entry.memory_bytes, keep=entry.name)
+
+            print(f"Loading model '{entry.name}'...")
+            rss_before = _rss_bytes()
+            started = time.perf_counter()
+            pipeline = entry.loader.load_model()
+            elapsed = time.perf_counter() - started
+            memory = pipeline_memory_bytes(pipeline) or max(_rss_bytes() - rss_before, 0)
+
+            with self._lock:
+                entry.pipeline = pipeline
+                entry.memory_bytes = memory
+            MODEL_LOADS.labels(model=entry.name).inc()
+            MODEL_LOAD_SECONDS.labels(model=entry.name).observe(elapsed)
+            MODEL_RESIDENT_BYTES.labels(model=entry.name).set(memory)
+            print(f"Loaded model '{entry.name}' in {elapsed:.1f}s ({memory / 2**20:.0f} MiB).")
+
+        self._evict_until(self.memory_budget, keep=entry.name)
+
+    def _evict_until(self, budget: int, keep: Optional[str] = None):
+        """Unloads least recently used models until the loaded total fits in `budget`."""
+        if self.memory_budget <= 0:
+            return
+        evicted = []
+        with self._lock:
+            loaded = [e for e in self._entries.values() if e.pipeline is not None]
+            total = sum(e.memory_bytes for e in loaded)
+            if total <= budget:
+                return
+            candidates = sorted(
+                (e for e in loaded if not e.pinned and e.in_use == 0 and e.name != keep),
+                key=lambda e: e.last_used,
+            )
+            for entry in candidates:
+                if total <= budget:
+                    break
+                entry.pipeline = None
+                total -= entry.memory_bytes
+                evicted.append(entry.name)
+        if total > budget:
+            print(f"Loaded models use {total / 2**20:.0f} MiB, over the {budget / 2**20:.0f} MiB budget; "
+                  f"the rest are pinned or busy.")
+
+        for name in evicted:
+            self._release(name)
+        if evicted:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def evict(self, name: str) -> bool:
+        """Unloads `name` now unless it is serving a request. Returns True if it was unloaded."""
+        entry = self._entries.get(name.lower())
+        with self._lock:
+            if entry is None or entry.pipeline is None or entry.in_use:
+                return False
+            entry.pipeline = None
+        self._release(entry.name)
+        gc.collect()
+        return True
+
+    def _release(self, name: str):
+        close_batcher(name)
+        close_speculative_decoders(name)
+        MODEL_EVICTIONS.labels(model=name).inc()
+        MODEL_RESIDENT_BYTES.labels(model=name).set(0)
+        print(f"Evicted model '{name}'.")
+
+    def free_memory_bytes(self) -> int:
+        """Room left under the memory budget, or the host's available memory without one."""
+        if self.memory_budget <= 0:
+            return _available_bytes()
+        with self._lock:
+            used = sum(e.memory_bytes for e in self._entries.values() if e.pipeline is not None)
+        return max(self.memory_budget - used, 0)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "loaded": entry.pipeline is not None,
+                    "pinned": entry.pinned,
+                    "in_use": entry.in_use,
+                    "memory_bytes": entry.memory_bytes,
+                }
+                for name, entry in self._entries.items()
+            }
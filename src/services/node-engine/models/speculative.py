@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Speculative decoding for greedy generations.
+
+A small draft model that shares the target model's tokenizer proposes up to
+`k` tokens, one cheap forward pass each. The target model then scores all of
+them in one forward pass. The proposals are accepted up to the first one the
+target would not have picked itself. That position gets the target's own
+token instead, and if every proposal was accepted the same pass yields one
+bonus token. Each target pass therefore produces between 1 and `k + 1`
+tokens, and the output is the target's greedy output. Numerically it may
+differ only where a multi-token pass and a single-token pass round
+differently, as with any change of batch shape.
+
+Pairs are declared by the target's plugin (`DRAFT_MODEL`, `DRAFT_TOKENS` in
+its `loader.py`) and used when `SPECULATIVE_DECODING` is on and a request is
+greedy (temperature 0). A request decodes alone rather than in the
+continuous batch, which trades throughput for latency on a lightly loaded
+worker. The proposed and accepted token counters give the acceptance rate.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from .batching import GenerationResult, IncrementalDetokenizer
+from ..metrics import SPECULATIVE_ACCEPTED_TOKENS, SPECULATIVE_PROPOSED_TOKENS, SPECULATIVE_TARGET_PASSES
+
+# --- Configuration ---
+SPECULATIVE_DECODING = os.getenv("SPECULATIVE_DECODING", "false").lower() == "true"
+# Draft tokens per target pass when a plugin does not set DRAFT_TOKENS.
+SPECULATIVE_DRAFT_TOKENS = int(os.getenv("SPECULATIVE_DRAFT_TOKENS", "4"))
+
+
+def vocabularies_match(target_tokenizer, draft_tokenizer) -> bool:
+    """Token IDs mean the same to both models only if their vocabularies are identical."""
+    return target_tokenizer.get_vocab() == draft_tokenizer.get_vocab()
+
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding of one sequence with a target and a draft model.
+    """
+    def __init__(self, target, draft, tokenizer, name: str = "model", draft_tokens: int = SPECULATIVE_DRAFT_TOKENS):
+        self.target = target
+        self.draft = draft
+        self.tokenizer = tokenizer
+        self.name = name
+        self.draft_tokens = max(1, draft_tokens)
+
+        eos = getattr(getattr(target, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self._eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+
+    @classmethod
+    def from_pipelines(cls, target_pipe, draft_pipe, name: str, **kwargs) -> "SpeculativeDecoder":
+        return cls(target_pipe.model, draft_pipe.model, target_pipe.tokenizer, name=name, **kwargs)
+
+    def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 150,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> GenerationResult:
+        """
+        Decodes greedily and returns a `GenerationResult` whose
+        `proposed_tokens`/`accepted_tokens` describe the draft's hit rate.
+        `on_token` receives each newly decoded piece of text; setting
+        `cancelled` stops the generation after the current target pass.
+        """
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        if not prompt_ids:
+            bos = self.tokenizer.bos_token_id
+            prompt_ids = [bos if bos is not None else self.tokenizer.eos_token_id or 0]
+        max_new_tokens = max(1, int(max_new_tokens))
+        started = time.monotonic()
+
+        target_cache, draft_cache = DynamicCache(), DynamicCache()
+        with torch.no_grad():
+            # The first token comes from the target's pass over the prompt;
+            # the draft only needs the prompt in its cache.
+            logits = self._forward(self.target, target_cache, prompt_ids)
+            generated = [int(logits[-1].argmax())]
+            first_token_at = time.monotonic()
+            passes, proposed, accepted = 1, 0, 0
+            detokenizer = IncrementalDetokenizer(self.tokenizer)
+            self._emit(generated, detokenizer, on_token)
+
+            finish_reason = self._finish_reason(generated, max_new_tokens)
+            while finish_reason is None:
+                if cancelled is not None and cancelled.is_set():
+                    finish_reason = "cancelled"
+                    break
+                sequence = prompt_ids + generated
+                # Leave room for the target's own token after the proposals.
+                k = min(self.draft_tokens, max_new_tokens - len(generated) - 1)
+                drafts = self._propose(draft_cache, sequence, k)
+
+                # One target pass scores the last token and every proposal.
+                logits = self._forward(self.target, target_cache, sequence[-1:] + drafts)
+                choices = logits.argmax(dim=-1).tolist()
+                n = 0
+                while n < len(drafts) and drafts[n] == choices[n]:
+                    n += 1
+                new_tokens = drafts[:n] + [choices[n]]
+                passes, proposed, accepted = passes + 1, proposed + len(drafts), accepted + n
+
+                # Forget what the target cached for the rejected proposals.
+                target_cache.crop(len(sequence) + n)
+                if draft_cache.get_seq_length() > len(sequence) + n:
+                    draft_cache.crop(len(sequence) + n)
+
+                for token in new_tokens:
+                    generated.append(token)
+                    finish_reason = self._finish_reason(generated, max_new_tokens)
+                    if finish_reason is not None:
+                        break
+                self._emit(generated, detokenizer, on_token)
+
+        SPECULATIVE_TARGET_PASSES.labels(model=self.name).inc(passes)
+        SPECULATIVE_PROPOSED_TOKENS.labels(model=self.name).inc(proposed)
+        SPECULATIVE_ACCEPTED_TOKENS.labels(model=self.name).inc(accepted)
+        self._emit(generated, detokenizer, on_token, final=True)
+        return GenerationResult(
+            text=self.tokenizer.decode(prompt_ids + generated, skip_special_tokens=True),
+            completion=self.tokenizer.decode(generated, skip_special_tokens=True),
+            prompt_tokens=len(prompt_ids),
+            completion_tokens=len(generated),
+            finish_reason=finish_reason,
+            prefill_seconds=first_token_at - started,
+            decode_seconds=time.monotonic() - first_token_at,
+            proposed_tokens=proposed,
+            accepted_tokens=accepted,
+        )
+
+    # --- Decoding Steps ---
+
+    def _forward(self, model, cache: DynamicCache, input_ids: List[int]) -> torch.Tensor:
+        """Feeds tokens that are not cached yet and returns their logits, one row per token."""
+        outputs = model(
+            input_ids=torch.tensor([input_ids], dtype=torch.long, device=model.device),
+            past_key_values=cache,
+            use_cache=True,
+        )
+        return outputs.logits[0].float()
+
+    def _propose(self, cache: DynamicCache, sequence: List[int], k: int) -> List[int]:
+        """Greedily drafts `k` tokens after `sequence`, catching the draft's cache up first."""
+        drafts: List[int] = []
+        pending = sequence[cache.get_seq_length():]
+        for _ in range(k):
+            logits = self._forward(self.draft, cache, pending)
+            token = int(logits[-1].argmax())
+            drafts.append(token)
+            pending = [token]
+        return drafts
+
+    def _finish_reason(self, generated: List[int], max_new_tokens: int) -> Optional[str]:
+        if generated[-1] in self._eos_ids:
+            return "stop"
+        if len(generated) >= max_new_tokens:
+            return "length"
+        return None
+
+    def _emit(self, generated: List[int], detokenizer: IncrementalDetokenizer,
+              on_token: Optional[Callable[[str], None]], final: bool = False):
+        """Passes newly decoded text to `on_token`."""
+        if on_token is None:
+            return
+        piece = detokenizer.step(generated, final=final)
+        if not piece:
+            return
+        try:
+            on_token(piece)
+        except Exception as e:
+            print(f"Token callback failed for a speculative '{self.name}' sequence: {e}")
+
+
+# --- Per-Model Registry ---
+# Target name -> (draft name, target model, draft model, decoder or None if the pair is unusable).
+_decoders: Dict[str, Tuple[str, object, object, Optional[SpeculativeDecoder]]] = {}
+_decoders_lock = threading.Lock()
+
+
+def get_speculative_decoder(model_name: str, target_pipe, draft_name: str, draft_pipe,
+                            draft_tokens: int = SPECULATIVE_DRAFT_TOKENS) -> Optional[SpeculativeDecoder]:
+    """
+    Returns the decoder for `model_name` drafting with `draft_pipe`, or None
+    if the two models do not share a vocabulary. Rebuilt when either
+    pipeline behind the pair has been replaced.
+    """
+    with _decoders_lock:
+        cached = _decoders.get(model_name)
+        if cached is not None and cached[1] is target_pipe.model and cached[2] is draft_pipe.model:
+            return cached[3]
+        decoder = None
+        if vocabularies_match(target_pipe.tokenizer, draft_pipe.tokenizer):
+            decoder = SpeculativeDecoder.from_pipelines(target_pipe, draft_pipe, name=model_name,
+                                                        draft_tokens=draft_tokens)
+        else:
+            print(f"Draft model '{draft_name}' does not share the vocabulary of '{model_name}'; "
+                  f"decoding without it.")
+        _decoders[model_name] = (draft_name, target_pipe.model, draft_pipe.model, decoder)
+        return decoder
+
+
+def close_speculative_decoders(model_name: str):
+    """Drops the decoders that use `model_name` as target or draft, so an unloaded model can be freed."""
+    with _decoders_lock:
+        for name, (draft_name, *_) in list(_decoders.items()):
+            if model_name in (name, draft_name):
+                del _decoders[name]
@@ -3,10 +3,14 @@
 import os
 import json
 from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from dotenv import load_dotenv
 
+from .settlement import SettlementOutbox, SettlementPipeline, SETTLEMENT_DB_PATH
+
 # --- Configuration & Setup ---
 
 # Load environment variables from .env file
@@ -17,6 +21,11 @@ RPC_URL = os.environ.get("RPC_URL")
 DEAI_TOKEN_CONTRACT_ADDRESS = os.environ.get("DEAI_TOKEN_CONTRACT_ADDRESS")
 OPERATOR_PRIVATE_KEY = os.environ.get("OPERATOR_PRIVATE_KEY")
 OPERATOR_ADDRESS = os.environ.get("OPERATOR_ADDRESS")
+ONCHAIN_MAX_CONNECTIONS = int(os.environ.get("ONCHAIN_MAX_CONNECTIONS", "32"))
+ONCHAIN_CALL_TIMEOUT_SECONDS = float(os.environ.get("ONCHAIN_CALL_TIMEOUT_SECONDS", "5"))
+# Processes sharing SETTLEMENT_DB_PATH elect one flusher through a lease in
+# the outbox (see settlement.py); disable to only accrue from this process.
+SETTLEMENT_FLUSH_ENABLED = os.environ.get("SETTLEMENT_FLUSH_ENABLED", "true").lower() == "true"
 
 # --- ABI Loading ---
 # Load the ABI from the contract artifact
@@ -37,7 +46,14 @@ class OnChainService:
     Handles checking token allowances and processing payments via `transferFrom`.
     """
     def __init__(self):
-        self.w3 = Web3(Web3.HTTPProvider(RPC_URL))
+        # One keep-alive pool for every call, instead of a connection per request.
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ONCHAIN_MAX_CONNECTIONS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.w3 = Web3(Web3.HTTPProvider(
+            RPC_URL, session=session, request_kwargs={"timeout": ONCHAIN_CALL_TIMEOUT_SECONDS}
+        ))
         # Inject middleware for PoA chains like Polygon, Rinkeby, etc.
         self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
@@ -58,6 +74,14 @@ class OnChainService:
 
         # Get token decimals for conversions
         self.token_decimals = self.token_contract.functions.decimals().call()
+
+        # Charges are accrued locally and settled in aggregated transfers.
+        self.settlement = SettlementPipeline(
+            self.w3, self.token_contract, self.operator_account,
+            SettlementOutbox(SETTLEMENT_DB_PATH), self.token_decimals,
+        )
+        if SETTLEMENT_FLUSH_ENABLED:
+            self.settlement.start()
         print("OnChainService initialized successfully.")
 
     def _convert_usd_to_token_units(self, amount_usd: float) -> int:
@@ -68,17 +92,22 @@ class OnChainService:
         """
         return int(amount_usd * (10 ** self.token_decimals))
 
-    def process_payment(self, user_address: str, amount_usd: float) -> bool:
+    def process_payment(self, user_address: str, amount_usd: float, job_id: str = None) -> bool:
         """
-        Checks a user's token allowance for the operator and, if sufficient, 
-        executes `transferFrom` to process the payment.
+        Checks a user's token allowance for the operator and, if sufficient,
+        accrues the charge for settlement.
+
+        The `transferFrom` happens later, aggregated with the user's other
+        charges, in the settlement pipeline's next flush. Passing the job id
+        makes repeated calls for the same job charge it only once.
 
         Args:
             user_address: The user's wallet address.
             amount_usd: The cost of the job in USD.
+            job_id: Optional unique id of the job being charged.
 
         Returns:
-            True if the payment was successfully processed, False otherwise.
+            True if the charge was accepted, False otherwise.
         """
         try:
             user_address_checksum = self.w3.to_checksum_address(user_address)
@@ -93,34 +122,10 @@ class OnChainService:
                 print(f"Insufficient allowance for user {user_address_checksum}")
                 return False
 
-            # 2. Build & Sign Transaction
-            print("Allowance is sufficient. Building transaction...")
-            nonce = self.w3.eth.get_transaction_count(self.operator_address)
-            tx = self.token_contract.functions.transferFrom(
-                user_address_checksum,
-                self.operator_address,
-                token_amount
-            ).build_transaction({
-                'chainId': self.w3.eth.chain_id,
-                'gas': 200000, # Can be estimated with .estimateGas()
-                'gasPrice": self.w3.eth.gas_price,
-                'nonce': nonce,
-            })
-
-            signed_tx = self.w3.eth.account.sign_transaction(tx, private_key=self.operator_account.key)
-
-            # 3. Send Transaction & Wait for Receipt
-            print("Sending transaction...")
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-
-            # 4. Check Receipt Status
-            if tx_receipt['status'] == 1:
-                print(f"Successfully processed payment of {amount_usd} USD from {user_address_checksum}")
-                return True
-            else:
-                print(f"On-chain transaction failed for user {user_address_checksum}")
-                return False
+            # 2. Accrue for the next settlement flush
+            self.settlement.accrue(user_address_checksum, amount_usd, job_id)
+            print(f"Accrued payment of {amount_usd} USD from {user_address_checksum} for settlement")
+            return True
 
         except Exception as e:
             print(f"An error occurred during on-chain payment processing: {e}")
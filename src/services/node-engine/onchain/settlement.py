@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched on-chain settlement of job charges.
+
+Charges are accrued per user in a persistent SQLite outbox and periodically
+flushed as one aggregated `transferFrom` per user:
+
+1. `accrue` records a charge (idempotent per job id) without touching the chain.
+2. The flusher groups unsettled charges by user, signs a transfer with a
+   nonce from the local `NonceManager`, and persists the signed transaction
+   *before* broadcasting it, so a crash can only ever re-send the same
+   transaction with the same nonce.
+3. Transactions are broadcast back to back without waiting for receipts.
+4. A receipt tracker marks batches confirmed or failed. A batch whose nonce
+   was consumed by something else is marked dropped. The charges of dropped
+   and failed batches go back into the pool for the next flush.
+
+A transaction the node keeps rejecting is re-signed at the same nonce after
+`SETTLEMENT_MAX_BROADCAST_ATTEMPTS`, with a fresh gas price. Since it keeps
+its nonce, at most one version of a transfer can ever be mined. Every version
+is kept (`batch_transactions`), and the receipt tracker looks for each of
+them, so an earlier one that was mined after all is never taken for a drop.
+
+Nonces are allocated locally, so only one process may flush for a given
+outbox. The processes sharing the outbox elect that flusher through a lease
+row that the holder renews on every step. Any process can safely `accrue`.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import rlp
+from web3.exceptions import TransactionNotFound
+
+from ..balances.ledger import MICROS_PER_USD, to_micros, _ImmediateTransaction
+from ..metrics import (
+    SETTLEMENT_BROADCAST_FAILURES, SETTLEMENT_PENDING_CHARGES, SETTLEMENT_RELEASED_CHARGES, SETTLEMENT_TRANSFERS,
+)
+
+# --- Configuration ---
+SETTLEMENT_DB_PATH = os.getenv("SETTLEMENT_DB_PATH", "settlement.db")
+SETTLEMENT_FLUSH_SECONDS = float(os.getenv("SETTLEMENT_FLUSH_SECONDS", "30"))
+SETTLEMENT_RECEIPT_POLL_SECONDS = float(os.getenv("SETTLEMENT_RECEIPT_POLL_SECONDS", "5"))
+# Users owing less than this are carried over to a later flush.
+SETTLEMENT_MIN_AMOUNT_USD = float(os.getenv("SETTLEMENT_MIN_AMOUNT_USD", "0"))
+SETTLEMENT_GAS_LIMIT = int(os.getenv("SETTLEMENT_GAS_LIMIT", "200000"))
+# Rejected broadcasts of a batch before it is re-signed with a fresh gas price.
+SETTLEMENT_MAX_BROADCAST_ATTEMPTS = int(os.getenv("SETTLEMENT_MAX_BROADCAST_ATTEMPTS", "5"))
+# How long the flusher's lease outlives its last step; longer than a flush takes.
+SETTLEMENT_LEASE_SECONDS = float(os.getenv("SETTLEMENT_LEASE_SECONDS", "120"))
+
+# --- Batch States ---
+SIGNED = "signed"        # persisted, not yet accepted by the node
+SENT = "sent"            # accepted by the node, waiting for a receipt
+CONFIRMED = "confirmed"
+FAILED = "failed"        # mined but reverted; charges released
+DROPPED = "dropped"      # nonce used by another transaction; charges released
+
+
+class SettlementOutbox:
+    """
+    SQLite store of accrued charges and the transfer batches settling them.
+    Same connection handling as `SQLiteLedger`: WAL mode, one connection per thread.
+    """
+    def __init__(self, path: str = SETTLEMENT_DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS charges (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_address TEXT NOT NULL,
+                amount_micros INTEGER NOT NULL,
+                job_id TEXT UNIQUE,
+                batch_id INTEGER,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS charges_unbatched ON charges (batch_id, user_address);
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_address TEXT NOT NULL,
+                amount_micros INTEGER NOT NULL,
+                nonce INTEGER NOT NULL,
+                tx_hash TEXT NOT NULL,
+                raw_tx BLOB NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS batches_status ON batches (status);
+            CREATE TABLE IF NOT EXISTS batch_transactions (
+                tx_hash TEXT PRIMARY KEY,
+                batch_id INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS batch_transactions_batch ON batch_transactions (batch_id);
+            CREATE TABLE IF NOT EXISTS flush_lease (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_charge(self, user_address: str, amount_usd: float, job_id: Optional[str] = None) -> bool:
+        """Records a charge. Returns False if `job_id` was already charged."""
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO charges (user_address, amount_micros, job_id, created_at) VALUES (?, ?, ?, ?)",
+            (user_address, to_micros(amount_usd), job_id, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def unbatched_totals(self) -> List[Tuple[str, int, int]]:
+        """Returns `(user, total_micros, last_charge_id)` for every user with unsettled charges."""
+        return self._connection().execute(
+            "SELECT user_address, SUM(amount_micros), MAX(id) FROM charges "
+            "WHERE batch_id IS NULL GROUP BY user_address"
+        ).fetchall()
+
+    def create_batch(self, user_address: str, last_charge_id: int, amount_micros: int,
+                     nonce: int, tx_hash: str, raw_tx: bytes) -> Optional[int]:
+        """
+        Persists a signed transfer and claims the charges it settles. Returns
+        None without writing anything if the unclaimed charges up to
+        `last_charge_id` no longer add up to `amount_micros` (e.g. another
+        flusher claimed some); that transfer must not be sent.
+        """
+        now = time.time()
+        with _ImmediateTransaction(self._connection()) as conn:
+            # The write lock is held from here on, so the charges cannot be claimed in between.
+            claimable = conn.execute(
+                "SELECT COALESCE(SUM(amount_micros), 0) FROM charges "
+                "WHERE user_address = ? AND batch_id IS NULL AND id <= ?",
+                (user_address, last_charge_id),
+            ).fetchone()[0]
+            if claimable != amount_micros:
+                return None
+            cursor = conn.execute(
+                "INSERT INTO batches (user_address, amount_micros, nonce, tx_hash, raw_tx, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_address, amount_micros, nonce, tx_hash, raw_tx, SIGNED, now, now),
+            )
+            batch_id = cursor.lastrowid
+            conn.execute(
+                "INSERT INTO batch_transactions (tx_hash, batch_id, created_at) VALUES (?, ?, ?)",
+                (tx_hash, batch_id, now),
+            )
+            conn.execute(
+                "UPDATE charges SET batch_id = ? WHERE user_address = ? AND batch_id IS NULL AND id <= ?",
+                (batch_id, user_address, last_charge_id),
+            )
+        return batch_id
+
+    def transfer(self, batch_id: int) -> Tuple[str, int]:
+        """Returns `(user, amount_micros)` settled by a batch."""
+        return self._connection().execute(
+            "SELECT user_address, amount_micros FROM batches WHERE id = ?", (batch_id,)
+        ).fetchone()
+
+    def replace_transaction(self, batch_id: int, tx_hash: str, raw_tx: bytes):
+        """
+        Swaps a signed batch's transaction for one re-signed at the same nonce.
+        The hashes of the earlier versions stay in `batch_transactions`.
+        """
+        now = time.time()
+        with _ImmediateTransaction(self._connection()) as conn:
+            conn.execute("UPDATE batches SET tx_hash = ?, raw_tx = ?, updated_at = ? WHERE id = ?",
+                         (tx_hash, raw_tx, now, batch_id))
+            conn.execute("INSERT OR IGNORE INTO batch_transactions (tx_hash, batch_id, created_at) VALUES (?, ?, ?)",
+                         (tx_hash, batch_id, now))
+
+    def transaction_hashes(self, batch_id: int) -> List[str]:
+        """Every transaction ever signed for a batch, newest first."""
+        rows = self._connection().execute(
+            "SELECT tx_hash FROM batch_transactions WHERE batch_id = ? ORDER BY created_at DESC, rowid DESC",
+            (batch_id,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def batches(self, status: str) -> List[Tuple[int, str, int, bytes]]:
+        """Returns `(id, tx_hash, nonce, raw_tx)` for batches in `status`, oldest nonce first."""
+        return self._connection().execute(
+            "SELECT id, tx_hash, nonce, raw_tx FROM batches WHERE status = ? ORDER BY nonce", (status,)
+        ).fetchall()
+
+    def set_status(self, batch_id: int, status: str) -> int:
+        """Updates a batch; returns the number of charges released back to the pool."""
+        with _ImmediateTransaction(self._connection()) as conn:
+            conn.execute("UPDATE batches SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), batch_id))
+            if status in (DROPPED, FAILED):
+                return conn.execute("UPDATE charges SET batch_id = NULL WHERE batch_id = ?", (batch_id,)).rowcount
+        return 0
+
+    def acquire_lease(self, owner: str, ttl: float) -> bool:
+        """Takes or renews the flusher lease; False while another owner holds an unexpired one."""
+        now = time.time()
+        with _ImmediateTransaction(self._connection()) as conn:
+            row = conn.execute("SELECT owner, expires_at FROM flush_lease WHERE id = 1").fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO flush_lease (id, owner, expires_at) VALUES (1, ?, ?)",
+                         (owner, now + ttl))
+        return True
+
+    def release_lease(self, owner: str):
+        self._connection().execute("DELETE FROM flush_lease WHERE owner = ?", (owner,))
+
+    def max_nonce(self) -> Optional[int]:
+        """Highest nonce this outbox ever signed with, so a restart never reuses one."""
+        row = self._connection().execute(
+            "SELECT MAX(nonce) FROM batches WHERE status IN (?, ?)", (SIGNED, SENT)
+        ).fetchone()
+        return row[0]
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        pending = conn.execute("SELECT COUNT(*) FROM charges WHERE batch_id IS NULL").fetchone()[0]
+        by_status = dict(conn.execute("SELECT status, COUNT(*) FROM batches GROUP BY status").fetchall())
+        return {"pending_charges": pending, "batches": by_status}
+
+
+class NonceManager:
+    """
+    Hands out consecutive nonces for the operator without a chain lookup per transaction.
+    """
+    def __init__(self, w3, address: str):
+        self.w3 = w3
+        self.address = address
+        self._next: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def allocate(self, floor: Optional[int] = None) -> int:
+        """Returns the next nonce; `floor` is the lowest value acceptable after a resync."""
+        with self._lock:
+            if self._next is None:
+                self._next = self.w3.eth.get_transaction_count(self.address, "pending")
+                if floor is not None:
+                    self._next = max(self._next, floor)
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def reset(self):
+        """Forgets the local counter; the next allocation re-reads the pending count."""
+        with self._lock:
+            self._next = None
+
+
+class SettlementPipeline:
+    """
+    Accrues charges and settles them in aggregated, pipelined `transferFrom` calls.
+    """
+    def __init__(self, w3, token_contract, operator_account, outbox: SettlementOutbox, token_decimals: int,
+                 flush_interval: float = SETTLEMENT_FLUSH_SECONDS,
+                 receipt_poll_interval: float = SETTLEMENT_RECEIPT_POLL_SECONDS,
+                 min_amount_usd: float = SETTLEMENT_MIN_AMOUNT_USD,
+                 gas_limit: int = SETTLEMENT_GAS_LIMIT,
+                 max_broadcast_attempts: int = SETTLEMENT_MAX_BROADCAST_ATTEMPTS,
+                 lease_seconds: float = SETTLEMENT_LEASE_SECONDS,
+                 owner: Optional[str] = None):
+        self.w3 = w3
+        self.token_contract = token_contract
+        self.operator_account = operator_account
+        self.operator_address = operator_account.address
+        self.outbox = outbox
+        self.token_decimals = token_decimals
+        self.flush_interval = flush_interval
+        self.receipt_poll_interval = receipt_poll_interval
+        self.min_amount_micros = to_micros(min_amount_usd)
+        self.gas_limit = gas_limit
+        self.max_broadcast_attempts = max_broadcast_attempts
+        self.lease_seconds = lease_seconds
+        # Identifies this process as the holder of the outbox's flusher lease.
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.nonces = NonceManager(w3, self.operator_address)
+        self._chain_id = None
+        self._leading = False
+        self._broadcast_failures: Dict[int, int] = {}
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._loop, args=(self.flush, flush_interval), name="settlement-flush", daemon=True),
+            threading.Thread(target=self._loop, args=(self.track_receipts, receipt_poll_interval),
+                             name="settlement-receipts", daemon=True),
+        ]
+
+    # --- Lifecycle ---
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, flush: bool = True):
+        self._stopped.set()
+        if flush:
+            self.flush()
+        if self._leading:
+            self.outbox.release_lease(self.owner)
+            self._leading = False
+
+    def _loop(self, step, interval: float):
+        while not self._stopped.wait(interval):
+            try:
+                step()
+            except Exception as e:
+                print(f"Settlement {step.__name__} failed: {e}")
+
+    # --- Public API ---
+
+    def accrue(self, user_address: str, amount_usd: float, job_id: Optional[str] = None) -> bool:
+        """Records a charge for the next flush. Cheap and safe to call from any thread."""
+        added = self.outbox.add_charge(user_address, amount_usd, job_id)
+        if added:
+            SETTLEMENT_PENDING_CHARGES.inc()
+        return added
+
+    def flush(self) -> int:
+        """Signs and broadcasts one transfer per user with unsettled charges. Returns the number sent."""
+        with self._flush_lock:
+            if not self._lead():
+                return 0
+            # Batches left over from a failed broadcast or a restart keep their nonces.
+            sent = self._broadcast_signed()
+
+            totals = [t for t in self.outbox.unbatched_totals() if t[1] > 0 and t[1] >= self.min_amount_micros]
+            if not totals:
+                return sent
+            gas_price = self.w3.eth.gas_price
+
+            for user_address, amount_micros, last_charge_id in totals:
+                token_amount = amount_micros * 10 ** self.token_decimals // MICROS_PER_USD
+                allowance = self.token_contract.functions.allowance(user_address, self.operator_address).call()
+                if allowance < token_amount:
+                    print(f"Deferring settlement for {user_address}: allowance {allowance} < {token_amount}")
+                    continue
+                # A transfer the user cannot cover would revert, burn gas and release its charges again.
+                balance = self.token_contract.functions.balanceOf(user_address).call()
+                if balance < token_amount:
+                    print(f"Deferring settlement for {user_address}: balance {balance} < {token_amount}")
+                    continue
+
+                nonce = self.nonces.allocate(floor=self._nonce_floor())
+                signed = self._sign_transfer(user_address, token_amount, nonce, gas_price)
+                # Persist before sending: after a crash the same signed tx is re-sent, never a new one.
+                batch_id = self.outbox.create_batch(user_address, last_charge_id, amount_micros, nonce,
+                                                    signed.hash.hex(), bytes(signed.rawTransaction))
+                if batch_id is None:
+                    print(f"Charges of {user_address} changed while signing; settling them in the next flush.")
+                    # The nonce was never used; the next allocation re-reads it.
+                    self.nonces.reset()
+            SETTLEMENT_PENDING_CHARGES.set(self.outbox.stats()["pending_charges"])
+            return sent + self._broadcast_signed()
+
+    def track_receipts(self):
+        """Resolves sent batches to confirmed, failed or dropped."""
+        with self._flush_lock:
+            if not self._lead():
+                return
+        mined_nonce = None
+        for batch_id, tx_hash, nonce, _ in self.outbox.batches(SENT):
+            # A re-signed batch may still be settled by one of its earlier transactions.
+            receipt = self._receipt(tx_hash, self.outbox.transaction_hashes(batch_id))
+            if receipt is None:
+                if mined_nonce is None:
+                    mined_nonce = self.w3.eth.get_transaction_count(self.operator_address, "latest")
+                if nonce < mined_nonce:
+                    # Our nonce was mined, but by none of this batch's transactions.
+                    print(f"Settlement batch {batch_id} ({tx_hash}) was dropped; re-queuing its charges.")
+                    released = self.outbox.set_status(batch_id, DROPPED)
+                    SETTLEMENT_TRANSFERS.labels(status=DROPPED).inc()
+                    SETTLEMENT_RELEASED_CHARGES.labels(status=DROPPED).inc(released)
+                continue
+            status = CONFIRMED if receipt["status"] == 1 else FAILED
+            released = self.outbox.set_status(batch_id, status)
+            if status == FAILED:
+                print(f"Settlement transfer {receipt['transactionHash'].hex()} reverted; "
+                      f"re-queuing its {released} charges.")
+                SETTLEMENT_RELEASED_CHARGES.labels(status=FAILED).inc(released)
+            SETTLEMENT_TRANSFERS.labels(status=status).inc()
+
+    def stats(self) -> dict:
+        return self.outbox.stats()
+
+    # --- Internals ---
+
+    def _lead(self) -> bool:
+        """Renews this process's flusher lease; False while another process holds it."""
+        leading = self.outbox.acquire_lease(self.owner, self.lease_seconds)
+        if leading and not self._leading:
+            # Another flusher may have used nonces since this one last led.
+            self.nonces.reset()
+        self._leading = leading
+        return leading
+
+    def _receipt(self, tx_hash: str, earlier_hashes: List[str]):
+        """The receipt of whichever of a batch's transactions was mined, or None."""
+        for candidate in [tx_hash] + [h for h in earlier_hashes if h != tx_hash]:
+            try:
+                return self.w3.eth.get_transaction_receipt(candidate)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _sign_transfer(self, user_address: str, token_amount: int, nonce: int, gas_price: int):
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        tx = self.token_contract.functions.transferFrom(
+            user_address, self.operator_address, token_amount
+        ).build_transaction({
+            'chainId': self._chain_id,
+            'gas': self.gas_limit,
+            'gasPrice': gas_price,
+            'nonce': nonce,
+            'from': self.operator_address,
+        })
+        return self.w3.eth.account.sign_transaction(tx, private_key=self.operator_account.key)
+
+    def _resign(self, batch_id: int, raw_tx: bytes, nonce: int):
+        """
+        Re-signs a batch the node keeps rejecting at the same nonce, outbidding
+        both the current gas price and, by the replacement margin, the old
+        transaction's, in case that one did reach a mempool. Only one of the
+        two can be mined.
+        """
+        user_address, amount_micros = self.outbox.transfer(batch_id)
+        # Legacy transaction: [nonce, gasPrice, gas, to, value, data, v, r, s].
+        old_gas_price = int.from_bytes(rlp.decode(bytes(raw_tx))[1], "big")
+        gas_price = max(self.w3.eth.gas_price, old_gas_price * 9 // 8 + 1)
+        token_amount = amount_micros * 10 ** self.token_decimals // MICROS_PER_USD
+        signed = self._sign_transfer(user_address, token_amount, nonce, gas_price)
+        self.outbox.replace_transaction(batch_id, signed.hash.hex(), bytes(signed.rawTransaction))
+        SETTLEMENT_TRANSFERS.labels(status="resigned").inc()
+        print(f"Re-signed settlement batch {batch_id} at nonce {nonce} with gas price {gas_price}.")
+
+    def _nonce_floor(self) -> Optional[int]:
+        highest = self.outbox.max_nonce()
+        return highest + 1 if highest is not None else None
+
+    def _broadcast_signed(self) -> int:
+        """Sends every signed-but-unsent batch in nonce order without waiting for receipts."""
+        sent = 0
+        for batch_id, tx_hash, nonce, raw_tx in self.outbox.batches(SIGNED):
+            try:
+                self.w3.eth.send_raw_transaction(raw_tx)
+            except Exception as e:
+                message = str(e).lower()
+                already_sent = "known" in message or "nonce too low" in message
+                # Nodes word a used nonce differently; the chain itself can tell.
+                if not already_sent and self.w3.eth.get_transaction_count(self.operator_address, "latest") > nonce:
+                    already_sent = True
+                if not already_sent:
+                    # Later nonces cannot be mined before this one; retry on the next flush.
+                    failures = self._broadcast_failures.get(batch_id, 0) + 1
+                    SETTLEMENT_BROADCAST_FAILURES.inc()
+                    print(f"Failed to broadcast settlement batch {batch_id} (nonce {nonce}), "
+                          f"attempt {failures}/{self.max_broadcast_attempts}: {e}")
+                    if failures >= self.max_broadcast_attempts:
+                        # E.g. underpriced or bad gas. A node that still refuses the
+                        # re-signed transfer (say, no gas funds) keeps failing here.
+                        self._resign(batch_id, raw_tx, nonce)
+                        failures = 0
+                    self._broadcast_failures[batch_id] = failures
+                    self.nonces.reset()
+                    break
+                # Already in the pool or mined: let the receipt tracker decide.
+            self._broadcast_failures.pop(batch_id, None)
+            self.outbox.set_status(batch_id, SENT)
+            SETTLEMENT_TRANSFERS.labels(status=SENT).inc()
+            sent += 1
+        return sent
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared Redis connections for the API process and the Celery workers.
+
+Both clients are created lazily and cached for the lifetime of the process, so
+every module reuses the same connection pool instead of opening its own.
+"""
+import os
+import functools
+
+import redis
+import redis.asyncio as redis_asyncio
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Defaults to the Celery broker so a single Redis instance is enough in development.
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+
+
+@functools.lru_cache(maxsize=1)
+def get_redis() -> redis.Redis:
+    """Returns the process-wide synchronous Redis client."""
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+@functools.lru_cache(maxsize=1)
+def get_async_redis() -> redis_asyncio.Redis:
+    """Returns the process-wide asyncio Redis client."""
+    return redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
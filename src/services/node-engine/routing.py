@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Model-affinity routing between the API and the Celery workers.
+
+Every model has its own queue, `model.<name>`. A worker consumes the queues
+of the models it serves (`WORKER_MODELS`, default: every registered plugin)
+and advertises them in Redis. Each model has a sorted set of worker names,
+scored by the time the advertisement expires, so the API can tell whether a
+live worker serves a model with one Redis round trip. Workers also advertise
+which models they currently hold in memory, and a few load figures (active
+tasks, free model memory, token throughput). `fleet_snapshot` sums these up
+for the node, together with the queue lengths and the fleet's rolling
+latency (see fleet_metrics.py).
+
+Tasks carry a Celery priority. On Redis, kombu keeps one list per priority
+step for each queue and workers drain the more urgent lists first, so an
+interactive request overtakes queued bulk work. `queue_keys` names those
+lists, for whoever needs a queue's length.
+"""
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .fleet_metrics import latency_keys, merge_histograms, quantile
+
+load_dotenv()
+
+# --- Configuration ---
+MODEL_QUEUE_PREFIX = "model."
+WORKER_ADVERT_TTL_SECONDS = float(os.getenv("WORKER_ADVERT_TTL_SECONDS", "30"))
+# Comma-separated models this worker serves; empty means every registered model.
+WORKER_MODELS = [name.strip().lower() for name in os.getenv("WORKER_MODELS", "").split(",") if name.strip()]
+
+# Celery message priority per class; on Redis, lower is taken first.
+TASK_PRIORITIES = {"interactive": 0, "normal": 3, "bulk": 9}
+PRIORITY_STEPS = [0, 3, 6, 9]
+# kombu's Redis transport names a priority list `<queue><separator><step>`.
+_PRIORITY_SEPARATOR = "\x06\x16"
+
+SERVING_KEY = "deai:models:{model}:workers"
+LOADED_KEY = "deai:models:{model}:loaded"
+WORKERS_KEY = "deai:workers"
+WORKER_STATS_KEY = "deai:workers:{worker}:stats"
+
+
+def model_queue(model_name: str) -> str:
+    """Name of the Celery queue holding tasks for `model_name`."""
+    return f"{MODEL_QUEUE_PREFIX}{model_name.lower()}"
+
+
+def queue_keys(model_name: str) -> List[str]:
+    """The Redis lists holding the tasks of a model's queue, one per priority step, most urgent first."""
+    queue = model_queue(model_name)
+    return [f"{queue}{_PRIORITY_SEPARATOR}{step}" if step else queue for step in PRIORITY_STEPS]
+
+
+def worker_models(available: Iterable[str], configured: Optional[List[str]] = None) -> List[str]:
+    """The models a worker should serve: `WORKER_MODELS` if set, limited to those it has plugins for."""
+    configured = WORKER_MODELS if configured is None else configured
+    available = list(available)
+    if not configured:
+        return available
+    missing = [name for name in configured if name not in available]
+    if missing:
+        print(f"WORKER_MODELS lists models without a plugin on this worker: {missing}")
+    return [name for name in configured if name in available]
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ModelAdvertiser:
+    """
+    Periodically refreshes this worker's entries in the per-model sorted sets.
+    """
+    def __init__(self, worker_name: str, served: Callable[[], List[str]], loaded: Callable[[], List[str]],
+                 client=None, ttl_seconds: float = WORKER_ADVERT_TTL_SECONDS,
+                 stats: Optional[Callable[[], Dict[str, float]]] = None):
+        if client is None:
+            from .redis_client import get_redis
+            client = get_redis()
+        self.redis = client
+        self.worker_name = worker_name
+        self.served = served
+        self.loaded = loaded
+        self.stats = stats
+        self.ttl = ttl_seconds
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-advertiser", daemon=True)
+
+    def start(self):
+        self.advertise_once()
+        self._thread.start()
+
+    def stop(self):
+        """Stops refreshing and withdraws the advertisement immediately."""
+        self._stopped.set()
+        pipe = self.redis.pipeline()
+        for model in self.served():
+            pipe.zrem(SERVING_KEY.format(model=model), self.worker_name)
+            pipe.zrem(LOADED_KEY.format(model=model), self.worker_name)
+        pipe.zrem(WORKERS_KEY, self.worker_name)
+        pipe.delete(WORKER_STATS_KEY.format(worker=self.worker_name))
+        pipe.execute()
+
+    def advertise_once(self):
+        now = time.time()
+        expires = now + self.ttl
+        served = self.served()
+        loaded = set(self.loaded())
+        pipe = self.redis.pipeline()
+        for model in served:
+            serving_key = SERVING_KEY.format(model=model)
+            loaded_key = LOADED_KEY.format(model=model)
+            pipe.zadd(serving_key, {self.worker_name: expires})
+            if model in loaded:
+                pipe.zadd(loaded_key, {self.worker_name: expires})
+            else:
+                pipe.zrem(loaded_key, self.worker_name)
+            # Drop workers that stopped refreshing without withdrawing.
+            pipe.zremrangebyscore(serving_key, "-inf", now)
+            pipe.zremrangebyscore(loaded_key, "-inf", now)
+            pipe.expire(serving_key, int(self.ttl * 2))
+            pipe.expire(loaded_key, int(self.ttl * 2))
+        if self.stats is not None:
+            stats_key = WORKER_STATS_KEY.format(worker=self.worker_name)
+            pipe.zadd(WORKERS_KEY, {self.worker_name: expires})
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now)
+            pipe.hset(stats_key, mapping=self.stats())
+            pipe.expire(stats_key, int(self.ttl * 2))
+        pipe.execute()
+
+    def _run(self):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                self.advertise_once()
+            except Exception as e:
+                print(f"Failed to advertise models for worker {self.worker_name}: {e}")
+
+
+async def model_workers(model_name: str, client=None) -> Tuple[int, int]:
+    """
+    Returns `(serving, loaded)`: how many live workers consume the model's
+    queue, and how many of them hold it in memory.
+    """
+    if client is None:
+        from .redis_client import get_async_redis
+        client = get_async_redis()
+    now = time.time()
+    model = model_name.lower()
+    pipe = client.pipeline(transaction=False)
+    pipe.zcount(SERVING_KEY.format(model=model), now, "+inf")
+    pipe.zcount(LOADED_KEY.format(model=model), now, "+inf")
+    serving, loaded = await pipe.execute()
+    return serving, loaded
+
+
+async def fleet_snapshot(models: Iterable[str], client=None) -> dict:
+    """
+    Sums up the live workers behind this node, in two Redis round trips:
+    which of `models` they serve and hold in memory, the tasks waiting in
+    each model queue, the rolling task latency, and the workers' active
+    tasks, free memory and token throughput.
+    """
+    if client is None:
+        from .redis_client import get_async_redis
+        client = get_async_redis()
+    now = time.time()
+    models = [name.lower() for name in models]
+    pipe = client.pipeline(transaction=False)
+    for model in models:
+        pipe.zcount(SERVING_KEY.format(model=model), now, "+inf")
+        pipe.zcount(LOADED_KEY.format(model=model), now, "+inf")
+        for key in queue_keys(model):
+            pipe.llen(key)
+    windows = latency_keys(now)
+    for key in windows:
+        pipe.hgetall(key)
+    pipe.zrangebyscore(WORKERS_KEY, now, "+inf")
+    *replies, workers = await pipe.execute()
+    stride = 2 + len(PRIORITY_STEPS)
+    counts, histogram = replies[:stride * len(models)], merge_histograms(replies[stride * len(models):])
+
+    pipe = client.pipeline(transaction=False)
+    for worker in workers:
+        pipe.hgetall(WORKER_STATS_KEY.format(worker=worker))
+    stats = await pipe.execute() if workers else []
+
+    served, loaded = counts[0::stride], counts[1::stride]
+    queues = [sum(counts[i + 2:i + stride]) for i in range(0, len(counts), stride)]
+    total = {field: sum(float(s.get(field, 0)) for s in stats)
+             for field in ("concurrency", "active_tasks", "free_memory_bytes", "tokens_per_second")}
+    return {
+        "models": [model for model, n in zip(models, served) if n],
+        "loaded_models": [model for model, n in zip(models, loaded) if n],
+        "queues": dict(zip(models, queues)),
+        "queue_depth": sum(queues),
+        "workers": len(workers),
+        "capacity": int(total["concurrency"]),
+        "active_tasks": int(total["active_tasks"]),
+        "free_memory_bytes": int(total["free_memory_bytes"]),
+        "tokens_per_second": total["tokens_per_second"],
+        "latency_samples": sum(histogram),
+        "latency_p50_seconds": quantile(histogram, 0.5),
+        "latency_p95_seconds": quantile(histogram, 0.95),
+    }
+
@@ -1,109 +1,441 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import gc
 import os
-import importlib.util
+import queue
+import time
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from threading import Event, Thread
+from typing import Dict, List, Optional
+
+import torch
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import (
+    worker_init, celeryd_after_setup, worker_process_init, worker_ready, worker_shutdown, task_revoked,
+)
+from kombu import Queue
+from prometheus_client import REGISTRY
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, set_seed
 
 from .celery_app import celery_app
+from .cancellation import CancellationWatcher
+from .models.batching import GenerationResult, get_batcher
+from .models.registry import ModelRegistry
+from .models.speculative import SPECULATIVE_DECODING, SpeculativeDecoder, get_speculative_decoder
+from .routing import ModelAdvertiser, model_queue, worker_models
+from .main.token_stream import TokenPublisher
+from .main import result_cache
+from .fleet_metrics import ActiveTasks, SharedWorkerLoad, record_latency
+from .metering import Meter, TokenPrice, Usage, debit_usage
+from .metrics import CANCELLED_TASKS, EXPIRED_GPU_SECONDS_SAVED, EXPIRED_TASKS, GENERATION_TOKENS
+from .tracing import extract, tracer
+
+# --- Configuration ---
+# Route generations through the per-model continuous batching engine.
+# Concurrent tasks share a batch only on a thread pool, the default worker
+# pool (see celery_app.py); a prefork child runs one task at a time.
+BATCHING_ENABLED = os.getenv("BATCHING_ENABLED", "true").lower() == "true"
+# On a prefork pool, load the served models in the parent before it forks, so
+# the children share the weight pages copy-on-write instead of each loading
+# its own copy on first use.
+WORKER_PRELOAD_MODELS = os.getenv("WORKER_PRELOAD_MODELS", "true").lower() == "true"
+# Weight of the latest task in each model's moving average of generation time.
+GENERATION_SECONDS_SMOOTHING = 0.1
+
+# --- Model Registry ---
+# Plugins are registered at import; weights load on first use and are evicted
+# under MODEL_MEMORY_BUDGET_MB (see models/registry.py).
+model_registry = ModelRegistry(Path(__file__).parent / "models")
+model_registry.discover()
+
+# One queue per registered model, plus the default queue for everything else.
+celery_app.conf.task_queues = [Queue(celery_app.conf.task_default_queue)] + [
+    Queue(model_queue(name)) for name in model_registry.names()
+]
+
+_advertiser: Optional[ModelAdvertiser] = None
+_token_sample = (time.monotonic(), 0.0)
+_worker_concurrency = 1
+active_tasks = ActiveTasks()
+# Under a prefork pool the tasks run in the children, so they count their load in Redis.
+_shared_load: Optional[SharedWorkerLoad] = None
+# Usage of finished tasks, debited from the users' balances in batches.
+meter = Meter(debit_usage)
+# Cancel flags of the running tasks, polled from Redis (see cancellation.py).
+cancellations = CancellationWatcher()
+# Moving average of the time a generation of each model takes on this worker.
+_generation_seconds: Dict[str, float] = {}
+
+
+def _observe_generation_seconds(model_name: str, seconds: float):
+    average = _generation_seconds.get(model_name)
+    _generation_seconds[model_name] = seconds if average is None else (
+        average + GENERATION_SECONDS_SMOOTHING * (seconds - average))
 
-# --- Global Model Registries ---
-# These dictionaries will be populated on worker start.
-_model_pipelines: Dict[str, Any] = {}
-_model_costs: Dict[str, float] = {}
 
-# --- Dynamic Model Loading ---
+def _worker_stats() -> Dict[str, float]:
+    """Load figures advertised with this worker's models (see routing.fleet_snapshot)."""
+    global _token_sample
+    if _shared_load is not None:
+        active, generated = _shared_load.read()
+    else:
+        active = active_tasks.count
+        generated = sum(
+            REGISTRY.get_sample_value("deai_batch_generated_tokens_total", {"model": name}) or 0.0
+            for name in model_registry.names()
+        )
+    now = time.monotonic()
+    then, previous = _token_sample
+    _token_sample = (now, generated)
+    return {
+        "concurrency": _worker_concurrency,
+        "active_tasks": active,
+        "free_memory_bytes": model_registry.free_memory_bytes(),
+        "tokens_per_second": round(max(generated - previous, 0.0) / max(now - then, 1e-6), 2),
+    }
+
+@worker_init.connect
+def load_pinned_models_on_worker_start(sender, **kwargs):
+    """Warms the pinned models when the Celery worker starts."""
+    model_registry.preload_pinned()
+
+@celeryd_after_setup.connect
+def subscribe_to_model_queues(sender, instance, **kwargs):
+    """Consumes only the queues of the models this worker serves (see WORKER_MODELS)."""
+    global _advertiser, _worker_concurrency, _shared_load
+    _worker_concurrency = getattr(instance, "concurrency", None) or 1
+    pool_cls = getattr(instance, "pool_cls", None)
+    if isinstance(pool_cls, type) and issubclass(pool_cls, PreforkPool):
+        # The children inherit this before the fork; this process only reads it.
+        _shared_load = SharedWorkerLoad(sender)
+        _shared_load.reset()
+    served = worker_models(model_registry.names())
+    instance.app.amqp.queues.select([celery_app.conf.task_default_queue] + [model_queue(name) for name in served])
+    _advertiser = ModelAdvertiser(sender, served=lambda: served, loaded=model_registry.loaded,
+                                  stats=_worker_stats)
+    print(f"Worker {sender} serving models: {served}")
+
+@celeryd_after_setup.connect
+def preload_models_before_fork(sender, instance, **kwargs):
+    """Loads the served models into a prefork worker's parent process (see WORKER_PRELOAD_MODELS)."""
+    pool_cls = getattr(instance, "pool_cls", None)
+    if not WORKER_PRELOAD_MODELS or not (isinstance(pool_cls, type) and issubclass(pool_cls, PreforkPool)):
+        return
+    for name in worker_models(model_registry.names()):
+        try:
+            with model_registry.use(name):
+                pass
+        except Exception as e:
+            print(f"Failed to preload model '{name}' before forking. Error: {e}")
+    # Keep the children's garbage collector from writing to, and so copying,
+    # the pages of every object loaded so far.
+    gc.freeze()
+
+@worker_process_init.connect
+def share_cpu_threads_between_children(**kwargs):
+    """Gives each prefork child its share of the cores, unless OMP_NUM_THREADS sets it."""
+    if "OMP_NUM_THREADS" not in os.environ:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(_worker_concurrency, 1)))
 
-def _load_dynamic_models():
+@worker_ready.connect
+def start_advertising_models(sender, **kwargs):
+    if _advertiser:
+        _advertiser.start()
+
+@worker_shutdown.connect
+def stop_advertising_models(sender, **kwargs):
+    if _advertiser:
+        _advertiser.stop()
+    if _shared_load is not None:
+        _shared_load.reset()
+    cancellations.close()
+    meter.close()
+
+@task_revoked.connect
+def record_expired_task(sender=None, request=None, expired=False, **kwargs):
     """
-    Scans the 'models' directory, dynamically imports each model's 'loader.py',
-    and populates the global model registries.
+    Accounts for a generation dropped unstarted because its deadline (the
+    Celery `expires` set by the API) passed, and ends its token stream.
     """
-    models_dir = Path(__file__).parent / "models"
-    if not models_dir.is_dir():
-        print(f"Models directory not found at: {models_dir}")
+    if not expired or request is None or getattr(sender, "name", None) != "generate_text_task":
         return
-
-    print("--- Starting Dynamic Model Loading ---")
-    for model_dir in models_dir.iterdir():
-        if model_dir.is_dir():
-            model_name = model_dir.name
-            loader_path = model_dir / "loader.py"
-            if loader_path.is_file():
-                try:
-                    spec = importlib.util.spec_from_file_location(f"models.{model_name}.loader", loader_path)
-                    model_loader = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(model_loader)
-
-                    # Load the model pipeline
-                    _model_pipelines[model_name] = model_loader.load_model()
-                    # Load the model cost
-                    _model_costs[model_name] = model_loader.get_cost()
-
-                    print(f"Successfully loaded model plugin: '{model_name}'")
-                except Exception as e:
-                    print(f"Failed to load model plugin '{model_name}'. Error: {e}")
-    print("--- Dynamic Model Loading Finished ---")
-
-@celery_app.on_after_configure.connect
-def load_models_on_worker_start(sender, **kwargs):
-    """Loads all dynamic models when the Celery worker starts."""
-    _load_dynamic_models()
+    task_kwargs = request.kwargs or {}
+    model_key = str(task_kwargs.get("model_name", "")).lower()
+    EXPIRED_TASKS.labels(model=model_key).inc()
+    EXPIRED_GPU_SECONDS_SAVED.labels(model=model_key).inc(_generation_seconds.get(model_key, 0.0))
+    print(f"Dropped task {request.id} for model {model_key}: its deadline passed while queued.")
+    if task_kwargs.get("stream"):
+        TokenPublisher(request.id).close(error="The task's deadline passed before a worker started it.")
 
 # --- Public Functions to Access Model Data ---
 
 def get_available_models() -> List[str]:
-    """Returns a list of names of the loaded models."""
-    return list(_model_pipelines.keys())
+    """Returns the names of every model this worker can serve."""
+    return model_registry.names()
+
+def get_loaded_models() -> List[str]:
+    """Returns the names of the models currently held in memory."""
+    return model_registry.loaded()
+
+def get_model_price(model_name: str) -> Optional[TokenPrice]:
+    """Returns the token prices of a specific model."""
+    return model_registry.price(model_name)
+
+def get_all_model_prices() -> Dict[str, TokenPrice]:
+    """Returns the token prices of every model."""
+    return model_registry.prices()
+
+def get_model_revision(model_name: str) -> Optional[str]:
+    """Returns the revision of a model's weights, used to key cached results."""
+    return model_registry.revision(model_name)
+
+# --- Generation Helpers ---
+
+class CancelledCriteria(StoppingCriteria):
+    """Stops a Hugging Face generation once the task's cancel event is set."""
+    def __init__(self, cancelled: Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool,
+                          device=input_ids.device)
+
+
+def _generate_batched(model_name: str, model_pipeline, prompt: str, temperature: float,
+                      max_new_tokens: int, publisher: Optional[TokenPublisher] = None,
+                      seed: Optional[int] = None, cancelled: Optional[Event] = None) -> GenerationResult:
+    """Runs the prompt through the model's shared batching engine."""
+    batcher = get_batcher(model_name, model_pipeline)
+    if publisher is None:
+        return batcher.generate(prompt, temperature=temperature, max_new_tokens=max_new_tokens, seed=seed,
+                                cancelled=cancelled)
 
-def get_model_cost(model_name: str) -> float:
-    """Returns the cost for a specific model."""
-    return _model_costs.get(model_name)
+    # The engine thread only enqueues pieces; Redis writes happen on this thread.
+    pieces: "queue.Queue[str]" = queue.Queue()
+    future = batcher.submit(prompt, temperature=temperature, max_new_tokens=max_new_tokens,
+                            on_token=pieces.put, seed=seed, cancelled=cancelled)
+    while not (future.done() and pieces.empty()):
+        try:
+            publisher.publish(pieces.get(timeout=0.05))
+        except queue.Empty:
+            continue
+    return future.result()
 
-def get_all_model_costs() -> Dict[str, float]:
-    """Returns the entire dictionary of model costs."""
-    return _model_costs
+
+def _speculative_decoder(model_name: str, model_pipeline, temperature: float,
+                         stack: ExitStack) -> Optional[SpeculativeDecoder]:
+    """
+    The decoder for a greedy request to a model whose plugin names a draft
+    model, with the draft loaded and held for the rest of `stack`; otherwise None.
+    """
+    if not SPECULATIVE_DECODING or temperature or not hasattr(model_pipeline, "model"):
+        return None
+    pair = model_registry.draft(model_name)
+    if pair is None:
+        return None
+    draft_name, draft_tokens = pair
+    with tracer.span("worker.draft_model_fetch", attributes={"draft_model": draft_name}):
+        draft_pipeline = stack.enter_context(model_registry.use(draft_name))
+    return get_speculative_decoder(model_name, model_pipeline, draft_name, draft_pipeline, draft_tokens)
+
+
+def _generate_speculative(decoder: SpeculativeDecoder, prompt: str, max_new_tokens: int,
+                          publisher: Optional[TokenPublisher] = None,
+                          cancelled: Optional[Event] = None) -> GenerationResult:
+    """Decodes on this thread, so pieces go straight to the publisher."""
+    on_token = publisher.publish if publisher is not None else None
+    return decoder.generate(prompt, max_new_tokens=max_new_tokens, on_token=on_token, cancelled=cancelled)
+
+
+def _trace_batched_generation(model_name: str, generation: GenerationResult):
+    """Records the batching engine's stage timings as spans ending now, under the current span."""
+    decode_start = time.time() - generation.decode_seconds
+    prefill_start = decode_start - generation.prefill_seconds
+    tokens = {"prompt_tokens": generation.prompt_tokens, "completion_tokens": generation.completion_tokens}
+    tracer.record("worker.batch_wait", prefill_start - generation.queue_seconds, prefill_start)
+    tracer.record("worker.prefill", prefill_start, decode_start, attributes={"prompt_tokens": generation.prompt_tokens})
+    tracer.record("worker.decode", decode_start, decode_start + generation.decode_seconds, attributes=tokens)
+    GENERATION_TOKENS.labels(model=model_name, kind="prompt").observe(generation.prompt_tokens)
+    GENERATION_TOKENS.labels(model=model_name, kind="completion").observe(generation.completion_tokens)
+
+
+def _generate_with_pipeline(model_pipeline, prompt: str, temperature: float,
+                            max_new_tokens: int, publisher: Optional[TokenPublisher] = None,
+                            seed: Optional[int] = None, cancelled: Optional[Event] = None) -> str:
+    """
+    Runs the prompt through the Hugging Face pipeline directly. `generate`
+    takes no per-call RNG, so a seed only reseeds the process-wide one, and
+    sampling is reproducible only while no other generation runs alongside.
+    """
+    if seed is not None:
+        set_seed(seed)
+    # Prepare generation parameters
+    gen_params = {
+        "temperature": temperature,
+        "max_new_tokens": max_new_tokens,
+    }
+    if cancelled is not None:
+        gen_params["stopping_criteria"] = StoppingCriteriaList([CancelledCriteria(cancelled)])
+
+    if publisher is None:
+        # Perform the core inference task
+        generated_text = model_pipeline(prompt, **gen_params)
+    else:
+        # Same approach as `GemmaModel.stream`: generate in a separate thread
+        # and forward the streamer's pieces as they become available.
+        streamer = TextIteratorStreamer(model_pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        outcome = {}
+
+        def _run():
+            try:
+                outcome["result"] = model_pipeline(prompt, streamer=streamer, **gen_params)
+            except Exception as e:
+                outcome["error"] = e
+                streamer.end()
+
+        thread = Thread(target=_run)
+        thread.start()
+        for new_text in streamer:
+            publisher.publish(new_text)
+        thread.join()
+        if "error" in outcome:
+            raise outcome["error"]
+        generated_text = outcome["result"]
+
+    # The result from the pipeline might be a list with a dictionary
+    if isinstance(generated_text, list) and generated_text:
+        return generated_text[0].get('generated_text', '')
+    return str(generated_text)
+
+
+def _count_tokens(model_pipeline, prompt: str, output: str):
+    """Prompt and completion token counts of a pipeline generation, tokenized once at the end."""
+    tokenizer = getattr(model_pipeline, "tokenizer", None)
+    if tokenizer is None:
+        return 0, 0
+    prompt_tokens = len(tokenizer(prompt)["input_ids"])
+    # The pipeline returns the prompt followed by the completion.
+    return prompt_tokens, max(0, len(tokenizer(output)["input_ids"]) - prompt_tokens)
 
 # --- Celery Task Definition ---
 
 @celery_app.task(bind=True, name="generate_text_task")
-def generate_text_task(self, prompt: str, model_name: str, temperature: float = 0.7, max_new_tokens: int = 150):
+def generate_text_task(self, prompt: str, model_name: str, temperature: float = 0.7, max_new_tokens: int = 150,
+                       stream: bool = False, seed: Optional[int] = None, cache_key: Optional[str] = None,
+                       user: Optional[str] = None):
     """
     Celery task to run model inference using a dynamically loaded model.
     The signature now matches the API request for simpler invocation.
+    With `stream=True`, decoded text is also published token by token for
+    the API's streaming endpoint. When the API passes a `cache_key` (the
+    request is deterministic), the result is stored in the result cache,
+    unless it was sampled on the pipeline path, whose seeding is not
+    reproducible under a thread pool.
+    The prompt and completion tokens are priced, and billed to `user` if given.
+    The trace context in the task headers (see tracing.py) is continued.
+    A cancelled task (see cancellation.py) stops between decode steps and
+    returns a "CANCELLED" result with the text generated so far; only those
+    tokens are billed.
     """
+    parent, enqueued_at = extract(self.request.headers)
+    if enqueued_at is not None:
+        tracer.record("worker.queue_wait", enqueued_at, time.time(), parent=parent)
+    publisher = TokenPublisher(self.request.id) if stream else None
     self.update_state(state='PROGRESS', meta={'status': 'Fetching model...'})
 
-    model_pipeline = _model_pipelines.get(model_name.lower())
+    model_key = model_name.lower()
 
-    if not model_pipeline:
-        error_msg = f"Model '{model_name}' not loaded on this worker."
+    if model_key not in model_registry.names():
+        error_msg = f"Model '{model_name}' is not available on this worker."
         print(error_msg)
+        if publisher:
+            publisher.close(error=error_msg)
         self.update_state(state='FAILURE', meta={'exc_type': 'ValueError', 'exc_message': error_msg})
         raise ValueError(error_msg)
 
+    if cancellations.is_cancelled(self.request.id):
+        # Cancelled while queued: nothing was generated, so nothing is billed.
+        CANCELLED_TASKS.labels(model=model_key, stage="queued").inc()
+        if publisher:
+            publisher.close(status="CANCELLED")
+        return {"status": "CANCELLED", "output": "", "usage": Usage(user or "", model_key, 0, 0, 0.0).to_dict()}
+
     try:
         self.update_state(state='PROGRESS', meta={'status': f'Generating text with {model_name}...'})
 
-        # Prepare generation parameters
-        gen_params = {
-            "temperature": temperature,
-            "max_new_tokens": max_new_tokens,
-        }
-
-        # Perform the core inference task
-        generated_text = model_pipeline(prompt, **gen_params)
-
-        # The result from the pipeline might be a list with a dictionary
-        if isinstance(generated_text, list) and generated_text:
-            output = generated_text[0].get('generated_text', '')
-        else:
-            output = str(generated_text)
+        # Loads the model on first use and keeps it resident until the generation ends.
+        started = time.perf_counter()
+        attributes = {"model": model_key, "task_id": self.request.id}
+        with tracer.span("worker.generate", parent=parent, attributes=attributes) as span, ExitStack() as stack:
+            stack.enter_context(_shared_load if _shared_load is not None else active_tasks)
+            cancelled = stack.enter_context(cancellations.watch(self.request.id))
+            with tracer.span("worker.model_fetch"):
+                model_pipeline = stack.enter_context(model_registry.use(model_key))
+            speculative = _speculative_decoder(model_key, model_pipeline, temperature, stack)
+            generate_started = time.perf_counter()
+            if speculative is not None or (BATCHING_ENABLED and hasattr(model_pipeline, "model")):
+                if speculative is not None:
+                    # Verify several draft tokens per target pass; the output stays the greedy one.
+                    generation = _generate_speculative(speculative, prompt, max_new_tokens, publisher, cancelled)
+                    span.set_attribute("accepted_draft_tokens", generation.accepted_tokens)
+                else:
+                    # Share a padded forward pass with other in-flight requests for this model.
+                    generation = _generate_batched(model_key, model_pipeline, prompt, temperature,
+                                                   max_new_tokens, publisher, seed, cancelled)
+                _trace_batched_generation(model_key, generation)
+                span.set_attribute("completion_tokens", generation.completion_tokens)
+                output = generation.text
+                prompt_tokens, completion_tokens = generation.prompt_tokens, generation.completion_tokens
+                was_cancelled = generation.finish_reason == "cancelled"
+            else:
+                with tracer.span("worker.pipeline"):
+                    output = _generate_with_pipeline(model_pipeline, prompt, temperature, max_new_tokens,
+                                                     publisher, seed, cancelled)
+                if temperature and seed is not None:
+                    # Sampled from the process-wide RNG, which concurrent tasks also draw
+                    # from, so the seed does not reproduce this output; keep it uncached.
+                    cache_key = None
+                prompt_tokens, completion_tokens = _count_tokens(model_pipeline, prompt, output)
+                was_cancelled = cancelled.is_set()
+            span.set_attribute("cancelled", was_cancelled)
+            if not was_cancelled:
+                _observe_generation_seconds(model_key, time.perf_counter() - generate_started)
 
-        return {"status": "SUCCESS", "output": output}
+        if _shared_load is not None:
+            _shared_load.add_tokens(completion_tokens)
+        status = "CANCELLED" if was_cancelled else "SUCCESS"
+        if publisher:
+            publisher.close(status=status)
+        price = model_registry.price(model_key)
+        usage = Usage(user or "", model_key, prompt_tokens, completion_tokens,
+                      price.cost(prompt_tokens, completion_tokens))
+        if user:
+            meter.record(usage)
+        result = {"status": status, "output": output, "usage": usage.to_dict()}
+        if was_cancelled:
+            CANCELLED_TASKS.labels(model=model_key, stage="running").inc()
+            print(f"Task {self.request.id} was cancelled after {completion_tokens} tokens.")
+            return result
+        try:
+            record_latency(time.perf_counter() - started)
+        except Exception as e:
+            print(f"Failed to record latency for task {self.request.id}: {e}")
+        if cache_key:
+            try:
+                # The token counts, not the cost: each hit is billed to its own requester.
+                result_cache.store(cache_key, {"status": "SUCCESS", "output": output,
+                                               "usage": {"prompt_tokens": prompt_tokens,
+                                                         "completion_tokens": completion_tokens}})
+            except Exception as e:
+                # The generation succeeded; a cache failure must not fail the task.
+                print(f"Failed to cache result for task {self.request.id}: {e}")
+        return result
 
     except Exception as e:
         print(f"Task failed during inference for model {model_name}: {e}")
+        if publisher:
+            publisher.close(error=str(e))
         self.update_state(
             state='FAILURE',
             meta={
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the Redis token-bucket rate limiter and queue depth admission
+control, against fakeredis.
+"""
+
+import asyncio
+
+import pytest
+
+from services.node_engine.main import admission
+from services.node_engine.main.admission import RateLimiter
+from services.node_engine.routing import model_queue, queue_keys
+
+
+# --- Fixtures ---
+
+def _check_many(limiter, requests):
+    async def run():
+        return [await limiter.check(*request) for request in requests]
+    return asyncio.run(run())
+
+
+# --- Test Cases ---
+
+def test_address_bucket_allows_its_burst_then_asks_to_retry(async_redis_client):
+    limiter = RateLimiter(async_redis_client, address_rate=0.5, address_burst=3)
+    decisions = _check_many(limiter, [("gemma", "0xA")] * 4 + [("gemma", "0xB")])
+    assert [d.allowed for d in decisions] == [True, True, True, False, True]
+    assert decisions[3].reason == "address"
+    assert decisions[3].retry_after == 2  # one token at 0.5/s
+
+
+def test_api_key_is_shared_across_addresses_and_limits_all_or_nothing(async_redis_client):
+    limiter = RateLimiter(async_redis_client, address_rate=1, address_burst=2, api_key_rate=0.1, api_key_burst=2)
+    decisions = _check_many(limiter, [("gemma", "0xA", "key"), ("gemma", "0xB", "key"), ("gemma", "0xA", "key"),
+                                      ("gemma", "0xA")])
+    assert [d.allowed for d in decisions] == [True, True, False, True]
+    assert decisions[2].reason == "api_key"
+    # The rejected request did not spend 0xA's second token, which the last one used.
+    assert _check_many(limiter, [("gemma", "0xA")])[0].reason == "address"
+
+
+def test_bucket_refills_over_time(async_redis_client):
+    limiter = RateLimiter(async_redis_client, address_rate=20, address_burst=1)
+
+    async def run():
+        first, second = await limiter.check("gemma", "0xA"), await limiter.check("gemma", "0xA")
+        await asyncio.sleep(0.1)
+        return first, second, await limiter.check("gemma", "0xA")
+    assert [d.allowed for d in asyncio.run(run())] == [True, False, True]
+
+
+def test_full_model_queue_turns_requests_away(redis_client, async_redis_client):
+    redis_client.rpush(model_queue("gemma"), *range(4))
+    redis_client.rpush(queue_keys("gemma")[-1], "bulk")
+    limiter = RateLimiter(async_redis_client, max_queue_depth=5, queue_retry_after=7)
+    gemma, mistral = _check_many(limiter, [("gemma", "0xA"), ("mistral", "0xA")])
+    assert (gemma.allowed, gemma.reason, gemma.retry_after) == (False, "queue", 7)
+    assert mistral.allowed
+
+
+def test_requests_are_admitted_when_redis_fails(monkeypatch):
+    class Unreachable:
+        def register_script(self, script):
+            async def call(keys, args):
+                raise ConnectionError("redis is down")
+            return call
+
+    monkeypatch.setattr(admission, "rate_limiter", RateLimiter(Unreachable()))
+    assert asyncio.run(admission.admit("gemma", "0xA")).allowed
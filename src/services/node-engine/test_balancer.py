@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `/proxy-inference` peer balancer, with a fake clock and
+httpx's mock transport instead of real nodes.
+"""
+
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from services.node_engine.balancer import PeerBalancer, post_to_peer
+
+PEERS = ["http://a:8000", "http://b:8000", "http://c:8000", "http://d:8000"]
+
+
+# --- Fixtures ---
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def balancer(clock):
+    return PeerBalancer(eject_after_failures=2, eject_seconds=30, rng=random.Random(0), clock=clock)
+
+
+def _request(balancer, clock, peer, seconds, ok=True):
+    with balancer.track(peer) as attempt:
+        clock.now += seconds
+        attempt.succeeded() if ok else attempt.failed()
+
+
+# --- Test Cases ---
+
+def test_slow_and_busy_peers_are_avoided(balancer, clock):
+    for peer in PEERS:
+        _request(balancer, clock, peer, 1.0 if peer == PEERS[0] else 0.05)
+    picks = [balancer.choose(PEERS) for _ in range(200)]
+    assert PEERS[0] not in picks  # it loses every pairing it is sampled into
+
+    with balancer.track(PEERS[1]), balancer.track(PEERS[1]):
+        picks = [balancer.choose(PEERS[1:3]) for _ in range(20)]
+    assert set(picks) == {PEERS[2]}
+
+
+def test_failing_peer_is_ejected_then_readmitted(balancer, clock):
+    for peer in PEERS:
+        _request(balancer, clock, peer, 0.05)
+    _request(balancer, clock, PEERS[0], 0.001, ok=False)
+    _request(balancer, clock, PEERS[0], 0.001, ok=False)
+    assert balancer.stats()[PEERS[0]]["ejected"]
+    assert PEERS[0] not in {balancer.choose(PEERS) for _ in range(200)}
+    # An ejected peer is still used when it is the only candidate.
+    assert balancer.choose(PEERS[:1]) == PEERS[0]
+
+    clock.now += 31
+    assert not balancer.stats()[PEERS[0]]["ejected"]
+
+
+def test_at_most_half_of_the_peers_are_ejected(balancer, clock):
+    for peer in PEERS:
+        for _ in range(2):
+            _request(balancer, clock, peer, 0.01, ok=False)
+    assert sum(s["ejected"] for s in balancer.stats().values()) == 2
+
+
+def test_post_moves_to_another_peer_when_connection_fails(balancer):
+    def handler(request):
+        if request.url.host == "a":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"task_id": "t1"})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            results = [await post_to_peer(client, balancer, PEERS[:2], "/generate", {}) for _ in range(5)]
+            with pytest.raises(httpx.ConnectError):
+                await post_to_peer(client, balancer, PEERS[:1], "/generate", {})
+            return results
+
+    for peer, response in asyncio.run(run()):
+        assert peer == PEERS[1] and response.json() == {"task_id": "t1"}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the continuous batching engine, run on CPU against a tiny,
+randomly initialised GPT-2 so no model download is required.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+from services.node_engine.models.batching import ContinuousBatcher, IncrementalDetokenizer
+
+# --- Test Constants ---
+VOCAB = ["<pad>", "<eos>"] + list("abcdefghijklmnopqrstuvwxyz ")
+PROMPTS = ["hello world", "a", "the quick brown fox", "zz top"]
+
+
+# --- Fixtures ---
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    """A two-layer GPT-2 with a character-level tokenizer."""
+    torch.manual_seed(0)
+    backend = Tokenizer(models.WordLevel({tok: i for i, tok in enumerate(VOCAB)}, unk_token="<pad>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", behavior="isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<eos>")
+    config = GPT2Config(
+        vocab_size=len(VOCAB), n_positions=128, n_embd=32, n_layer=2, n_head=2,
+        bos_token_id=1, eos_token_id=1, pad_token_id=0,
+    )
+    model = GPT2LMHeadModel(config).to(torch.float64).eval()
+    return model, tokenizer
+
+
+@pytest.fixture
+def batcher(tiny_model):
+    model, tokenizer = tiny_model
+    b = ContinuousBatcher(model, tokenizer, name="tiny", max_batch_size=4, max_wait_ms=50, min_decode_steps=1)
+    yield b
+    b.close()
+
+
+# --- Test Cases ---
+
+def test_batched_greedy_matches_unbatched(tiny_model, batcher, reference_greedy):
+    """Concurrent greedy requests produce the same tokens as one-at-a-time decoding."""
+    model, tokenizer = tiny_model
+    futures = [batcher.submit(p, temperature=0, max_new_tokens=12) for p in PROMPTS]
+    results = [f.result(timeout=30) for f in futures]
+
+    for prompt, result in zip(PROMPTS, results):
+        expected = reference_greedy(model, tokenizer, prompt, 12)
+        assert result.completion_tokens == len(expected)
+        assert result.completion == tokenizer.decode(expected, skip_special_tokens=True)
+        assert result.prompt_tokens == len(prompt)
+
+    assert batcher.stats()["avg_batch_size"] > 1
+
+
+def test_requests_are_admitted_into_a_running_batch(tiny_model, batcher):
+    """Late arrivals join in-flight work instead of waiting for the batch to drain."""
+    long_running = batcher.submit("long", temperature=0, max_new_tokens=60)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        late = list(pool.map(lambda p: batcher.generate(p, temperature=0, max_new_tokens=3), PROMPTS))
+
+    assert all(r.completion_tokens <= 3 for r in late)
+    long_running.result(timeout=30)
+    assert batcher.stats()["prefills"] >= 2
+
+
+def test_sampling_respects_token_limit(batcher):
+    """Sampled rows stop at `max_new_tokens` with a `length` finish reason."""
+    result = batcher.generate("abc", temperature=1.5, max_new_tokens=5)
+    assert result.completion_tokens <= 5
+    assert result.finish_reason in ("stop", "length")
+    assert result.text.startswith("abc")
+
+
+def test_results_carry_stage_timings(batcher):
+    """Each result reports its wait for a batch slot, its prefill and its decode time."""
+    result = batcher.generate("timing", temperature=0, max_new_tokens=8)
+    assert result.queue_seconds >= 0
+    assert result.prefill_seconds > 0
+    assert result.decode_seconds >= 0
+    if result.completion_tokens > 1:
+        assert result.decode_seconds > 0
+
+
+def test_cancelled_sequences_leave_the_batch_with_what_they_generated(batcher):
+    cancelled = threading.Event()
+    pieces = []
+
+    def on_token(piece):
+        pieces.append(piece)
+        if len(pieces) == 3:
+            cancelled.set()
+
+    running = batcher.submit("long", temperature=0, max_new_tokens=100, on_token=on_token, cancelled=cancelled)
+    queued = batcher.submit("hello", temperature=0, max_new_tokens=100, cancelled=threading.Event())
+    queued_cancel = threading.Event()
+    queued_cancel.set()
+    never_admitted = batcher.submit("a", temperature=0, max_new_tokens=100, cancelled=queued_cancel)
+
+    result = running.result(timeout=30)
+    assert (result.finish_reason, result.completion_tokens) == ("cancelled", 3)
+    skipped = never_admitted.result(timeout=30)
+    assert (skipped.finish_reason, skipped.completion_tokens) == ("cancelled", 0)
+    assert queued.result(timeout=30).finish_reason in ("stop", "length")
+    assert batcher.stats()["sequences_cancelled"] == 2
+
+
+def test_streamed_pieces_decode_only_the_newest_tokens():
+    class WordTokenizer:
+        """Joins words with spaces, like a SentencePiece decode drops the first one's."""
+        def __init__(self):
+            self.decoded_lengths = []
+
+        def decode(self, ids, skip_special_tokens=True):
+            self.decoded_lengths.append(len(ids))
+            return " ".join(words[i] for i in ids)
+
+    words = ["Hello", "streaming", "world", "again", "and", "again"]
+    tokenizer = WordTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    pieces = [detokenizer.step(list(range(n))) for n in range(1, len(words) + 1)]
+
+    assert "".join(pieces) == " ".join(words)
+    assert max(tokenizer.decoded_lengths) <= 2
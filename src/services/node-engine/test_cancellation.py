@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for cooperative task cancellation: the cancel flags, the worker-side
+watcher, the stream reader count behind cancel-on-disconnect, and the
+stopping criteria of the pipeline path, against fakeredis.
+"""
+
+import asyncio
+import threading
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, StoppingCriteriaList
+
+from services.node_engine.cancellation import (
+    CancellationWatcher, StreamReaders, remember_task, request_cancel, was_issued,
+)
+from services.node_engine.tasks import CancelledCriteria
+
+
+# --- Test Cases ---
+
+def test_watcher_raises_the_event_of_a_cancelled_task(redis_client, async_redis_client):
+    watcher = CancellationWatcher(redis_client, interval=3600)
+    with watcher.watch("t1") as t1, watcher.watch("t2") as t2:
+        watcher.poll_once()
+        assert not t1.is_set()
+        asyncio.run(request_cancel("t1", async_redis_client))
+        watcher.poll_once()
+        assert t1.is_set() and not t2.is_set()
+    assert watcher.is_cancelled("t1") and not watcher.is_cancelled("t2")
+    watcher.close()
+
+
+def test_task_is_cancelled_only_once_its_last_reader_has_gone(async_redis_client):
+    readers = StreamReaders(async_redis_client, grace_seconds=0.05)
+
+    async def run():
+        await readers.attach("done")
+        await readers.detach("done", finished=True)
+        for _ in range(2):
+            await readers.attach("t1")
+        await readers.detach("t1", finished=False)
+        first_left = await async_redis_client.exists("deai:tasks:t1:cancel")
+        await readers.detach("t1", finished=False)
+        last_left = await async_redis_client.exists("deai:tasks:t1:cancel")
+        return first_left, last_left, await async_redis_client.exists("deai:tasks:done:cancel")
+
+    assert asyncio.run(run()) == (0, 1, 0)
+
+
+def test_reader_reattaching_within_the_grace_period_keeps_the_task(async_redis_client):
+    readers = StreamReaders(async_redis_client, grace_seconds=0.1)
+
+    async def run():
+        await readers.attach("t1")
+        release = readers.detach("t1", finished=False)
+        await asyncio.sleep(0.02)
+        await readers.attach("t1")  # e.g. resuming with Last-Event-ID
+        await release
+        return await async_redis_client.exists("deai:tasks:t1:cancel")
+
+    assert asyncio.run(run()) == 0
+
+
+def test_only_issued_task_ids_are_remembered(async_redis_client):
+
+    async def run():
+        await remember_task("t1", async_redis_client)
+        return await was_issued("t1", async_redis_client), await was_issued("made-up", async_redis_client)
+
+    assert asyncio.run(run()) == (True, False)
+
+
+def test_unknown_task_cannot_be_cancelled(async_redis_client, monkeypatch):
+    from fastapi import HTTPException
+    from services.node_engine import cancellation
+    from services.node_engine.main import routes
+
+    monkeypatch.setattr(routes, "was_issued", lambda task_id: cancellation.was_issued(task_id, async_redis_client))
+    monkeypatch.setattr(routes, "request_cancel", lambda task_id: request_cancel(task_id, async_redis_client))
+    monkeypatch.setattr(routes, "AsyncResult", lambda task_id, app: type("Result", (), {"state": "PENDING"}))
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(routes.cancel_task("made-up"))
+    assert rejected.value.status_code == 404
+    assert not asyncio.run(async_redis_client.exists("deai:tasks:made-up:cancel"))
+
+    asyncio.run(remember_task("queued", async_redis_client))
+    assert asyncio.run(routes.cancel_task("queued")).status == "CANCELLING"
+    assert asyncio.run(async_redis_client.exists("deai:tasks:queued:cancel"))
+
+
+def test_stopping_criteria_ends_a_pipeline_generation():
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=16, n_positions=64, n_embd=16, n_layer=1, n_head=2)).eval()
+    cancelled = threading.Event()
+    criteria = StoppingCriteriaList([CancelledCriteria(cancelled)])
+    input_ids = torch.tensor([[1, 2, 3]])
+
+    kwargs = dict(max_new_tokens=20, min_new_tokens=20, do_sample=False, pad_token_id=0, stopping_criteria=criteria)
+    assert model.generate(input_ids, **kwargs).shape[1] == 23
+    cancelled.set()
+    assert model.generate(input_ids, **kwargs).shape[1] == 4
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for node capability records: change detection, proxy ranking, and
+propagation through gossip on the simulated network.
+"""
+
+import asyncio
+from dataclasses import replace
+
+from services.node_engine.capabilities import Capabilities, CapabilityPublisher, rank_peers
+from services.node_engine.grpc.gossip import Update, ALIVE, updates_from_proto, updates_to_proto
+from services.node_engine.benchmarks.gossip_convergence import SimulatedNetwork, build_cluster, wait_until
+
+GEMMA = Capabilities(models=("gemma",), loaded_models=("gemma",), queue_depth=4, tokens_per_second=40.0)
+
+
+# --- Test Cases ---
+
+def test_only_material_changes_are_republished():
+    published = []
+    records = iter([GEMMA, replace(GEMMA, queue_depth=5), replace(GEMMA, models=("gemma", "mistral"))])
+
+    async def collect():
+        return next(records)
+
+    async def run():
+        publisher = CapabilityPublisher(collect, published.append, threshold=0.25)
+        return [await publisher.refresh() for _ in range(3)]
+
+    assert asyncio.run(run()) == [True, False, True]
+    assert [record.models for record in published] == [("gemma",), ("gemma", "mistral")]
+
+
+def test_proxy_candidates_are_filtered_by_model_and_weighted_by_backlog():
+    records = {
+        "http://a:8000": GEMMA,
+        "http://b:8000": Capabilities(models=("gemma", "mistral"), loaded_models=("mistral",)),
+        "http://c:8000": None,
+    }
+    candidates, weights = rank_peers(records, "Mistral", cold_penalty=4)
+    assert candidates == ["http://b:8000"] and weights == {"http://b:8000": 1.0}
+
+    candidates, weights = rank_peers(records, "gemma", cold_penalty=4)
+    assert sorted(candidates) == ["http://a:8000", "http://b:8000"]
+    assert weights == {"http://a:8000": 5.0, "http://b:8000": 4.0}
+
+    # Nobody advertises llama: fall back to the peers that publish nothing.
+    assert rank_peers(records, "llama")[0] == ["http://c:8000"]
+
+
+def test_records_survive_the_wire_and_spread_through_gossip():
+    update = Update("a:1", 3, ALIVE, GEMMA)
+    assert updates_from_proto(updates_to_proto([update, Update("b:1", 0, ALIVE)])) == [update, Update("b:1", 0, ALIVE)]
+
+    async def run():
+        network = SimulatedNetwork(latency=0.001)
+        nodes = build_cluster(8, network, period=0.05)
+        try:
+            for node in nodes:
+                node.start()
+            await asyncio.gather(*(node.join([nodes[0].address]) for node in nodes[1:]))
+            nodes[3].membership.set_capabilities(GEMMA)
+            return await wait_until(
+                lambda: all(n.membership.capabilities_of().get(nodes[3].address) == GEMMA for n in nodes), timeout=10)
+        finally:
+            await asyncio.gather(*(node.stop() for node in nodes))
+
+    assert asyncio.run(run()) < 10
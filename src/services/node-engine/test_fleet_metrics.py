@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the fleet load figures behind the gateway heartbeat, against fakeredis.
+"""
+
+import asyncio
+
+import pytest
+
+from services.node_engine.fleet_metrics import LATENCY_BUCKETS, heartbeat, quantile, record_latency
+from services.node_engine.routing import ModelAdvertiser, fleet_snapshot, model_queue
+
+
+# --- Test Cases ---
+
+def test_quantiles_interpolate_within_buckets():
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    counts[LATENCY_BUCKETS.index(1)] = 10  # ten samples in (0.5, 1]
+    assert quantile(counts, 0.5) == pytest.approx(0.75)
+    assert quantile(counts, 1.0) == pytest.approx(1.0)
+    assert quantile([0] * len(counts), 0.95) == 0.0
+
+
+def test_heartbeat_reports_measured_fleet_load(redis_client, async_redis_client):
+    for name, active in (("w1", 2), ("w2", 1)):
+        ModelAdvertiser(name, served=lambda: ["gemma"], loaded=list, client=redis_client,
+                        stats=lambda: {"concurrency": 4, "active_tasks": active, "free_memory_bytes": 100,
+                                       "tokens_per_second": 12.5}).advertise_once()
+    redis_client.rpush(model_queue("gemma"), "t1", "t2", "t3")
+    for seconds in [0.3] * 19 + [20]:
+        record_latency(seconds, client=redis_client)
+
+    snapshot = asyncio.run(fleet_snapshot(["gemma"], client=async_redis_client))
+    assert snapshot["latency_samples"] == 20
+    message = heartbeat(snapshot, target_p95=10)
+
+    assert message["type"] == "metrics"
+    assert message["load"] == 0.75  # (3 active + 3 queued) / 8 slots
+    assert message["queues"] == {"gemma": 3} and message["active_tasks"] == 3
+    assert 250 < message["latency_p50_ms"] <= 500
+    assert message["latency_p95_ms"] == 500
+    assert message["score"] == round(1 / 1.05, 3)
+    assert message["tokens_per_second"] == 25.0 and message["memory_headroom_bytes"] == 200
+
+
+def test_heartbeat_without_workers_reports_full_load():
+    snapshot = {"active_tasks": 0, "queue_depth": 5, "capacity": 0, "queues": {"gemma": 5}, "workers": 0,
+                "latency_p50_seconds": 0.0, "latency_p95_seconds": 0.0, "tokens_per_second": 0.0,
+                "free_memory_bytes": 0}
+    assert (heartbeat(snapshot)["score"], heartbeat(snapshot)["load"]) == (0.0, 1.0)
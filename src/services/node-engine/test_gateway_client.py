@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the asyncio gateway client, against a local WebSocket server
+standing in for the gateway and in-memory task results.
+"""
+
+import asyncio
+import json
+
+import websockets
+
+from services.node_engine.main.websocket import GatewayClient
+
+
+class FakeTasks:
+    """Tasks that finish `delay` seconds after dispatch, echoing their prompt."""
+    def __init__(self, delay: float = 0.2):
+        self.delay = delay
+        self.dispatched = []
+
+    def dispatch(self, payload):
+        self.dispatched.append(payload)
+        return payload["prompt"]
+
+    async def events(self, task_id, timeout=None):
+        yield {"task_id": task_id, "status": "PENDING", "result": None}
+        await asyncio.sleep(self.delay)
+        yield {"task_id": task_id, "status": "SUCCESS", "result": {"status": "SUCCESS", "output": task_id.upper()}}
+
+    async def tokens(self, task_id):
+        for i, piece in enumerate(task_id):
+            yield f"{i}-0", "token", piece
+        yield "end-0", "end", "SUCCESS"
+
+
+async def _metrics():
+    return {"type": "metrics", "score": 1.0, "load": 0.0}
+
+
+def _client(url, tasks, **kwargs):
+    return GatewayClient(url, dispatch=tasks.dispatch, events=tasks.events, tokens=tasks.tokens,
+                         metrics=_metrics, reconnect_min=0.05, reconnect_max=0.2, **kwargs)
+
+
+def _route(request_id, prompt, **payload):
+    return json.dumps({"type": "route_inference", "requestId": request_id, "payload": {"prompt": prompt, **payload}})
+
+
+# --- Test Cases ---
+
+def test_routed_requests_run_concurrently_and_stream_tokens():
+    async def run():
+        received = []
+        done = asyncio.Event()
+
+        async def gateway(ws):
+            for i in range(8):
+                await ws.send(_route(f"r{i}", f"p{i}"))
+            await ws.send(_route("s", "ab", stream=True))
+            async for raw in ws:
+                received.append(json.loads(raw))
+                if sum(m["type"] == "inference_result" for m in received) == 9:
+                    done.set()
+
+        tasks = FakeTasks(delay=0.3)
+        async with websockets.serve(gateway, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            client = _client(f"ws://127.0.0.1:{port}", tasks)
+            client.start()
+            started = asyncio.get_running_loop().time()
+            await asyncio.wait_for(done.wait(), timeout=5)
+            elapsed = asyncio.get_running_loop().time() - started
+            await client.stop()
+        return received, elapsed
+
+    received, elapsed = asyncio.run(run())
+    results = {m["requestId"]: m["payload"] for m in received if m["type"] == "inference_result"}
+    assert results["r3"] == {"status": "SUCCESS", "output": "P3"}
+    assert elapsed < 1.5  # nine 0.3 s tasks, not served one at a time
+    tokens = [m["token"] for m in received if m["type"] == "inference_token"]
+    assert tokens == ["a", "b"]
+    assert any(m["type"] == "metrics" for m in received)
+
+
+def test_in_flight_limit_and_reconnect():
+    async def run():
+        connections = []
+        results = []
+
+        async def gateway(ws):
+            connections.append(ws)
+            if len(connections) == 1:
+                await ws.send(_route("r1", "p1"))
+                await ws.send(_route("r2", "p2"))
+                await asyncio.sleep(0.1)
+                await ws.close()  # drop while both are running
+                return
+            async for raw in ws:
+                message = json.loads(raw)
+                if message["type"] == "inference_result":
+                    results.append(message["requestId"])
+
+        tasks = FakeTasks(delay=0.4)
+        async with websockets.serve(gateway, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            client = _client(f"ws://127.0.0.1:{port}", tasks, max_in_flight=1)
+            client.start()
+            await asyncio.sleep(0.2)
+            peak = client.in_flight
+            for _ in range(50):
+                if len(results) == 2:
+                    break
+                await asyncio.sleep(0.1)
+            await client.stop()
+        return peak, len(connections), sorted(results)
+
+    peak, connections, results = asyncio.run(run())
+    assert peak == 1
+    assert connections >= 2
+    assert results == ["r1", "r2"]  # answered on the new connection
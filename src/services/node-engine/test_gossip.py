@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for SWIM gossip membership, with a fake clock for the precedence
+rules and the in-process simulated network for whole clusters.
+"""
+
+import asyncio
+
+import pytest
+
+from services.node_engine.grpc.gossip import ALIVE, SUSPECT, DEAD, Membership, Update
+from services.node_engine.benchmarks.gossip_convergence import SimulatedNetwork, build_cluster, sees, wait_until
+
+
+# --- Fixtures ---
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def membership(clock):
+    changes = []
+    view = Membership("self:1", clock=clock, on_change=lambda address, status: changes.append((address, status)))
+    view.changes = changes
+    return view
+
+
+# --- Test Cases ---
+
+def test_updates_follow_incarnation_precedence(membership, clock):
+    assert membership.apply(Update("a:1", 0, ALIVE))
+    assert membership.apply(Update("a:1", 0, SUSPECT))
+    assert not membership.apply(Update("a:1", 0, ALIVE))  # a stale ALIVE cannot clear suspicion
+    assert membership.apply(Update("a:1", 1, ALIVE))  # a refutation can
+
+    membership.suspect("a:1")
+    clock.now += 10
+    membership.expire(suspicion_timeout=5)
+    assert membership.members["a:1"].status == DEAD
+    assert not membership.apply(Update("a:1", 1, SUSPECT))
+    assert membership.live_addresses() == []
+    assert membership.changes == [("a:1", ALIVE), ("a:1", SUSPECT), ("a:1", ALIVE), ("a:1", SUSPECT), ("a:1", DEAD)]
+
+    clock.now += 120
+    membership.expire(suspicion_timeout=5, dead_retention=60)
+    assert "a:1" not in membership.members
+
+
+def test_suspicion_of_self_is_refuted_with_a_new_incarnation(membership):
+    assert not membership.apply(Update("self:1", 0, SUSPECT))
+    assert membership.incarnation == 1
+    assert Update("self:1", 1, ALIVE) in membership.updates_to_send()
+
+
+def test_updates_are_retransmitted_a_bounded_number_of_times(membership):
+    for i in range(20):
+        membership.apply(Update(f"n{i}:1", 0, ALIVE))
+    assert len(membership.updates_to_send(limit=8)) == 8
+    sent = 8
+    while True:
+        batch = membership.updates_to_send(limit=8)
+        if not batch:
+            break
+        sent += len(batch)
+    assert sent == 20 * membership.retransmit_limit()
+
+
+def test_cluster_converges_and_detects_a_failed_node():
+    async def run():
+        network = SimulatedNetwork(latency=0.001)
+        nodes = build_cluster(12, network, period=0.05)
+        addresses = [node.address for node in nodes]
+        try:
+            for node in nodes:
+                node.start()
+            await asyncio.gather(*(node.join([addresses[0]]) for node in nodes[1:]))
+            joined = await wait_until(
+                lambda: all(sees(n, a, ALIVE) for n in nodes for a in addresses if a != n.address), timeout=10)
+
+            network.down.add(addresses[-1])
+            await nodes[-1].stop()
+            detected = await wait_until(lambda: all(sees(n, addresses[-1], DEAD) for n in nodes[:-1]), timeout=10)
+            return joined, detected
+        finally:
+            await asyncio.gather(*(node.stop() for node in nodes))
+
+    joined, detected = asyncio.run(run())
+    assert joined < 10 and detected < 10  # wait_until returns NaN on timeout
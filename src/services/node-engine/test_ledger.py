@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQLite balance ledger, including the legacy JSON migration and
+concurrent debits from several processes.
+"""
+
+import json
+import multiprocessing
+import pytest
+
+from services.node_engine.balances.ledger import SQLiteLedger, migrate_json_file
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "ledger.db")
+
+
+def _debit_many(args):
+    db_path, count = args
+    ledger = SQLiteLedger(db_path)
+    return sum(ledger.debit("0xUser", 1.0) is not None for _ in range(count))
+
+
+# --- Test Cases ---
+
+def test_debit_is_refused_when_balance_is_insufficient(db_path):
+    ledger = SQLiteLedger(db_path)
+    ledger.credit("0xUser", 1.5)
+    assert ledger.debit("0xUser", 1.0) == pytest.approx(0.5)
+    assert ledger.debit("0xUser", 1.0) is None
+    assert ledger.get_balance("0xUser") == pytest.approx(0.5)
+    assert ledger.get_balance("0xUnknown") == 0.0
+
+
+def test_json_migration_is_idempotent(db_path, tmp_path):
+    legacy = tmp_path / "balances.json"
+    legacy.write_text(json.dumps({"0xA": 10.0, "0xB": 0.25}))
+    ledger = SQLiteLedger(db_path)
+
+    assert migrate_json_file(ledger, legacy) == 2
+    ledger.credit("0xA", 5.0)
+    assert migrate_json_file(ledger, legacy) == 0
+    assert ledger.get_balance("0xA") == pytest.approx(15.0)
+    assert ledger.get_balance("0xB") == pytest.approx(0.25)
+
+
+def test_concurrent_processes_never_overdraw(db_path):
+    """Four processes race for 100 credits; exactly 100 debits may succeed."""
+    SQLiteLedger(db_path).credit("0xUser", 100.0)
+    with multiprocessing.Pool(4) as pool:
+        succeeded = sum(pool.map(_debit_many, [(db_path, 40)] * 4))
+
+    assert succeeded == 100
+    assert SQLiteLedger(db_path).get_balance("0xUser") == 0.0
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for token pricing and the batched metering of usage into the ledger,
+against SQLite and fakeredis.
+"""
+
+import time
+
+import fakeredis
+import pytest
+
+from services.node_engine.balances.ledger import RedisLedger, SQLiteLedger
+from services.node_engine.metering import Meter, TokenPrice, Usage, estimate_tokens
+
+PRICE = TokenPrice(prompt_per_1k=0.5, completion_per_1k=1.5)
+
+
+# --- Fixtures ---
+
+@pytest.fixture(params=["sqlite", "redis"])
+def ledger(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteLedger(str(tmp_path / "ledger.db"))
+    return RedisLedger(fakeredis.FakeRedis(decode_responses=True))
+
+
+def _usage(user, prompt_tokens, completion_tokens):
+    return Usage(user, "tiny", prompt_tokens, completion_tokens, PRICE.cost(prompt_tokens, completion_tokens))
+
+
+# --- Test Cases ---
+
+def test_cost_grows_with_tokens():
+    assert PRICE.cost(10, 10) == pytest.approx(0.02)
+    assert PRICE.cost(200, 2000) == pytest.approx(3.1)
+    # The quote assumes a full-length completion.
+    assert estimate_tokens("x" * 10) == 3
+    assert PRICE.quote("x" * 10, 100) == pytest.approx(PRICE.cost(3, 100))
+
+
+def test_meter_debits_each_user_once_per_flush(ledger):
+    ledger.credit("0xA", 10.0)
+    debits = []
+
+    def debit(charges):
+        debits.append(charges)
+        ledger.charge(charges, reference="usage")
+
+    meter = Meter(debit, interval=3600)
+    for _ in range(3):
+        meter.record(_usage("0xA", 100, 1000))
+    meter.record(_usage("0xB", 0, 1000))
+    assert meter.flush() == 4
+    assert meter.flush() == 0
+
+    assert debits == [{"0xA": pytest.approx(4.65), "0xB": pytest.approx(1.5)}]
+    assert ledger.get_balance("0xA") == pytest.approx(5.35)
+    # Delivered work is billed even past the balance.
+    assert ledger.get_balance("0xB") == pytest.approx(-1.5)
+
+
+def test_failed_debit_is_retried_on_the_next_flush():
+    attempts = []
+
+    def flaky_debit(charges):
+        attempts.append(dict(charges))
+        if len(attempts) == 1:
+            raise ConnectionError("ledger unavailable")
+
+    meter = Meter(flaky_debit, interval=3600)
+    meter.record(_usage("0xA", 0, 1000))
+    with pytest.raises(ConnectionError):
+        meter.flush()
+    meter.record(_usage("0xA", 0, 1000))
+    assert meter.flush() == 2
+    assert attempts[-1] == {"0xA": pytest.approx(3.0)}
+
+
+def test_full_batch_wakes_the_flusher():
+    flushed = []
+    meter = Meter(flushed.append, interval=3600, batch_size=2)
+    meter.record(_usage("0xA", 1, 1))
+    meter.record(_usage("0xA", 1, 1))
+    deadline = time.monotonic() + 5
+    while not flushed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert flushed == [{"0xA": pytest.approx(PRICE.cost(2, 2))}]
+    meter.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the lazy, memory-bounded model registry, using throwaway loader
+plugins that build ~1 MiB torch modules.
+"""
+
+import pytest
+
+from services.node_engine.metering import TokenPrice
+from services.node_engine.models.registry import ModelRegistry
+
+LOADER_TEMPLATE = '''
+import types
+import torch
+
+LOADS = []
+
+def get_price():
+    return {{"prompt": {cost}, "completion": {cost} * 3}}
+
+def load_model():
+    LOADS.append(1)
+    return types.SimpleNamespace(model=torch.nn.Linear(512, 512))
+'''
+
+MIB = 1024 * 1024
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def models_dir(tmp_path):
+    for i, name in enumerate(["alpha", "beta", "gamma"]):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "loader.py").write_text(LOADER_TEMPLATE.format(cost=0.001 * (i + 1)))
+    return tmp_path
+
+
+def _registry(models_dir, budget_mb=2.5, pinned=()):
+    registry = ModelRegistry(models_dir, memory_budget_mb=budget_mb, pinned=pinned)
+    registry.discover()
+    return registry
+
+
+def _load(registry, name):
+    with registry.use(name) as pipe:
+        return pipe
+
+
+# --- Test Cases ---
+
+def test_discovery_registers_prices_without_loading(models_dir):
+    registry = _registry(models_dir)
+    assert registry.names() == ["alpha", "beta", "gamma"]
+    assert registry.price("beta") == TokenPrice(0.002, 0.006)
+    assert registry.prices()["gamma"].cost(1000, 1000) == pytest.approx(0.012)
+    assert registry.loaded() == []
+
+    pipe = _load(registry, "alpha")
+    assert _load(registry, "alpha") is pipe  # loaded once, then reused
+    assert registry.stats()["alpha"]["memory_bytes"] == (512 * 512 + 512) * 4
+
+
+def test_least_recently_used_model_is_evicted_over_budget(models_dir):
+    registry = _registry(models_dir)
+    _load(registry, "alpha")
+    _load(registry, "beta")
+    _load(registry, "alpha")  # beta is now the least recently used
+    _load(registry, "gamma")
+    assert sorted(registry.loaded()) == ["alpha", "gamma"]
+
+
+def test_pinned_and_busy_models_are_not_evicted(models_dir):
+    registry = _registry(models_dir, pinned=["alpha"])
+    registry.preload_pinned()
+    assert registry.loaded() == ["alpha"]
+
+    with registry.use("beta"):
+        with registry.use("gamma"):
+            # Over budget, but alpha is pinned and the others are busy.
+            assert sorted(registry.loaded()) == ["alpha", "beta", "gamma"]
+        # Released, gamma is the only model that can go.
+        assert sorted(registry.loaded()) == ["alpha", "beta"]
+
+
+def test_unknown_model_raises(models_dir):
+    registry = _registry(models_dir)
+    with pytest.raises(KeyError):
+        _load(registry, "delta")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `grpc.aio` peer mesh, against in-process servers on free ports.
+"""
+
+import asyncio
+import socket
+
+import pytest
+
+from services.node_engine.grpc import node_pb2, node_pb2_grpc
+from services.node_engine.grpc import server as mesh
+
+
+# --- Fixtures ---
+
+@pytest.fixture(autouse=True)
+def empty_mesh():
+    with mesh.peers_lock:
+        mesh.peers.clear()
+    yield
+    with mesh.peers_lock:
+        mesh.peers.clear()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# --- Test Cases ---
+
+def test_announce_returns_known_peers_and_registers_the_caller():
+    async def run():
+        port = _free_port()
+        await mesh.serve(str(port), self_address=f"localhost:{port}")
+        try:
+            mesh._add_peers(["10.0.0.1:50051"])
+            stub = node_pb2_grpc.NodeStub(mesh.peer_channels.get(f"localhost:{port}"))
+            response = await stub.AnnouncePeer(node_pb2.AnnouncePeerRequest(address="10.0.0.2:50051"), timeout=5)
+            return list(response.current_peers)
+        finally:
+            await mesh.shutdown(grace=0)
+
+    assert asyncio.run(run()) == ["10.0.0.1:50051"]
+    assert mesh.peers == {"10.0.0.1:50051", "10.0.0.2:50051"}
+
+
+def test_unresponsive_peers_are_removed_and_live_ones_kept():
+    async def run():
+        port = _free_port()
+        live, dead = f"127.0.0.1:{port}", f"127.0.0.1:{_free_port()}"
+        await mesh.serve(str(port))
+        channels = mesh.PeerChannels()
+        prober = mesh.PeerProber(channels, interval=0.1, timeout=0.5, max_failures=2)
+        try:
+            mesh._add_peers([live, dead])
+            prober.start()
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if dead not in mesh.peers:
+                    break
+            await asyncio.sleep(0.3)  # let the supervisor close the dead peer's channel
+            return live, len(channels)
+        finally:
+            await prober.stop()
+            await channels.close_all()
+            await mesh.shutdown(grace=0)
+
+    live, open_channels = asyncio.run(run())
+    assert mesh.peers == {live}
+    assert open_channels == 1
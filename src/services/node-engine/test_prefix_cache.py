@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the prompt prefix KV cache, run on CPU against a tiny, randomly
+initialised GPT-2 so no model download is required.
+"""
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from services.node_engine.models.prefix_cache import PrefixCache
+
+SYSTEM_PROMPT = list(range(2, 42))
+
+
+# --- Fixtures ---
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=64, n_positions=256, n_embd=32, n_layer=2, n_head=2,
+                        bos_token_id=1, eos_token_id=1, pad_token_id=0)
+    return GPT2LMHeadModel(config).to(torch.float64).eval()
+
+
+def _kv(ids):
+    """A fake one-layer KV cache whose values are the token IDs it covers."""
+    t = torch.tensor(ids, dtype=torch.float32).view(1, 1, -1, 1)
+    return ((t, t.clone()),)
+
+
+def _cached_ids(kv):
+    return kv[0][0].flatten().long().tolist()
+
+
+# --- Test Cases ---
+
+def test_longest_shared_prefix_is_cropped_from_a_cached_prompt():
+    cache = PrefixCache(max_tokens=1000, min_prefix_tokens=4)
+    first = SYSTEM_PROMPT + [50, 51, 52]
+    cache.insert(first, _kv(first))
+
+    length, kv = cache.match(SYSTEM_PROMPT + [60, 61])
+    assert length == len(SYSTEM_PROMPT)
+    assert _cached_ids(kv) == SYSTEM_PROMPT
+
+    # The same prompt again leaves its last token to be processed.
+    length, kv = cache.match(first)
+    assert length == len(first) - 1 and _cached_ids(kv) == first[:-1]
+
+    assert cache.match([7, 8, 9, 10, 11]) == (0, None)
+    assert cache.match(SYSTEM_PROMPT[:3] + [60]) == (0, None)  # shorter than min_prefix_tokens
+
+
+def test_least_recently_used_prompts_are_evicted():
+    cache = PrefixCache(max_tokens=100, min_prefix_tokens=4)
+    a, b, c = (SYSTEM_PROMPT + [50 + i] for i in range(3))
+    cache.insert(a, _kv(a))
+    cache.insert(b, _kv(b))
+    cache.match(a + [0])  # a is now more recent than b
+    cache.insert(c, _kv(c))
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["cached_tokens"] <= 100
+    length, kv = cache.match(b + [0])
+    assert length == len(SYSTEM_PROMPT)  # b itself is gone, the shared prefix is not
+
+    # A longer prompt replaces the entry it extends.
+    longer = c + [60, 61]
+    cache.insert(longer, _kv(longer))
+    assert cache.stats()["entries"] == 2
+
+
+def test_resumed_generation_matches_full_prefill(tiny_model):
+    cache = PrefixCache(max_tokens=1000, min_prefix_tokens=8)
+    for suffix in ([50, 51, 52], [53, 54], [50, 51, 55, 56]):
+        input_ids = torch.tensor([SYSTEM_PROMPT + suffix])
+        expected = tiny_model.generate(input_ids, max_new_tokens=8, do_sample=False, pad_token_id=0)
+        actual = cache.generate(tiny_model, input_ids, max_new_tokens=8, do_sample=False, pad_token_id=0)
+        assert torch.equal(actual, expected)
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["tokens_saved"] == len(SYSTEM_PROMPT) + len(SYSTEM_PROMPT) + 2
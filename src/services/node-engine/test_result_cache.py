@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the deterministic generation result cache, against fakeredis.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.node_engine.main import result_cache
+from services.node_engine.metering import TokenPrice
+
+
+# --- Fixtures ---
+
+def _lookup(client, key):
+    return asyncio.run(result_cache.lookup(key, client=client))
+
+
+# --- Test Cases ---
+
+def test_only_deterministic_requests_have_keys():
+    greedy = result_cache.cache_key("Gemma", "rev1", "hi", 0.0, 50, seed=None)
+    assert greedy == result_cache.cache_key("gemma", "rev1", "hi", 0, 50, seed=7)  # seed is irrelevant when greedy
+    assert greedy != result_cache.cache_key("gemma", "rev2", "hi", 0.0, 50, seed=None)
+    assert greedy != result_cache.cache_key("gemma", "rev1", "hi", 0.0, 51, seed=None)
+
+    assert result_cache.cache_key("gemma", "rev1", "hi", 0.7, 50, seed=None) is None
+    seeded = result_cache.cache_key("gemma", "rev1", "hi", 0.7, 50, seed=1)
+    assert seeded and seeded != result_cache.cache_key("gemma", "rev1", "hi", 0.7, 50, seed=2)
+
+
+def test_stored_result_is_served_on_lookup(redis_client, async_redis_client):
+    key = result_cache.cache_key("gemma", "rev1", "hi", 0.0, 50, seed=None)
+    assert _lookup(async_redis_client, key) is None
+
+    result = {"status": "SUCCESS", "output": "hello"}
+    assert result_cache.store(key, result, client=redis_client)
+    assert _lookup(async_redis_client, key) == result
+    assert 0 < redis_client.ttl(key) <= result_cache.RESULT_CACHE_TTL_SECONDS
+
+
+def test_oldest_entries_are_dropped_over_the_size_cap(redis_client, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_BYTES", 250)
+    keys = [result_cache.cache_key("gemma", "rev1", f"prompt {i}", 0.0, 50, seed=None) for i in range(3)]
+    for key in keys:
+        assert result_cache.store(key, {"status": "SUCCESS", "output": "x" * 80}, client=redis_client)
+
+    assert redis_client.get(keys[0]) is None
+    assert redis_client.get(keys[1]) and redis_client.get(keys[2])
+    assert int(redis_client.get(result_cache.TOTAL_KEY)) <= 250
+
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_ENTRY_BYTES", 10)
+    assert not result_cache.store(keys[0], {"status": "SUCCESS", "output": "too large"}, client=redis_client)
+
+
+def test_cache_hit_is_billed_to_the_requester(monkeypatch):
+    from services.node_engine.main import routes
+
+    recorded, stored = [], {}
+    monkeypatch.setattr(routes, "meter", SimpleNamespace(record=recorded.append))
+    monkeypatch.setattr(routes, "get_model_price", lambda model: TokenPrice(1.0, 2.0))
+    monkeypatch.setattr(type(routes.celery_app.backend), "store_result",
+                        lambda backend, task_id, result, state: stored.update({task_id: result}))
+    cached = {"status": "SUCCESS", "output": "hello", "usage": {"prompt_tokens": 100, "completion_tokens": 50}}
+    request = routes.GenerateRequest(address="0xB", prompt="hi", model="Gemma", temperature=0.0)
+
+    task_id = asyncio.run(routes._complete_from_cache(request, cached))
+
+    (usage,) = recorded
+    assert (usage.user, usage.model, usage.cost_usd) == ("0xB", "gemma", pytest.approx(0.2))
+    assert stored[task_id] == {"status": "SUCCESS", "output": "hello", "usage": usage.to_dict()}
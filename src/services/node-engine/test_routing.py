@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the worker model advertisements the API routes by, against fakeredis.
+"""
+
+import asyncio
+
+import pytest
+
+from services.node_engine.routing import ModelAdvertiser, fleet_snapshot, model_queue, model_workers, worker_models
+
+
+# --- Fixtures ---
+
+def _workers(client, model):
+    return asyncio.run(model_workers(model, client=client))
+
+
+# --- Test Cases ---
+
+def test_worker_models_honours_configuration():
+    assert worker_models(["gemma", "mistral"], configured=[]) == ["gemma", "mistral"]
+    assert worker_models(["gemma", "mistral"], configured=["mistral", "llama"]) == ["mistral"]
+    assert model_queue("Gemma") == "model.gemma"
+
+
+def test_advertisements_track_served_and_loaded_models(redis_client, async_redis_client):
+    loaded = []
+    worker = ModelAdvertiser("w1", served=lambda: ["gemma", "mistral"], loaded=lambda: list(loaded),
+                             client=redis_client)
+
+    worker.advertise_once()
+    assert _workers(async_redis_client, "gemma") == (1, 0)
+    loaded.append("gemma")
+    worker.advertise_once()
+    assert _workers(async_redis_client, "gemma") == (1, 1)
+    assert _workers(async_redis_client, "mistral") == (1, 0)
+    assert _workers(async_redis_client, "llama") == (0, 0)
+
+    worker.stop()
+    assert _workers(async_redis_client, "gemma") == (0, 0)
+
+
+def test_stale_advertisements_are_ignored(redis_client, async_redis_client):
+    ModelAdvertiser("w1", served=lambda: ["gemma"], loaded=list, client=redis_client, ttl_seconds=-1).advertise_once()
+    assert _workers(async_redis_client, "gemma") == (0, 0)
+
+
+def test_fleet_snapshot_sums_worker_adverts_and_queues(redis_client, async_redis_client):
+    for name, tps in (("w1", 10.0), ("w2", 5.5)):
+        ModelAdvertiser(name, served=lambda: ["gemma"], loaded=lambda: ["gemma"] if name == "w1" else [],
+                        client=redis_client, stats=lambda: {"free_memory_bytes": 1024, "tokens_per_second": tps},
+                        ).advertise_once()
+    redis_client.rpush(model_queue("gemma"), "t1", "t2")
+
+    snapshot = asyncio.run(fleet_snapshot(["gemma", "mistral"], client=async_redis_client))
+    assert snapshot["models"] == ["gemma"] and snapshot["loaded_models"] == ["gemma"]
+    assert snapshot["queues"] == {"gemma": 2, "mistral": 0}
+    assert snapshot["workers"] == 2
+    assert snapshot["free_memory_bytes"] == 2048 and snapshot["tokens_per_second"] == 15.5
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for task priorities on the Redis broker and for the accounting of
+tasks that expire before a worker starts them, against fakeredis.
+"""
+
+import asyncio
+import socket
+import threading
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import redis.asyncio
+from celery import Celery
+from prometheus_client import REGISTRY
+
+from services.node_engine import tasks
+from services.node_engine.routing import PRIORITY_STEPS, TASK_PRIORITIES, fleet_snapshot, model_queue
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def redis_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{port}/0"
+    server.shutdown()
+    server.server_close()
+
+
+def _sample(name, model):
+    return REGISTRY.get_sample_value(name, {"model": model}) or 0.0
+
+
+# --- Test Cases ---
+
+def test_interactive_tasks_are_taken_before_queued_bulk_work(redis_url):
+    app = Celery("scheduling-test", broker=redis_url)
+    app.conf.broker_transport_options = {"priority_steps": PRIORITY_STEPS}
+    for prompt in ("bulk", "normal", "interactive"):
+        app.send_task("generate_text_task", kwargs={"prompt": prompt}, queue=model_queue("gemma"),
+                      priority=TASK_PRIORITIES[prompt])
+
+    # The queue length counts every priority list (see routing.queue_keys).
+    client = redis.asyncio.from_url(redis_url, decode_responses=True)
+    assert asyncio.run(fleet_snapshot(["gemma"], client=client))["queues"] == {"gemma": 3}
+
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        taken = [channel.basic_get(model_queue("gemma"), no_ack=True).decode()[1]["prompt"] for _ in range(3)]
+    assert taken == ["interactive", "normal", "bulk"]
+
+
+def test_expired_task_counts_the_generation_time_it_saved():
+    tasks._observe_generation_seconds("tiny", 2.0)
+    tasks._observe_generation_seconds("tiny", 4.0)
+    expired_before = _sample("deai_expired_tasks_total", "tiny")
+    saved_before = _sample("deai_expired_gpu_seconds_saved_total", "tiny")
+
+    request = SimpleNamespace(id="task-1", kwargs={"model_name": "Tiny", "prompt": "hi"})
+    tasks.record_expired_task(sender=tasks.generate_text_task, request=request, expired=True)
+    # A task revoked for another reason saved nothing by expiring.
+    tasks.record_expired_task(sender=tasks.generate_text_task, request=request, expired=False)
+
+    assert _sample("deai_expired_tasks_total", "tiny") == expired_before + 1
+    assert _sample("deai_expired_gpu_seconds_saved_total", "tiny") == pytest.approx(saved_before + 2.2)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the batched settlement pipeline against an in-process eth-tester chain.
+"""
+
+import pytest
+from eth_account import Account
+from web3 import Web3, EthereumTesterProvider
+
+from services.node_engine.onchain.settlement import FAILED, SettlementOutbox, SettlementPipeline
+
+# A stand-in token that answers every call with uint256.max, so allowance
+# checks pass and `transferFrom` transactions succeed.
+_STUB_TOKEN_INITCODE = "0x6029600c60003960296000f3" + "7f" + "ff" * 32 + "60005260206000f3"
+
+_TOKEN_ABI = [
+    {
+        "name": "allowance", "type": "function", "stateMutability": "view",
+        "inputs": [{"name": "owner", "type": "address"}, {"name": "spender", "type": "address"}],
+        "outputs": [{"name": "", "type": "uint256"}],
+    },
+    {
+        "name": "balanceOf", "type": "function", "stateMutability": "view",
+        "inputs": [{"name": "owner", "type": "address"}],
+        "outputs": [{"name": "", "type": "uint256"}],
+    },
+    {
+        "name": "transferFrom", "type": "function", "stateMutability": "nonpayable",
+        "inputs": [{"name": "from", "type": "address"}, {"name": "to", "type": "address"},
+                   {"name": "value", "type": "uint256"}],
+        "outputs": [{"name": "", "type": "bool"}],
+    },
+]
+
+USER_A = Web3.to_checksum_address("0x" + "aa" * 20)
+USER_B = Web3.to_checksum_address("0x" + "bb" * 20)
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def chain():
+    w3 = Web3(EthereumTesterProvider())
+    tx_hash = w3.eth.send_transaction({"from": w3.eth.accounts[0], "data": _STUB_TOKEN_INITCODE})
+    token = w3.eth.contract(address=w3.eth.wait_for_transaction_receipt(tx_hash).contractAddress, abi=_TOKEN_ABI)
+    operator = Account.from_key(w3.provider.ethereum_tester.backend.account_keys[1].to_bytes())
+    return w3, token, operator
+
+
+def _pipeline(chain, db_path, **kwargs):
+    w3, token, operator = chain
+    return SettlementPipeline(w3, token, operator, SettlementOutbox(db_path), token_decimals=18, **kwargs)
+
+
+def _settled_transfers(w3, token, operator):
+    """(from, value, nonce) of every transferFrom the operator sent, in nonce order."""
+    transfers = []
+    for number in range(w3.eth.block_number + 1):
+        for tx in w3.eth.get_block(number, full_transactions=True).transactions:
+            if tx["from"] == operator.address:
+                _, args = token.decode_function_input(tx.get("input", tx.get("data")))
+                transfers.append((args["from"], args["value"], tx["nonce"]))
+    return sorted(transfers, key=lambda t: t[2])
+
+
+# --- Test Cases ---
+
+def test_charges_are_aggregated_into_one_transfer_per_user(chain, tmp_path):
+    w3, token, operator = chain
+    pipeline = _pipeline(chain, tmp_path / "settlement.db")
+
+    assert pipeline.accrue(USER_A, 1.0, job_id="job-1")
+    assert pipeline.accrue(USER_A, 2.5, job_id="job-2")
+    assert pipeline.accrue(USER_B, 0.25, job_id="job-3")
+    assert not pipeline.accrue(USER_A, 1.0, job_id="job-1")  # same job is charged once
+
+    assert pipeline.flush() == 2
+    pipeline.track_receipts()
+
+    transfers = _settled_transfers(w3, token, operator)
+    assert {(sender, value) for sender, value, _ in transfers} == {
+        (USER_A, 3_500_000_000_000_000_000),
+        (USER_B, 250_000_000_000_000_000),
+    }
+    assert [nonce for _, _, nonce in transfers] == [0, 1]
+    assert pipeline.stats() == {"pending_charges": 0, "batches": {"confirmed": 2}}
+
+
+def test_signed_batches_survive_a_restart(chain, tmp_path):
+    w3, token, operator = chain
+    db_path = tmp_path / "settlement.db"
+    crashed = _pipeline(chain, db_path)
+    crashed.accrue(USER_A, 1.0, job_id="job-1")
+
+    # The node rejects the broadcast, as if the process died right after signing.
+    send = w3.eth.send_raw_transaction
+    w3.eth.send_raw_transaction = lambda raw: (_ for _ in ()).throw(ConnectionError("node unavailable"))
+    assert crashed.flush() == 0
+    w3.eth.send_raw_transaction = send
+
+    restarted = _pipeline(chain, db_path)
+    restarted.accrue(USER_B, 2.0, job_id="job-2")
+    assert restarted.flush() == 2
+    restarted.track_receipts()
+
+    transfers = _settled_transfers(w3, token, operator)
+    assert [(sender, nonce) for sender, _, nonce in transfers] == [(USER_A, 0), (USER_B, 1)]
+    assert restarted.stats()["batches"] == {"confirmed": 2}
+
+
+def test_only_the_lease_holder_flushes_a_shared_outbox(chain, tmp_path):
+    w3, token, operator = chain
+    db_path = tmp_path / "settlement.db"
+    first = _pipeline(chain, db_path, owner="api-1")
+    second = _pipeline(chain, db_path, owner="worker-1")
+    first.accrue(USER_A, 1.0, job_id="job-1")
+
+    assert first.flush() == 1
+    second.accrue(USER_A, 2.0, job_id="job-2")
+    assert second.flush() == 0
+    first.stop(flush=False)  # releases the lease
+    assert second.flush() == 1
+    second.track_receipts()
+
+    transfers = _settled_transfers(w3, token, operator)
+    assert [(value, nonce) for _, value, nonce in transfers] == [
+        (1_000_000_000_000_000_000, 0), (2_000_000_000_000_000_000, 1),
+    ]
+
+
+def test_batch_is_not_created_when_its_charges_were_claimed(tmp_path):
+    outbox = SettlementOutbox(tmp_path / "settlement.db")
+    outbox.add_charge(USER_A, 1.0, job_id="job-1")
+    outbox.add_charge(USER_A, 2.0, job_id="job-2")
+    (user, amount, last_id), = outbox.unbatched_totals()
+
+    assert outbox.create_batch(user, last_id, amount, 0, "0x01", b"tx") is not None
+    # A second flusher with the same, now stale, totals signs nothing that can be sent.
+    assert outbox.create_batch(user, last_id, amount, 1, "0x02", b"tx") is None
+    assert outbox.stats()["batches"] == {"signed": 1}
+
+
+def test_reverted_batch_releases_its_charges(tmp_path):
+    outbox = SettlementOutbox(tmp_path / "settlement.db")
+    outbox.add_charge(USER_A, 1.0, job_id="job-1")
+    (user, amount, last_id), = outbox.unbatched_totals()
+    batch_id = outbox.create_batch(user, last_id, amount, 0, "0x01", b"tx")
+
+    assert outbox.set_status(batch_id, FAILED) == 1
+    assert outbox.unbatched_totals() == [(user, amount, last_id)]
+
+
+def test_rejected_batch_is_resigned_at_the_same_nonce(chain, tmp_path):
+    w3, token, operator = chain
+    pipeline = _pipeline(chain, tmp_path / "settlement.db", max_broadcast_attempts=2)
+    pipeline.accrue(USER_A, 1.0, job_id="job-1")
+
+    send = w3.eth.send_raw_transaction
+    w3.eth.send_raw_transaction = lambda raw: (_ for _ in ()).throw(ValueError("transaction underpriced"))
+    assert pipeline.flush() == 0
+    (_, first_hash, _, _), = pipeline.outbox.batches("signed")
+    assert pipeline.flush() == 0
+    (_, resigned_hash, nonce, _), = pipeline.outbox.batches("signed")
+    w3.eth.send_raw_transaction = send
+
+    assert resigned_hash != first_hash and nonce == 0
+    assert pipeline.flush() == 1
+    pipeline.track_receipts()
+    assert [(sender, nonce) for sender, _, nonce in _settled_transfers(w3, token, operator)] == [(USER_A, 0)]
+
+
+def test_earlier_transaction_of_a_resigned_batch_still_settles_it(chain, tmp_path):
+    w3, token, operator = chain
+    pipeline = _pipeline(chain, tmp_path / "settlement.db", max_broadcast_attempts=1)
+    pipeline.accrue(USER_A, 1.0, job_id="job-1")
+
+    # The send times out, but the transaction reached a mempool and is mined later.
+    send, timed_out = w3.eth.send_raw_transaction, []
+    w3.eth.send_raw_transaction = lambda raw: timed_out.append(raw) or (_ for _ in ()).throw(TimeoutError("timed out"))
+    assert pipeline.flush() == 0
+    w3.eth.send_raw_transaction = send
+    (_, resigned_hash, _, _), = pipeline.outbox.batches("signed")
+    send(timed_out[0])
+
+    # The re-signed version is refused, as its nonce is used, and left to the receipt tracker.
+    assert pipeline.flush() == 1
+    pipeline.track_receipts()
+
+    assert pipeline.stats() == {"pending_charges": 0, "batches": {"confirmed": 1}}
+    (_, _, nonce), = _settled_transfers(w3, token, operator)
+    assert nonce == 0 and resigned_hash != w3.keccak(timed_out[0]).hex()
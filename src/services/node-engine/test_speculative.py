@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for speculative decoding, run on CPU with two tiny, randomly
+initialised GPT-2 models sharing a character-level tokenizer.
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+from services.node_engine.models.speculative import (
+    SpeculativeDecoder, close_speculative_decoders, get_speculative_decoder,
+)
+
+# --- Test Constants ---
+VOCAB = ["<pad>", "<eos>"] + list("abcdefghijklmnopqrstuvwxyz ")
+PROMPTS = ["hello world", "a", "the quick brown fox", "zz top"]
+
+
+# --- Fixtures ---
+
+def _tokenizer(vocab):
+    backend = Tokenizer(models.WordLevel({tok: i for i, tok in enumerate(vocab)}, unk_token="<pad>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", behavior="isolated")
+    backend.decoder = decoders.Fuse()
+    return PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<eos>")
+
+
+def _gpt2(layers):
+    config = GPT2Config(
+        vocab_size=len(VOCAB), n_positions=128, n_embd=32, n_layer=layers, n_head=2,
+        bos_token_id=1, eos_token_id=1, pad_token_id=0,
+    )
+    return GPT2LMHeadModel(config).to(torch.float64).eval()
+
+
+@pytest.fixture(scope="module")
+def tiny_models():
+    """A three-layer target, a draft made of its first layer, and an unrelated one-layer draft."""
+    torch.manual_seed(0)
+    target = _gpt2(3)
+    related = _gpt2(1)
+    related.load_state_dict(target.state_dict(), strict=False)
+    unrelated = _gpt2(1)
+    return target, related, unrelated, _tokenizer(VOCAB)
+
+
+# --- Test Cases ---
+
+@pytest.mark.parametrize("draft_tokens", [1, 3, 6])
+@pytest.mark.parametrize("draft", ["related", "unrelated"])
+def test_speculative_output_matches_greedy(tiny_models, draft, draft_tokens, reference_greedy):
+    target, related, unrelated, tokenizer = tiny_models
+    decoder = SpeculativeDecoder(target, related if draft == "related" else unrelated, tokenizer,
+                                 name="tiny", draft_tokens=draft_tokens)
+    for prompt in PROMPTS:
+        for max_new_tokens in (1, 7, 40):
+            expected = reference_greedy(target, tokenizer, prompt, max_new_tokens)
+            result = decoder.generate(prompt, max_new_tokens=max_new_tokens)
+            assert result.completion == tokenizer.decode(expected, skip_special_tokens=True)
+            assert result.completion_tokens == len(expected)
+            assert result.finish_reason == ("stop" if expected[-1] == 1 else "length")
+            assert 0 <= result.accepted_tokens <= result.proposed_tokens
+
+
+def test_target_as_its_own_draft_accepts_every_proposal(tiny_models):
+    target, _, _, tokenizer = tiny_models
+    decoder = SpeculativeDecoder(target, target, tokenizer, name="tiny", draft_tokens=4)
+    result = decoder.generate("the quick brown fox", max_new_tokens=40)
+    assert result.proposed_tokens > 0
+    assert result.accepted_tokens == result.proposed_tokens
+
+
+def test_streamed_pieces_add_up_to_the_completion(tiny_models):
+    target, related, _, tokenizer = tiny_models
+    pieces = []
+    result = SpeculativeDecoder(target, related, tokenizer, draft_tokens=3).generate(
+        "hello world", max_new_tokens=30, on_token=pieces.append)
+    assert "".join(pieces) == result.completion
+
+
+def test_cancelled_generation_stops_early(tiny_models):
+    target, related, _, tokenizer = tiny_models
+    cancelled = threading.Event()
+    cancelled.set()
+    result = SpeculativeDecoder(target, related, tokenizer).generate("zz top", max_new_tokens=40,
+                                                                     cancelled=cancelled)
+    assert result.finish_reason == "cancelled"
+    assert result.completion_tokens == 1
+
+
+def test_draft_with_another_vocabulary_is_not_used(tiny_models):
+    target, related, _, tokenizer = tiny_models
+    target_pipe = SimpleNamespace(model=target, tokenizer=tokenizer)
+    other_pipe = SimpleNamespace(model=related, tokenizer=_tokenizer(list(reversed(VOCAB))))
+    try:
+        assert get_speculative_decoder("tiny", target_pipe, "other", other_pipe) is None
+        close_speculative_decoders("other")
+        same_pipe = SimpleNamespace(model=related, tokenizer=tokenizer)
+        decoder = get_speculative_decoder("tiny", target_pipe, "draft", same_pipe)
+        assert decoder is not None and decoder.draft is related
+        assert get_speculative_decoder("tiny", target_pipe, "draft", same_pipe) is decoder
+    finally:
+        close_speculative_decoders("tiny")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the per-stage spans and their propagation through Celery task headers.
+"""
+
+import json
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from services.node_engine import tracing
+from services.node_engine.tracing import (
+    FileExporter,
+    InMemoryExporter,
+    SpanContext,
+    Tracer,
+    extract,
+    format_traceparent,
+    inject,
+    parse_traceparent,
+)
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def exporter():
+    return InMemoryExporter()
+
+
+@pytest.fixture
+def tracer(exporter):
+    return Tracer(exporter)
+
+
+def _stage_count(stage: str) -> float:
+    return REGISTRY.get_sample_value("deai_stage_seconds_count", {"stage": stage}) or 0.0
+
+
+# --- Test Cases ---
+
+def test_traceparent_round_trips_and_rejects_malformed_headers():
+    context = SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7")
+    header = format_traceparent(context)
+    assert header == "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    assert parse_traceparent(header) == context
+    for bad in (None, "", "garbage", "00-xyz-00f067aa0ba902b7-01", "ff-" + header[3:],
+                "00-00000000000000000000000000000000-00f067aa0ba902b7-01"):
+        assert parse_traceparent(bad) is None
+
+
+def test_nested_spans_share_the_trace_and_feed_the_stage_histogram(tracer, exporter):
+    before = _stage_count("test.child")
+    with tracer.span("test.root", attributes={"model": "tiny"}) as root:
+        with tracer.span("test.child") as child:
+            time.sleep(0.01)
+        with pytest.raises(ValueError):
+            with tracer.span("test.failing"):
+                raise ValueError("boom")
+    assert tracing.current_span() is None
+
+    spans = {span.name: span for span in exporter.spans(root.trace_id)}
+    assert set(spans) == {"test.root", "test.child", "test.failing"}
+    assert spans["test.child"].parent_id == root.span_id
+    assert spans["test.root"].parent_id is None
+    assert child.duration >= 0.01
+    assert root.duration >= child.duration
+    assert spans["test.failing"].status == "ERROR"
+    assert _stage_count("test.child") == before + 1
+
+
+def test_task_headers_carry_the_trace_to_the_worker(tracer, exporter):
+    """The worker's spans, including the queue wait, join the API's trace."""
+    with tracer.span("api.enqueue") as enqueue:
+        headers = inject({})
+    parent, enqueued_at = extract(headers)
+    assert parent == enqueue.context
+    assert enqueued_at == pytest.approx(time.time(), abs=5)
+
+    wait = tracer.record("worker.queue_wait", enqueued_at, enqueued_at + 0.25, parent=parent)
+    with tracer.span("worker.generate", parent=parent) as generate:
+        pass
+    assert wait.duration == pytest.approx(0.25)
+    assert {span.parent_id for span in (wait, generate)} == {enqueue.span_id}
+    assert len(exporter.spans(enqueue.trace_id)) == 3
+    assert extract(None) == (None, None)
+
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(FileExporter(str(path)))
+    with tracer.span("test.outer"):
+        with tracer.span("test.inner", attributes={"completion_tokens": 3}):
+            pass
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["name"] for r in records] == ["test.inner", "test.outer"]
+    assert records[0]["attributes"] == {"completion_tokens": 3}
+    assert records[0]["parent_id"] == records[1]["span_id"]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the worker pool setup: models are loaded before a prefork pool
+forks its children, and left to load on first use on a thread pool. A
+prefork worker advertises the load its children count in Redis.
+"""
+
+import gc
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.concurrency.thread import TaskPool as ThreadPool
+
+from services.node_engine import tasks
+from services.node_engine.fleet_metrics import SharedWorkerLoad
+from services.node_engine.models.registry import ModelRegistry
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = ModelRegistry(tmp_path)
+    for name in ("small", "large"):
+        registry.register(name, SimpleNamespace(get_price=lambda: {"prompt": 0.0, "completion": 0.0},
+                                                load_model=lambda: SimpleNamespace()))
+    monkeypatch.setattr(tasks, "model_registry", registry)
+    yield registry
+    gc.unfreeze()
+
+
+# --- Test Cases ---
+
+def test_prefork_worker_loads_its_models_before_forking(registry):
+    tasks.preload_models_before_fork(sender="worker", instance=SimpleNamespace(pool_cls=PreforkPool))
+    assert sorted(registry.loaded()) == ["large", "small"]
+    assert gc.get_freeze_count() > 0
+
+
+def test_models_are_left_to_load_on_first_use_otherwise(registry, monkeypatch):
+    tasks.preload_models_before_fork(sender="worker", instance=SimpleNamespace(pool_cls=ThreadPool))
+    monkeypatch.setattr(tasks, "WORKER_PRELOAD_MODELS", False)
+    tasks.preload_models_before_fork(sender="worker", instance=SimpleNamespace(pool_cls=PreforkPool))
+    assert registry.loaded() == []
+
+
+def test_prefork_worker_advertises_the_load_of_its_children(registry, monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    # The advertising parent and a child that inherited the same counter.
+    monkeypatch.setattr(tasks, "_shared_load", SharedWorkerLoad("worker-1", client))
+    child = SharedWorkerLoad("worker-1", client)
+    tasks._worker_stats()
+
+    with child:
+        child.add_tokens(40)
+        stats = tasks._worker_stats()
+    assert stats["active_tasks"] == 1 and stats["tokens_per_second"] > 0
+    assert tasks._worker_stats()["active_tasks"] == 0
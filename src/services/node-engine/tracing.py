@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-stage latency spans for a generation, from the API through the broker
+to the worker.
+
+Spans follow the OpenTelemetry model: a trace ID, a span ID, a parent, a
+start and end time, and attributes. The API opens a span per request, with
+children for the cache lookup, worker check, payment verification and
+enqueue. `inject` puts the W3C `traceparent` of the current span, and the
+enqueue time, into the Celery task headers. On the worker, `extract` reads
+them back, so the queue wait and the worker's spans join the same trace.
+The worker's spans cover the model fetch, the wait for a batch slot, the
+prefill and the decode.
+
+Every finished span is observed in the `deai_stage_seconds` histogram under
+its name, next to the metrics the FastAPI `Instrumentator` serves. It is
+also handed to the exporter chosen by `TRACE_EXPORTER`: `none` (the
+default), `memory` (kept in the process, for tests) or `file` (JSON lines
+appended to `TRACE_FILE`).
+"""
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, MutableMapping, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from .metrics import STAGE_SECONDS
+
+load_dotenv()
+
+# --- Configuration ---
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_MEMORY_MAX_SPANS = int(os.getenv("TRACE_MEMORY_MAX_SPANS", "10000"))
+
+# Task header carrying the wall-clock time the API enqueued the task.
+ENQUEUED_AT_HEADER = "deai_enqueued_at"
+
+
+class SpanContext(NamedTuple):
+    trace_id: str  # 32 hex digits
+    span_id: str  # 16 hex digits
+    sampled: bool = True
+
+
+def format_traceparent(context: SpanContext) -> str:
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """Parses a W3C `traceparent` header. Returns None if it is missing or invalid."""
+    parts = (header or "").strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    _, trace_id, span_id, flags = parts[:4]
+    if len(trace_id) != 32 or len(span_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(span_id, 16), int(flags, 16)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_time: float = 0.0  # Unix time, in seconds
+    end_time: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "OK"
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, (self.end_time or self.start_time) - self.start_time)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record["duration"] = self.duration
+        return record
+
+
+# --- Exporters ---
+
+class InMemoryExporter:
+    """Keeps the most recent finished spans in memory."""
+    def __init__(self, max_spans: int = TRACE_MEMORY_MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            return [span for span in self._spans if trace_id is None or span.trace_id == trace_id]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class FileExporter:
+    """Appends each finished span to a file as one JSON line."""
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+def exporter_from_env(kind: str = TRACE_EXPORTER):
+    if kind == "memory":
+        return InMemoryExporter()
+    if kind == "file":
+        return FileExporter()
+    return None
+
+
+# --- Tracer ---
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("deai_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    """Creates spans, and observes and exports them when they end."""
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    def _new_span(self, name: str, parent: Optional[SpanContext], start_time: float,
+                  attributes: Optional[Dict[str, Any]]) -> Span:
+        if parent is None and current_span() is not None:
+            parent = current_span().context
+        return Span(
+            name=name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            start_time=start_time,
+            attributes=dict(attributes or {}),
+        )
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None,
+             attributes: Optional[Dict[str, Any]] = None) -> Iterator[Span]:
+        """
+        Times the body as a span, a child of `parent` or else of the current
+        span. It becomes the current span inside the body.
+        """
+        span = self._new_span(name, parent, time.time(), attributes)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "ERROR"
+            span.set_attribute("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_time = span.start_time + (time.perf_counter() - started)
+            self._end(span)
+
+    def record(self, name: str, start_time: float, end_time: float, parent: Optional[SpanContext] = None,
+               attributes: Optional[Dict[str, Any]] = None) -> Span:
+        """Records a span that was timed elsewhere (e.g. by the batching engine)."""
+        span = self._new_span(name, parent, start_time, attributes)
+        span.end_time = max(start_time, end_time)
+        self._end(span)
+        return span
+
+    def _end(self, span: Span):
+        STAGE_SECONDS.labels(stage=span.name).observe(span.duration)
+        if self.exporter is not None:
+            try:
+                self.exporter.export(span)
+            except Exception as e:
+                print(f"Failed to export span '{span.name}': {e}")
+
+
+tracer = Tracer(exporter_from_env())
+
+
+# --- Propagation Through Celery ---
+
+def inject(headers: MutableMapping[str, Any], span: Optional[Span] = None) -> MutableMapping[str, Any]:
+    """Adds the trace context of `span` (default: the current one) and the enqueue time to task headers."""
+    span = span or current_span()
+    if span is not None:
+        headers["traceparent"] = format_traceparent(span.context)
+    headers[ENQUEUED_AT_HEADER] = time.time()
+    return headers
+
+
+def extract(headers: Optional[Dict[str, Any]]):
+    """
+    Reads task headers written by `inject`.
+
+    Returns:
+        `(parent, enqueued_at)`: the API's span context and the enqueue time,
+        either of which is None if absent.
+    """
+    headers = headers or {}
+    enqueued_at = headers.get(ENQUEUED_AT_HEADER)
+    try:
+        enqueued_at = float(enqueued_at) if enqueued_at is not None else None
+    except (TypeError, ValueError):
+        enqueued_at = None
+    return parse_traceparent(headers.get("traceparent")), enqueued_at
@@ -12,7 +12,9 @@ of its services, making the app more modular, testable, and maintainable.
 """
 
 import os
+import asyncio
 import functools
+from typing import Optional, Union
 from fastapi import HTTPException, status
 
 # Import the refactored service class and its configuration variables
@@ -24,12 +26,68 @@ from .onchain.service import (
     OPERATOR_ADDRESS,
     DEAI_TOKEN_ABI
 )
+from .onchain.async_service import AsyncOnChainService
+
+# Serve payment checks from the event loop instead of the default thread pool.
+ONCHAIN_ASYNC = os.getenv("ONCHAIN_ASYNC", "true").lower() == "true"
+
+_async_onchain_service: Optional[AsyncOnChainService] = None
+_async_onchain_lock = asyncio.Lock()
+
+
+async def get_onchain_service() -> Union[AsyncOnChainService, OnChainService]:
+    """
+    Dependency provider for the on-chain service.
+
+    Returns the `AsyncOnChainService` singleton, started on first use, unless
+    `ONCHAIN_ASYNC=false`, in which case the blocking `OnChainService` from
+    `get_sync_onchain_service` is returned.
+
+    Raises:
+        HTTPException: 503 Service Unavailable if the service cannot be
+                       initialized. A failed start is not cached, so the next
+                       request tries again.
+    """
+    global _async_onchain_service
+    if not ONCHAIN_ASYNC:
+        return get_sync_onchain_service()
+    if _async_onchain_service is not None:
+        return _async_onchain_service
+
+    async with _async_onchain_lock:
+        if _async_onchain_service is None:
+            try:
+                service = AsyncOnChainService(
+                    rpc_url=RPC_URL,
+                    contract_address=DEAI_TOKEN_CONTRACT_ADDRESS,
+                    operator_pk=OPERATOR_PRIVATE_KEY,
+                    operator_address=OPERATOR_ADDRESS,
+                    contract_abi=DEAI_TOKEN_ABI
+                )
+                await service.start()
+            except (ValueError, ConnectionError) as e:
+                print(f"CRITICAL: Failed to initialize AsyncOnChainService: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=f"Could not initialize blockchain service: {e}"
+                )
+            _async_onchain_service = service
+    return _async_onchain_service
+
+
+async def close_onchain_service():
+    """Releases the async service's connection pool on application shutdown."""
+    global _async_onchain_service
+    if _async_onchain_service is not None:
+        await _async_onchain_service.close()
+        _async_onchain_service = None
 
 
 @functools.lru_cache(maxsize=1)
-def get_onchain_service() -> OnChainService:
+def get_sync_onchain_service() -> OnChainService:
     """
-    Dependency provider for the OnChainService.
+    Provider for the blocking OnChainService, for Celery workers and other
+    code that runs outside the event loop.
 
     This function is responsible for instantiating the OnChainService with
     the required configuration from environment variables and ABI files.
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Allowance lookups for payment verification without an RPC round trip per request.
+
+- `AllowanceCache` keeps `allowance(owner, spender)` results for a short TTL.
+- `AllowanceWatcher` polls the token's `Approval` and `Transfer` logs and
+  drops cached entries for any owner they mention, so the TTL only bounds
+  staleness when the watcher falls behind.
+- `AllowanceReader` coalesces concurrent cache misses: the first caller waits
+  a few milliseconds, then resolves every pending (owner, spender) pair in a
+  single JSON-RPC batch of `eth_call`s. `AsyncAllowanceReader` does the same
+  on an event loop, for the `AsyncWeb3` service.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from web3 import Web3
+
+from ..metrics import (
+    ALLOWANCE_CACHE_HITS,
+    ALLOWANCE_CACHE_MISSES,
+    ALLOWANCE_CACHE_INVALIDATIONS,
+    ALLOWANCE_LOOKUP_SECONDS,
+    ONCHAIN_RPC_ROUND_TRIPS,
+    ONCHAIN_RPC_BATCH_SIZE,
+)
+
+# --- Configuration ---
+ALLOWANCE_CACHE_TTL_SECONDS = float(os.getenv("ALLOWANCE_CACHE_TTL_SECONDS", "5"))
+ALLOWANCE_BATCH_WINDOW_MS = float(os.getenv("ALLOWANCE_BATCH_WINDOW_MS", "2"))
+ALLOWANCE_MAX_BATCH = int(os.getenv("ALLOWANCE_MAX_BATCH", "100"))
+ALLOWANCE_EVENT_POLL_SECONDS = float(os.getenv("ALLOWANCE_EVENT_POLL_SECONDS", "2"))
+
+APPROVAL_TOPIC = Web3.to_hex(Web3.keccak(text="Approval(address,address,uint256)"))
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+
+Key = Tuple[str, str]  # (owner, spender), both checksummed
+
+
+def owners_in_logs(logs) -> List[str]:
+    """Owners whose allowance an `Approval` or `Transfer` log may have changed."""
+    # Both events index the owner / sender as the first topic argument.
+    return [Web3.to_checksum_address("0x" + bytes(log["topics"][1])[-20:].hex()) for log in logs]
+
+
+def allowance_logs_filter(contract_address: str, from_block: int, to_block: int) -> dict:
+    return {
+        "address": contract_address,
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "topics": [[APPROVAL_TOPIC, TRANSFER_TOPIC]],
+    }
+
+
+def _allowance_calls(token_contract, keys: List[Key]) -> List[dict]:
+    return [
+        {
+            "to": token_contract.address,
+            "data": token_contract.functions.allowance(owner, spender)._encode_transaction_data(),
+        }
+        for owner, spender in keys
+    ]
+
+
+def _batch_payload(calls: List[dict]) -> List[dict]:
+    return [
+        {"jsonrpc": "2.0", "id": i, "method": "eth_call", "params": [call, "latest"]}
+        for i, call in enumerate(calls)
+    ]
+
+
+def _decode_batch(replies: List[dict], count: int) -> List[int]:
+    by_id = {reply["id"]: reply for reply in replies}
+    results = []
+    for i in range(count):
+        reply = by_id.get(i)
+        if reply is None or "error" in reply:
+            raise ValueError(f"eth_call batch entry {i} failed: {reply and reply.get('error')}")
+        results.append(int(reply["result"], 16))
+    return results
+
+
+class AllowanceCache:
+    """
+    Thread-safe TTL cache of allowances, indexed by owner for cheap invalidation.
+    """
+    def __init__(self, ttl_seconds: float = ALLOWANCE_CACHE_TTL_SECONDS):
+        self.ttl = ttl_seconds
+        self._entries: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner: str, spender: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(owner, {}).get(spender)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, owner: str, spender: str, value: int):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.setdefault(owner, {})[spender] = (value, time.monotonic() + self.ttl)
+
+    def invalidate_owner(self, owner: str):
+        with self._lock:
+            if self._entries.pop(owner, None) is not None:
+                ALLOWANCE_CACHE_INVALIDATIONS.inc()
+
+
+class AllowanceWatcher:
+    """
+    Background thread that invalidates cached allowances on token events.
+    """
+    def __init__(self, w3: Web3, contract_address: str, cache: AllowanceCache,
+                 poll_seconds: float = ALLOWANCE_EVENT_POLL_SECONDS):
+        self.w3 = w3
+        self.contract_address = contract_address
+        self.cache = cache
+        self.poll_seconds = poll_seconds
+        self._next_block: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="allowance-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def poll_once(self):
+        """Processes logs from blocks mined since the previous poll."""
+        latest = self.w3.eth.block_number
+        if self._next_block is None:
+            self._next_block = latest + 1
+            return
+        if latest < self._next_block:
+            return
+
+        logs = self.w3.eth.get_logs(allowance_logs_filter(self.contract_address, self._next_block, latest))
+        ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_getLogs").inc()
+        for owner in owners_in_logs(logs):
+            self.cache.invalidate_owner(owner)
+        self._next_block = latest + 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Allowance watcher failed to poll token events: {e}")
+            self._stopped.wait(self.poll_seconds)
+
+
+class AllowanceReader:
+    """
+    Resolves allowances through the cache, sharing one RPC round trip between
+    all lookups that miss within the same batching window.
+    """
+    def __init__(self, w3: Web3, token_contract, rpc_url: Optional[str] = None,
+                 cache: Optional[AllowanceCache] = None,
+                 window_ms: float = ALLOWANCE_BATCH_WINDOW_MS,
+                 max_batch: int = ALLOWANCE_MAX_BATCH,
+                 session: Optional[requests.Session] = None,
+                 timeout: float = 10.0):
+        self.w3 = w3
+        self.token_contract = token_contract
+        self.rpc_url = rpc_url
+        self.cache = cache or AllowanceCache()
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+        # Keep-alive connection pool for raw JSON-RPC batches.
+        self._session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._inflight: Dict[Key, Future] = {}
+        self._queued: List[Key] = []
+
+    def get_allowance(self, owner: str, spender: str) -> int:
+        started = time.perf_counter()
+        try:
+            cached = self.cache.get(owner, spender)
+            if cached is not None:
+                ALLOWANCE_CACHE_HITS.inc()
+                return cached
+            ALLOWANCE_CACHE_MISSES.inc()
+
+            key = (owner, spender)
+            leader = False
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is None:
+                    future = Future()
+                    self._inflight[key] = future
+                    self._queued.append(key)
+                    # The first queued key makes this caller responsible for the flush.
+                    leader = len(self._queued) == 1
+            if leader:
+                if self.window > 0:
+                    time.sleep(self.window)
+                self._flush()
+            return future.result(timeout=30)
+        finally:
+            ALLOWANCE_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                keys = self._queued[:self.max_batch]
+                del self._queued[:self.max_batch]
+            if not keys:
+                return
+            try:
+                values = self._fetch(keys)
+            except Exception as e:
+                with self._lock:
+                    futures = [self._inflight.pop(key) for key in keys]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for key, value in zip(keys, values):
+                self.cache.set(key[0], key[1], value)
+            with self._lock:
+                futures = [self._inflight.pop(key) for key in keys]
+            for future, value in zip(futures, values):
+                future.set_result(value)
+
+    def _fetch(self, keys: List[Key]) -> List[int]:
+        """Reads the allowances for `keys`, in one round trip when the provider allows it."""
+        calls = _allowance_calls(self.token_contract, keys)
+        ONCHAIN_RPC_BATCH_SIZE.observe(len(calls))
+
+        if len(calls) == 1 or not self.rpc_url:
+            # Non-HTTP providers (e.g. an in-process test chain) are called one by one.
+            results = []
+            for call in calls:
+                ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_call").inc()
+                results.append(int.from_bytes(bytes(self.w3.eth.call(call)), "big"))
+            return results
+
+        ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_call_batch").inc()
+        response = self._session.post(self.rpc_url, json=_batch_payload(calls), timeout=self.timeout)
+        response.raise_for_status()
+        return _decode_batch(response.json(), len(calls))
+
+
+class AsyncAllowanceReader:
+    """
+    Event-loop counterpart of `AllowanceReader` for an `AsyncWeb3` client.
+
+    Batches are posted through the caller's shared `aiohttp` session, and each
+    round trip is bounded by `semaphore` and `timeout`.
+    """
+    def __init__(self, w3, token_contract, rpc_url: str, session,
+                 cache: Optional[AllowanceCache] = None,
+                 window_ms: float = ALLOWANCE_BATCH_WINDOW_MS,
+                 max_batch: int = ALLOWANCE_MAX_BATCH,
+                 semaphore: Optional[asyncio.Semaphore] = None,
+                 timeout: float = 10.0):
+        self.w3 = w3
+        self.token_contract = token_contract
+        self.rpc_url = rpc_url
+        self.session = session
+        self.cache = cache or AllowanceCache()
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.semaphore = semaphore or asyncio.Semaphore(max_batch)
+        self.timeout = timeout
+        self._inflight: Dict[Key, asyncio.Future] = {}
+        self._queued: List[Key] = []
+
+    async def get_allowance(self, owner: str, spender: str) -> int:
+        started = time.perf_counter()
+        try:
+            cached = self.cache.get(owner, spender)
+            if cached is not None:
+                ALLOWANCE_CACHE_HITS.inc()
+                return cached
+            ALLOWANCE_CACHE_MISSES.inc()
+
+            key = (owner, spender)
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._inflight[key] = future
+                self._queued.append(key)
+                if len(self._queued) == 1:
+                    asyncio.create_task(self._flush())
+            # Shielded so one cancelled caller does not fail the shared read.
+            return await asyncio.shield(future)
+        finally:
+            ALLOWANCE_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+
+    async def _flush(self):
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        keys, self._queued = self._queued, []
+        batches = [keys[i:i + self.max_batch] for i in range(0, len(keys), self.max_batch)]
+        await asyncio.gather(*(self._resolve(batch) for batch in batches))
+
+    async def _resolve(self, keys: List[Key]):
+        try:
+            values = await self._fetch(keys)
+        except Exception as e:
+            for key in keys:
+                self._inflight.pop(key).set_exception(e)
+            return
+        for key, value in zip(keys, values):
+            self.cache.set(key[0], key[1], value)
+            self._inflight.pop(key).set_result(value)
+
+    async def _fetch(self, keys: List[Key]) -> List[int]:
+        calls = _allowance_calls(self.token_contract, keys)
+        ONCHAIN_RPC_BATCH_SIZE.observe(len(calls))
+        async with self.semaphore:
+            if len(calls) == 1:
+                ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_call").inc()
+                result = await asyncio.wait_for(self.w3.eth.call(calls[0]), self.timeout)
+                return [int.from_bytes(bytes(result), "big")]
+
+            ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_call_batch").inc()
+
+            async def post():
+                async with self.session.post(self.rpc_url, json=_batch_payload(calls)) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+
+            return _decode_batch(await asyncio.wait_for(post(), self.timeout), len(calls))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Non-blocking variant of `OnChainService` built on `AsyncWeb3`.
+
+Payment checks run on the event loop instead of the default thread pool. All
+RPCs share one keep-alive `aiohttp` session, at most
+`ONCHAIN_MAX_CONCURRENCY` of them are in flight at once, and each one is
+bounded by `ONCHAIN_CALL_TIMEOUT_SECONDS`.
+"""
+import asyncio
+import os
+
+import aiohttp
+from eth_account import Account
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from web3.middleware import async_geth_poa_middleware
+
+from .allowance import (
+    AllowanceCache,
+    AsyncAllowanceReader,
+    ALLOWANCE_EVENT_POLL_SECONDS,
+    allowance_logs_filter,
+    owners_in_logs,
+)
+from .service import (
+    ALLOWANCE_WATCH_EVENTS,
+    ONCHAIN_MAX_CONNECTIONS,
+    ONCHAIN_CALL_TIMEOUT_SECONDS,
+)
+from ..metrics import ONCHAIN_RPC_ROUND_TRIPS
+
+# --- Configuration ---
+ONCHAIN_MAX_CONCURRENCY = int(os.environ.get("ONCHAIN_MAX_CONCURRENCY", "64"))
+
+
+class AsyncOnChainService:
+    """
+    Checks token allowances without blocking the event loop.
+
+    Construct it, then `await start()` inside the running loop before use, and
+    `await close()` on shutdown to release the connection pool.
+    """
+    def __init__(self, rpc_url: str, contract_address: str, operator_pk: str, operator_address: str, contract_abi: dict,
+                 max_connections: int = ONCHAIN_MAX_CONNECTIONS,
+                 max_concurrency: int = ONCHAIN_MAX_CONCURRENCY,
+                 call_timeout: float = ONCHAIN_CALL_TIMEOUT_SECONDS):
+        # --- Validation ---
+        if not all([rpc_url, contract_address, operator_pk, operator_address, contract_abi]):
+            raise ValueError("One or more required arguments for AsyncOnChainService are missing.")
+
+        self.rpc_url = rpc_url
+        self.max_connections = max_connections
+        self.call_timeout = call_timeout
+        self.w3 = AsyncWeb3(AsyncHTTPProvider(rpc_url))
+        self.w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+
+        self.contract_address = AsyncWeb3.to_checksum_address(contract_address)
+        self.operator_address = AsyncWeb3.to_checksum_address(operator_address)
+        try:
+            operator_account = Account.from_key(operator_pk)
+        except Exception as e:
+            raise ValueError(f"Invalid OPERATOR_PRIVATE_KEY. Error: {e}")
+        if operator_account.address != self.operator_address:
+            raise ValueError("OPERATOR_PRIVATE_KEY does not correspond to OPERATOR_ADDRESS")
+
+        self.token_contract = self.w3.eth.contract(address=self.contract_address, abi=contract_abi)
+        self.token_decimals = None
+        self.allowance_cache = AllowanceCache()
+        self.allowance_reader = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self._watch_task = None
+
+    async def _rpc(self, awaitable):
+        """Runs one RPC under the concurrency limit and the per-call timeout."""
+        async with self._semaphore:
+            return await asyncio.wait_for(awaitable, self.call_timeout)
+
+    async def start(self):
+        """Opens the shared session and checks the node and contract are reachable."""
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.call_timeout),
+        )
+        # web3 reuses a cached session per endpoint; hand it ours so every call pools.
+        await self.w3.provider.cache_async_session(self._session)
+
+        try:
+            connected = await self._rpc(self.w3.is_connected())
+        except Exception:
+            connected = False
+        if not connected:
+            await self.close()
+            raise ConnectionError(f"Failed to connect to blockchain node at {self.rpc_url}")
+
+        try:
+            self.token_decimals = await self._rpc(self.token_contract.functions.decimals().call())
+        except Exception as e:
+            await self.close()
+            raise ConnectionError(f"Failed to call contract. Is the contract address and RPC_URL correct? Error: {e}")
+
+        self.allowance_reader = AsyncAllowanceReader(
+            self.w3, self.token_contract, self.rpc_url, self._session,
+            cache=self.allowance_cache, semaphore=self._semaphore, timeout=self.call_timeout,
+        )
+        if ALLOWANCE_WATCH_EVENTS:
+            self._watch_task = asyncio.create_task(self._watch_allowance_events())
+        print("AsyncOnChainService instance created successfully.")
+
+    async def close(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _watch_allowance_events(self):
+        """Drops cached allowances for owners named in new Approval/Transfer logs."""
+        next_block = None
+        while True:
+            try:
+                latest = await self._rpc(self.w3.eth.block_number)
+                if next_block is not None and latest >= next_block:
+                    logs = await self._rpc(self.w3.eth.get_logs(
+                        allowance_logs_filter(self.contract_address, next_block, latest)
+                    ))
+                    ONCHAIN_RPC_ROUND_TRIPS.labels(method="eth_getLogs").inc()
+                    for owner in owners_in_logs(logs):
+                        self.allowance_cache.invalidate_owner(owner)
+                next_block = latest + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Allowance watcher failed to poll token events: {e}")
+            await asyncio.sleep(ALLOWANCE_EVENT_POLL_SECONDS)
+
+    def _convert_usd_to_token_units(self, amount_usd: float) -> int:
+        """
+        Converts a USD amount to the token's smallest unit (e.g., wei).
+        Assumes a fixed 1:1 conversion rate (1 USD = 1 DeAI Token).
+        """
+        return int(amount_usd * (10 ** self.token_decimals))
+
+    async def verify_payment(self, user_address: str, amount_usd: float) -> tuple[bool, str]:
+        """
+        Checks if the user has a sufficient token allowance for `amount_usd`,
+        the most the operation can cost (priced from the model registry).
+        This is a read-only operation and does not perform any transaction.
+        """
+        try:
+            user_address_checksum = AsyncWeb3.to_checksum_address(user_address)
+            token_amount = self._convert_usd_to_token_units(amount_usd)
+
+            allowance = await self.allowance_reader.get_allowance(user_address_checksum, self.operator_address)
+            if allowance < token_amount:
+                print(f"Insufficient allowance for user {user_address_checksum}")
+                return False, "Insufficient allowance."
+            return True, "Payment verified."
+
+        except Exception as e:
+            print(f"An error occurred during payment verification: {e!r}")
+            return False, "An error occurred during verification."
@@ -3,10 +3,14 @@
 import os
 import json
 from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from dotenv import load_dotenv
 
+from .allowance import AllowanceCache, AllowanceReader, AllowanceWatcher
+
 # --- Configuration & Setup ---
 
 # It's better to load env vars once at the application entry point,
@@ -18,6 +22,11 @@ RPC_URL = os.environ.get("RPC_URL")
 DEAI_TOKEN_CONTRACT_ADDRESS = os.environ.get("DEAI_TOKEN_CONTRACT_ADDRESS")
 OPERATOR_PRIVATE_KEY = os.environ.get("OPERATOR_PRIVATE_KEY")
 OPERATOR_ADDRESS = os.environ.get("OPERATOR_ADDRESS")
+# Poll Approval/Transfer logs to invalidate cached allowances early.
+ALLOWANCE_WATCH_EVENTS = os.environ.get("ALLOWANCE_WATCH_EVENTS", "true").lower() == "true"
+# Connection pool size and per-call timeout for JSON-RPC requests.
+ONCHAIN_MAX_CONNECTIONS = int(os.environ.get("ONCHAIN_MAX_CONNECTIONS", "32"))
+ONCHAIN_CALL_TIMEOUT_SECONDS = float(os.environ.get("ONCHAIN_CALL_TIMEOUT_SECONDS", "5"))
 
 # --- ABI Loading ---
 try:
@@ -44,7 +53,14 @@ class OnChainService:
         if not all([rpc_url, contract_address, operator_pk, operator_address, contract_abi]):
             raise ValueError("One or more required arguments for OnChainService are missing.")
 
-        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        # One keep-alive pool shared by web3 and the batched allowance reads.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ONCHAIN_MAX_CONNECTIONS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.w3 = Web3(Web3.HTTPProvider(
+            rpc_url, session=self.session, request_kwargs={"timeout": ONCHAIN_CALL_TIMEOUT_SECONDS}
+        ))
         self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
         if not self.w3.is_connected():
@@ -71,7 +87,18 @@ class OnChainService:
             self.token_decimals = self.token_contract.functions.decimals().call()
         except Exception as e:
             raise ConnectionError(f"Failed to call contract. Is the contract address and RPC_URL correct? Error: {e}")
-        
+
+        # Allowance reads go through a short-TTL cache and are batched across
+        # concurrent verifications instead of costing one round trip each.
+        self.allowance_cache = AllowanceCache()
+        self.allowance_reader = AllowanceReader(
+            self.w3, self.token_contract, rpc_url=rpc_url, cache=self.allowance_cache, session=self.session
+        )
+        self.allowance_watcher = None
+        if ALLOWANCE_WATCH_EVENTS:
+            self.allowance_watcher = AllowanceWatcher(self.w3, self.contract_address, self.allowance_cache)
+            self.allowance_watcher.start()
+
         print("OnChainService instance created successfully.")
 
     def _convert_usd_to_token_units(self, amount_usd: float) -> int:
@@ -81,23 +108,18 @@ class OnChainService:
         """
         return int(amount_usd * (10 ** self.token_decimals))
 
-    def verify_payment(self, user_address: str, model: str) -> tuple[bool, str]:
+    def verify_payment(self, user_address: str, amount_usd: float) -> tuple[bool, str]:
         """
-        Checks if the user has a sufficient token allowance for the operation.
+        Checks if the user has a sufficient token allowance for `amount_usd`,
+        the most the operation can cost (priced from the model registry).
         This is a read-only operation and does not perform any transaction.
         """
-        # In a real app, model cost would come from a config or database
-        costs = {"gemma": 10, "stable-diffusion": 25, "music-gen": 50}
-        amount_usd = costs.get(model)
-        if not amount_usd:
-            return False, "Invalid model specified"
-            
         try:
             user_address_checksum = self.w3.to_checksum_address(user_address)
             token_amount = self._convert_usd_to_token_units(amount_usd)
 
             print(f"Checking allowance for {user_address_checksum}...")
-            allowance = self.token_contract.functions.allowance(user_address_checksum, self.operator_address).call()
+            allowance = self.allowance_reader.get_allowance(user_address_checksum, self.operator_address)
             print(f"Allowance is: {allowance}, Required: {token_amount}")
 
             if allowance < token_amount:
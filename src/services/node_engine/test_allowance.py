@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the allowance cache, request coalescing and event-based invalidation,
+run against an in-process eth-tester chain.
+"""
+
+import asyncio
+import threading
+import pytest
+from web3 import AsyncWeb3, Web3, EthereumTesterProvider
+from web3.providers.eth_tester import AsyncEthereumTesterProvider
+
+from services.node_engine.onchain.allowance import (
+    APPROVAL_TOPIC,
+    AllowanceCache,
+    AllowanceReader,
+    AllowanceWatcher,
+    AsyncAllowanceReader,
+)
+
+# A stand-in token small enough to assemble by hand: any call returns storage
+# slot 0 as `allowance(...)`, and a transaction with a 32-byte payload stores
+# it and emits `Approval(msg.sender, 0, 0)`, like `approve` would.
+_RUNTIME = (
+    "36602014601257"          # if calldatasize == 32 jump to the setter
+    "600054600052"            # mstore(0, sload(0))
+    "60206000f3"              # return 32 bytes
+    "5b600035600055"          # setter: sstore(0, calldataload(0))
+    "337f" + APPROVAL_TOPIC[2:] +
+    "60006000a2"              # log2(0, 0, Approval, caller)
+    "00"
+)
+_INITCODE = "0x6041600c60003960416000f3" + _RUNTIME
+
+_ALLOWANCE_ABI = [{
+    "name": "allowance", "type": "function", "stateMutability": "view",
+    "inputs": [{"name": "owner", "type": "address"}, {"name": "spender", "type": "address"}],
+    "outputs": [{"name": "", "type": "uint256"}],
+}]
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def chain():
+    w3 = Web3(EthereumTesterProvider())
+    owner, operator = w3.eth.accounts[:2]
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_transaction({"from": owner, "data": _INITCODE}))
+    token = w3.eth.contract(address=receipt.contractAddress, abi=_ALLOWANCE_ABI)
+
+    def approve(amount: int):
+        w3.eth.send_transaction({"from": owner, "to": token.address, "data": amount.to_bytes(32, "big")})
+
+    approve(100)
+    return w3, token, owner, operator, approve
+
+
+class _CountingReader(AllowanceReader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetches = []
+
+    def _fetch(self, keys):
+        self.fetches.append(list(keys))
+        return super()._fetch(keys)
+
+
+class _AsyncCountingReader(AsyncAllowanceReader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetches = []
+
+    async def _fetch(self, keys):
+        self.fetches.append(list(keys))
+        return await super()._fetch(keys)
+
+
+# --- Test Cases ---
+
+def test_concurrent_lookups_share_one_read(chain):
+    w3, token, owner, operator, _ = chain
+    reader = _CountingReader(w3, token, window_ms=50)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(reader.get_allowance(owner, operator)))
+               for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [100] * 16
+    assert reader.fetches == [[(owner, operator)]]
+    # Served from the cache until the TTL expires.
+    assert reader.get_allowance(owner, operator) == 100
+    assert len(reader.fetches) == 1
+
+
+def test_approval_event_invalidates_cached_allowance(chain):
+    w3, token, owner, operator, approve = chain
+    cache = AllowanceCache(ttl_seconds=3600)
+    reader = _CountingReader(w3, token, cache=cache, window_ms=0)
+    watcher = AllowanceWatcher(w3, token.address, cache)
+    watcher.poll_once()
+
+    assert reader.get_allowance(owner, operator) == 100
+    approve(5)
+    assert reader.get_allowance(owner, operator) == 100  # stale until the logs are seen
+    watcher.poll_once()
+    assert reader.get_allowance(owner, operator) == 5
+    assert len(reader.fetches) == 2
+
+
+
+def test_async_reader_coalesces_lookups_on_the_event_loop():
+    async def scenario():
+        w3 = AsyncWeb3(AsyncEthereumTesterProvider())
+        owner, operator = (await w3.eth.accounts)[:2]
+        tx_hash = await w3.eth.send_transaction({"from": owner, "data": _INITCODE})
+        receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
+        token = w3.eth.contract(address=receipt.contractAddress, abi=_ALLOWANCE_ABI)
+        await w3.eth.send_transaction({"from": owner, "to": token.address, "data": (42).to_bytes(32, "big")})
+
+        reader = _AsyncCountingReader(w3, token, rpc_url=None, session=None, window_ms=10)
+        results = await asyncio.gather(*(reader.get_allowance(owner, operator) for _ in range(16)))
+        return results, reader.fetches, (owner, operator)
+
+    results, fetches, key = asyncio.run(scenario())
+    assert results == [42] * 16
+    assert fetches == [[key]]
@@ -8,8 +8,9 @@ app = Flask(__name__)
 
 # --- Configuration ---
 # General Config
-AI_NODE_URL = os.environ.get("AI_NODE_URL", "http://127.0.0.1:8080/stream")
+AI_NODE_URL = os.environ.get("AI_NODE_URL", "http://127.0.0.1:8080/api/gateway/stream")
 API_KEY = os.environ.get("API_KEY", "default-secret-key")
+WALLET_ADDRESS = os.environ.get("WALLET_ADDRESS", "")
 
 # Database Config
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat.db'
@@ -55,10 +56,13 @@ def generate_stream():
     }
     
     data = {
+        "address": WALLET_ADDRESS,
         "prompt": prompt, 
         "model": model,
         "temperature": temperature,
-        "max_new_tokens": max_new_tokens
+        "max_new_tokens": max_new_tokens,
+        # A person is waiting on the reply: overtake queued bulk jobs.
+        "priority": "interactive"
     }
 
     try:
@@ -70,9 +74,13 @@ def generate_stream():
         return Response(error_message, status=500)
 
     def stream_content():
-        for line in response.iter_lines():
-            if line:
+        # Blank lines delimit SSE events, so they are relayed as well.
+        try:
+            for line in response.iter_lines():
                 yield line + b'\n'
+        finally:
+            # Closing the tab drops this connection too, which cancels the generation on the node.
+            response.close()
     
     return Response(stream_with_context(stream_content()), mimetype='text/event-stream')
 